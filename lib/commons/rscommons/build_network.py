@@ -13,7 +13,6 @@
 # Date:     15 May 2019
 # -------------------------------------------------------------------------------
 from typing import List
-from osgeo import ogr
 from rscommons import Logger, get_shp_or_gpkg, VectorBase
 from rscommons.vector_ops import get_geometry_unary_union
 
@@ -129,24 +128,7 @@ def process_reaches(in_path: str, out_path: str, attribute_filter=None, transfor
         clip_shape ([type], optional): [description]. Defaults to None.
     """
     with get_shp_or_gpkg(in_path) as in_lyr, get_shp_or_gpkg(out_path, write=True) as out_lyr:
-        out_lyr.ogr_layer.StartTransaction()
-        for feature, _counter, _progbar in in_lyr.iterate_features("Processing reaches", attribute_filter=attribute_filter, clip_shape=clip_shape):
-            # get the input geometry and reproject the coordinates
-            geom = feature.GetGeometryRef()
-            if transform is not None:
-                geom.Transform(transform)
-
-            # Create output Feature
-            out_feature = ogr.Feature(out_lyr.ogr_layer_def)
-
-            # Add field values from input Layer
-            for i in range(0, out_lyr.ogr_layer_def.GetFieldCount()):
-                field_name = out_lyr.ogr_layer_def.GetFieldDefn(i).GetNameRef()
-                output_field_index = feature.GetFieldIndex(field_name)
-                if output_field_index >= 0:
-                    out_feature.SetField(field_name, feature.GetField(output_field_index))
-
-            # Add new feature to output Layer
-            out_feature.SetGeometry(geom)
-            out_lyr.ogr_layer.CreateFeature(out_feature)
-        out_lyr.ogr_layer.CommitTransaction()
+        _fids, wkbs, columns = in_lyr.read_columns(attribute_filter=attribute_filter, clip_shape=clip_shape)
+
+        # Fields that are not in the output layer are ignored by write_columns()
+        out_lyr.write_columns(wkbs, columns, transform=transform, name="Processing reaches")
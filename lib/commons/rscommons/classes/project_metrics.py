@@ -11,6 +11,7 @@ from osgeo import ogr
 from rscommons.classes.raster import get_raster_cell_area, categorical_raster_count
 from rscommons.classes.vector_base import get_utm_zone_epsg
 from rscommons.raster_buffer_stats import raster_buffer_stats2
+from rscommons.zonal_stats import zonal_tally
 from rscommons.get_project_datasets import get_project_datasets
 from rscommons import VectorBase, get_shp_or_gpkg, Logger, dotenv
 from sympy import arg
@@ -221,21 +222,12 @@ class MetricsJson:
 
         cell_area = get_raster_cell_area(raster_path)
 
-        cats = {}
-        for key in polygons.keys():
-            cats[key] = {}
-
         with rasterio.open(raster_path) as src:
+            dtype = np.dtype(src.dtypes[0]).type
 
-            for poly_id, polygon in polygons.items():
-
-                raw_raster, _out_transform = mask(src, [polygon], crop=True)
-                # mask_raster = np.ma.masked_values(raw_raster, src.nodata)
-
-                for val in np.unique(raw_raster):
-                    if val != src.nodata:
-                        cats[poly_id][str(val)] = {'area': np.count_nonzero(raw_raster == val) * cell_area,
-                                                   'count': np.count_nonzero(raw_raster == val)}
+        # Format the category keys the same way as the raster's own values
+        tallies = zonal_tally(polygons, raster_path)
+        cats = {poly_id: {str(dtype(val)): {'area': count * cell_area, 'count': count} for val, count in tally.items()} for poly_id, tally in tallies.items()}
 
         if len(polygons) == 1:  # assumes this is for the huc8
             self.metrics['project']['metrics']['raster']['categorical'].append({dataset_name: {'cellSize': np.sqrt(cell_area), 'categories': cats[list(cats.keys())[0]]}})
@@ -6,6 +6,7 @@ import math
 import re
 from enum import Enum
 from typing import Union, List, Tuple
+import numpy as np
 from osgeo import ogr, gdal, osr
 from shapely.wkb import loads as wkbload, dumps as wkbdumps
 from shapely.geometry.base import BaseGeometry
@@ -13,6 +14,7 @@ from shapely.geometry import Point
 from rscommons import Logger, ProgressBar, Raster
 from rscommons.util import safe_makedirs
 from rscommons.classes.vector_datasource import DatasetRegistry
+from rscommons.layer_cache import LayerColumns, layer_cache, dataset_stamp
 
 # NO_UI = os.environ.get('NO_UI') is not None
 
@@ -56,6 +58,10 @@ class VectorBase():
         ogr.wkbPolygon, ogr.wkbPolygon25D, ogr.wkbPolygonM, ogr.wkbPolygonZM,
         ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D, ogr.wkbMultiPolygonM, ogr.wkbMultiPolygonZM
     ]
+    # Field types that the Arrow stream hands back as plain NumPy arrays
+    ARROW_FIELD_TYPES = [ogr.OFTInteger, ogr.OFTInteger64, ogr.OFTReal, ogr.OFTString]
+    # Number of features moved per batch (and per transaction) by read_columns() and write_columns()
+    COLUMN_BATCH_SIZE = 10000
     MULTI_TYPES = {
         ogr.wkbMultiPoint: [ogr.wkbPoint, ogr.wkbPoint25D, ogr.wkbPointM, ogr.wkbPointZM],
         ogr.wkbMultiPolygon: [ogr.wkbPolygon, ogr.wkbPolygon25D, ogr.wkbPolygonM, ogr.wkbPolygonZM],
@@ -565,6 +571,263 @@ class VectorBase():
         if progbar is not None:
             progbar.finish()
 
+    def read_cached(self, attribute_filter: str = None, epsg: int = None, spatial_ref: osr.SpatialReference = None, use_cache: bool = True) -> LayerColumns:
+        """Decode every feature into Shapely geometries and attribute columns using the process layer cache
+
+        Layers are cached per dataset, layer, attribute filter and output projection so that
+        reading the same layer again in this process (until it changes on disk) skips OGR entirely.
+        The returned geometries and columns are shared and must not be modified.
+
+        Args:
+            attribute_filter (str, optional): Attribute Query like "HUC = 17060104". Defaults to None.
+            epsg (int, optional): EPSG to project the geometries to. Defaults to None.
+            spatial_ref (osr.SpatialReference, optional): Spatial Ref to project the geometries to. Defaults to None.
+            use_cache (bool, optional): reuse and store the layer in the layer cache. Defaults to True.
+
+        Raises:
+            VectorBaseException: [description]
+
+        Returns:
+            LayerColumns: FIDs, geometries and attribute columns of the features
+        """
+        if self.ogr_layer_def is None:
+            raise VectorBaseException('read_cached: Layer not initialized. No ogr_layer found')
+
+        if epsg is not None and spatial_ref is not None:
+            raise VectorBaseException('read_cached: Specify either an EPSG or a spatial_ref. Not both')
+
+        key = (os.path.abspath(self.filepath), self.ogr_layer_name, attribute_filter, epsg,
+               spatial_ref.ExportToWkt() if spatial_ref is not None else None)
+        stamp = dataset_stamp(self.filepath)
+        if use_cache is True:
+            cached = layer_cache.get(key, stamp)
+            if cached is not None:
+                return cached
+
+        transform = None
+        if epsg is not None:
+            _outref, transform = VectorBase.get_transform_from_epsg(self.spatial_ref, epsg)
+        elif spatial_ref is not None:
+            transform = self.get_transform(self.spatial_ref, spatial_ref)
+
+        field_defs = self.get_fields()
+        dtypes = {}
+        for name, field_def in field_defs.items():
+            if field_def.GetType() in [ogr.OFTInteger, ogr.OFTInteger64]:
+                dtypes[name] = np.int64
+            elif field_def.GetType() == ogr.OFTReal:
+                dtypes[name] = np.float64
+
+        fids = []
+        geoms = []
+        columns = {name: [] for name in field_defs}
+        geom_bytes = 0
+        for feature, _counter, _progbar in self.iterate_features(attribute_filter=attribute_filter):
+            fids.append(feature.GetFID())
+            geom = feature.GetGeometryRef()
+            if geom is None:
+                geoms.append(None)
+            else:
+                geom_bytes += geom.WkbSize()
+                geoms.append(VectorBase.ogr2shapely(geom, transform))
+            for idx, values in enumerate(columns.values()):
+                values.append(feature.GetField(idx))
+
+        layer = LayerColumns(fids, geoms, columns, dtypes, geom_bytes)
+        if use_cache is True:
+            layer_cache.put(key, stamp, layer)
+        return layer
+
+    def read_columns(self, fields: List[str] = None, attribute_filter: str = None,
+                     clip_shape: Union[BaseGeometry, ogr.Geometry] = None, clip_rect: List[float] = None
+                     ) -> Tuple[np.ndarray, np.ndarray, dict]:
+        """Read a whole layer as arrays: FIDs, WKB geometries and one array per field
+
+        GDAL's Arrow stream (GDAL 3.6+) is used when the layer supports it and has only integer,
+        real and string fields. Otherwise the features are read straight into column lists. Nulls are returned as None
+        (object arrays) and features without geometry have a None WKB.
+
+        Args:
+            fields (List[str], optional): fields to read. Defaults to None (all the fields).
+            attribute_filter (str, optional): Attribute Query like "HUC = 17060104". Defaults to None.
+            clip_shape (BaseGeometry, optional): Only read features that intersect this shape. Defaults to None.
+            clip_rect (List[double minx, double miny, double maxx, double maxy)]): Only read features within this rectangle. Defaults to None.
+
+        Raises:
+            VectorBaseException: [description]
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, dict]: FIDs, WKB geometries and field arrays keyed by field name
+        """
+        if self.ogr_layer_def is None:
+            raise VectorBaseException('read_columns: Layer not initialized. No ogr_layer found')
+
+        if clip_shape is not None and clip_rect is not None:
+            raise VectorBaseException('read_columns: You can only use clip_geom OR clip_rect, not both')
+
+        field_defs = self.get_fields()
+        fields = list(field_defs) if fields is None else fields
+        for field in fields:
+            if field not in field_defs:
+                raise VectorBaseException('read_columns: Field "{}" not found in {}'.format(field, self.ogr_layer_name))
+
+        if clip_shape is not None:
+            self.ogr_layer.SetSpatialFilter(self.shapely2ogr(clip_shape) if isinstance(clip_shape, BaseGeometry) else clip_shape)
+        elif clip_rect is not None:
+            self.ogr_layer.SetSpatialFilterRect(*clip_rect)
+        if attribute_filter:
+            self.ogr_layer.SetAttributeFilter(attribute_filter)
+
+        try:
+            if hasattr(self.ogr_layer, 'GetArrowStreamAsNumPy') and self.ogr_layer.TestCapability(ogr.OLCFastGetArrowStream) \
+                    and all(field_defs[field].GetType() in VectorBase.ARROW_FIELD_TYPES for field in fields):
+                fids, wkbs, columns = self.__read_arrow(fields, field_defs)
+            else:
+                fids, wkbs, columns = self.__read_batches(fields, field_defs)
+        finally:
+            if clip_shape is not None or clip_rect is not None:
+                self.ogr_layer.SetSpatialFilter(None)
+            if attribute_filter:
+                self.ogr_layer.SetAttributeFilter('')
+
+        return fids, wkbs, columns
+
+    def __read_arrow(self, fields: List[str], field_defs: dict) -> Tuple[np.ndarray, np.ndarray, dict]:
+        """Read the filtered layer through GDAL's Arrow stream"""
+
+        fid_name = self.ogr_layer.GetFIDColumn() or 'OGC_FID'
+        geom_name = self.ogr_layer.GetGeometryColumn() or 'wkb_geometry'
+        batches = {name: [] for name in [fid_name, geom_name] + fields}
+
+        stream = self.ogr_layer.GetArrowStreamAsNumPy(options=['INCLUDE_FID=YES', 'MAX_FEATURES_IN_BATCH={}'.format(VectorBase.COLUMN_BATCH_SIZE)])
+        for batch in stream:
+            for name, values in batches.items():
+                values.append(batch[name])
+
+        def concatenate(name):
+            arrays = batches[name]
+            if any(isinstance(array, np.ma.MaskedArray) for array in arrays):
+                # Nulls come back masked. Hand them back as None like OGR does
+                arrays = [np.where(np.ma.getmaskarray(array), None, np.ma.getdata(array).astype(object)) for array in arrays]
+            return np.concatenate(arrays) if len(arrays) > 0 else np.array([], dtype=object)
+
+        fids = concatenate(fid_name).astype(np.int64)
+        wkbs = concatenate(geom_name).astype(object)
+        columns = {}
+        for field in fields:
+            values = concatenate(field)
+            if field_defs[field].GetType() == ogr.OFTString:
+                values = np.array([value.decode('utf-8') if isinstance(value, bytes) else value for value in values], dtype=object)
+            elif values.dtype == bool:
+                values = values.astype(np.int64)
+            columns[field] = values
+        return fids, wkbs, columns
+
+    def __read_batches(self, fields: List[str], field_defs: dict) -> Tuple[np.ndarray, np.ndarray, dict]:
+        """Read the filtered layer feature by feature into arrays"""
+
+        field_indices = [self.ogr_layer_def.GetFieldIndex(field) for field in fields]
+        fids = []
+        wkbs = []
+        values = [[] for _field in fields]
+
+        self.ogr_layer.ResetReading()
+        for feature in self.ogr_layer:
+            fids.append(feature.GetFID())
+            geom = feature.GetGeometryRef()
+            wkbs.append(bytes(geom.ExportToWkb()) if geom is not None else None)
+            for column, idx in zip(values, field_indices):
+                column.append(feature.GetField(idx))
+
+        columns = {field: VectorBase.__column_array(column, field_defs[field].GetType()) for field, column in zip(fields, values)}
+        return np.array(fids, dtype=np.int64), VectorBase.__column_array(wkbs, None), columns
+
+    @staticmethod
+    def __column_array(values: list, field_type: int) -> np.ndarray:
+        """Typed array for integer and real fields without nulls. Object array for everything else"""
+
+        if field_type in [ogr.OFTInteger, ogr.OFTInteger64, ogr.OFTReal] and all(value is not None for value in values):
+            return np.array(values, dtype=np.float64 if field_type == ogr.OFTReal else np.int64)
+
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+    def write_columns(self, geoms: list, columns: dict, fids: List[int] = None, transform: osr.CoordinateTransformation = None, name: str = None) -> int:
+        """Write whole arrays of features to the layer in batched transactions
+
+        Each column is written to the field of the same name. Columns without a matching field
+        in this layer are ignored and None values are written as null.
+
+        Args:
+            geoms (list): WKB bytes or ogr.Geometry for each feature (None for no geometry). Pass None instead of a list to keep the geometries of updated features
+            columns (dict): field values keyed by field name. Arrays or lists, one value per feature
+            fids (List[int], optional): update these existing features instead of creating new ones. Defaults to None.
+            transform (osr.CoordinateTransformation, optional): transform applied to every geometry. Defaults to None.
+            name (str, optional): Name for use on the progress bar. If ommitted you won't get a progress bar
+
+        Raises:
+            VectorBaseException: [description]
+
+        Returns:
+            int: number of features written
+        """
+        if self.ogr_layer_def is None:
+            raise VectorBaseException('write_columns: Layer not initialized. No ogr_layer found')
+
+        if geoms is None and fids is None:
+            raise VectorBaseException('write_columns: Geometries are required when creating new features')
+
+        count = len(fids) if fids is not None else len(geoms)
+        for field, values in columns.items():
+            if len(values) != count:
+                raise VectorBaseException('write_columns: Field "{}" has {:,} values for {:,} features'.format(field, len(values), count))
+
+        # Plain Python values and the index of the output field for each column
+        outputs = []
+        for field, values in columns.items():
+            idx = self.ogr_layer_def.GetFieldIndex(field)
+            if idx >= 0:
+                outputs.append((idx, values.tolist() if isinstance(values, np.ndarray) else values))
+
+        progbar = ProgressBar(count, 50, name) if name is not None else None
+        for start in range(0, count, VectorBase.COLUMN_BATCH_SIZE):
+            self.ogr_layer.StartTransaction()
+            for position in range(start, min(start + VectorBase.COLUMN_BATCH_SIZE, count)):
+                if fids is None:
+                    feature = ogr.Feature(self.ogr_layer_def)
+                else:
+                    feature = self.ogr_layer.GetFeature(int(fids[position]))
+                    if feature is None:
+                        raise VectorBaseException('write_columns: No feature with FID={}'.format(fids[position]))
+
+                geom = geoms[position] if geoms is not None else None
+                if geom is not None:
+                    if not isinstance(geom, ogr.Geometry):
+                        geom = ogr.CreateGeometryFromWkb(geom)
+                    if transform is not None:
+                        geom.Transform(transform)
+                    feature.SetGeometryDirectly(geom)
+
+                for idx, values in outputs:
+                    if values[position] is None:
+                        feature.SetFieldNull(idx)
+                    else:
+                        feature.SetField(idx, values[position])
+
+                if fids is None:
+                    self.ogr_layer.CreateFeature(feature)
+                else:
+                    self.ogr_layer.SetFeature(feature)
+                feature = None
+            self.ogr_layer.CommitTransaction()
+            if progbar is not None:
+                progbar.update(min(start + VectorBase.COLUMN_BATCH_SIZE, count))
+
+        if progbar is not None:
+            progbar.finish()
+        return count
+
     @staticmethod
     def __start_transaction(write_layers: list):
         if write_layers is None:
@@ -5,15 +5,202 @@ from __future__ import annotations
 import os
 import glob
 import csv
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import Dict
 import sqlite3
 from osgeo import ogr, osr
 from rscommons import Logger, VectorBase
 
+# Pragmas applied to every pooled connection. journal_mode is left alone by
+# default because WAL mode is stored in the file and leaves -wal/-shm files
+# next to GeoPackages. Use configure_pragmas() to change or add to these.
+PRAGMAS = OrderedDict([
+    ('foreign_keys', 'ON'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY')
+])
+
+# Number of rows handed to each executemany() call by batch_write()
+BATCH_SIZE = 10000
+
+
+class ConnectionPool():
+    """One open connection per database path for each process and thread
+
+    Connections are reopened when the file behind a path is deleted or replaced.
+    """
+
+    def __init__(self):
+        self.log = Logger('SQLite')
+        self._connections = {}
+
+    def get(self, filepath: str) -> sqlite3.Connection:
+        """Pooled connection to a database. The pragmas are applied when it is first opened
+
+        Args:
+            filepath (str): path to the SQLite database or GeoPackage
+
+        Returns:
+            sqlite3.Connection: open connection
+        """
+        key = (os.path.abspath(filepath), os.getpid(), threading.get_ident())
+        identity = _file_identity(filepath)
+
+        entry = self._connections.get(key)
+        if entry is not None and entry[1] != identity:
+            self.log.debug('Database file replaced. Reopening {}'.format(filepath))
+            self._close(key)
+            entry = None
+
+        if entry is None:
+            conn = sqlite3.connect(filepath)
+            for pragma, value in PRAGMAS.items():
+                conn.execute('PRAGMA {} = {}'.format(pragma, value))
+            entry = [conn, _file_identity(filepath), 0]
+            self._connections[key] = entry
+
+        return entry[0]
+
+    def acquire(self, filepath: str) -> sqlite3.Connection:
+        """Pooled connection that is held (by SQLiteCon) until release() is called"""
+        conn = self.get(filepath)
+        self._connections[(os.path.abspath(filepath), os.getpid(), threading.get_ident())][2] += 1
+        return conn
+
+    def release(self, filepath: str) -> bool:
+        """Release a connection from acquire()
+
+        Returns:
+            bool: True when nobody holds the connection any more
+        """
+        entry = self._connections.get((os.path.abspath(filepath), os.getpid(), threading.get_ident()))
+        if entry is None:
+            return True
+        entry[2] = max(entry[2] - 1, 0)
+        return entry[2] == 0
+
+    def close(self, filepath: str = None):
+        """Close the pooled connections of one database or all of them"""
+
+        for key in list(self._connections):
+            if filepath is None or key[0] == os.path.abspath(filepath):
+                self._close(key)
+
+    def _close(self, key: tuple):
+        conn = self._connections.pop(key)[0]
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# The pool shared by every database helper in this process
+_pool = ConnectionPool()
+
+
+def get_connection(filepath: str) -> sqlite3.Connection:
+    """Pooled connection to a database for this process and thread
+
+    The connection is shared so do not close it and do not change its row_factory.
+    Set row_factory on the cursor instead.
+
+    Args:
+        filepath (str): path to the SQLite database or GeoPackage
+
+    Returns:
+        sqlite3.Connection: open connection with the pragmas applied
+    """
+    return _pool.get(filepath)
+
+
+def close_connections(filepath: str = None):
+    """Close the pooled connections. Needed before a database file is moved or copied
+
+    Args:
+        filepath (str, optional): only close the connection to this database. Defaults to None (all).
+    """
+    _pool.close(filepath)
+
+
+def configure_pragmas(**pragmas):
+    """Change the pragmas applied to pooled connections, e.g. configure_pragmas(journal_mode='WAL')
+
+    Connections that are already open are closed so that the next use reopens them with the new settings.
+    """
+    PRAGMAS.update(pragmas)
+    _pool.close()
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """Explicit transaction that commits on success and rolls back on error
+
+    Inside a transaction that is already open (e.g. within SQLiteCon) a savepoint is used
+    instead and committing is left to the owner of the outer transaction.
+
+    Args:
+        conn (sqlite3.Connection): open connection
+    """
+    if conn.in_transaction:
+        conn.execute('SAVEPOINT rs_transaction')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK TO rs_transaction')
+            conn.execute('RELEASE rs_transaction')
+            raise
+        conn.execute('RELEASE rs_transaction')
+    else:
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def batch_write(database: str, sql: str, rows: list, describe=None, batch_size: int = BATCH_SIZE) -> int:
+    """Run a parameterized INSERT/UPDATE for many rows in batches inside one explicit transaction
+
+    Each batch goes through batch_insert() so failing rows are logged individually.
+
+    Args:
+        database (str): path to the database
+        sql (str): parameterized statement
+        rows (list): parameter lists, one per row
+        describe (function, optional): formats a row for the error log. Defaults to str.
+        batch_size (int, optional): rows per executemany() call. Defaults to BATCH_SIZE.
+
+    Returns:
+        int: number of rows that could not be written
+    """
+    conn = get_connection(database)
+    errs = 0
+    with transaction(conn):
+        for start in range(0, len(rows), batch_size):
+            errs += batch_insert(conn, sql, rows[start:start + batch_size], describe)
+    return errs
+
+
+def _file_identity(filepath: str) -> tuple:
+    """Device and inode of a file so a deleted and recreated database is detected"""
+    if not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    return (stat.st_dev, stat.st_ino)
+
 
 class SQLiteCon():
     """This is just a loose mapping class to allow us to use Python's 'with' keyword.
 
+    The connection comes from the connection pool. Rows are returned as dictionaries and any
+    changes that have not been committed are rolled back on exit.
+
     Raises:
         VectorBaseException: Various
     """
@@ -23,16 +210,15 @@ class SQLiteCon():
         self.filepath = filepath
         self.conn = None
         self.curs = None
+        self._row_factory = None
 
     def __enter__(self) -> SQLiteCon:
         """Behaviour on open when using the "with VectorBase():" Syntax
         """
 
-        self.conn = sqlite3.connect(self.filepath)
-
-        # turn on foreign key constraints. Does not happen by default
-        self.conn.execute('PRAGMA foreign_keys = ON;')
+        self.conn = _pool.acquire(self.filepath)
 
+        self._row_factory = self.conn.row_factory
         self.conn.row_factory = dict_factory
         self.curs = self.conn.cursor()
         return self
@@ -41,7 +227,10 @@ class SQLiteCon():
         """Behaviour on close when using the "with VectorBase():" Syntax
         """
         self.curs.close()
-        self.conn.close()
+        self.conn.row_factory = self._row_factory
+        if _pool.release(self.filepath) and self.conn.in_transaction:
+            # Same as closing a connection without committing
+            self.conn.rollback()
         self.curs = None
         self.conn = None
 
@@ -76,14 +265,15 @@ def create_database(huc: str, db_path: str, metadata: Dict[str, str], epsg: int,
     log = Logger('Database')
     if os.path.isfile(db_path) and delete is True:
         log.info('Removing existing SQLite database at {0}'.format(db_path))
+        close_connections(db_path)
         os.remove(db_path)
 
     log.info('Creating database schema at {0}'.format(db_path))
     qry = open(schema_path, 'r').read()
     sqlite3.complete_statement(qry)
-    conn = sqlite3.connect(db_path)
-    conn.execute('PRAGMA foreign_keys = ON;')
+    conn = get_connection(db_path)
     curs = conn.cursor()
+    curs.row_factory = None
     curs.executescript(qry)
 
     csv_dir = os.path.join(os.path.dirname(schema_path), 'data')
@@ -128,13 +318,12 @@ def update_database(db_path, csv_path):
 
     log.info('Updating SQLite database at {0}'.format(db_path))
 
-    conn = sqlite3.connect(db_path)
-    conn.execute('PRAGMA foreign_keys = ON;')
-    conn.row_factory = dict_factory
+    conn = get_connection(db_path)
     curs = conn.cursor()
+    curs.row_factory = dict_factory
 
     try:
-        huc = conn.execute('SELECT WatershedID FROM vwReaches GROUP BY WatershedID').fetchall()[0]['WatershedID']
+        huc = curs.execute('SELECT WatershedID FROM vwReaches GROUP BY WatershedID').fetchall()[0]['WatershedID']
     except Exception as e:
         log.error('Error retrieving HUC from DB')
         raise e
@@ -162,15 +351,19 @@ def load_lookup_data(db_path, csv_dir):
         csv_dir (str): Full path to the root folder containing CSV lookup files
     """
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = dict_factory
-    curs = conn.cursor()
-
     log = Logger('Database')
 
     if not os.path.isdir(csv_dir):
         raise Exception('csv_dir path was not a valid directory: {}'.format(csv_dir))
 
+    conn = get_connection(db_path)
+    curs = conn.cursor()
+
+    # INSERT OR REPLACE deletes the existing lookup rows. With foreign keys on
+    # that would cascade to the tables that reference them
+    conn.commit()
+    conn.execute('PRAGMA foreign_keys = OFF')
+
     # Load lookup table data into the database
     dir_search = os.path.join(csv_dir, '**', '*.csv')
     for file_name in glob.glob(dir_search, recursive=True):
@@ -184,6 +377,7 @@ def load_lookup_data(db_path, csv_dir):
             log.info('{:,} records loaded into {} lookup data table'.format(curs.rowcount, table_name))
 
     conn.commit()
+    conn.execute('PRAGMA foreign_keys = {}'.format(PRAGMAS.get('foreign_keys', 'OFF')))
 
 
 def get_db_srs(database):
@@ -203,8 +397,9 @@ def load_geometries(database, target_srs=None, where_clause=None):
         target_srs.SetAxisMappingStrategy(db_srs.GetAxisMappingStrategy())
         transform = osr.CoordinateTransformation(db_srs, target_srs)
 
-    conn = sqlite3.connect(database)
-    curs = conn.execute('SELECT ReachID, Geometry FROM Reaches {}'.format('WHERE {}'.format(where_clause) if where_clause else ''))
+    curs = get_connection(database).cursor()
+    curs.row_factory = None
+    curs.execute('SELECT ReachID, Geometry FROM Reaches {}'.format('WHERE {}'.format(where_clause) if where_clause else ''))
     reaches = {}
 
     for row in curs.fetchall():
@@ -217,9 +412,9 @@ def load_geometries(database, target_srs=None, where_clause=None):
 
 def load_attributes(database, fields, where_clause=None):
 
-    conn = sqlite3.connect(database)
-    conn.row_factory = dict_factory
-    curs = conn.execute('SELECT ReachID, {} FROM vwReaches {}'.format(','.join(fields), 'WHERE {}'.format(where_clause) if where_clause else ''))
+    curs = get_connection(database).cursor()
+    curs.row_factory = dict_factory
+    curs.execute('SELECT ReachID, {} FROM vwReaches {}'.format(','.join(fields), 'WHERE {}'.format(where_clause) if where_clause else ''))
     reaches = {}
     for row in curs.fetchall():
         reaches[row['ReachID']] = {}
@@ -230,60 +425,131 @@ def load_attributes(database, fields, where_clause=None):
 
 
 def write_db_attributes(database, reaches, fields, set_null_first=True, summarize=True):
+    """Write the values of several ReachAttributes fields for many reaches
+
+    The values are loaded into a temporary table keyed by ReachID and then applied to all
+    the fields with one UPDATE joined to that table. With set_null_first the same UPDATE
+    also nulls the fields of the reaches that have no values.
+
+    Args:
+        database (str): path to the database
+        reaches (dict): field values keyed by ReachID. Each is a dictionary keyed by field name. Missing fields are written as NULL
+        fields (list): ReachAttributes fields to write
+        set_null_first (bool, optional): null the fields of every other reach. Defaults to True.
+        summarize (bool, optional): log summary statistics of the fields afterwards. Defaults to True.
+    """
 
     if len(reaches) < 1:
         return
 
-    conn = sqlite3.connect(database)
-    conn.execute('pragma foreign_keys=ON')
-    curs = conn.cursor()
+    results = [[reachid] + [values.get(field) for field in fields] for reachid, values in reaches.items()]
 
-    # Optionally clear all the values in the fields first
-    if set_null_first is True:
-        [curs.execute('UPDATE ReachAttributes SET {} = NULL'.format(field)) for field in fields]
+    conn = get_connection(database)
+    with transaction(conn):
+        # Untyped columns so that ReachAttributes applies its own column affinity as before
+        conn.execute('DROP TABLE IF EXISTS temp.ReachValues')
+        conn.execute('CREATE TEMP TABLE ReachValues (ReachID INTEGER PRIMARY KEY NOT NULL, {})'.format(','.join(fields)))
+        sql = 'INSERT INTO temp.ReachValues (ReachID, {}) VALUES (?, {})'.format(','.join(fields), ','.join('?' * len(fields)))
+        for start in range(0, len(results), BATCH_SIZE):
+            conn.executemany(sql, results[start:start + BATCH_SIZE])
 
-    results = []
-    for reachid, values in reaches.items():
-        results.append([values[field] if field in values else None for field in fields])
-        results[-1].append(reachid)
-
-    sql = 'UPDATE ReachAttributes SET {} WHERE ReachID = ?'.format(','.join(['{}=?'.format(field) for field in fields]))
-    curs.executemany(sql, results)
-    conn.commit()
+        # Reaches without a row in ReachValues get NULL from the subquery
+        conn.execute('UPDATE ReachAttributes SET ({0}) = (SELECT {0} FROM temp.ReachValues V WHERE V.ReachID = ReachAttributes.ReachID){1}'.format(
+            ','.join(fields), '' if set_null_first is True else ' WHERE ReachID IN (SELECT ReachID FROM temp.ReachValues)'))
+        conn.execute('DROP TABLE temp.ReachValues')
 
     if summarize is True:
-        [summarize_reaches(database, field) for field in fields]
+        summarize_reaches(database, fields)
+
 
+def batch_insert(conn: sqlite3.Connection, sql: str, rows: list, describe=None) -> int:
+    """Insert many rows with a single executemany() inside the current transaction.
+    A transaction is opened when there is none, so the caller is always responsible for committing.
 
-def summarize_reaches(database, field):
+    SQLite does not report which row violated a constraint. If the batch fails
+    it is rolled back and retried one row at a time so that every failing row
+    can be logged.
+
+    Args:
+        conn (sqlite3.Connection): open database connection
+        sql (str): parameterized INSERT statement
+        rows (list): parameter lists, one per row
+        describe (function, optional): formats a row for the error log. Defaults to str.
+
+    Returns:
+        int: number of rows that could not be inserted
+    """
 
     log = Logger('Database')
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    describe = describe if describe is not None else str
 
-    curs.execute('SELECT Max({0}), Min({0}), Avg({0}), Count({0}) FROM ReachAttributes WHERE ({0} IS NOT NULL)'.format(field))
-    row = curs.fetchone()
-    if row and row[3] > 0:
-        msg = '{}, max: {:.2f}, min: {:.2f}, avg: {:.2f}'.format(field, row[0], row[1], row[2])
-    else:
-        msg = "0 non null values"
+    # Releasing a savepoint outside a transaction would commit it
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    conn.execute('SAVEPOINT batch_insert')
+    try:
+        conn.executemany(sql, rows)
+        conn.execute('RELEASE batch_insert')
+        return 0
+    except sqlite3.Error:
+        conn.execute('ROLLBACK TO batch_insert')
+        conn.execute('RELEASE batch_insert')
+
+    errs = 0
+    for row in rows:
+        try:
+            conn.execute(sql, row)
+        # Sqlite can't report on SQL errors so we have to print good log messages to help intuit what the problem is
+        except sqlite3.IntegrityError:
+            # This is likely a constraint error.
+            log.error('Integrity Error when inserting records: {}'.format(describe(row)))
+            errs += 1
+        except sqlite3.Error as err:
+            # This is any other kind of error
+            log.error('SQL Error when inserting records: {} ERROR: {}'.format(describe(row), str(err)))
+            errs += 1
+
+    return errs
+
+
+def summarize_reaches(database, fields):
+    """Log the maximum, minimum, average and number of nulls of ReachAttributes fields
+
+    The statistics of all the fields come from a single aggregate query.
+
+    Args:
+        database (str): path to the database
+        fields (list): field names (or a single field name)
+    """
+
+    log = Logger('Database')
+    fields = [fields] if isinstance(fields, str) else list(fields)
+    if len(fields) < 1:
+        return
 
-    curs.execute('SELECT Count(*) FROM ReachAttributes WHERE {0} IS NULL'.format(field))
+    curs = get_connection(database).cursor()
+    curs.row_factory = None
+    curs.execute('SELECT Count(*), {} FROM ReachAttributes'.format(','.join(['Max({0}), Min({0}), Avg({0}), Count({0})'.format(field) for field in fields])))
     row = curs.fetchone()
-    msg += ', nulls: {:,}'.format(row[0])
 
-    log.info(msg)
+    for idx, field in enumerate(fields):
+        max_value, min_value, avg_value, count = row[1 + 4 * idx: 5 + 4 * idx]
+        if count > 0:
+            msg = '{}, max: {:.2f}, min: {:.2f}, avg: {:.2f}'.format(field, max_value, min_value, avg_value)
+        else:
+            msg = "0 non null values"
+
+        msg += ', nulls: {:,}'.format(row[0] - count)
+        log.info(msg)
 
 
 def set_reach_fields_null(database, fields):
 
     log = Logger('Database')
     log.info('Setting {} reach fields to NULL'.format(len(fields)))
-    conn = sqlite3.connect(database)
-    conn.execute('PRAGMA foreign_keys = ON')
-    conn.execute('UPDATE ReachAttributes SET {}'.format(','.join(['{} = NULL'.format(field) for field in fields])))
-    conn.commit()
-    conn.close()
+    conn = get_connection(database)
+    with transaction(conn):
+        conn.execute('UPDATE ReachAttributes SET {}'.format(','.join(['{} = NULL'.format(field) for field in fields])))
 
 
 def execute_query(database, sql, message='Executing database SQL query'):
@@ -291,11 +557,9 @@ def execute_query(database, sql, message='Executing database SQL query'):
     log = Logger('Database')
     log.info(message)
 
-    conn = sqlite3.connect(database)
-    conn.execute('pragma foreign_keys=ON')
-    curs = conn.cursor()
-    curs.execute(sql)
-    conn.commit()
+    conn = get_connection(database)
+    with transaction(conn):
+        curs = conn.execute(sql)
     log.info('{:,} records affected.'.format(curs.rowcount))
 
 
@@ -310,8 +574,8 @@ def get_metadata(database):
     log = Logger('Database')
     log.debug('Retrieving metadata')
 
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
+    curs = get_connection(database).cursor()
+    curs.row_factory = None
     curs.execute('SELECT KeyInfo, ValueInfo FROM MetaData')
     meta = {}
     for row in curs.fetchall():
@@ -328,7 +592,6 @@ def store_metadata(database, key, value):
     if isinstance(value, list):
         formatted_value = ', '.join(value)
 
-    conn = sqlite3.connect(database)
-    curs = conn.cursor()
-    curs.execute('INSERT OR REPLACE INTO MetaData (KeyInfo, ValueInfo) VALUES (?, ?)', [key, formatted_value])
-    conn.commit()
+    conn = get_connection(database)
+    with transaction(conn):
+        conn.execute('INSERT OR REPLACE INTO MetaData (KeyInfo, ValueInfo) VALUES (?, ?)', [key, formatted_value])
@@ -0,0 +1,97 @@
+# Name:     Geometry Union
+#
+# Purpose:  Union large lists of geometries with a balanced tree reduction.
+#
+#           Geometries are sorted along a Z-order curve of their envelope
+#           centres so that each group holds geometries that are close
+#           together. The groups are unioned (optionally in a process pool)
+#           and then neighbouring results are merged pairwise, level by level,
+#           until one geometry is left. Every geometry takes part in a
+#           logarithmic number of unions instead of being re-unioned into an
+#           ever growing accumulated geometry.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from typing import List
+import numpy as np
+from shapely.ops import unary_union
+from shapely.geometry.base import BaseGeometry
+from rscommons import Logger
+from rscommons.process_pool import ordered_map
+
+# Number of geometries unioned together at the first level of the tree
+GROUP_SIZE = 256
+
+
+def spatial_order(geoms: List[BaseGeometry]) -> np.ndarray:
+    """Order of the geometries along a Z-order (Morton) curve of their envelope centres
+
+    Args:
+        geoms (List[BaseGeometry]): geometries to sort. None and empty geometries go last
+
+    Returns:
+        np.ndarray: positions in geoms sorted so that neighbours in the order are close in space
+    """
+
+    bounds = np.array([geom.bounds if geom is not None and not geom.is_empty else (np.nan,) * 4 for geom in geoms], dtype=np.float64).reshape(-1, 4)
+    centres = np.column_stack([(bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2])
+    missing = np.isnan(centres[:, 0])
+
+    # Quantize each axis to 16 bits over the extent of the valid centres
+    cells = np.zeros(centres.shape, dtype=np.uint32)
+    if not missing.all():
+        low = np.nanmin(centres, axis=0)
+        span = np.maximum(np.nanmax(centres, axis=0) - low, np.finfo(np.float64).tiny)
+        cells[~missing] = np.floor((centres[~missing] - low) / span * 65535).astype(np.uint32)
+
+    codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << np.uint32(1))
+    codes[missing] = np.iinfo(np.uint32).max
+    return np.argsort(codes, kind='stable')
+
+
+def tree_union(geoms: List[BaseGeometry], workers: int = 1, group_size: int = GROUP_SIZE) -> BaseGeometry:
+    """Union geometries with a spatially grouped, balanced tree reduction
+
+    Args:
+        geoms (List[BaseGeometry]): geometries to union
+        workers (int, optional): number of processes used for each level of the tree. Defaults to 1.
+        group_size (int, optional): number of geometries unioned together at the first level. Defaults to GROUP_SIZE.
+
+    Returns:
+        BaseGeometry: the union of all the geometries. None if there are none
+    """
+
+    log = Logger('tree_union')
+    geoms = [geom for geom in geoms if geom is not None and not geom.is_empty]
+    if len(geoms) == 0:
+        return None
+
+    order = spatial_order(geoms)
+    level = [[geoms[idx] for idx in order[start:start + group_size]] for start in range(0, len(geoms), group_size)]
+    log.debug('Unioning {:,} geometries in {:,} groups'.format(len(geoms), len(level)))
+
+    while True:
+        # Small levels are not worth sending to other processes
+        level_workers = min(workers, len(level)) if len(level) > 1 else 1
+        unioned = list(ordered_map(_union_group, level, level_workers))
+        if len(unioned) == 1:
+            return unioned[0]
+        # Neighbours in the spatial order are merged together at the next level
+        level = [unioned[start:start + 2] for start in range(0, len(unioned), 2)]
+
+
+def _union_group(group: List[BaseGeometry]) -> BaseGeometry:
+    """Union one group of geometries"""
+
+    return group[0] if len(group) == 1 else unary_union(group)
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Insert a zero bit between each of the lower 16 bits of every value"""
+
+    values = values.astype(np.uint32) & np.uint32(0x0000FFFF)
+    values = (values | (values << np.uint32(8))) & np.uint32(0x00FF00FF)
+    values = (values | (values << np.uint32(4))) & np.uint32(0x0F0F0F0F)
+    values = (values | (values << np.uint32(2))) & np.uint32(0x33333333)
+    values = (values | (values << np.uint32(1))) & np.uint32(0x55555555)
+    return values
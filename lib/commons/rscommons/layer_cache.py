@@ -0,0 +1,188 @@
+# Name:     Layer Cache
+#
+# Purpose:  Process-level store of decoded vector layers shared across a
+#           model run.
+#
+#           A model such as BRAT reads the same layer many times (load the
+#           geometries, union them, buffer them for every vegetation raster...)
+#           and pays for the OGR to Shapely conversion every time. Layers read
+#           through VectorBase.read_cached() are kept here in columnar form
+#           (an array of FIDs, a list of Shapely geometries and one array per
+#           attribute field) keyed on the dataset path, layer, attribute filter
+#           and output projection.
+#
+#           Entries are dropped when the dataset changes on disk (modification
+#           time or size) and the least recently used entries are evicted once
+#           the total estimated size goes over the byte budget.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+import os
+import sys
+from collections import OrderedDict
+from typing import Dict, List
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+from rscommons.classes.logger import Logger
+
+# Default total size of the cached layers
+DEFAULT_BUDGET = 512 * 1024 ** 2
+
+# Rough Python and GEOS overhead of each Shapely geometry on top of its WKB size
+GEOMETRY_OVERHEAD = 128
+
+
+class LayerColumns():
+    """Decoded features of one layer in columnar form
+
+    The geometries and columns are shared by every caller that gets this entry
+    from the cache so they must be treated as read only.
+    """
+
+    def __init__(self, fids: List[int], geoms: List[BaseGeometry], columns: Dict[str, list], dtypes: Dict[str, np.dtype] = None, geom_bytes: int = 0):
+        """
+        Args:
+            fids (List[int]): feature ID of every feature
+            geoms (List[BaseGeometry]): Shapely geometry of every feature (None when the feature has none)
+            columns (Dict[str, list]): field values of every feature keyed by field name
+            dtypes (Dict[str, np.dtype], optional): array type for each field. Fields with nulls or no type are stored as objects. Defaults to None.
+            geom_bytes (int, optional): WKB size of all the geometries, used to estimate the memory used. Defaults to 0.
+        """
+        dtypes = dtypes or {}
+
+        self.fids = np.asarray(fids, dtype=np.int64)
+        self.geoms = geoms
+        self.columns = {}
+        for name, values in columns.items():
+            dtype = dtypes.get(name)
+            if dtype is None or any(value is None for value in values):
+                dtype = object
+            self.columns[name] = np.array(values, dtype=dtype)
+
+        self.nbytes = self.fids.nbytes + geom_bytes + GEOMETRY_OVERHEAD * len(geoms)
+        for values in self.columns.values():
+            self.nbytes += values.nbytes
+            if values.dtype == object:
+                self.nbytes += sum(sys.getsizeof(value) for value in values)
+
+    def __len__(self) -> int:
+        return len(self.fids)
+
+    def geometry_dict(self, id_field: str = None) -> Dict[int, BaseGeometry]:
+        """Geometries keyed by FID or by the values of a field
+
+        Args:
+            id_field (str, optional): field used as the key. Defaults to None (use the FID).
+
+        Returns:
+            Dict[int, BaseGeometry]: geometry of each feature that has one
+        """
+        keys = self.fids if id_field is None else self.columns[id_field]
+        return {key: geom for key, geom in zip(keys.tolist(), self.geoms) if geom is not None}
+
+
+class LayerCache():
+    """Least recently used store of LayerColumns with a total byte budget
+    """
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        """
+        Args:
+            budget (int, optional): maximum total estimated size of the cached layers in bytes. Defaults to DEFAULT_BUDGET.
+        """
+        self.log = Logger('Layer Cache')
+        self.budget = budget
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, stamp: tuple) -> LayerColumns:
+        """Cached layer for a key if the dataset has not changed since it was stored
+
+        Args:
+            key (tuple): (dataset path, layer name, attribute filter, projection)
+            stamp (tuple): current dataset_stamp() of the dataset
+
+        Returns:
+            LayerColumns: the cached layer or None
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] != stamp:
+            self.log.debug('Dataset changed on disk. Dropping cached layer {}'.format(key[:2]))
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, stamp: tuple, columns: LayerColumns):
+        """Store a layer and evict the least recently used layers that no longer fit
+
+        Layers larger than the whole budget are not stored.
+
+        Args:
+            key (tuple): (dataset path, layer name, attribute filter, projection)
+            stamp (tuple): dataset_stamp() of the dataset when the layer was read
+            columns (LayerColumns): the decoded layer
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        if columns.nbytes > self.budget:
+            self.log.debug('Layer {} ({:,} bytes) is larger than the cache budget. Not cached'.format(key[:2], columns.nbytes))
+            return
+
+        self._entries[key] = (stamp, columns)
+        self.nbytes += columns.nbytes
+        while self.nbytes > self.budget:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Forget every cached layer"""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _remove(self, key: tuple):
+        _stamp, columns = self._entries.pop(key)
+        self.nbytes -= columns.nbytes
+
+
+# The cache shared by every reader in this process
+layer_cache = LayerCache()
+
+
+def dataset_stamp(ds_path: str) -> tuple:
+    """Modification time and size of a dataset and the files that change with it
+
+    This covers the SQLite WAL file of a geopackage and the attribute table of a shapefile.
+
+    Args:
+        ds_path (str): path to the dataset (not the layer)
+
+    Returns:
+        tuple: (mtime_ns, size) of each of the files that exist
+    """
+    paths = [ds_path, ds_path + '-wal']
+    if ds_path.lower().endswith('.shp'):
+        paths.append(os.path.splitext(ds_path)[0] + '.dbf')
+
+    stamp = []
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def clear_layer_cache():
+    """Forget every layer cached by VectorBase.read_cached()"""
+    layer_cache.clear()
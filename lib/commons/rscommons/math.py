@@ -1,5 +1,8 @@
 """" Math module to safely run expressions
 """
+import ast
+from functools import lru_cache, reduce
+import numpy as np
 # from sympy import zoo, oo, nan
 from sympy.parsing.sympy_parser import parse_expr, TokenError
 
@@ -35,3 +38,148 @@ def safe_eval(eval_fn: str, fn_params: dict = None) -> float:
         raise EquationError('Error parsing equation: "{}", variables: "{}", Err: {}'.format(eval_fn, fn_params, err)) from None
     except Exception as err:
         raise err
+
+
+def _log(value, base=None):
+    """Natural logarithm or, like SymPy's log(x, b), the logarithm in another base"""
+    return np.log(value) if base is None else np.log(value) / np.log(base)
+
+
+def _max(*values):
+    """Element-wise maximum of any number of values like SymPy's Max()"""
+    return reduce(np.maximum, values)
+
+
+def _min(*values):
+    """Element-wise minimum of any number of values like SymPy's Min()"""
+    return reduce(np.minimum, values)
+
+
+class CompiledEquation():
+    """An equation parsed and validated once that can be evaluated over whole arrays of values
+
+    Only numbers, variables, the arithmetic operators and the constants and functions in CONSTANTS
+    and FUNCTIONS are allowed. These cover the SymPy names that safe_eval() equations use (pi, E,
+    ln, two argument log, Max, Min and Abs) but not the rest of SymPy (e.g. trigonometric functions,
+    floor or Piecewise) and ^ is not a power. The variables are evaluated with NumPy so each one
+    can be a single value or an array with one value per feature (or reach). A parameter with the
+    same name as a constant takes its place, as it does in safe_eval().
+
+    Args:
+        eval_fn (str): An equation as a string
+    """
+
+    CONSTANTS = {
+        'pi': np.pi,
+        'E': np.e
+    }
+
+    # Functions that can be called from an equation and their NumPy implementations
+    FUNCTIONS = {
+        'exp': np.exp,
+        'log': _log,
+        'ln': np.log,
+        'log10': np.log10,
+        'sqrt': np.sqrt,
+        'abs': np.abs,
+        'Abs': np.abs,
+        'Max': _max,
+        'Min': _min
+    }
+
+    # Fewest and most arguments of the functions that do not take exactly one. None is no limit
+    ARGUMENTS = {
+        'log': (1, 2),
+        'Max': (1, None),
+        'Min': (1, None)
+    }
+
+    OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.UAdd, ast.USub)
+
+    def __init__(self, eval_fn: str):
+        self.eval_fn = eval_fn
+        try:
+            tree = ast.parse(eval_fn.strip(), mode='eval')
+        except SyntaxError as err:
+            raise EquationError('Error parsing equation: "{}", Err: {}'.format(eval_fn, err)) from None
+
+        self.variables = set()
+        self.constants = set()
+        self.__validate(tree.body)
+        self.variables = sorted(self.variables)
+        self.code = compile(tree, '<equation>', 'eval')
+
+    def __validate(self, node: ast.AST):
+        """Walk the expression and reject anything that isn't on the whitelist"""
+
+        if isinstance(node, ast.BinOp) and isinstance(node.op, self.OPERATORS):
+            self.__validate(node.left)
+            self.__validate(node.right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, self.OPERATORS):
+            self.__validate(node.operand)
+        elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            pass
+        elif isinstance(node, ast.Name):
+            if node.id in self.FUNCTIONS:
+                raise EquationError('Function "{}" used as a variable in equation: "{}"'.format(node.id, self.eval_fn))
+            if node.id in self.CONSTANTS:
+                self.constants.add(node.id)
+            else:
+                self.variables.add(node.id)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.FUNCTIONS and len(node.keywords) == 0:
+            fewest, most = self.ARGUMENTS.get(node.func.id, (1, 1))
+            if len(node.args) < fewest or (most is not None and len(node.args) > most):
+                raise EquationError('Wrong number of arguments for "{}" in equation: "{}"'.format(node.func.id, self.eval_fn))
+            for arg in node.args:
+                self.__validate(arg)
+        else:
+            raise EquationError('Unsupported expression "{}" in equation: "{}"'.format(ast.dump(node), self.eval_fn))
+
+    def evaluate(self, fn_params: dict, count: int = None) -> np.ndarray:
+        """Evaluate the equation for every value of the parameters
+
+        Args:
+            fn_params (dict): A dictionary of parameter names and their values. Each value is a number or an array
+            count (int, optional): number of results when all the parameters are single values. Defaults to None.
+
+        Raises:
+            EquationError: when a variable is missing or a result is infinite or not a number
+
+        Returns:
+            np.ndarray: float array of results, one per element of the parameter arrays
+        """
+        missing = [variable for variable in self.variables if variable not in fn_params]
+        if len(missing) > 0:
+            raise EquationError('Equation is missing values for {}: "{}"'.format(', '.join(missing), self.eval_fn))
+
+        namespace = {name: np.asarray(fn_params[name] if name in fn_params else self.CONSTANTS[name], dtype=np.float64) for name in self.constants}
+        namespace.update({variable: np.asarray(fn_params[variable], dtype=np.float64) for variable in self.variables})
+        namespace.update(self.FUNCTIONS)
+        namespace['__builtins__'] = {}
+
+        with np.errstate(all='ignore'):
+            result = np.asarray(eval(self.code, namespace), dtype=np.float64)
+        if count is not None:
+            result = np.broadcast_to(result, (count,)) if result.ndim == 0 else result
+
+        invalid = np.flatnonzero(~np.isfinite(result))
+        if len(invalid) > 0:
+            first = np.unravel_index(invalid[0], result.shape) if result.ndim > 0 else ()
+            values = {variable: float(namespace[variable][first] if namespace[variable].ndim > 0 else namespace[variable]) for variable in self.variables}
+            raise EquationError('Equation produced infinite or non-numeric result for {:,} of {:,} values: eq: "{}", first invalid variables: "{}"'.format(
+                len(invalid), result.size, self.eval_fn, values))
+
+        return result
+
+
+@lru_cache(maxsize=64)
+def compile_equation(eval_fn: str) -> CompiledEquation:
+    """Parse and validate an equation once so it can be evaluated over arrays of values
+
+    Args:
+        eval_fn (str): An equation as a string
+
+    Returns:
+        CompiledEquation: the validated equation
+    """
+    return CompiledEquation(eval_fn)
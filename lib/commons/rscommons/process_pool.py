@@ -0,0 +1,51 @@
+# Name:     Process Pool
+#
+# Purpose:  Run independent tasks (e.g. raster tiles) in a pool of worker
+#           processes and hand the results back in task order so that a single
+#           writer in the calling process produces the same output as a serial
+#           loop.
+#
+#           Only a bounded number of tasks are in flight at any time so memory
+#           does not grow with the number of tasks when the writer is slower
+#           than the workers.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+
+def ordered_map(func: Callable, tasks: Iterable, workers: int, initializer: Callable = None, initargs: tuple = (), pending_per_worker: int = 2) -> Iterator:
+    """Apply func to every task and yield the results in task order
+
+    Args:
+        func (Callable): module level function that takes one task. It must be picklable
+        tasks (Iterable): task arguments. Consumed lazily
+        workers (int): number of worker processes. 1 or less runs every task in this process
+        initializer (Callable, optional): called once in each worker (or once here when serial) with initargs. Defaults to None.
+        initargs (tuple, optional): arguments for the initializer. Defaults to ().
+        pending_per_worker (int, optional): tasks queued per worker. Defaults to 2.
+
+    Yields:
+        the result of func for each task
+    """
+
+    tasks = iter(tasks)
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield func(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        # Zip the bounded range first so that no task is pulled from the iterator and dropped
+        pending = deque(executor.submit(func, task) for _slot, task in zip(range(pending_per_worker * workers), tasks))
+        while len(pending) > 0:
+            result = pending.popleft().result()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(executor.submit(func, task))
+            yield result
@@ -21,6 +21,7 @@ from shapely.geometry import shape
 from osgeo import ogr
 from osgeo import osr
 from rscommons import ProgressBar, Logger
+from rscommons.zonal_stats import zonal_statistics
 from rasterio.mask import mask
 import numpy as np
 
@@ -117,6 +118,26 @@ import numpy as np
 
 
 def raster_buffer_stats2(polygons, raster):
+    """Statistics of the raster cells under each polygon
+
+    Uses the single pass zonal statistics engine. See masked_buffer_stats()
+    for the original implementation that masks the raster once per polygon.
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        raster (str): path to the raster
+
+    Returns:
+        dict: keyed by polygon ID. Values are dictionaries with Mean, Maximum, Minimum, Count and Sum
+    """
+
+    return zonal_statistics(polygons, raster)
+
+
+def masked_buffer_stats(polygons, raster):
+    """Per-polygon reference implementation of raster_buffer_stats2() that
+    reads the raster under each polygon with rasterio.mask.mask()
+    """
 
     log = Logger('Buffer Stats')
 
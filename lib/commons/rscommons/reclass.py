@@ -0,0 +1,174 @@
+# Name:     Reclass
+#
+# Purpose:  Reclassify categorical rasters (e.g. LANDFIRE vegetation types)
+#           with NumPy lookup tables instead of calling a Python function per
+#           cell with np.vectorize().
+#
+#           Codes that span a modest range are remapped by indexing a dense
+#           lookup array. Sparse codes fall back to a binary search of the
+#           sorted codes with np.searchsorted(). reclass_raster() applies any
+#           number of tables block by block so that several products are
+#           written from a single read of the source raster.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from typing import Dict, List, Tuple
+import numpy as np
+import rasterio
+from rscommons import Logger, ProgressBar
+
+# Largest range of codes that gets a dense lookup array
+DENSE_LIMIT = 1 << 20
+
+
+class ReclassTable():
+    """Lookup table that maps integer raster codes to new values
+    """
+
+    def __init__(self, mapping: dict, default=0, dtype=None, dense_limit: int = DENSE_LIMIT):
+        """
+        Args:
+            mapping (dict): new values keyed by integer code
+            default (optional): value for codes that are not in the mapping. Defaults to 0.
+            dtype (optional): output data type. Defaults to the type that holds all the values and the default.
+            dense_limit (int, optional): largest code range stored as a dense array. Defaults to DENSE_LIMIT.
+        """
+
+        if any(not isinstance(code, (int, np.integer)) for code in mapping.keys()):
+            raise Exception('Reclass tables require integer codes')
+
+        self.dtype = np.dtype(dtype) if dtype is not None else np.asarray(list(mapping.values()) + [default]).dtype
+        self.default = default
+
+        self._keys = np.array(sorted(mapping.keys()), dtype=np.int64)
+        self._values = np.array([mapping[code] for code in self._keys.tolist()], dtype=self.dtype)
+
+        span = int(self._keys[-1] - self._keys[0]) + 1 if len(self._keys) > 0 else 0
+        self._dense = 0 < span <= dense_limit
+        if self._dense:
+            # Values and presence of every code between the smallest and largest code
+            self._offset = int(self._keys[0])
+            self._present = np.zeros(span, dtype=bool)
+            self._present[self._keys - self._offset] = True
+            self._lut = np.full(span, default, dtype=self.dtype)
+            self._lut[self._keys - self._offset] = self._values
+
+    def __call__(self, codes: np.ndarray) -> np.ndarray:
+        """Reclassify an array of codes
+
+        Args:
+            codes (np.ndarray): integer codes
+
+        Returns:
+            np.ndarray: new values with the same shape as codes
+        """
+
+        return self.lookup(codes)[0]
+
+    def lookup(self, codes: np.ndarray):
+        """Reclassify an array of codes and report which codes are in the table
+
+        Args:
+            codes (np.ndarray): integer codes
+
+        Returns:
+            tuple: new values and a boolean array that is False for codes not in the table
+        """
+
+        positions, found = self._positions(codes)
+        if len(self._keys) == 0:
+            return np.full(found.shape, self.default, dtype=self.dtype), found
+
+        values = np.take(self._lut if self._dense else self._values, positions)
+        if not found.all():
+            values[~found] = self.default
+        return values, found
+
+    def missing(self, codes: np.ndarray) -> np.ndarray:
+        """Codes in the array that have no value in the table
+
+        Args:
+            codes (np.ndarray): integer codes
+
+        Returns:
+            np.ndarray: sorted unique codes that are not in the table
+        """
+
+        _positions, found = self._positions(codes)
+        return np.unique(np.asarray(codes)[~found])
+
+    def _positions(self, codes: np.ndarray):
+        """Position of each code in the lookup arrays and whether the code is in the table"""
+
+        codes = np.asarray(codes)
+        if not np.issubdtype(codes.dtype, np.integer):
+            raise Exception('Reclass tables can only be applied to integer arrays. Found {}'.format(codes.dtype))
+
+        if len(self._keys) == 0:
+            return np.zeros(codes.shape, dtype=np.intp), np.zeros(codes.shape, dtype=bool)
+
+        if self._dense:
+            positions = codes.astype(np.int64) - self._offset
+            found = (positions >= 0) & (positions < len(self._present))
+            np.clip(positions, 0, len(self._present) - 1, out=positions)
+            found &= self._present[positions]
+        else:
+            positions = np.searchsorted(self._keys, codes)
+            np.clip(positions, 0, len(self._keys) - 1, out=positions)
+            found = self._keys[positions] == codes
+
+        return positions, found
+
+
+def reclass_raster(raster_path: str, products: List[Tuple[str, ReclassTable, float]], label: str = None, **profile) -> Dict[str, np.ndarray]:
+    """Write one or more reclassified copies of a categorical raster from a single
+    block by block read of the source raster
+
+    Args:
+        raster_path (str): path to the source raster. Band 1 is used
+        products (List[Tuple[str, ReclassTable, float]]): (output path, table, output NoData) for each product.
+            When the output NoData is None the source NoData cells are reclassified like any other
+            cell and the output has no NoData value. Otherwise they are written as the output NoData.
+        label (str, optional): progress bar label. Defaults to None.
+        profile: creation options applied to every output (e.g. compress='deflate')
+
+    Returns:
+        Dict[str, np.ndarray]: codes that were not in the table of each product, keyed by output path
+    """
+
+    log = Logger('Reclass')
+    log.info('Reclassifying {} into {:,} rasters'.format(raster_path, len(products)))
+
+    missing = {output_path: set() for output_path, _table, _nodata in products}
+    with rasterio.open(raster_path) as src:
+        outputs = []
+        try:
+            for output_path, table, nodata in products:
+                out_meta = src.meta.copy()
+                out_meta.update(profile)
+                out_meta['dtype'] = table.dtype.name
+                out_meta['nodata'] = nodata
+                outputs.append((rasterio.open(output_path, 'w', **out_meta), table, nodata, missing[output_path]))
+
+            windows = [window for _ji, window in src.block_windows(1)]
+            progbar = ProgressBar(len(windows), 50, label or 'Reclassifying {}'.format(raster_path))
+            for counter, window in enumerate(windows):
+                progbar.update(counter + 1)
+                codes = src.read(1, window=window)
+                is_nodata = codes == src.nodata if src.nodata is not None else None
+
+                for dst, table, nodata, product_missing in outputs:
+                    values, found = table.lookup(codes)
+                    if nodata is not None and is_nodata is not None:
+                        values[is_nodata] = nodata
+                        found |= is_nodata
+                    if not found.all():
+                        product_missing.update(np.unique(codes[~found]).tolist())
+                    dst.write(values, 1, window=window)
+
+            progbar.finish()
+        finally:
+            for dst, _table, _nodata, _missing in outputs:
+                dst.close()
+
+    return {output_path: np.array(sorted(codes), dtype=np.int64) for output_path, codes in missing.items()}
@@ -16,6 +16,8 @@ import argparse
 import os
 import sys
 import traceback
+from typing import List
+import numpy as np
 from osgeo import ogr, osr
 from shapely.geometry import LineString, Point
 from rscommons import Logger, ProgressBar, initGDALOGRErrors, dotenv, get_shp_or_gpkg, VectorBase
@@ -23,36 +25,8 @@ from rscommons.classes.vector_base import get_utm_zone_epsg
 
 initGDALOGRErrors()
 
-
-class SegmentFeature:
-    '''
-    '''
-
-    def __init__(self, feature, transform):
-        self.name = feature.GetField('GNIS_NAME')
-        georef = feature.GetGeometryRef()
-        self.fid = feature.GetFID()
-        geotype = georef.GetGeometryType()
-        self.FCode = feature.GetField('FCode')
-        self.TotDASqKm = feature.GetField('TotDASqKm')
-        self.DivDASqKm = feature.GetField('DivDASqKm')
-        self.NHDPlusID = feature.GetField('NHDPlusID')
-
-        if geotype not in [ogr.wkbLineStringZM, ogr.wkbLineString, ogr.wkbLineString25D, ogr.wkbLineStringM]:
-            raise Exception('Multipart geometry in the original ShapeFile')
-
-        pts = []
-
-        pts = georef.GetPoints()
-
-        self.start = ogr.Geometry(ogr.wkbPoint)
-        self.start.AddPoint(*pts[0])
-
-        self.end = ogr.Geometry(ogr.wkbPoint)
-        self.end.AddPoint(*pts[-1])
-
-        georef.Transform(transform)
-        self.length_m = georef.Length()
+# Number of vertices sent to PROJ per call when transforming whole networks
+TRANSFORM_BATCH_SIZE = 100000
 
 
 def segment_network(inpath: str, outpath: str, interval: float, minimum: float, watershed_id: str, create_layer=False):
@@ -101,108 +75,185 @@ def segment_network(inpath: str, outpath: str, interval: float, minimum: float,
                 'WatershedID': ogr.OFTString
             })
 
-        # Retrieve all input features keeping track of which ones have GNIS names or not
-        named_features = {}
-        all_features = []
-        junctions = []
-
         # Omit pipelines with FCode 428**
         attribute_filter = 'FCode < 42800 OR FCode > 42899'
         log.info('Filtering out pipelines ({})'.format(attribute_filter))
 
-        for in_feature, _counter, _progbar in in_lyr.iterate_features("Loading Network", attribute_filter=attribute_filter):
-            # Store relevant items as a tuple:
-            # (name, FID, StartPt, EndPt, Length, FCode)
-            s_feat = SegmentFeature(in_feature, transform)
-
-            # Add the end points of all lines to a single list
-            junctions.extend([s_feat.start, s_feat.end])
-
-            if not s_feat.name or len(s_feat.name) < 1 or interval <= 0:
-                # Add features without a GNIS name to list. Also add to list if not segmenting
-                all_features.append(s_feat)
-            else:
-                # Build separate lists for each unique GNIS name
-                if s_feat.name not in named_features:
-                    named_features[s_feat.name] = [s_feat]
-                else:
-                    named_features[s_feat.name].append(s_feat)
-
-        # Loop over all features with the same GNIS name.
-        # Only merge them if they meet at a junction where no other lines meet.
-        log.info('Merging simple features with the same GNIS name...')
-        for name, features in named_features.items():
-            log.debug('   {} x{}'.format(name.encode('utf-8'), len(features)))
-            all_features.extend(features)
-
-        log.info('{:,} features after merging. Starting segmentation...'.format(len(all_features)))
+        # Load the whole network as columns. Input fields are copied to the output field in the same position
+        in_fields = [in_lyr.ogr_layer_def.GetFieldDefn(i).GetName() for i in range(in_lyr.ogr_layer_def.GetFieldCount())]
+        _fids, wkbs, in_columns = in_lyr.read_columns(in_fields, attribute_filter=attribute_filter)
+        lines = []
+        for geom_wkb in wkbs:
+            geom = ogr.CreateGeometryFromWkb(bytes(geom_wkb)) if geom_wkb is not None else None
+            if geom is None or geom.GetGeometryType() not in [ogr.wkbLineStringZM, ogr.wkbLineString, ogr.wkbLineString25D, ogr.wkbLineStringM]:
+                raise Exception('Multipart geometry in the original ShapeFile')
+            lines.append(np.array(geom.GetPoints(), dtype=np.float64))
+        names = in_columns['GNIS_NAME'].tolist()
+        log.info('{:,} features loaded'.format(len(lines)))
+
+        # Project every vertex in one pass to get the lengths and the coordinates used for cutting
+        utm_lines = transform_lines(lines, transform)
+        lengths = np.array([line_lengths(line)[-1] if len(line) > 1 else 0.0 for line in utm_lines])
+
+        # Features without a GNIS name go first, followed by separate lists for each unique GNIS name.
+        # Keep the input order if not segmenting
+        order = list(range(len(lines)))
+        if interval > 0:
+            named_features = {}
+            for idx, name in enumerate(names):
+                if name and len(name) > 0:
+                    named_features.setdefault(name, []).append(idx)
+            order = [idx for idx, name in enumerate(names) if not name or len(name) < 1]
+
+            # Loop over all features with the same GNIS name.
+            # Only merge them if they meet at a junction where no other lines meet.
+            log.info('Merging simple features with the same GNIS name...')
+            for name, features in named_features.items():
+                log.debug('   {} x{}'.format(name.encode('utf-8'), len(features)))
+                order.extend(features)
+
+        log.info('{:,} features after merging. Starting segmentation...'.format(len(order)))
 
         # Segment the features at the desired interval
-        # rid = 0
         log.info('Segmenting Network...')
-        progbar = ProgressBar(len(all_features), 50, "Segmenting")
-        counter = 0
-
-        out_lyr.ogr_layer.StartTransaction()
-        for orig_feat in all_features:
-            counter += 1
+        progbar = ProgressBar(len(order), 50, "Segmenting")
+        out_fields = [out_lyr.ogr_layer_def.GetFieldDefn(i).GetNameRef() for i in range(len(in_fields))]
+        out_geoms = []
+        out_rows = []
+        cut_parts = []
+        cut_positions = []
+        for counter, idx in enumerate(order, start=1):
             progbar.update(counter)
 
-            old_feat = in_lyr.ogr_layer.GetFeature(orig_feat.fid)
-            old_geom = old_feat.GetGeometryRef()
             #  Anything that produces reach shorter than the minimum just gets added. Also just add features if not segmenting
-            if orig_feat.length_m < (interval + minimum) or interval <= 0:
-                new_ogr_feat = ogr.Feature(out_lyr.ogr_layer_def)
-                copy_fields(old_feat, new_ogr_feat, in_lyr.ogr_layer_def, out_lyr.ogr_layer_def)
-                # Set the attributes using the values from the delimited text file
-                new_ogr_feat.SetField("GNIS_NAME", orig_feat.name)
-                new_ogr_feat.SetField("WatershedID", watershed_id)
-                new_ogr_feat.SetGeometry(old_geom)
-                out_lyr.ogr_layer.CreateFeature(new_ogr_feat)
-                # rid += 1
+            if lengths[idx] < (interval + minimum) or interval <= 0:
+                out_geoms.append(wkbs[idx])
+                out_rows.append(idx)
             else:
-                # From here on out we use shapely and project to UTM. We'll transform back before writing to disk.
-                new_geom = old_geom.Clone()
-                new_geom.Transform(transform)
-                remaining = LineString(new_geom.GetPoints())
-                while remaining and remaining.length >= (interval + minimum):
-                    part1shply, part2shply = cut(remaining, interval)
-                    remaining = part2shply
-
-                    new_ogr_feat = ogr.Feature(out_lyr.ogr_layer_def)
-                    copy_fields(old_feat, new_ogr_feat, in_lyr.ogr_layer_def, out_lyr.ogr_layer_def)
-
-                    # Set the attributes using the values from the delimited text file
-                    new_ogr_feat.SetField("GNIS_NAME", orig_feat.name)
-                    new_ogr_feat.SetField("WatershedID", watershed_id)
-
-                    geo = ogr.CreateGeometryFromWkt(part1shply.wkt)
-                    geo.Transform(transform_back)
-                    new_ogr_feat.SetGeometry(geo)
-                    out_lyr.ogr_layer.CreateFeature(new_ogr_feat)
-                    # rid += 1
-
-                # Add any remaining line to outGeometries
-                if remaining:
-                    new_ogr_feat = ogr.Feature(out_lyr.ogr_layer_def)
-                    copy_fields(old_feat, new_ogr_feat, in_lyr.ogr_layer_def, out_lyr.ogr_layer_def)
-
-                    # Set the attributes using the values from the delimited text file
-                    new_ogr_feat.SetField("GNIS_NAME", orig_feat.name)
-                    new_ogr_feat.SetField("WatershedID", watershed_id)
-
-                    geo = ogr.CreateGeometryFromWkt(remaining.wkt)
-                    geo.Transform(transform_back)
-                    new_ogr_feat.SetGeometry(geo)
-                    out_lyr.ogr_layer.CreateFeature(new_ogr_feat)
-                    # rid += 1
-        out_lyr.ogr_layer.CommitTransaction()
+                # Parts are cut in UTM and transformed back before writing to disk.
+                for part in segment_line(utm_lines[idx], interval, minimum):
+                    cut_positions.append(len(out_geoms))
+                    cut_parts.append(part)
+                    out_geoms.append(None)
+                    out_rows.append(idx)
         progbar.finish()
 
+        # Transform all the new parts back to the input spatial reference
+        for position, part in zip(cut_positions, transform_lines(cut_parts, transform_back)):
+            out_geoms[position] = LineString(part).wkb
+
+        out_columns = {out_field: in_columns[in_field][out_rows] for in_field, out_field in zip(in_fields, out_fields)}
+        out_columns['GNIS_NAME'] = in_columns['GNIS_NAME'][out_rows]
+        out_columns['WatershedID'] = [watershed_id] * len(out_rows)
+        out_lyr.write_columns(out_geoms, out_columns, name='Writing Network')
+
         log.info(('{:,} features written to {:}'.format(out_lyr.ogr_layer.GetFeatureCount(), outpath)))
         log.info('Process completed successfully.')
 
 
+def transform_lines(lines: List[np.ndarray], transform: osr.CoordinateTransformation) -> List[np.ndarray]:
+    """Transform the vertices of many lines with batched calls to PROJ
+
+    Args:
+        lines (List[np.ndarray]): vertex arrays with 2 or 3 columns
+        transform (osr.CoordinateTransformation): transformation to apply
+
+    Returns:
+        List[np.ndarray]: transformed vertex arrays with the same shapes
+    """
+    if len(lines) == 0:
+        return []
+
+    xyz = np.zeros((sum(len(line) for line in lines), 3))
+    offsets = np.cumsum([0] + [len(line) for line in lines])
+    for line, start in zip(lines, offsets):
+        xyz[start:start + len(line), :line.shape[1]] = line
+
+    for start in range(0, len(xyz), TRANSFORM_BATCH_SIZE):
+        batch = xyz[start:start + TRANSFORM_BATCH_SIZE]
+        batch[:] = np.array(transform.TransformPoints(batch.tolist()))[:, :3]
+
+    return [xyz[start:end, :line.shape[1]] for line, start, end in zip(lines, offsets[:-1], offsets[1:])]
+
+
+def line_lengths(coords: np.ndarray) -> np.ndarray:
+    """Cumulative 2D length at every vertex after the first, summed in the same order as GEOS and OGR
+
+    Args:
+        coords (np.ndarray): line vertices
+
+    Returns:
+        np.ndarray: distance along the line of the second to last vertex
+    """
+    deltas = np.diff(coords[:, :2], axis=0)
+    return np.cumsum(np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1]))
+
+
+def segment_line(coords: np.ndarray, interval: float, minimum: float) -> List[np.ndarray]:
+    """Cut a line every interval until what remains is shorter than the interval plus the minimum
+
+    This gives the same parts as calling cut() on the remaining line over and over but the distance
+    to each vertex is a cumulative sum of the segment lengths instead of a projection of every vertex
+    onto the line.
+
+    Args:
+        coords (np.ndarray): line vertices in a projected coordinate system
+        interval (float): distance between cuts
+        minimum (float): shortest part allowed at the end of the line
+
+    Returns:
+        List[np.ndarray]: vertices of each part in order along the line
+    """
+    line = LineString(coords)
+    if np.array_equal(coords[0], coords[-1]) or not line.is_simple:
+        # Closed lines need the special ring handling in cut(). On lines that touch themselves the
+        # projection of a vertex can land on an earlier part of the line so cut() is used for both.
+        parts = []
+        remaining = line
+        while remaining and remaining.length >= (interval + minimum):
+            part, remaining = cut(remaining, interval)
+            parts.append(np.asarray(part.coords))
+        return parts + [np.asarray(remaining.coords)] if remaining else parts
+
+    segments = np.diff(coords[:, :2], axis=0)
+    segments = np.sqrt(segments[:, 0] * segments[:, 0] + segments[:, 1] * segments[:, 1])
+
+    # The remaining line is the head point followed by coords[vertex:]
+    parts = []
+    head = coords[0]
+    vertex = 1
+    while vertex < len(coords):
+        delta = coords[vertex, :2] - head[:2]
+        first = np.sqrt(delta[0] * delta[0] + delta[1] * delta[1])
+        distances = np.cumsum(np.concatenate(([first], segments[vertex:])))
+        if not distances[-1] >= interval + minimum:
+            break
+
+        # First vertex at or beyond the cut
+        after = int(np.searchsorted(distances, interval, side='left'))
+        if interval >= distances[-1]:
+            break
+
+        if distances[after] == interval:
+            parts.append(np.vstack([head[np.newaxis], coords[vertex:vertex + after + 1]]))
+            head = coords[vertex + after]
+            vertex = vertex + after + 1
+        else:
+            # Interpolate along the segment that contains the cut
+            start = head if after == 0 else coords[vertex + after - 1]
+            end = coords[vertex + after]
+            before = 0.0 if after == 0 else distances[after - 1]
+            fraction = (interval - before) / (first if after == 0 else segments[vertex + after - 1])
+            cut_point = end.copy() if fraction >= 1.0 else (end - start) * fraction + start
+
+            parts.append(np.vstack([head[np.newaxis], coords[vertex:vertex + after], cut_point[np.newaxis]]))
+            head = cut_point
+            vertex = vertex + after
+
+    parts.append(np.vstack([head[np.newaxis], coords[vertex:]]))
+    return parts
+
+
 def cut(line, distance):
     """
     Cuts a line in two at a distance from its starting point
@@ -240,12 +291,6 @@ def cut(line, distance):
     return None
 
 
-def copy_fields(in_feature, out_feature, in_layer_def, out_layer_def):
-    # Add field values from input Layer
-    for i in range(0, in_layer_def.GetFieldCount()):
-        out_feature.SetField(out_layer_def.GetFieldDefn(i).GetNameRef(), in_feature.GetField(i))
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('network', help='Input stream network ShapeFile path', type=str)
@@ -0,0 +1,110 @@
+# Name:     Spatial Index
+#
+# Purpose:  Thin wrapper around the Shapely STRtree that answers queries with
+#           positions in the original list of geometries instead of geometry
+#           objects so that results can be used to index NumPy arrays and
+#           parallel lists of attributes.
+#
+#           Shapely 1.x STRtree queries return the geometry objects themselves
+#           while Shapely 2.x returns integer indices. Both are handled here.
+#
+#           connected_components() groups geometries that touch or overlap,
+#           directly or through a chain of others, with a union-find over the
+#           index so each pair of candidates is tested once.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from typing import List
+from shapely.strtree import STRtree
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+
+
+class GeometryIndex():
+    """STRtree over a list of Shapely geometries that returns list indices
+    """
+
+    def __init__(self, geoms: List[BaseGeometry]):
+        self.geoms = list(geoms)
+
+        # Empty geometries cannot be indexed. They never intersect anything anyway
+        indexed = [idx for idx, geom in enumerate(self.geoms) if geom is not None and not geom.is_empty]
+        self._indexed = indexed
+        self._tree = STRtree([self.geoms[idx] for idx in indexed]) if len(indexed) > 0 else None
+
+        # Shapely 1.x hands back the geometry objects so map them back to their list position
+        self._positions = {}
+        for idx in indexed:
+            self._positions.setdefault(id(self.geoms[idx]), []).append(idx)
+
+    def __len__(self):
+        return len(self.geoms)
+
+    def query(self, geom: BaseGeometry) -> List[int]:
+        """Indices of the geometries whose envelopes intersect the envelope of geom
+
+        Args:
+            geom (BaseGeometry): query geometry
+
+        Returns:
+            List[int]: sorted positions in the list passed to the constructor
+        """
+        if self._tree is None or geom is None or geom.is_empty:
+            return []
+
+        results = self._tree.query(geom)
+        indices = set()
+        for result in results:
+            if isinstance(result, BaseGeometry):
+                indices.update(self._positions[id(result)])
+            else:
+                indices.add(self._indexed[int(result)])
+
+        return sorted(indices)
+
+    def intersecting(self, geom: BaseGeometry) -> List[int]:
+        """Indices of the geometries that actually intersect geom
+
+        Args:
+            geom (BaseGeometry): query geometry
+
+        Returns:
+            List[int]: sorted positions in the list passed to the constructor
+        """
+        return [idx for idx in self.query(geom) if self.geoms[idx].intersects(geom)]
+
+
+def connected_components(geoms: List[BaseGeometry], index: GeometryIndex = None) -> List[int]:
+    """Label the geometries that touch or overlap each other, directly or through
+    a chain of other geometries, with the same component
+
+    Args:
+        geoms (List[BaseGeometry]): geometries to group
+        index (GeometryIndex, optional): existing index over geoms. Defaults to None.
+
+    Returns:
+        List[int]: component of each geometry, which is the position of its first member in geoms
+    """
+    index = index if index is not None else GeometryIndex(geoms)
+    parents = list(range(len(geoms)))
+
+    def find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    for idx, geom in enumerate(geoms):
+        if geom is None or geom.is_empty:
+            continue
+        prepared = None
+        for other in index.query(geom):
+            # Each pair only needs testing once and pairs already joined need no test at all
+            if other <= idx or find(idx) == find(other):
+                continue
+            prepared = prepared if prepared is not None else prep(geom)
+            if prepared.intersects(geoms[other]):
+                root, other_root = find(idx), find(other)
+                parents[max(root, other_root)] = min(root, other_root)
+
+    return [find(idx) for idx in range(len(geoms))]
@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from osgeo import ogr
 from shapely.geometry import Point, Polygon, MultiPolygon, LineString, LinearRing
 from shapely.ops import unary_union
@@ -93,63 +93,163 @@ def centerline_points(in_lines: Path, distance: float = 0.0, transform: Transfor
     Returns:
         [type]: [description]
     """
+    coords, fids, properties = centerline_point_arrays(in_lines, distance, transform, fields, divergence_field, downlevel_field)
+
+    out_group = {}
+    for (x, y), fid in zip(coords.tolist(), fids.tolist()):
+        out_group.setdefault(fid, []).append(RiverPoint(Point(x, y), properties=properties[fid]))
+    return out_group
+
+
+def centerline_point_arrays(in_lines: Path, distance: float = 0.0, transform: Transform = None, fields=None, divergence_field=None,
+                            downlevel_field=None) -> Tuple[np.ndarray, np.ndarray, Dict[int, Dict[str, Any]]]:
+    """Generates points along each line feature at specified distances from the end as well as quarter and halfway
+
+    The points of all the lines are interpolated together and returned as arrays that can go straight
+    into NARVoronoi, with the FID of the line feature for each point.
+
+    Args:
+        in_lines (Path): path of shapefile with features
+        distance (float, optional): distance from ends to generate points. Defaults to 0.0.
+        transform (Transform, optional): coordinate transformation. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, Dict[int, Dict[str, Any]]]: point coordinates (n x 2), FID for each point and the properties of each FID
+    """
     log = Logger('centerline_points')
+    lines = []
+    line_fids = []
+    properties = {}
     with get_shp_or_gpkg(in_lines) as in_lyr:
-        out_group = {}
         ogr_extent = in_lyr.ogr_layer.GetExtent()
-        extent = Polygon.from_bounds(ogr_extent[0], ogr_extent[2], ogr_extent[1], ogr_extent[3])
-
-        for feat, _counter, progbar in in_lyr.iterate_features("Centerline points"):
 
+        for feat, _counter, _progbar in in_lyr.iterate_features("Centerline points"):
             line = VectorBase.ogr2shapely(feat, transform)
 
-            fid = feat.GetFID()
-            out_points = []
+            fid = int(feat.GetFID())
             # Attach the FID in case we need it later
             props = {'fid': fid}
 
             if fields:
                 for field in fields:
-                    divergence = feat.GetField(divergence_field) # 'Divergence'
+                    divergence = feat.GetField(divergence_field)  # 'Divergence'
                     if divergence == 2:
-                        value = feat.GetField(downlevel_field) # 'DnLevelPat'
+                        value = feat.GetField(downlevel_field)  # 'DnLevelPat'
                     else:
                         value = feat.GetField(field)
                     props[field] = str(int(value)) if value else None
 
-            pts = [
-                line.interpolate(distance),
-                line.interpolate(0.5, True),
-                line.interpolate(-distance)]
+            lines.append(np.asarray(line.coords)[:, :2])
+            line_fids.append(fid)
+            properties[fid] = props
+            feat = None
+
+    line_ids, distances = centerline_distances([line_length(coords) for coords in lines], distance)
+    coords = interpolate_lines(lines, line_ids, distances)
 
-            total = line.length
+    # Recall that interpolation can have multiple solutions due to pythagorean theorem
+    # Throw away anything that's not inside our bounds
+    outside = ~((coords[:, 0] > ogr_extent[0]) & (coords[:, 0] < ogr_extent[1]) & (coords[:, 1] > ogr_extent[2]) & (coords[:, 1] < ogr_extent[3]))
+    for x, y in coords[outside].tolist():
+        log.warning('Point {} is outside of extent: {}'.format((x, y), ogr_extent))
+
+    return coords, np.array(line_fids, dtype=np.int64)[line_ids], properties
+
+
+def centerline_distances(lengths: List[float], distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Distances along each line at which centerline points are generated
+
+    These are the distance from each end, halfway, every interval (the same proportion of the line as
+    the distance) and the quarters if they are far enough from the ends. Negative distances are from the end.
+
+    Args:
+        lengths (List[float]): length of each line
+        distance (float): distance from ends to generate points
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: index of the line for each distance and the distances
+    """
+    line_ids = []
+    distances = []
+    for line_id, total in enumerate(lengths):
+        line_distances = [distance, 0.5 * total, -distance]
+        if distance > 0 and total > 0:
+            # Accumulate the proportion the same way as stepping along the line one interval at a time
             interval = distance / total
-            current = interval
-            while current < 1.0:
-                pts.append(line.interpolate(current, True))
-                current = current + interval
-
-            # pts = [
-            #     line.interpolate(distance),
-            #     line.interpolate(0.5, True),
-            #     line.interpolate(-distance)
-            # ]
-
-            if line.project(line.interpolate(0.25, True)) > distance:
-                pts.append(line.interpolate(0.25, True))
-                pts.append(line.interpolate(-0.25, True))
-
-            for pt in pts:
-                # Recall that interpolation can have multiple solutions due to pythagorean theorem
-                # Throw away anything that's not inside our bounds
-                if not extent.contains(pt):
-                    progbar.erase()
-                    log.warning('Point {} is outside of extent: {}'.format(pt.coords[0], ogr_extent))
-                out_points.append(RiverPoint(pt, properties=props))
-
-            out_group[int(fid)] = out_points
-            feat = None
-        return out_group
+            steps = np.cumsum(np.full(int(np.ceil(1.0 / interval)) + 2, interval))
+            line_distances.extend((steps[steps < 1.0] * total).tolist())
+        if 0.25 * total > distance:
+            line_distances.extend([0.25 * total, -0.25 * total])
+        line_ids.extend([line_id] * len(line_distances))
+        distances.extend(line_distances)
+
+    return np.array(line_ids, dtype=np.int64), np.array(distances, dtype=np.float64)
+
+
+def line_length(coords: np.ndarray) -> float:
+    """Length of a line from its vertices, summed in the same order as GEOS"""
+    deltas = np.diff(coords[:, :2], axis=0)
+    return float(np.cumsum(np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1]))[-1]) if len(deltas) > 0 else 0.0
+
+
+def interpolate_lines(lines: List[np.ndarray], line_ids: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """Points at distances along many lines at once, the same as LineString.interpolate() on each
+
+    Negative distances are measured back from the end of the line and distances beyond either
+    end of the line give the end point.
+
+    Args:
+        lines (List[np.ndarray]): vertices of each line
+        line_ids (np.ndarray): index of the line for each distance
+        distances (np.ndarray): distances along the lines
+
+    Returns:
+        np.ndarray: coordinates of each point
+    """
+    if len(distances) == 0:
+        return np.empty((0, 2))
+
+    # Every vertex and segment of every line in one array with the cumulative length at the end of each segment
+    vertex_offsets = np.cumsum([0] + [len(coords) for coords in lines])
+    vertices = np.concatenate(lines)
+    seg_lengths = []
+    seg_ends = []
+    for coords in lines:
+        deltas = np.diff(coords[:, :2], axis=0)
+        lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+        seg_lengths.append(lengths)
+        seg_ends.append(np.cumsum(lengths))
+    seg_offsets = vertex_offsets - np.arange(len(vertex_offsets))
+    seg_lengths = np.concatenate(seg_lengths)
+    seg_ends = np.concatenate(seg_ends)
+
+    first_seg = seg_offsets[line_ids]
+    last_seg = seg_offsets[line_ids + 1]
+    totals = np.where(last_seg > first_seg, seg_ends[np.maximum(last_seg - 1, 0)], 0.0)
+    distances = np.where(distances < 0, totals + distances, distances)
+
+    # The first segment that ends beyond the distance. Distances past the end of the line use the last vertex
+    seg_count = last_seg - first_seg
+    position = np.zeros(len(distances), dtype=np.int64)
+    order = np.argsort(line_ids, kind='stable')
+    bounds = np.searchsorted(line_ids[order], np.arange(len(lines) + 1))
+    for line_id in np.flatnonzero(np.diff(bounds)):
+        rows = order[bounds[line_id]:bounds[line_id + 1]]
+        position[rows] = np.searchsorted(seg_ends[seg_offsets[line_id]:seg_offsets[line_id + 1]], distances[rows], side='right')
+
+    points = vertices[vertex_offsets[line_ids] + np.minimum(position, seg_count)][:, :2].copy()
+    inside = (distances > 0) & (position < seg_count)
+    segment = first_seg[inside] + position[inside]
+    start = vertices[vertex_offsets[line_ids[inside]] + position[inside], :2]
+    end = vertices[vertex_offsets[line_ids[inside]] + position[inside] + 1, :2]
+    before = np.where(position[inside] > 0, seg_ends[np.maximum(segment - 1, 0)], 0.0)
+    fraction = (distances[inside] - before) / seg_lengths[segment]
+    points[inside] = np.where(fraction[:, np.newaxis] >= 1.0, end, (end - start) * fraction[:, np.newaxis] + start)
+
+    # Distances at or before the start of the line give the first vertex
+    at_start = distances <= 0
+    points[at_start] = vertices[vertex_offsets[line_ids[at_start]], :2]
+    return points
 
 
 def centerline_vertex_between_distance(in_lines, distance=0.0):
@@ -269,37 +369,33 @@ def densifyShape(shape, spacing):
 
 def _densifyRing(ring, spacing):
     """
-    Densify this particular ring using _densify segment on each segment
+    Densify this particular ring by adding points along each segment at the spacing
     :param ring:
     :param spacing:
     :return:
     """
-    # Densify all the line segments. This return a list with the first point and any linear interpolated points
-    densesegments = [_densifySegment(LineString([ring.coords[x - 1], ring.coords[x]]), spacing) for x in range(1, len(ring.coords))]
+    coords = np.asarray(ring.coords)
+    starts, ends = coords[:-1], coords[1:]
+    deltas = ends[:, :2] - starts[:, :2]
+    lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+
+    # Segments shorter than the spacing just keep their first point. Longer ones get a point every spacing
+    # from their first point (the same values as np.arange(0, length, spacing)) except any that land on their last point
+    counts = np.where(lengths < spacing, 1, np.ceil(lengths / spacing)).astype(np.int64)
+    segment = np.repeat(np.arange(len(lengths)), counts)
+    distances = (np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)) * spacing
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (distances / lengths[segment])[:, np.newaxis]
+    points = np.where(fraction >= 1.0, ends[segment], (ends[segment] - starts[segment]) * fraction + starts[segment])
+    points[distances <= 0] = starts[segment[distances <= 0]]
+    keep = (lengths[segment] < spacing) | np.any(points != ends[segment], axis=1)
+
     # Finally add the very last point to complete the ring
-    densesegments.append([ring.coords[-1]])
-    poly = Polygon(LinearRing([pt for seg in densesegments for pt in seg]))
+    poly = Polygon(LinearRing(np.vstack([points[keep], coords[-1:]])))
     return poly
 
 
-def _densifySegment(segment, spacing):
-    """
-    A segment is defined as a LineString with two points in it. Spacing is the point spacing we want.
-    :param segment:
-    :param spacing:
-    :return:
-    """
-    if segment.length < spacing:
-        return [segment.coords[0]]
-
-    pts = []
-    for currDist in np.arange(0, segment.length, spacing):
-        newpt = segment.interpolate(currDist).coords[0]
-        if newpt != segment.coords[-1]:
-            pts.append(newpt)
-    return pts
-
-
 def GetBufferedBounds(shape, buffer):
     """[summary]
 
@@ -0,0 +1,336 @@
+# Name:     Tiled Voronoi
+#
+# Purpose:  Build the Voronoi diagram of a very large set of points one tile
+#           at a time so that Qhull never has to hold more than a tile (plus
+#           a halo of its neighbours) in memory and the tiles can be built in
+#           a process pool.
+#
+#           A cell from a tile is only trusted when no point is closer to any
+#           of its vertices than the points that meet there. That is certain
+#           when the empty circle of the vertex lies inside the tile's window
+#           and the rest are checked against all the points with a KD tree.
+#           The hull points are in every window and an unbounded cell is only
+#           trusted when its infinite ridges are edges of the hull of all the
+#           points. Points whose cells are not trusted are tried again with
+#           the points in the empty circles of their wrong cells or, when
+#           there are too many of those, with twice the halo until the window
+#           holds every point.
+#
+#           The vertices of the tiles are stitched together by the points
+#           that meet at them, so a vertex shared by cells that came from
+#           different tiles gets one index.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from itertools import chain
+from typing import Tuple
+import numpy as np
+from scipy.spatial import Voronoi, ConvexHull, cKDTree
+from scipy.spatial.qhull import QhullError
+from rscommons import Logger, ProgressBar
+from rscommons.process_pool import ordered_map
+
+# A vertex is wrong when a point is closer to it than this proportion of its distance from the points that meet there
+EMPTY_CIRCLE_TOLERANCE = 1e-9
+
+
+class TiledVoronoi:
+    """Voronoi diagram stitched together from tiles
+
+    It has the vertices, ridge_points, ridge_vertices, regions and point_region of scipy.spatial.Voronoi.
+    There is one region for each point, in point order, so point_region is just the point index.
+    """
+
+    def __init__(self, points: np.ndarray, tile_size: float, halo: float = None, workers: int = 1):
+        """
+        Args:
+            points (np.ndarray): point coordinates with one row per point
+            tile_size (float): width and height of the tiles, in the units of the points
+            halo (float, optional): distance the first window reaches beyond each tile. Defaults to a quarter of the tile size.
+            workers (int, optional): number of processes building tiles. Defaults to 1.
+        """
+        log = Logger('TiledVoronoi')
+        self.points = np.asarray(points, dtype=np.float64)[:, 0:2]
+        point_count = len(self.points)
+
+        # Grid of tiles over the points, with the points sorted by tile so a window is a few slices
+        self.min_xy = self.points.min(axis=0)
+        self.max_xy = self.points.max(axis=0)
+        self.tile_size = float(tile_size)
+        self.tile_shape = np.maximum(np.ceil((self.max_xy - self.min_xy) / self.tile_size), 1).astype(np.int64)
+        point_tiles = self._tile_of(self.points)
+        tile_index = point_tiles[:, 1] * self.tile_shape[0] + point_tiles[:, 0]
+        self._order = np.argsort(tile_index, kind='stable')
+        self._tile_bounds = np.searchsorted(tile_index[self._order], np.arange(self.tile_shape[0] * self.tile_shape[1] + 1))
+
+        # The hull points and the position of each point around the hull (counterclockwise) so infinite ridges can be checked
+        self._hull = ConvexHull(self.points).vertices
+        self._hull_pos = np.full(point_count, -1, dtype=np.int64)
+        self._hull_pos[self._hull] = np.arange(len(self._hull))
+        self._hull_count = len(self._hull)
+
+        # The trusted cells from every tile: their points, regions, vertex keys and coordinates and ridges
+        pieces = []
+
+        # Centres and radii of the empty circles of the wrong cell of each point that has to be tried again.
+        # Every point that can change the cell is inside one of them
+        self._circles = {}
+        self._circle_tries = {}
+        self._tree = None
+        self._tile_points = int(np.max(np.diff(self._tile_bounds)))
+
+        unresolved = np.arange(point_count)
+        first_halo = halo = self.tile_size / 4 if halo is None else float(halo)
+        groups = [(core, halo, False) for core in self._tile_cores(unresolved, self.tile_size)]
+        while len(groups) > 0:
+            log.info('Building {:,} Voronoi cells in {:,} tiles'.format(len(unresolved), len(groups)))
+            untrusted = []
+            progbar = ProgressBar(len(groups), 50, 'Voronoi tiles')
+            for counter, result in enumerate(ordered_map(_tile_cells, self._tasks(groups), workers), start=1):
+                progbar.update(counter)
+                point_ids, region_lengths, region_vertices, keys, coords, radius, outside, ridge_points, ridge_vertices, untrusted_ids = result
+                untrusted.append(untrusted_ids)
+
+                # Check the vertices whose empty circles reach out of the window against all the points
+                wrong_vertex = np.zeros(len(keys), dtype=bool)
+                if np.any(outside):
+                    if self._tree is None:
+                        self._tree = cKDTree(self.points)
+                    distance, _nearest = self._tree.query(coords[outside])
+                    wrong_vertex[outside] = distance < radius[outside] * (1.0 - EMPTY_CIRCLE_TOLERANCE)
+
+                owner = np.repeat(np.arange(len(point_ids)), region_lengths)
+                wrong_cell = np.zeros(len(point_ids), dtype=bool)
+                wrong_cell[owner[(region_vertices >= 0) & wrong_vertex[np.maximum(region_vertices, 0)]]] = True
+                untrusted.append(point_ids[wrong_cell])
+
+                # The next window for a wrong cell should hold the points in the empty circles of all its vertices
+                region_ends = np.cumsum(region_lengths)
+                for idx in np.flatnonzero(wrong_cell).tolist():
+                    cell = region_vertices[region_ends[idx] - region_lengths[idx]:region_ends[idx]]
+                    cell = cell[cell >= 0]
+                    self._circles[int(point_ids[idx])] = (coords[cell], radius[cell])
+
+                region_vertices = region_vertices[~wrong_cell[owner]]
+                point_ids, region_lengths = point_ids[~wrong_cell], region_lengths[~wrong_cell]
+                trusted_ridges = np.any(np.isin(ridge_points, point_ids), axis=1)
+                ridge_points, ridge_vertices = ridge_points[trusted_ridges], ridge_vertices[trusted_ridges]
+
+                # Keep just the vertices of the trusted cells
+                keep = np.zeros(len(keys), dtype=bool)
+                keep[region_vertices[region_vertices >= 0]] = True
+                local = np.cumsum(keep) - 1
+                pieces.append((
+                    point_ids,
+                    region_lengths,
+                    np.where(region_vertices >= 0, local[region_vertices], -1),
+                    keys[keep],
+                    coords[keep],
+                    ridge_points,
+                    np.where(ridge_vertices >= 0, local[ridge_vertices], -1)
+                ))
+            progbar.finish()
+
+            unresolved = np.sort(np.concatenate(untrusted)) if len(untrusted) > 0 else np.empty(0, dtype=np.int64)
+
+            # The points left over are few and mostly along the edges of the tiles so they are tried again
+            # in smaller groups. When there are not too many points in the empty circles of a wrong cell
+            # those points are enough to get it right. Otherwise the halo doubles and once it is bigger
+            # than a group the groups grow with it so the same points are not triangulated again for every group
+            halo *= 2
+            by_circles = self._by_circles(unresolved)
+            groups = [(core, first_halo, True) for core in self._tile_cores(unresolved[by_circles], self.tile_size / 4)]
+            groups.extend((core, halo, False) for core in self._tile_cores(unresolved[~by_circles], max(self.tile_size / 4, halo)))
+
+        self._stitch(pieces, point_count)
+        log.info('{:,} Voronoi vertices and {:,} ridges stitched together'.format(len(self.vertices), len(self.ridge_points)))
+
+    def _stitch(self, pieces: list, point_count: int):
+        """Join the trusted cells from all the tiles into one diagram
+
+        A vertex is the same in every tile that has it when the same points meet there, so the vertices
+        are matched by those points (their keys). Ridges between cells from different tiles come back
+        from both tiles and the first of each is kept
+        """
+        width = max(piece[3].shape[1] for piece in pieces)
+        keys = np.concatenate([np.pad(piece[3], ((0, 0), (0, width - piece[3].shape[1])), constant_values=-1) for piece in pieces])
+        coords = np.concatenate([piece[4] for piece in pieces])
+
+        # Number the vertices in the order they were first seen
+        _unique, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(len(first))
+        global_ids = rank[inverse.ravel()]
+        self.vertices = coords[np.sort(first)]
+
+        offsets = np.cumsum([0] + [len(piece[3]) for piece in pieces])
+        point_ids = np.concatenate([piece[0] for piece in pieces])
+        region_lengths = np.concatenate([piece[1] for piece in pieces])
+        region_vertices = np.concatenate([np.where(piece[2] >= 0, global_ids[piece[2] + offset], -1) for piece, offset in zip(pieces, offsets)]).tolist()
+        region_ends = np.cumsum(region_lengths).tolist()
+        self.regions = [[] for _pt in range(point_count)]
+        for point_id, region_start, region_end in zip(point_ids.tolist(), [0] + region_ends[:-1], region_ends):
+            self.regions[point_id] = region_vertices[region_start:region_end]
+        self.point_region = np.arange(point_count, dtype=np.intp)
+
+        ridge_points = np.concatenate([piece[5] for piece in pieces])
+        ridge_vertices = np.concatenate([np.where(piece[6] >= 0, global_ids[piece[6] + offset], -1) for piece, offset in zip(pieces, offsets)])
+        _pairs, first = np.unique(ridge_points, axis=0, return_index=True)
+        first = np.sort(first)
+        self.ridge_points = ridge_points[first].astype(np.intc)
+        self.ridge_vertices = ridge_vertices[first]
+
+    def _tile_of(self, coords: np.ndarray) -> np.ndarray:
+        """Column and row of the tile each coordinate falls in, clamped to the grid"""
+        return np.clip(np.floor((coords - self.min_xy) / self.tile_size).astype(np.int64), 0, self.tile_shape - 1)
+
+    def _tile_cores(self, unresolved: np.ndarray, size: float) -> list:
+        """The unresolved points grouped into square tiles of a size"""
+        if len(unresolved) == 0:
+            return []
+        tile_xy = np.floor((self.points[unresolved] - self.min_xy) / size).astype(np.int64)
+        order = np.lexsort((tile_xy[:, 0], tile_xy[:, 1]))
+        tile_xy = tile_xy[order]
+        starts = np.flatnonzero(np.any(np.diff(tile_xy, axis=0) != 0, axis=1)) + 1
+        return np.split(unresolved[order], starts)
+
+    def _by_circles(self, unresolved: np.ndarray) -> np.ndarray:
+        """Which unresolved points to try again with the points in the empty circles of their wrong cells
+
+        That is the points with circles that hold no more points than a tile and that have not already been
+        tried that way twice. The circles of all the others are dropped
+        """
+        by_circles = np.zeros(len(unresolved), dtype=bool)
+        for idx, point_id in enumerate(unresolved.tolist()):
+            circles = self._circles.get(point_id)
+            if circles is not None and self._circle_tries.get(point_id, 0) < 2:
+                by_circles[idx] = np.sum(self._tree.query_ball_point(circles[0], circles[1], return_length=True)) <= self._tile_points
+            if not by_circles[idx]:
+                self._circles.pop(point_id, None)
+        return by_circles
+
+    def _tasks(self, groups: list):
+        """One task for each group of unresolved points: the points within the halo of the group (and within the
+        empty circles of their wrong cells) and which of them to resolve"""
+        for core, halo, by_circles in groups:
+            core_coords = self.points[core]
+            window_min = core_coords.min(axis=0) - halo
+            window_max = core_coords.max(axis=0) + halo
+
+            first, last = self._tile_of(window_min), self._tile_of(window_max)
+            window_ids = np.concatenate([
+                self._order[self._tile_bounds[row_idx * self.tile_shape[0] + first[0]]:self._tile_bounds[row_idx * self.tile_shape[0] + last[0] + 1]]
+                for row_idx in range(first[1], last[1] + 1)
+            ])
+            coords = self.points[window_ids]
+            inside = np.all((coords >= window_min) & (coords <= window_max), axis=1)
+
+            # There are no points beyond the extent so a window reaching past it is open on that side.
+            # The hull points are in every window so the unbounded cells open to the same side as in the whole diagram
+            window = np.concatenate([np.where(window_min <= self.min_xy, -np.inf, window_min), np.where(window_max >= self.max_xy, np.inf, window_max)])
+            covers_all = bool(np.all(np.isinf(window)))
+            window_ids = np.union1d(window_ids[inside], self._hull)
+
+            if by_circles:
+                circles = [self._circles.pop(point_id) for point_id in core.tolist()]
+                for point_id in core.tolist():
+                    self._circle_tries[point_id] = self._circle_tries.get(point_id, 0) + 1
+                centres = np.concatenate([circle[0] for circle in circles])
+                radii = np.concatenate([circle[1] for circle in circles]) * (1.0 + EMPTY_CIRCLE_TOLERANCE)
+                in_circles = self._tree.query_ball_point(centres, radii)
+                window_ids = np.union1d(window_ids, np.fromiter(chain.from_iterable(in_circles), dtype=np.int64))
+            coords = self.points[window_ids]
+            resolve = np.isin(window_ids, core)
+
+            yield window_ids, coords, resolve, window, covers_all, self._hull_pos[window_ids], self._hull_count
+
+
+def _tile_cells(task: Tuple) -> Tuple:
+    """Build the Voronoi diagram of the points in a window and return the cells that might be right
+
+    Args:
+        task (Tuple): global ids and coordinates of the window points, which of them to resolve, the window
+            bounds, whether the window holds every point and the position of each point around the hull
+
+    Returns:
+        Tuple: the ids of the candidate points with the lengths and vertices of their regions, the key
+            (generating point ids), coordinates, empty circle radius and whether the circle reaches out of the
+            window for each of those vertices, the ridges of the candidate cells with their vertices and the ids
+            of the points that have to be tried again. Vertices are indexes into the returned vertex arrays
+    """
+    window_ids, coords, resolve, window, covers_all, hull_pos, hull_count = task
+    try:
+        # Centre the window on the origin, the same as NARVoronoi does for all the points, so Qhull keeps its precision
+        centre = coords.mean(axis=0)
+        vor = Voronoi(coords - centre)
+    except (QhullError, ValueError) as e:
+        if covers_all:
+            raise Exception('Qhull could not build the Voronoi diagram of {:,} points'.format(len(coords))) from e
+        # Too few points (or all in a line). Try again with a bigger window
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty((0, 3), dtype=np.int64), np.empty((0, 2)), np.empty(0), np.empty(0, dtype=bool), np.empty((0, 2), dtype=np.int64), np.empty((0, 2), dtype=np.int64), window_ids[resolve]
+
+    # Every (vertex, point) pair of every point's region
+    region_lengths = np.array([len(region) for region in vor.regions], dtype=np.int64)
+    region_starts = np.cumsum(region_lengths) - region_lengths
+    flat = np.fromiter(chain.from_iterable(vor.regions), dtype=np.int64, count=int(region_lengths.sum()))
+    point_lengths = region_lengths[vor.point_region]
+    pair_point = np.repeat(np.arange(len(coords)), point_lengths)
+    pair_offset = np.arange(len(pair_point)) - np.repeat(np.cumsum(point_lengths) - point_lengths, point_lengths)
+    pair_vertex = flat[np.repeat(region_starts[vor.point_region], point_lengths) + pair_offset]
+    finite = pair_vertex >= 0
+
+    # An infinite ridge is only right if it is between neighbours around the hull of all the points
+    all_ridge_vertices = np.asarray(vor.ridge_vertices, dtype=np.int64).reshape(-1, 2)
+    infinite = np.any(all_ridge_vertices < 0, axis=1)
+    pos = hull_pos[vor.ridge_points[infinite]]
+    gap = np.abs(pos[:, 0] - pos[:, 1])
+    wrong = np.any(pos < 0, axis=1) | ((gap != 1) & (gap != hull_count - 1))
+    wrong_infinite = np.zeros(len(coords), dtype=bool)
+    wrong_infinite[vor.ridge_points[infinite][wrong].ravel()] = True
+
+    candidate = resolve & (point_lengths > 0)
+    if not covers_all:
+        candidate &= ~wrong_infinite
+
+    # Regions of the candidate points and the vertices they use
+    candidate_pairs = candidate[pair_point]
+    region_vertices = pair_vertex[candidate_pairs]
+    ridge_mask = np.any(candidate[vor.ridge_points], axis=1)
+    ridge_vertices = all_ridge_vertices[ridge_mask]
+    used = np.unique(region_vertices[region_vertices >= 0])
+    local = np.full(len(vor.vertices), -1, dtype=np.int64)
+    local[used] = np.arange(len(used))
+
+    # The key of a vertex is the sorted global ids of all the points whose regions meet at it
+    key_pairs = finite & (local[np.maximum(pair_vertex, 0)] >= 0)
+    key_vertex = local[pair_vertex[key_pairs]]
+    key_point = window_ids[pair_point[key_pairs]]
+    # (padded with -1 when more than three regions meet at some of the vertices)
+    order = np.lexsort((key_point, key_vertex))
+    key_counts = np.bincount(key_vertex, minlength=len(used))
+    key_starts = np.cumsum(key_counts) - key_counts
+    keys = np.full((len(used), max(int(key_counts.max()) if len(used) > 0 else 0, 3)), -1, dtype=np.int64)
+    keys[key_vertex[order], np.arange(len(order)) - key_starts[key_vertex[order]]] = key_point[order]
+
+    # A vertex is only right if no point is closer to it than the points that meet there. That is
+    # certain when its empty circle is inside the window. The others are checked against every point
+    radius = np.zeros(len(used))
+    vertices = vor.vertices[used] + centre
+    np.maximum.at(radius, key_vertex, np.hypot(*(vertices[key_vertex] - coords[pair_point[key_pairs]]).T))
+    outside = np.zeros(len(used), dtype=bool)
+    if not covers_all:
+        outside = ~np.all((vertices - radius[:, np.newaxis] >= window[0:2]) & (vertices + radius[:, np.newaxis] <= window[2:4]), axis=1)
+
+    return (
+        window_ids[candidate],
+        point_lengths[candidate],
+        np.where(region_vertices >= 0, local[np.maximum(region_vertices, 0)], -1),
+        keys,
+        vertices,
+        radius,
+        outside,
+        np.sort(window_ids[vor.ridge_points[ridge_mask]], axis=1),
+        np.where(ridge_vertices >= 0, local[np.maximum(ridge_vertices, 0)], -1),
+        window_ids[resolve & ~candidate]
+    )
@@ -2,14 +2,16 @@
 NARVoronoi Module
 """
 # pylint: disable=no-member
-from typing import List
+from typing import List, Union
 import numpy as np
 from scipy.spatial.qhull import QhullError
 from scipy.spatial import Voronoi
-from shapely.geometry import Point, MultiPoint, LineString, Polygon, MultiPolygon
+from scipy.sparse import csr_matrix
+from shapely.geometry import Point, LineString, Polygon, MultiPolygon
 from shapely.ops import unary_union, linemerge
 from rscommons import Logger, ProgressBar
 from rscommons.thiessen.shapes import RiverPoint
+from rscommons.thiessen.tiled_voronoi import TiledVoronoi
 
 
 class NARVoronoi:
@@ -18,35 +20,47 @@ class NARVoronoi:
     shapes from it.
     """
 
-    def __init__(self, points: List[RiverPoint]):
+    def __init__(self, points: Union[List[RiverPoint], np.ndarray], tile_size: float = None, workers: int = 1):
         """
         The init method is where all the Voronoi magic happens.
-        :param points:
+        :param points: RiverPoints or an array of point coordinates with one row per point
+        :param tile_size: build the diagram in square tiles of this size (in the units of the points)
+                          instead of all at once. Use it when there are too many points for one Qhull call
+        :param workers: number of processes building tiles
         """
-        # The centroid is what we're going to use to shift all the coords around
         # NOTE: We drop the z coord here
-        multipoint = MultiPoint([x.point.coords[0][0:2] for x in points])
-        self.points = points
+        if isinstance(points, np.ndarray):
+            coords = np.array(points[:, 0:2], dtype=np.float64)
+            self.points = None
+        else:
+            coords = np.array([x.point.coords[0][0:2] for x in points], dtype=np.float64)
+            self.points = points
         self.polys = None
-        self.centroid = multipoint.centroid.coords[0]
         self.log = Logger('NARVoronoi')
         self.log.info('initializing...')
 
+        # The centroid is what we're going to use to shift all the coords around. The points are
+        # summed in order, which is how GEOS calculates the centroid of a MultiPoint
+        self.centroid = tuple((np.cumsum(coords, axis=0)[-1] / len(coords)).tolist())
+
         # Give us a numpy array that is easy to work with then subtract the centroid
         # centering our object around the origin so that the QHull method works properly
-        adjpoints = np.array(multipoint)
-        adjpoints = adjpoints - self.centroid
+        adjpoints = coords - self.centroid
 
         try:
-            self.log.info('Creating Voronoi')
-            self._vor = Voronoi(adjpoints)
+            if tile_size is None:
+                self.log.info('Creating Voronoi')
+                self._vor = Voronoi(adjpoints)
+            else:
+                self.log.info('Creating Voronoi in tiles')
+                self._vor = TiledVoronoi(adjpoints, tile_size, workers=workers)
         except QhullError as e:
             self.log.error("Something went wrong with QHull", e)
         except ValueError as e:
             self.log.error("Invalid array specified", e)
 
         # bake in region adjacency (I have no idea why it's not in by default)
-        self.region_neighbour = []
+        self.region_neighbour = None
 
         # Transform everything back to where it was (with some minor floating point rounding problems)
         # Note that we will use the following and NOT anything from inside _vor
@@ -59,20 +73,29 @@ class NARVoronoi:
         self.point_region = self._vor.point_region
 
     def calculate_neighbours(self):
-        self.region_neighbour = []
-        # Find which regions are next to which other regions
-        progbar = ProgressBar(len(self._vor.regions), 50, "baking in region adjacency")
-        counter = 0
-        for idx, reg in enumerate(self._vor.regions):
-            counter += 1
-            progbar.update(counter)
-            adj = []
-            for idy, reg2 in enumerate(self._vor.regions):
-                # Adjacent if we have two matching vertices (neighbours share a wall)
-                if idx != idy and len(set(reg) - (set(reg) - set(reg2))) >= 2:
-                    adj.append(idy)
-            self.region_neighbour.append(adj)
-        progbar.finish()
+        """Find which regions are next to which other regions
+
+        Neighbours share a wall, which is a ridge between the input points on either side of it, so
+        the adjacency comes straight from scipy's ridge_points. The result is a CSR matrix with one
+        row per region (including the empty one) and the neighbours of each row in ascending order.
+        """
+        self.log.info('Baking in region adjacency for {:,} regions'.format(len(self.regions)))
+
+        ridge_regions = self.point_region[self.ridge_points]
+        ridge_regions = ridge_regions[ridge_regions[:, 0] != ridge_regions[:, 1]]
+        rows = np.concatenate([ridge_regions[:, 0], ridge_regions[:, 1]])
+        cols = np.concatenate([ridge_regions[:, 1], ridge_regions[:, 0]])
+
+        # Sort by region then neighbour and drop any repeated pairs
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        unique = np.ones(len(rows), dtype=bool)
+        unique[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols = rows[unique], cols[unique]
+
+        indptr = np.zeros(len(self.regions) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.regions)), out=indptr[1:])
+        self.region_neighbour = csr_matrix((np.ones(len(cols), dtype=np.int8), cols, indptr), shape=(len(self.regions), len(self.regions)))
 
     def collectCenterLines(self, rivershape, flipIsland=None):
         """
@@ -83,40 +106,41 @@ class NARVoronoi:
         :return: LineString (Valid) or MultiLineString (invalid)
         """
 
-        # The first loop here asigns each polygon to either left or right side of the c
-        # hannel based on the self.point object we passed in earlier.
-        regions = []
-        if len(self.region_neighbour) == 0:
+        neighbours = self.region_neighbour
+        if neighbours is None:
             self.log.warning('Neighbours are empty. Have you run calculate_neighbours() before collectCenterLines?')
-        for idx, reg in enumerate(self.region_neighbour):
-            # obj will have everything we need to know.
-            obj = {
-                "id": idx,
-                "side": 1,
-                "adjacents": reg
-            }
-            lookupregion = np.where(self._vor.point_region == idx)
-            if len(lookupregion[0]) > 0:
-                ptidx = lookupregion[0][0]
+            neighbours = csr_matrix((len(self.regions), len(self.regions)), dtype=np.int8)
+
+        # The first loop here asigns each polygon to either left or right side of the c
+        # hannel based on the self.point object we passed in earlier (the first point in each region).
+        # Regions without a point stay on side 1
+        region_point = np.full(len(self.regions), -1, dtype=np.int64)
+        point_regions, first_points = np.unique(self.point_region, return_index=True)
+        region_point[point_regions[point_regions >= 0]] = first_points[point_regions >= 0]
+
+        sides = []
+        for ptidx in region_point:
+            side = 1
+            if ptidx >= 0:
                 point = self.points[int(ptidx)]
                 if flipIsland is not None and point.island == flipIsland:
-                    obj["side"] = point.side * -1
+                    side = point.side * -1
                 else:
-                    obj["side"] = point.side
-            regions.append(obj)
+                    side = point.side
+            sides.append(side)
 
         # The second loop goes over each region's neighbours and if a neighbour has a different side
         # Then we must be on opposite sides of a centerline and so try and find two points representing a wall between
         # These regions that we will add to our centerline
         centerlines = []
-        for region in regions:
-            for nidx in region['adjacents']:
-                neighbour = regions[nidx]
-                if neighbour['side'] != region['side']:
+        indptr, indices = neighbours.indptr, neighbours.indices
+        for idx, side in enumerate(sides):
+            for nidx in indices[indptr[idx]:indptr[idx + 1]].tolist():
+                if sides[nidx] != side:
 
                     # Get the two shared points these two regions should have
                     # NOTE: set(A) - (set(A) - set(B)) is a great pattern
-                    sharedpts = set(self.regions[region['id']]) - (set(self.regions[region['id']]) - set(self.regions[nidx]))
+                    sharedpts = set(self.regions[idx]) - (set(self.regions[idx]) - set(self.regions[nidx]))
 
                     # Add this point to the list if it is unique
                     if -1 not in sharedpts:
@@ -175,16 +199,26 @@ class NARVoronoi:
         Args:
             property_name ([type]): [description]
         """
+        return self.dissolve_by_ids([point.properties[property_name] for point in self.points])
+
+    def dissolve_by_ids(self, point_ids) -> dict:
+        """Group polygons by an id for each input point (such as the FID of the line it came from)
 
+        Args:
+            point_ids (list or np.ndarray): one id for each input point
+
+        Returns:
+            dict: dissolved polygon for each id, in the order the ids first appear
+        """
+        point_ids = point_ids.tolist() if isinstance(point_ids, np.ndarray) else list(point_ids)
         poly_groups = {}
 
         progbar1 = ProgressBar(len(self.point_region), 50, "Grouping Polygons...")
         counter = 0
         progbar1.update(counter)
 
-        for pt_id in range(len(self.point_region)):
-            region_id = self.point_region[pt_id]
-            fid = self.points[pt_id].properties[property_name]
+        for pt_id, region_id in enumerate(self.point_region.tolist()):
+            fid = point_ids[pt_id]
 
             counter += 1
             progbar1.update(counter)
@@ -10,8 +10,10 @@
 import os
 import sqlite3
 from copy import copy
+from collections import OrderedDict
 from typing import List
 from functools import reduce
+import numpy as np
 from osgeo import ogr, gdal, osr
 from shapely.ops import unary_union
 from shapely.geometry.base import BaseGeometry
@@ -19,6 +21,14 @@ from shapely.geometry import mapping, Point, MultiPoint, LineString, MultiLineSt
 from rscommons import Logger, ProgressBar, get_shp_or_gpkg, Timer, VectorBase
 from rscommons.util import sizeof_fmt, get_obj_size
 from rscommons.classes.vector_base import VectorBaseException
+from rscommons.spatial_index import GeometryIndex
+from rscommons.geometry_union import tree_union
+from rscommons.layer_cache import dataset_stamp
+
+
+# Most recently used unions of get_geometry_unary_union() keyed by layer, filter, clip and projection
+UNION_CACHE_SIZE = 8
+_unary_union_cache = OrderedDict()
 
 
 def print_geom_size(logger: Logger, geom_obj: BaseGeometry):
@@ -77,10 +87,16 @@ def get_geometry_union(in_layer_path: str, epsg: int = None,
 def get_geometry_unary_union(in_layer_path: str, epsg: int = None, spatial_ref: osr.SpatialReference = None,
                              attribute_filter: str = None,
                              clip_shape: BaseGeometry = None,
-                             clip_rect: List[float] = None
+                             clip_rect: List[float] = None,
+                             workers: int = 1,
+                             use_cache: bool = True
                              ) -> BaseGeometry:
     """Load all features from a ShapeFile and union them together into a single geometry
 
+    The features are unioned with a spatially grouped tree reduction (see tree_union). Results
+    are cached per layer path, filter, clip and projection until the dataset changes on disk so
+    that callers who union the same layer do not repeat the work.
+
     Args:
         in_layer_path (str): path to layer
         epsg (int, optional): EPSG to project to. Defaults to None.
@@ -88,6 +104,8 @@ def get_geometry_unary_union(in_layer_path: str, epsg: int = None, spatial_ref:
         attribute_filter (str, optional): Filter to a set of attributes. Defaults to None.
         clip_shape (BaseGeometry, optional): Clip to a specified shape. Defaults to None.
         clip_rect (List[double minx, double miny, double maxx, double maxy)]): Iterate over a subset by clipping to a Shapely-ish geometry. Defaults to None.
+        workers (int, optional): number of processes used to union the feature groups. Defaults to 1.
+        use_cache (bool, optional): reuse and store the result in the union cache. Defaults to True.
 
     Raises:
         VectorBaseException: [description]
@@ -100,6 +118,18 @@ def get_geometry_unary_union(in_layer_path: str, epsg: int = None, spatial_ref:
     if epsg is not None and spatial_ref is not None:
         raise VectorBaseException('Specify either an EPSG or a spatial_ref. Not both')
 
+    cache_key = None
+    if use_cache is True:
+        cache_key = (os.path.abspath(in_layer_path), attribute_filter, epsg,
+                     spatial_ref.ExportToWkt() if spatial_ref is not None else None,
+                     clip_shape.wkb if clip_shape is not None else None,
+                     tuple(clip_rect) if clip_rect is not None else None)
+        cache_stamp = _dataset_stamp(in_layer_path)
+        if cache_key in _unary_union_cache and _unary_union_cache[cache_key][0] == cache_stamp:
+            _unary_union_cache.move_to_end(cache_key)
+            log.debug('Using cached union of {}'.format(in_layer_path))
+            return _unary_union_cache[cache_key][1]
+
     with get_shp_or_gpkg(in_layer_path) as in_layer:
         transform = None
         if epsg is not None:
@@ -139,18 +169,13 @@ def get_geometry_unary_union(in_layer_path: str, epsg: int = None, spatial_ref:
                 log.warning('Zero Area for shape with FID={}'.format(feature.GetFID()))
             else:
                 geom_list.append(VectorBase.ogr2shapely(new_geom, transform))
-
-                # IF we get past a certain size then run the union
-                if len(geom_list) >= 500:
-                    geom_list = [unary_union(geom_list)]
             new_geom = None
 
     log.debug('finished iterating with list of size: {}'.format(len(geom_list)))
 
     if len(geom_list) > 1:
-        log.debug('Starting final union of geom_list of size: {}'.format(len(geom_list)))
-        # Do a final union to clean up anything that might still be in the list
-        geom_union = unary_union(geom_list)
+        log.debug('Starting tree union of geom_list of size: {}'.format(len(geom_list)))
+        geom_union = tree_union(geom_list, workers)
     elif len(geom_list) == 0:
         log.warning('No geometry found to union')
         return None
@@ -160,11 +185,29 @@ def get_geometry_unary_union(in_layer_path: str, epsg: int = None, spatial_ref:
         log.debug('   done')
 
     print_geom_size(log, geom_union)
+
+    if cache_key is not None:
+        _unary_union_cache[cache_key] = (cache_stamp, geom_union)
+        while len(_unary_union_cache) > UNION_CACHE_SIZE:
+            _unary_union_cache.popitem(last=False)
+
     log.debug('Complete')
     # Return a shapely object
     return geom_union
 
 
+def clear_unary_union_cache():
+    """Forget every union cached by get_geometry_unary_union()"""
+    _unary_union_cache.clear()
+
+
+def _dataset_stamp(in_layer_path: str) -> tuple:
+    """Modification time and size of the dataset behind a layer path"""
+
+    ds_path, _lyr_name = VectorBase.path_sorter(in_layer_path)
+    return dataset_stamp(ds_path)
+
+
 def copy_feature_class(in_layer_path: str, out_layer_path: str,
                        epsg: int = None,
                        attribute_filter: str = None,
@@ -203,36 +246,32 @@ def copy_feature_class(in_layer_path: str, out_layer_path: str,
         if buffer != 0:
             buffer_convert = in_layer.rough_convert_metres_to_vector_units(buffer)
 
-        # This is the callback method that will be run on each feature
-        for feature, _counter, progbar in in_layer.iterate_features("Copying features", write_layers=[out_layer], clip_shape=clip_shape, clip_rect=clip_rect, attribute_filter=attribute_filter):
-            geom = feature.GetGeometryRef()
+        fids, wkbs, columns = in_layer.read_columns(clip_shape=clip_shape, clip_rect=clip_rect, attribute_filter=attribute_filter)
 
-            if geom is None:
-                progbar.erase()  # get around the progressbar
-                log.warning('Feature with FID={} has no geometry. Skipping'.format(feature.GetFID()))
+        # Geometries only need decoding here when they are checked or buffered
+        check_length = in_layer.ogr_geom_type not in VectorBase.POINT_TYPES + VectorBase.POLY_TYPES
+        keep = []
+        geoms = []
+        for idx, (fid, wkb) in enumerate(zip(fids.tolist(), wkbs)):
+            if wkb is None:
+                log.warning('Feature with FID={} has no geometry. Skipping'.format(fid))
                 continue
-            if geom.GetGeometryType() in VectorBase.LINE_TYPES:
-                if geom.Length() == 0.0:
-                    progbar.erase()  # get around the progressbar
-                    log.warning('Feature with FID={} has no Length. Skipping'.format(feature.GetFID()))
+
+            geom = wkb
+            if check_length or buffer_convert != 0:
+                geom = ogr.CreateGeometryFromWkb(wkb)
+                if geom.GetGeometryType() in VectorBase.LINE_TYPES and geom.Length() == 0.0:
+                    log.warning('Feature with FID={} has no Length. Skipping'.format(fid))
                     continue
 
-            # Buffer the shape if we need to
-            if buffer_convert != 0:
-                geom = geom.Buffer(buffer_convert)
+                # Buffer the shape if we need to
+                if buffer_convert != 0:
+                    geom = geom.Buffer(buffer_convert)
 
-            geom.Transform(transform)
+            keep.append(idx)
+            geoms.append(geom)
 
-            # Create output Feature
-            out_feature = ogr.Feature(out_layer.ogr_layer_def)
-            out_feature.SetGeometry(geom)
-
-            # Add field values from input Layer
-            for i in range(0, out_layer.ogr_layer_def.GetFieldCount()):
-                out_feature.SetField(out_layer.ogr_layer_def.GetFieldDefn(i).GetNameRef(), feature.GetField(i))
-
-            out_layer.ogr_layer.CreateFeature(out_feature)
-            out_feature = None
+        out_layer.write_columns(geoms, {field: values[keep] for field, values in columns.items()}, transform=transform, name="Copying features")
 
 
 def merge_feature_classes(feature_class_paths: List[str], out_layer_path: str, boundary: BaseGeometry = None):
@@ -269,32 +308,14 @@ def merge_feature_classes(feature_class_paths: List[str], out_layer_path: str, b
             fccount += 1
             log.info("Merging feature class {}/{}".format(fccount, len(feature_class_paths)))
 
-            out_layer.ogr_layer.StartTransaction()
-
             with get_shp_or_gpkg(in_layer_path) as in_layer:
-                if boundary is not None:
-                    in_layer.SetSpatialFilter(VectorBase.shapely2ogr(boundary))
-
-                log.info('Processing feature: {}/{}'.format(fccount, len(feature_class_paths)))
-
-                for feature, _counter, progbar in in_layer.iterate_features('Processing feature'):
-                    geom = feature.GetGeometryRef()
-
-                    if geom is None:
-                        progbar.erase()  # get around the progressbar
-                        log.warning('Feature with FID={} has no geometry. Skipping'.format(feature.GetFID()))
-                        continue
-
-                    # geom.Transform(transform)
-                    out_feature = ogr.Feature(out_layer.ogr_layer_def)
+                fids, wkbs, columns = in_layer.read_columns(clip_shape=boundary)
 
-                    for i in range(in_layer.ogr_layer_def.GetFieldCount()):
-                        field_name = in_layer.ogr_layer_def.GetFieldDefn(i).GetNameRef()
-                        out_feature.SetField(field_name, feature.GetField(i))
+            keep = np.array([wkb is not None for wkb in wkbs], dtype=bool)
+            for fid in fids[~keep].tolist():
+                log.warning('Feature with FID={} has no geometry. Skipping'.format(fid))
 
-                    out_feature.SetGeometry(geom)
-                    out_layer.ogr_layer.CreateFeature(out_feature)
-            out_layer.ogr_layer.CommitTransaction()
+            out_layer.write_columns(wkbs[keep], {field: values[keep] for field, values in columns.items()}, name='Processing feature')
 
     log.info('Merge complete.')
     return fccount
@@ -383,7 +404,7 @@ def load_attributes(in_layer_path: str, id_field: str, fields: list) -> dict:
     return feature_values
 
 
-def load_geometries(in_layer_path: str, id_field: str = None, epsg: int = None, spatial_ref: osr.SpatialReference = None) -> dict:
+def load_geometries(in_layer_path: str, id_field: str = None, epsg: int = None, spatial_ref: osr.SpatialReference = None, use_cache: bool = True) -> dict:
     """[summary]
 
     Args:
@@ -391,6 +412,7 @@ def load_geometries(in_layer_path: str, id_field: str = None, epsg: int = None,
         id_field (str, optional): [description]. Defaults to None.
         epsg (int, optional): [description]. Defaults to None.
         spatial_ref (osr.SpatialReference, optional): [description]. Defaults to None.
+        use_cache (bool, optional): read the layer through the process layer cache (see VectorBase.read_cached). Defaults to True.
 
     Raises:
         VectorBaseException: [description]
@@ -404,43 +426,26 @@ def load_geometries(in_layer_path: str, id_field: str = None, epsg: int = None,
         raise VectorBaseException('Specify either an EPSG or a spatial_ref. Not both')
 
     with get_shp_or_gpkg(in_layer_path) as in_layer:
-        # Determine the transformation if user provides an EPSG
-        transform = None
-        if epsg is not None:
-            _outref, transform = VectorBase.get_transform_from_epsg(in_layer.spatial_ref, epsg)
-        elif spatial_ref is not None:
-            transform = in_layer.get_transform(in_layer.spatial_ref, spatial_ref)
-
-        features = {}
-
-        for feature, _counter, progbar in in_layer.iterate_features("Loading features"):
-
-            if id_field is None:
-                reach = feature.GetFID()
-            else:
-                reach = feature.GetField(id_field)
-
-            geom = feature.GetGeometryRef()
-            geo_type = geom.GetGeometryType()
-
-            new_geom = VectorBase.ogr2shapely(geom, transform=transform)
-
-            if new_geom.is_empty:
-                progbar.erase()  # get around the progressbar
-                log.warning('Empty feature with FID={} cannot be unioned and will be ignored'.format(feature.GetFID()))
-            elif not new_geom.is_valid:
-                progbar.erase()  # get around the progressbar
-                log.warning('Invalid feature with FID={} cannot be unioned and will be ignored'.format(feature.GetFID()))
-            # Filter out zero-length lines
-            elif geo_type in VectorBase.LINE_TYPES and new_geom.length == 0:
-                progbar.erase()  # get around the progressbar
-                log.warning('Zero Length for feature with FID={}'.format(feature.GetFID()))
-            # Filter out zero-area polys
-            elif geo_type in VectorBase.POLY_TYPES and new_geom.area == 0:
-                progbar.erase()  # get around the progressbar
-                log.warning('Zero Area for feature with FID={}'.format(feature.GetFID()))
-            else:
-                features[reach] = new_geom
+        layer = in_layer.read_cached(epsg=epsg, spatial_ref=spatial_ref, use_cache=use_cache)
+
+    keys = layer.fids if id_field is None else layer.columns[id_field]
+    features = {}
+    for fid, reach, new_geom in zip(layer.fids.tolist(), keys.tolist(), layer.geoms):
+
+        if new_geom is None:
+            log.warning('Feature with FID={} has no geometry and will be ignored'.format(fid))
+        elif new_geom.is_empty:
+            log.warning('Empty feature with FID={} cannot be unioned and will be ignored'.format(fid))
+        elif not new_geom.is_valid:
+            log.warning('Invalid feature with FID={} cannot be unioned and will be ignored'.format(fid))
+        # Filter out zero-length lines
+        elif new_geom.geom_type in ['LineString', 'MultiLineString'] and new_geom.length == 0:
+            log.warning('Zero Length for feature with FID={}'.format(fid))
+        # Filter out zero-area polys
+        elif new_geom.geom_type in ['Polygon', 'MultiPolygon'] and new_geom.area == 0:
+            log.warning('Zero Area for feature with FID={}'.format(fid))
+        else:
+            features[reach] = new_geom
 
     return features
 
@@ -461,23 +466,35 @@ def write_attributes(in_layer_path: str, output_values: dict, id_field: str, fie
         # Create each field and store the name and index in a list of tuples
         field_indices = [(field, in_layer.create_field(field, field_type)) for field in fields]  # TODO different field types
 
-        for feature, _counter, _progbar in in_layer.iterate_features("Writing Attributes", write_layers=[in_layer]):
-            reach = feature.GetField(id_field)  # TODO Error when id_field is same as FID field .GetFID() seems to work instead
+        fids, _wkbs, columns = in_layer.read_columns(fields=[id_field])
+
+        # Features are grouped by which of the fields they have values for so
+        # that every group is written as one set of columns
+        groups = {}
+        null_count = 0
+        for fid, reach in zip(fids.tolist(), columns[id_field].tolist()):
             if reach not in output_values:
                 continue
 
-            # Set all the field values and then store the feature
-            for field, _idx in field_indices:
-                if field in output_values[reach]:
-                    if not output_values[reach][field]:
-                        if null_values:
-                            feature.SetField(field, null_values)
-                        else:
-                            log.warning('Unhandled feature class value for None type')
-                            feature.SetField(field, None)
-                    else:
-                        feature.SetField(field, output_values[reach][field])
-            in_layer.ogr_layer.SetFeature(feature)
+            present = tuple(field for field, _idx in field_indices if field in output_values[reach])
+            if len(present) == 0:
+                continue
+
+            values = []
+            for field in present:
+                value = output_values[reach][field]
+                if not value:
+                    if not null_values:
+                        null_count += 1
+                    value = null_values if null_values else None
+                values.append(value)
+            groups.setdefault(present, []).append((fid, values))
+
+        if null_count > 0:
+            log.warning('Unhandled feature class value for None type ({:,} values)'.format(null_count))
+
+        for present, rows in groups.items():
+            in_layer.write_columns(None, {field: [row[1][idx] for row in rows] for idx, field in enumerate(present)}, fids=[row[0] for row in rows], name="Writing Attributes")
 
 
 def network_statistics(label: str, vector_layer_path: str):
@@ -873,6 +890,18 @@ def remove_holes_feature_class(in_layer_path, out_layer_path, min_hole_area=None
 
 
 def intersection(layer_path1, layer_path2, out_layer_path, epsg):
+    """Intersect every feature of the second layer with the union of the first layer
+
+    The first layer is loaded once into a spatial index. Each feature of the second
+    layer is intersected with the unary union of only the features whose envelopes
+    it touches and every output feature is written in a single transaction.
+
+    Args:
+        layer_path1 (str): path to the layer to intersect with
+        layer_path2 (str): path to the layer whose features and attributes are written
+        out_layer_path (str): path to the output layer
+        epsg (int): output EPSG
+    """
 
     # log = Logger('feature_class_intersection')
     with get_shp_or_gpkg(out_layer_path, write=True) as out_layer, \
@@ -882,27 +911,42 @@ def intersection(layer_path1, layer_path2, out_layer_path, epsg):
         out_layer.create_layer_from_ref(layer2, epsg=epsg)
         out_layer_defn = out_layer.ogr_layer.GetLayerDefn()
 
-        # layer1.ogr_layer.GetGeomType()
-        # create an empty geometry of the same type
-        union1 = ogr.Geometry(3)
-        # union all the geometrical features of layer 1
-        for feat, _counter, progbar in layer1.iterate_features():
-            geom = feat.GetGeometryRef()
-            union1 = union1.Union(geom)
-        for feat, _counter, progbar in layer2.iterate_features():
+        geoms1 = _load_overlay_geoms(layer1, 'Loading intersection features')
+        index1 = GeometryIndex(geoms1)
+
+        out_layer.ogr_layer.StartTransaction()
+        for feat, _counter, _progbar in layer2.iterate_features('Intersecting features'):
             geom = feat.GetGeometryRef()
-            intersection = union1.Intersection(geom)
+            if geom is None:
+                continue
+            s_geom = VectorBase.ogr2shapely(geom)
+            candidates = index1.query(s_geom)
+            s_inter = s_geom.intersection(unary_union([geoms1[idx] for idx in candidates])) if len(candidates) > 0 else Polygon()
+
+            intersection = VectorBase.shapely2ogr(s_inter)
             if intersection.IsValid():
-                # out_layer.create_feature(intersection)
                 out_feat = ogr.Feature(out_layer_defn)
                 out_feat.SetGeometry(intersection)
                 for i in range(0, out_layer.ogr_layer_def.GetFieldCount()):
                     out_feat.SetField(out_layer.ogr_layer_def.GetFieldDefn(i).GetNameRef(), feat.GetField(i))
 
                 out_layer.ogr_layer.CreateFeature(out_feat)
+        out_layer.ogr_layer.CommitTransaction()
 
 
 def difference(remove_layer, target_layer, out_layer_path, epsg=None):
+    """Remove the features of one layer from every feature of another
+
+    The remove layer is loaded once into a spatial index. Each target feature has the
+    unary union of only the remove features whose envelopes it touches subtracted in
+    one operation and every output polygon is written in a single transaction.
+
+    Args:
+        remove_layer (str): path to the layer to subtract
+        target_layer (str): path to the layer whose features and attributes are written
+        out_layer_path (str): path to the output layer
+        epsg (int, optional): unused. Defaults to None.
+    """
 
     log = Logger('feature_class_difference')
     with get_shp_or_gpkg(out_layer_path, write=True) as lyr_output, \
@@ -911,44 +955,66 @@ def difference(remove_layer, target_layer, out_layer_path, epsg=None):
 
         lyr_output.create_layer_from_ref(lyr_target)
         lyr_output_defn = lyr_output.ogr_layer.GetLayerDefn()
+
+        diff_geoms = _load_overlay_geoms(lyr_diff, 'Loading difference features')
+        diff_index = GeometryIndex(diff_geoms)
+
         lyr_output.ogr_layer.StartTransaction()
         for feat_target, _counter, _progbar in lyr_target.iterate_features("Differencing Target Features"):
 
             def write_polygon(out_geom):
                 out_feat = ogr.Feature(lyr_output_defn)
-                out_feat.SetGeometry(out_geom)
+                out_feat.SetGeometry(VectorBase.shapely2ogr(out_geom))
                 for i in range(0, lyr_output.ogr_layer_def.GetFieldCount()):
                     out_feat.SetField(lyr_output.ogr_layer_def.GetFieldDefn(i).GetNameRef(), feat_target.GetField(i))
                 lyr_output.ogr_layer.CreateFeature(out_feat)
 
             geom = feat_target.GetGeometryRef()
+            if geom is None:
+                continue
             if not geom.IsValid():
                 geom = geom_validity_fix(geom)
+            s_geom = VectorBase.ogr2shapely(geom)
 
-            for feat_diff, _counter, _progbar in lyr_diff.iterate_features(clip_shape=geom):
-                geom_diff = feat_diff.GetGeometryRef()
-                if not geom_diff.IsValid():
-                    geom_diff = geom_validity_fix(geom_diff)
+            candidates = [diff_geoms[idx] for idx in diff_index.query(s_geom)]
+            if len(candidates) > 0:
                 try:
-                    geom_orig = geom.Clone()
-                    geom = geom.Difference(geom_diff)
-                except:
-                    log.error(str(IOError))
-                    geom = geom_orig
-                    continue
-                if not geom.IsValid():
-                    geom = geom_validity_fix(geom)
-
-            if geom.IsValid() and geom.GetGeometryName() != 'GEOMETRYCOLLECTION':
-                if geom.GetGeometryName() == 'MULTIPOLYGON':
-                    for g in geom:
+                    s_geom = s_geom.difference(unary_union(candidates))
+                except Exception as ex:
+                    # Fall back to removing the features one at a time and skip any that fail
+                    log.error(str(ex))
+                    for geom_diff in candidates:
+                        try:
+                            s_geom = s_geom.difference(geom_diff)
+                        except Exception as ex_diff:
+                            log.error(str(ex_diff))
+                if not s_geom.is_valid:
+                    s_geom = VectorBase.ogr2shapely(geom_validity_fix(VectorBase.shapely2ogr(s_geom)))
+
+            if s_geom.is_valid and not s_geom.is_empty:
+                if isinstance(s_geom, MultiPolygon):
+                    for g in s_geom.geoms:
                         write_polygon(g)
-                else:
-                    write_polygon(geom)
+                elif isinstance(s_geom, Polygon):
+                    write_polygon(s_geom)
 
         lyr_output.ogr_layer.CommitTransaction()
 
 
+def _load_overlay_geoms(layer: VectorBase, label: str) -> List[BaseGeometry]:
+    """Valid Shapely geometries of every feature in a layer for the overlay operators"""
+
+    geoms = []
+    for feat, _counter, _progbar in layer.iterate_features(label):
+        geom = feat.GetGeometryRef()
+        if geom is None:
+            continue
+        if not geom.IsValid():
+            geom = geom_validity_fix(geom)
+        geoms.append(VectorBase.ogr2shapely(geom))
+    return geoms
+
+
 def geom_validity_fix(geom_in):
     # copied from vbet_outputs
     buff_dist = 0.0000001
@@ -0,0 +1,385 @@
+# Name:     Zonal Statistics
+#
+# Purpose:  Statistics of raster cells under many polygons in a single pass
+#           over the raster. Instead of masking the raster once per polygon,
+#           the raster is read in windows and the polygons that fall in each
+#           window are rasterized into a label array. Cell values are then
+#           accumulated per label with np.bincount style reductions.
+#
+#           Polygons frequently overlap (e.g. buffers of adjacent reaches) but
+#           a label array can only hold one polygon per cell. Polygons are
+#           therefore split into batches whose envelopes do not overlap and
+#           each batch gets its own label array over the same window read.
+#
+#           Cells are included when their centres fall inside a polygon, which
+#           is the same rule as rasterio.mask.mask(all_touched=False). The
+#           all_touched rule is also available for tools (e.g. RVD) that use it.
+#
+#           zonal_statistics() reduces continuous rasters to count, sum, mean,
+#           minimum and maximum. zonal_tally() counts the cells of each class of
+#           a categorical raster (e.g. vegetation types) under each polygon and
+#           zonal_cross_tally() does the same for combinations of classes across
+#           several aligned rasters (e.g. existing and historic vegetation).
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from typing import List
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio import features
+from rasterio.windows import Window, bounds as window_bounds
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+from rscommons import Logger, ProgressBar
+from rscommons.spatial_index import GeometryIndex
+
+
+def non_overlapping_batches(geoms: List[BaseGeometry], index: GeometryIndex = None, distance: float = 0.0) -> np.ndarray:
+    """Greedily assign each geometry to a batch such that the envelopes of
+    geometries in the same batch do not intersect. Envelopes are conservative
+    but avoid an expensive geometric predicate for every pair of neighbours.
+
+    Args:
+        geoms (List[BaseGeometry]): geometries
+        index (GeometryIndex, optional): existing spatial index over geoms. Defaults to None.
+        distance (float, optional): envelopes in the same batch must also be further apart than this. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: batch number for each geometry
+    """
+
+    index = index if index is not None else GeometryIndex(geoms)
+    batches = np.full(len(geoms), -1, dtype=np.int32)
+
+    for idx, geom in enumerate(geoms):
+        if geom is None or geom.is_empty:
+            batches[idx] = 0
+            continue
+
+        query = geom
+        if distance > 0:
+            minx, miny, maxx, maxy = geom.bounds
+            query = box(minx - distance, miny - distance, maxx + distance, maxy + distance)
+
+        taken = {batches[other] for other in index.query(query) if other != idx and batches[other] >= 0}
+        batch = 0
+        while batch in taken:
+            batch += 1
+        batches[idx] = batch
+
+    return batches
+
+
+def raster_windows(src, bounds: tuple, window_size: int):
+    """Square windows of a raster that cover a bounding box
+
+    Args:
+        src (rasterio.DatasetReader): open raster
+        bounds (tuple): (minx, miny, maxx, maxy) in raster coordinates
+        window_size (int): width and height of each window in cells
+
+    Yields:
+        Window: windows clipped to the raster extent
+    """
+
+    minx, miny, maxx, maxy = bounds
+    rows = []
+    cols = []
+    for x_coord, y_coord in [(minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)]:
+        row, col = src.index(x_coord, y_coord)
+        rows.append(row)
+        cols.append(col)
+
+    row_start = max(min(rows), 0)
+    row_stop = min(max(rows) + 1, src.height)
+    col_start = max(min(cols), 0)
+    col_stop = min(max(cols) + 1, src.width)
+
+    for row in range(row_start, row_stop, window_size):
+        for col in range(col_start, col_stop, window_size):
+            yield Window(col, row, min(window_size, col_stop - col), min(window_size, row_stop - row))
+
+
+def bounds_slices(inverse_transform: Affine, bounds: np.ndarray, shape: tuple):
+    """Row and column slices of an array covering the combined extent of a set of bounding boxes
+
+    Args:
+        inverse_transform (Affine): transform from map coordinates to array coordinates
+        bounds (np.ndarray): (n, 4) array of (minx, miny, maxx, maxy)
+        shape (tuple): (rows, columns) of the array. Slices are clipped to it
+
+    Returns:
+        tuple: row slice, column slice
+    """
+
+    minx, miny = np.nanmin(bounds[:, 0]), np.nanmin(bounds[:, 1])
+    maxx, maxy = np.nanmax(bounds[:, 2]), np.nanmax(bounds[:, 3])
+    corners = [inverse_transform * (x_coord, y_coord) for x_coord in (minx, maxx) for y_coord in (miny, maxy)]
+    cols = [corner[0] for corner in corners]
+    rows = [corner[1] for corner in corners]
+
+    row_start = max(int(np.floor(min(rows))), 0)
+    row_stop = min(int(np.ceil(max(rows))), shape[0])
+    col_start = max(int(np.floor(min(cols))), 0)
+    col_stop = min(int(np.ceil(max(cols))), shape[1])
+    return slice(row_start, row_stop), slice(col_start, col_stop)
+
+
+def valid_cells(data: np.ndarray, nodata) -> np.ndarray:
+    """Boolean mask of cells that are not NoData. Floating point rasters use the
+    same closeness test as np.ma.masked_values()"""
+
+    if nodata is None:
+        return np.ones(data.shape, dtype=bool)
+
+    if np.issubdtype(data.dtype, np.floating):
+        if np.isnan(nodata):
+            return ~np.isnan(data)
+        return ~np.isclose(data, nodata, rtol=1e-5, atol=1e-8)
+
+    return data != nodata
+
+
+def zone_windows(polygons: dict, src, window_size: int = 1024, all_touched: bool = False, label: str = 'Zonal Statistics'):
+    """Label arrays for the polygons under each window of a raster
+
+    This is the engine behind zonal_statistics(), zonal_tally() and
+    zonal_cross_tally(). Windows cover the extent of the polygons and the
+    polygons that overlap each window are rasterized batch by batch into
+    label arrays cropped to the batch extent. Callers read whichever rasters
+    they need once per window and pick out the labelled cells.
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        src (rasterio.DatasetReader): open raster that defines the grid
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+        all_touched (bool, optional): include every cell touched by a polygon instead of cell centres. Defaults to False.
+        label (str, optional): progress bar label. Defaults to 'Zonal Statistics'.
+
+    Yields:
+        tuple: (window, batches) where batches generates (members, rows, cols, labels). Members are
+            positions in polygons, rows and cols slice the window and labels hold the 1-based position
+            in members of the polygon covering each cell (zero is no polygon)
+    """
+
+    log = Logger(label)
+
+    geoms = list(polygons.values())
+    index = GeometryIndex(geoms)
+
+    # Cells touched by two polygons can be up to a cell apart from both envelopes
+    distance = 1.5 * max(abs(src.transform.a), abs(src.transform.e)) if all_touched else 0.0
+    batches = non_overlapping_batches(geoms, index, distance)
+    log.info('{} for {:,} polygons in {:,} non-overlapping batches'.format(label, len(geoms), int(batches.max()) + 1 if len(geoms) > 0 else 0))
+
+    geom_bounds = np.array([geom.bounds if geom is not None and not geom.is_empty else (np.nan,) * 4 for geom in geoms], dtype=np.float64).reshape(-1, 4)
+    if not np.isnan(geom_bounds).all():
+        bounds = (np.nanmin(geom_bounds[:, 0]), np.nanmin(geom_bounds[:, 1]), np.nanmax(geom_bounds[:, 2]), np.nanmax(geom_bounds[:, 3]))
+        windows = list(raster_windows(src, bounds, window_size))
+    else:
+        windows = []
+
+    def window_batches(window, candidates):
+        window_transform = src.window_transform(window)
+        shape = (int(window.height), int(window.width))
+
+        for batch in np.unique(batches[candidates]):
+            # Only rasterize the part of the window covered by the polygons in this batch
+            members = candidates[batches[candidates] == batch]
+            rows, cols = bounds_slices(~window_transform, geom_bounds[members], shape)
+            if all_touched:
+                rows = slice(max(rows.start - 1, 0), min(rows.stop + 1, shape[0]))
+                cols = slice(max(cols.start - 1, 0), min(cols.stop + 1, shape[1]))
+            if rows.start >= rows.stop or cols.start >= cols.stop:
+                continue
+
+            labels = features.rasterize(
+                [(geoms[idx], position) for position, idx in enumerate(members, start=1)],
+                out_shape=(rows.stop - rows.start, cols.stop - cols.start),
+                transform=window_transform * Affine.translation(cols.start, rows.start),
+                fill=0,
+                all_touched=all_touched,
+                dtype='int32'
+            )
+            yield members, rows, cols, labels
+
+    progbar = ProgressBar(len(windows), 50, label)
+    for counter, window in enumerate(windows):
+        progbar.update(counter + 1)
+
+        candidates = np.array(index.query(box(*window_bounds(window, src.transform))), dtype=np.int64)
+        if len(candidates) > 0:
+            yield window, window_batches(window, candidates)
+
+    progbar.finish()
+
+
+def zone_cells(polygons: dict, src, window_size: int = 1024, all_touched: bool = False, label: str = 'Zonal Statistics'):
+    """Stream the valid raster cells under each polygon in one pass over the raster
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        src (rasterio.DatasetReader): open raster. Band 1 is used
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+        all_touched (bool, optional): include every cell touched by a polygon instead of cell centres. Defaults to False.
+        label (str, optional): progress bar label. Defaults to 'Zonal Statistics'.
+
+    Yields:
+        tuple: (members, zone, values) where members are positions in polygons of the batch,
+            zone is the 1-based position in members of each cell and values are the cell values
+    """
+
+    for window, batches in zone_windows(polygons, src, window_size, all_touched, label):
+        data = src.read(1, window=window)
+        valid = valid_cells(data, src.nodata)
+
+        for members, rows, cols, labels in batches:
+            selected = (labels > 0) & valid[rows, cols]
+            if selected.any():
+                yield members, labels[selected], data[rows, cols][selected]
+
+
+def zonal_statistics(polygons: dict, raster: str, window_size: int = 1024) -> dict:
+    """Count, sum, mean, minimum and maximum of raster cells under each polygon
+
+    Drop-in replacement for looping rasterio.mask.mask() over each polygon.
+    Polygons that contain no valid raster cells (including those outside
+    the raster) get None for every statistic.
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        raster (str): path to the raster. Band 1 is used
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+
+    Returns:
+        dict: keyed by polygon ID. Values are dictionaries with Mean, Maximum, Minimum, Count and Sum
+    """
+
+    ids = list(polygons.keys())
+    counts = np.zeros(len(ids), dtype=np.int64)
+    sums = np.zeros(len(ids), dtype=np.float64)
+    minimums = np.full(len(ids), np.inf, dtype=np.float64)
+    maximums = np.full(len(ids), -np.inf, dtype=np.float64)
+
+    with rasterio.open(raster) as src:
+        for members, zone, values in zone_cells(polygons, src, window_size):
+            values = values.astype(np.float64)
+            counts[members] += np.bincount(zone, minlength=len(members) + 1)[1:]
+            sums[members] += np.bincount(zone, weights=values, minlength=len(members) + 1)[1:]
+
+            # Minimum and maximum by sorting on zone and reducing each run of equal zones
+            order = np.argsort(zone, kind='stable')
+            zone = zone[order]
+            values = values[order]
+            zones, starts = np.unique(zone, return_index=True)
+            present = members[zones - 1]
+            minimums[present] = np.minimum(minimums[present], np.minimum.reduceat(values, starts))
+            maximums[present] = np.maximum(maximums[present], np.maximum.reduceat(values, starts))
+
+    results = {}
+    for idx, poly_id in enumerate(ids):
+        if counts[idx] > 0:
+            results[poly_id] = {
+                'Mean': float(sums[idx] / counts[idx]),
+                'Maximum': float(maximums[idx]),
+                'Minimum': float(minimums[idx]),
+                'Count': int(counts[idx]),
+                'Sum': float(sums[idx])
+            }
+        else:
+            results[poly_id] = {'Mean': None, 'Maximum': None, 'Minimum': None, 'Count': None, 'Sum': None}
+
+    return results
+
+
+def zonal_tally(polygons: dict, raster: str, window_size: int = 1024, all_touched: bool = False) -> dict:
+    """Number of cells of each raster value under each polygon
+
+    Replaces masking a categorical raster once per polygon and calling np.unique()
+    on the result. NoData cells are not counted.
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        raster (str): path to a categorical raster. Band 1 is used
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+        all_touched (bool, optional): include every cell touched by a polygon instead of cell centres. Defaults to False.
+
+    Returns:
+        dict: keyed by polygon ID. Values are dictionaries of cell counts keyed by raster value.
+            Polygons without any valid cells get an empty dictionary.
+    """
+
+    tallies = zonal_cross_tally(polygons, [raster], window_size, all_touched)
+    return {poly_id: {key[0]: count for key, count in tally.items()} for poly_id, tally in tallies.items()}
+
+
+def zonal_cross_tally(polygons: dict, rasters: List[str], window_size: int = 1024, all_touched: bool = False) -> dict:
+    """Cross tabulation of the values of several aligned categorical rasters under each polygon
+
+    Each window of every raster is read once. Within each batch the polygon
+    position and the class of each raster are combined into a single integer
+    key so that one np.unique() call tallies every polygon and every
+    combination of classes at once. Memory use depends on the window size
+    and not the size of the rasters.
+
+    Args:
+        polygons (dict): Shapely polygons keyed by ID
+        rasters (List[str]): paths to rasters with identical extents and cell sizes. Band 1 of each is used
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+        all_touched (bool, optional): include every cell touched by a polygon instead of cell centres. Defaults to False.
+
+    Returns:
+        dict: keyed by polygon ID. Values are dictionaries of cell counts keyed by tuples of raster
+            values in the same order as rasters. NoData is None in the tuple. Cells that are NoData
+            in every raster are not counted. Polygons without any cells get an empty dictionary.
+    """
+
+    ids = list(polygons.keys())
+    tallies = [{} for _poly_id in ids]
+
+    sources = [rasterio.open(raster) for raster in rasters]
+    try:
+        for src, raster in zip(sources[1:], rasters[1:]):
+            if src.shape != sources[0].shape or not src.transform.almost_equals(sources[0].transform):
+                raise Exception('Raster {} is not aligned with {}. Cannot cross tabulate'.format(raster, rasters[0]))
+
+        for window, batches in zone_windows(polygons, sources[0], window_size, all_touched, 'Zonal Tally'):
+            data = [src.read(1, window=window) for src in sources]
+            valid = [valid_cells(values, src.nodata) for values, src in zip(data, sources)]
+            any_valid = np.logical_or.reduce(valid)
+
+            for members, rows, cols, labels in batches:
+                selected = (labels > 0) & any_valid[rows, cols]
+                if not selected.any():
+                    continue
+
+                # Mixed radix key of (polygon, class of each raster). Class zero is NoData
+                keys = labels[selected].astype(np.int64) - 1
+                radixes = []
+                class_values = []
+                for values, is_valid in zip(data, valid):
+                    values = values[rows, cols][selected]
+                    is_valid = is_valid[rows, cols][selected]
+                    classes = np.unique(values[is_valid])
+                    class_index = np.zeros(len(values), dtype=np.int64)
+                    class_index[is_valid] = np.searchsorted(classes, values[is_valid]) + 1
+                    keys = keys * (len(classes) + 1) + class_index
+                    radixes.append(len(classes) + 1)
+                    class_values.append([None] + classes.tolist())
+
+                combined, counts = np.unique(keys, return_counts=True)
+                combined = combined.tolist()
+                for key, count in zip(combined, counts.tolist()):
+                    classes = []
+                    for radix, values in zip(reversed(radixes), reversed(class_values)):
+                        classes.append(values[key % radix])
+                        key //= radix
+                    tally = tallies[members[key]]
+                    classes = tuple(reversed(classes))
+                    tally[classes] = tally.get(classes, 0) + count
+    finally:
+        for src in sources:
+            src.close()
+
+    return {poly_id: tally for poly_id, tally in zip(ids, tallies)}
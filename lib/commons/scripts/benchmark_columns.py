@@ -0,0 +1,148 @@
+""" Benchmark the columnar read and write API on VectorBase
+
+    Builds a synthetic geopackage of flow line style features with a typical
+    set of NHD attribute fields and compares features per second for:
+
+    - reading: iterate_features() with a GetField() call per field against
+      VectorBase.read_columns()
+    - copying: the previous copy_feature_class() loop that sets every field by
+      name on a new feature against the columnar copy_feature_class()
+
+    Usage: python benchmark_columns.py [--features 200000]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+from osgeo import ogr
+from shapely.geometry import LineString
+from rscommons import Logger, GeopackageLayer, get_shp_or_gpkg, VectorBase
+from rscommons.vector_ops import copy_feature_class
+from rscommons.util import safe_remove_dir
+
+FIELDS = {
+    'ReachCode': ogr.OFTString,
+    'FCode': ogr.OFTInteger,
+    'GNIS_NAME': ogr.OFTString,
+    'TotDASqKm': ogr.OFTReal,
+    'DivDASqKm': ogr.OFTReal,
+    'NHDPlusID': ogr.OFTInteger64,
+    'StreamOrde': ogr.OFTInteger,
+    'Slope': ogr.OFTReal
+}
+
+
+def synthetic_layer(gpkg: str, features: int):
+    """Short random walk polylines with every attribute field filled in"""
+
+    rng = np.random.default_rng(6)
+    with GeopackageLayer(gpkg, 'flowlines', write=True) as lyr:
+        lyr.create_layer(ogr.wkbLineString, epsg=4326, fields=FIELDS)
+        lyr.ogr_layer.StartTransaction()
+        for reach_id in range(features):
+            start = rng.uniform(-120, -110, 2)
+            line = LineString(start + np.cumsum(rng.normal(0, 0.001, (12, 2)), axis=0))
+            lyr.create_feature(line, {
+                'ReachCode': '{:014d}'.format(reach_id),
+                'FCode': int(rng.choice([46003, 46006, 55800])),
+                'GNIS_NAME': 'Creek {}'.format(reach_id % 500),
+                'TotDASqKm': float(rng.uniform(0, 1000)),
+                'DivDASqKm': float(rng.uniform(0, 1000)),
+                'NHDPlusID': 55000000000000 + reach_id,
+                'StreamOrde': int(rng.integers(1, 7)),
+                'Slope': float(rng.uniform(0, 0.1))
+            })
+        lyr.ogr_layer.CommitTransaction()
+
+
+def legacy_read(layer_path: str) -> int:
+    """Read every field of every feature one GetField call at a time"""
+
+    count = 0
+    with get_shp_or_gpkg(layer_path) as lyr:
+        field_count = lyr.ogr_layer_def.GetFieldCount()
+        for feature, _counter, _progbar in lyr.iterate_features():
+            for i in range(field_count):
+                feature.GetField(i)
+            feature.GetGeometryRef().ExportToWkb()
+            count += 1
+    return count
+
+
+def columns_read(layer_path: str) -> int:
+    """Read the whole layer as arrays"""
+
+    with get_shp_or_gpkg(layer_path) as lyr:
+        fids, _wkbs, _columns = lyr.read_columns()
+    return len(fids)
+
+
+def legacy_copy(in_layer_path: str, out_layer_path: str):
+    """The previous copy_feature_class() loop"""
+
+    with get_shp_or_gpkg(out_layer_path, write=True) as out_layer, get_shp_or_gpkg(in_layer_path) as in_layer:
+        out_layer.create_layer_from_ref(in_layer)
+        transform = VectorBase.get_transform(in_layer.spatial_ref, out_layer.spatial_ref)
+
+        for feature, _counter, _progbar in in_layer.iterate_features(write_layers=[out_layer]):
+            geom = feature.GetGeometryRef()
+            if geom is None or geom.Length() == 0.0:
+                continue
+            geom.Transform(transform)
+
+            out_feature = ogr.Feature(out_layer.ogr_layer_def)
+            out_feature.SetGeometry(geom)
+            for i in range(0, out_layer.ogr_layer_def.GetFieldCount()):
+                out_feature.SetField(out_layer.ogr_layer_def.GetFieldDefn(i).GetNameRef(), feature.GetField(i))
+            out_layer.ogr_layer.CreateFeature(out_feature)
+            out_feature = None
+
+
+def feature_count(layer_path: str) -> int:
+    with get_shp_or_gpkg(layer_path) as lyr:
+        return lyr.ogr_layer.GetFeatureCount()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--features', help='Number of flow line features', type=int, default=200000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        gpkg = os.path.join(temp_dir, 'columns.gpkg')
+        synthetic_layer(gpkg, args.features)
+        flowlines = os.path.join(gpkg, 'flowlines')
+        with get_shp_or_gpkg(flowlines) as lyr:
+            arrow = hasattr(lyr.ogr_layer, 'GetArrowStreamAsNumPy') and lyr.ogr_layer.TestCapability(ogr.OLCFastGetArrowStream)
+        print('{:,} features with {} fields. Arrow stream {}'.format(args.features, len(FIELDS), 'available' if arrow else 'not available'))
+
+        for name, legacy, columnar in [
+            ('read', lambda: legacy_read(flowlines), lambda: columns_read(flowlines)),
+            ('copy', lambda: legacy_copy(flowlines, os.path.join(gpkg, 'legacy_copy')),
+             lambda: copy_feature_class(flowlines, os.path.join(gpkg, 'columns_copy')))
+        ]:
+            start = time.perf_counter()
+            legacy()
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            columnar()
+            columnar_time = time.perf_counter() - start
+
+            print('{}: previous {:,.0f} features/s, columnar {:,.0f} features/s, speedup {:.1f}x'.format(
+                name, args.features / legacy_time, args.features / columnar_time, legacy_time / columnar_time))
+
+        legacy_count, columns_count = feature_count(os.path.join(gpkg, 'legacy_copy')), feature_count(os.path.join(gpkg, 'columns_copy'))
+        if legacy_count != columns_count:
+            raise Exception('Copies differ: {:,} features against {:,}'.format(legacy_count, columns_count))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+""" Benchmark the spatially indexed difference and intersection operators
+
+    Builds a synthetic geopackage with a layer of valley bottom style target
+    polygons and a layer of many small channel style polygons, then times
+    rscommons.vector_ops.difference() and intersection() against the previous
+    versions that query the remove layer once per target feature (difference)
+    and build the union with pairwise OGR Union calls (intersection).
+
+    The total output area of each pair of operators is compared.
+
+    Usage: python benchmark_overlay.py [--targets 500] [--removes 20000]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+from osgeo import ogr
+from shapely.geometry import LineString, Point
+from rscommons import Logger, GeopackageLayer, get_shp_or_gpkg
+from rscommons.vector_ops import difference, intersection, geom_validity_fix
+from rscommons.util import safe_remove_dir
+
+
+def synthetic_layers(gpkg: str, targets: int, removes: int):
+    """Long sinuous target polygons and small overlapping polygons scattered along them"""
+
+    rng = np.random.default_rng(4)
+    extent = 2000.0 * np.sqrt(targets)
+
+    with GeopackageLayer(gpkg, 'targets', write=True) as lyr:
+        lyr.create_layer(ogr.wkbPolygon, epsg=26912, fields={'ReachID': ogr.OFTInteger})
+        lyr.ogr_layer.StartTransaction()
+        for reach_id in range(targets):
+            start = rng.uniform(0, extent, 2)
+            steps = np.cumsum(rng.normal(0, 60, (40, 2)) + rng.normal(0, 40, 2), axis=0)
+            lyr.create_feature(LineString(start + steps).buffer(rng.uniform(40, 150)), {'ReachID': reach_id})
+        lyr.ogr_layer.CommitTransaction()
+
+    with GeopackageLayer(gpkg, 'removes', write=True) as lyr:
+        lyr.create_layer(ogr.wkbPolygon, epsg=26912, fields={'ChannelID': ogr.OFTInteger})
+        lyr.ogr_layer.StartTransaction()
+        for channel_id in range(removes):
+            lyr.create_feature(Point(rng.uniform(0, extent, 2)).buffer(rng.uniform(10, 80), 8), {'ChannelID': channel_id})
+        lyr.ogr_layer.CommitTransaction()
+
+
+def legacy_difference(remove_layer, target_layer, out_layer_path):
+    """Difference with one filtered query and one subtraction per overlapping feature"""
+
+    with get_shp_or_gpkg(out_layer_path, write=True) as lyr_output, \
+            get_shp_or_gpkg(remove_layer) as lyr_diff, \
+            get_shp_or_gpkg(target_layer) as lyr_target:
+
+        lyr_output.create_layer_from_ref(lyr_target)
+        lyr_output_defn = lyr_output.ogr_layer.GetLayerDefn()
+        lyr_output.ogr_layer.StartTransaction()
+        for feat_target, _counter, _progbar in lyr_target.iterate_features():
+            geom = feat_target.GetGeometryRef()
+            if not geom.IsValid():
+                geom = geom_validity_fix(geom)
+
+            for feat_diff, _counter, _progbar in lyr_diff.iterate_features(clip_shape=geom):
+                geom_diff = feat_diff.GetGeometryRef()
+                if not geom_diff.IsValid():
+                    geom_diff = geom_validity_fix(geom_diff)
+                geom = geom.Difference(geom_diff)
+                if not geom.IsValid():
+                    geom = geom_validity_fix(geom)
+
+            if geom.IsValid() and geom.GetGeometryName() != 'GEOMETRYCOLLECTION':
+                for g in (geom if geom.GetGeometryName() == 'MULTIPOLYGON' else [geom]):
+                    out_feat = ogr.Feature(lyr_output_defn)
+                    out_feat.SetGeometry(g)
+                    out_feat.SetField('ReachID', feat_target.GetField('ReachID'))
+                    lyr_output.ogr_layer.CreateFeature(out_feat)
+        lyr_output.ogr_layer.CommitTransaction()
+
+
+def legacy_intersection(layer_path1, layer_path2, out_layer_path):
+    """Intersection with the union built by pairwise OGR Union calls and no transaction"""
+
+    with get_shp_or_gpkg(out_layer_path, write=True) as out_layer, \
+            get_shp_or_gpkg(layer_path1) as layer1, \
+            get_shp_or_gpkg(layer_path2) as layer2:
+
+        out_layer.create_layer_from_ref(layer2)
+        out_layer_defn = out_layer.ogr_layer.GetLayerDefn()
+
+        union1 = ogr.Geometry(3)
+        for feat, _counter, _progbar in layer1.iterate_features():
+            union1 = union1.Union(feat.GetGeometryRef())
+        for feat, _counter, _progbar in layer2.iterate_features():
+            inter = union1.Intersection(feat.GetGeometryRef())
+            if inter.IsValid():
+                out_feat = ogr.Feature(out_layer_defn)
+                out_feat.SetGeometry(inter)
+                out_feat.SetField('ReachID', feat.GetField('ReachID'))
+                out_layer.ogr_layer.CreateFeature(out_feat)
+
+
+def total_area(layer_path: str) -> float:
+    """Sum of the feature areas in a layer"""
+
+    with get_shp_or_gpkg(layer_path) as lyr:
+        return sum(feat.GetGeometryRef().GetArea() for feat, *_ in lyr.iterate_features() if feat.GetGeometryRef() is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', help='Number of target polygons', type=int, default=500)
+    parser.add_argument('--removes', help='Number of polygons to remove or intersect', type=int, default=20000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        gpkg = os.path.join(temp_dir, 'overlay.gpkg')
+        synthetic_layers(gpkg, args.targets, args.removes)
+        targets, removes = os.path.join(gpkg, 'targets'), os.path.join(gpkg, 'removes')
+        print('{:,} target polygons and {:,} overlay polygons'.format(args.targets, args.removes))
+
+        for name, legacy, indexed in [
+            ('difference', lambda out: legacy_difference(removes, targets, out), lambda out: difference(removes, targets, out)),
+            ('intersection', lambda out: legacy_intersection(removes, targets, out), lambda out: intersection(removes, targets, out, None))
+        ]:
+            legacy_out, indexed_out = os.path.join(gpkg, 'legacy_{}'.format(name)), os.path.join(gpkg, 'indexed_{}'.format(name))
+
+            start = time.perf_counter()
+            legacy(legacy_out)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            indexed(indexed_out)
+            indexed_time = time.perf_counter() - start
+
+            legacy_area, indexed_area = total_area(legacy_out), total_area(indexed_out)
+            print('{}: previous {:.2f}s, indexed {:.2f}s, speedup {:.1f}x, area difference {:.6f}%'.format(
+                name, legacy_time, indexed_time, legacy_time / indexed_time, 100 * abs(legacy_area - indexed_area) / max(legacy_area, 1e-9)))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
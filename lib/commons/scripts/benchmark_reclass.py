@@ -0,0 +1,116 @@
+""" Benchmark lookup table reclassification against np.vectorize(dict.get)
+
+    Builds a synthetic LANDFIRE sized vegetation type tile (about 800 EVT style
+    codes) and times:
+
+    1. The five in memory reclass products of RVD's load_vegetation_raster()
+       with np.vectorize(dict.get) and with rscommons.reclass.ReclassTable.
+    2. Writing a reclassified raster block by block with a np.vectorize
+       callback (the old BRAT output_vegetation_raster()) and with
+       rscommons.reclass.reclass_raster(), plus five products from one read.
+
+    Usage: python benchmark_reclass.py [--size 5000]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rscommons import Logger
+from rscommons.reclass import ReclassTable, reclass_raster
+from rscommons.util import safe_remove_dir
+
+NODATA = -9999
+
+
+def synthetic_tile(path: str, size: int, codes: np.ndarray):
+    """Square int16 vegetation type raster written in tiled blocks with some NoData"""
+
+    rng = np.random.default_rng(1)
+    with rasterio.open(path, 'w', driver='GTiff', width=size, height=size, count=1, dtype='int16', tiled=True,
+                       blockxsize=256, blockysize=256, crs='EPSG:5070', transform=from_origin(0, size * 30.0, 30.0, 30.0), nodata=NODATA) as dst:
+        for _ij, window in dst.block_windows(1):
+            block = rng.choice(codes, (window.height, window.width)).astype(np.int16)
+            block[rng.random(block.shape) < 0.05] = NODATA
+            dst.write(block, 1, window=window)
+
+
+def vectorize_raster(raster_path: str, output_path: str, lookup: dict):
+    """Block by block reclass with a Python callback per cell"""
+
+    def translate(in_val, in_nodata, out_nodata):
+        if in_val == in_nodata:
+            return out_nodata
+        return lookup.get(in_val, -1)
+
+    vector = np.vectorize(translate)
+    with rasterio.open(raster_path) as src:
+        out_meta = src.meta
+        out_meta['dtype'] = 'int16'
+        out_meta['nodata'] = NODATA
+        with rasterio.open(output_path, 'w', **out_meta) as dst:
+            for _ji, window in dst.block_windows(1):
+                data = src.read(1, window=window, masked=True)
+                dst.write(np.int16(vector(data, src.nodata, NODATA)), window=window, indexes=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', help='Raster width and height in cells', type=int, default=5000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    rng = np.random.default_rng(2)
+    codes = np.concatenate([[11, 12, 31], rng.choice(np.arange(7000, 10000), 800, replace=False)])
+    lookups = [{int(code): int(value) for code, value in zip(codes, rng.integers(0, 5, len(codes)))} for _product in range(5)]
+    for lookup in lookups:
+        lookup[NODATA] = 0
+
+    temp_dir = mkdtemp()
+    try:
+        raster = os.path.join(temp_dir, 'evt.tif')
+        synthetic_tile(raster, args.size, codes)
+        print('{:,} x {:,} vegetation tile with {:,} codes'.format(args.size, args.size, len(codes)))
+
+        with rasterio.open(raster) as src:
+            raw_array = src.read(1, masked=True)
+
+        start = time.perf_counter()
+        expected = [np.vectorize(lookup.get)(raw_array) for lookup in lookups]
+        vectorize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tables = [ReclassTable(lookup) for lookup in lookups]
+        actual = [table(raw_array.data) for table in tables]
+        table_time = time.perf_counter() - start
+
+        equal = all(np.array_equal(np.ma.getdata(exp), act) for exp, act in zip(expected, actual))
+        print('In memory, 5 products: np.vectorize {:.2f}s, ReclassTable {:.2f}s, speedup {:.1f}x, identical {}'.format(
+            vectorize_time, table_time, vectorize_time / table_time, equal))
+
+        start = time.perf_counter()
+        vectorize_raster(raster, os.path.join(temp_dir, 'vectorize.tif'), lookups[0])
+        vectorize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reclass_raster(raster, [(os.path.join(temp_dir, 'reclass.tif'), ReclassTable(lookups[0], default=-1, dtype=np.int16), NODATA)])
+        table_time = time.perf_counter() - start
+
+        with rasterio.open(os.path.join(temp_dir, 'vectorize.tif')) as exp, rasterio.open(os.path.join(temp_dir, 'reclass.tif')) as act:
+            equal = np.array_equal(exp.read(1), act.read(1))
+        print('Blockwise raster, 1 product: np.vectorize {:.2f}s, reclass_raster {:.2f}s, speedup {:.1f}x, identical {}'.format(
+            vectorize_time, table_time, vectorize_time / table_time, equal))
+
+        start = time.perf_counter()
+        reclass_raster(raster, [(os.path.join(temp_dir, 'product{}.tif'.format(idx)), ReclassTable(lookup, dtype=np.int16), None) for idx, lookup in enumerate(lookups)])
+        print('Blockwise raster, 5 products from one read: reclass_raster {:.2f}s'.format(time.perf_counter() - start))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+""" Benchmark the network segmentation
+
+    Builds a synthetic dendritic flow line network (a branching tree of
+    random walk reaches with NHD style attributes and GNIS names shared along
+    stems) and segments it with the previous segment_network(), which builds
+    a SegmentFeature with OGR end points for every reach, fetches each reach
+    again by FID and cuts lines by projecting every vertex, and with
+    rscommons.segment_network, which reads the layer as columns, transforms
+    all the vertices in batches, cuts with cumulative lengths and writes in
+    batched transactions. The output layers are compared feature by feature.
+
+    Usage: python benchmark_segment_network.py [--reaches 200000]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+from osgeo import ogr, osr
+from shapely.geometry import LineString
+from rscommons import Logger, GeopackageLayer, get_shp_or_gpkg, VectorBase
+from rscommons.classes.vector_base import get_utm_zone_epsg
+from rscommons.segment_network import segment_network, cut
+from rscommons.util import safe_remove_dir
+
+FIELDS = {
+    'GNIS_NAME': ogr.OFTString,
+    'FCode': ogr.OFTInteger,
+    'TotDASqKm': ogr.OFTReal,
+    'DivDASqKm': ogr.OFTReal,
+    'NHDPlusID': ogr.OFTInteger64
+}
+
+
+def synthetic_network(gpkg: str, reaches: int):
+    """Binary tree of reaches flowing into their parents, each about 2km long"""
+
+    rng = np.random.default_rng(8)
+    ends = np.zeros((reaches, 2))
+    with GeopackageLayer(gpkg, 'flowlines', write=True) as lyr:
+        lyr.create_layer(ogr.wkbLineString, epsg=4326, fields=FIELDS)
+        lyr.ogr_layer.StartTransaction()
+        for reach_id in range(reaches):
+            start = ends[(reach_id - 1) // 2] if reach_id > 0 else np.array([-114.0, 44.0])
+            coords = np.vstack([start, start + np.cumsum(rng.normal(0, 0.001, (int(rng.integers(5, 40)), 2)) + [0.0, 0.0005], axis=0)])
+            ends[reach_id] = coords[-1]
+            lyr.create_feature(LineString(coords[::-1]), {
+                'GNIS_NAME': '' if reach_id % 5 == 0 else 'Creek {}'.format(reach_id % 3000),
+                'FCode': int(rng.choice([46003, 46006, 55800, 42801])),
+                'TotDASqKm': float(rng.uniform(0, 1000)),
+                'DivDASqKm': float(rng.uniform(0, 1000)),
+                'NHDPlusID': 55000000000000 + reach_id
+            })
+        lyr.ogr_layer.CommitTransaction()
+
+
+def legacy_segment_network(inpath: str, outpath: str, interval: float, minimum: float, watershed_id: str):
+    """segment_network() with a SegmentFeature per reach, a list of junctions and vertex projections"""
+
+    with get_shp_or_gpkg(outpath, write=True) as out_lyr, get_shp_or_gpkg(inpath) as in_lyr:
+        srs = in_lyr.spatial_ref
+        extent_centroid = ogr.Geometry(ogr.wkbPolygon).Centroid()
+        transform_ref, transform = VectorBase.get_transform_from_epsg(in_lyr.spatial_ref, get_utm_zone_epsg(extent_centroid.GetX()))
+        transform_back = osr.CoordinateTransformation(transform_ref, srs)
+
+        out_lyr.create_layer_from_ref(in_lyr)
+        out_lyr.create_fields({'ReachID': ogr.OFTInteger, 'WatershedID': ogr.OFTString})
+
+        named_features = {}
+        all_features = []
+        junctions = []
+        for in_feature, _counter, _progbar in in_lyr.iterate_features("Loading Network", attribute_filter='FCode < 42800 OR FCode > 42899'):
+            georef = in_feature.GetGeometryRef()
+            pts = georef.GetPoints()
+            start = ogr.Geometry(ogr.wkbPoint)
+            start.AddPoint(*pts[0])
+            end = ogr.Geometry(ogr.wkbPoint)
+            end.AddPoint(*pts[-1])
+            georef.Transform(transform)
+            s_feat = (in_feature.GetField('GNIS_NAME'), in_feature.GetFID(), georef.Length())
+            junctions.extend([start, end])
+            if not s_feat[0] or len(s_feat[0]) < 1 or interval <= 0:
+                all_features.append(s_feat)
+            else:
+                named_features.setdefault(s_feat[0], []).append(s_feat)
+
+        for _name, features in named_features.items():
+            all_features.extend(features)
+
+        def write(old_feat, name, geom):
+            new_ogr_feat = ogr.Feature(out_lyr.ogr_layer_def)
+            for i in range(0, in_lyr.ogr_layer_def.GetFieldCount()):
+                new_ogr_feat.SetField(out_lyr.ogr_layer_def.GetFieldDefn(i).GetNameRef(), old_feat.GetField(i))
+            new_ogr_feat.SetField("GNIS_NAME", name)
+            new_ogr_feat.SetField("WatershedID", watershed_id)
+            new_ogr_feat.SetGeometry(geom)
+            out_lyr.ogr_layer.CreateFeature(new_ogr_feat)
+
+        out_lyr.ogr_layer.StartTransaction()
+        for name, fid, length_m in all_features:
+            old_feat = in_lyr.ogr_layer.GetFeature(fid)
+            old_geom = old_feat.GetGeometryRef()
+            if length_m < (interval + minimum) or interval <= 0:
+                write(old_feat, name, old_geom)
+            else:
+                new_geom = old_geom.Clone()
+                new_geom.Transform(transform)
+                remaining = LineString(new_geom.GetPoints())
+                while remaining and remaining.length >= (interval + minimum):
+                    part1shply, remaining = cut(remaining, interval)
+                    geo = ogr.CreateGeometryFromWkt(part1shply.wkt)
+                    geo.Transform(transform_back)
+                    write(old_feat, name, geo)
+                if remaining:
+                    geo = ogr.CreateGeometryFromWkt(remaining.wkt)
+                    geo.Transform(transform_back)
+                    write(old_feat, name, geo)
+        out_lyr.ogr_layer.CommitTransaction()
+
+
+def compare(legacy_path: str, new_path: str):
+    """Raise if the features differ in order, attributes or (beyond the last few bits) coordinates"""
+
+    with get_shp_or_gpkg(legacy_path) as legacy_lyr, get_shp_or_gpkg(new_path) as new_lyr:
+        _fids, legacy_wkbs, legacy_columns = legacy_lyr.read_columns()
+        _fids, new_wkbs, new_columns = new_lyr.read_columns()
+
+    if len(legacy_wkbs) != len(new_wkbs):
+        raise Exception('Feature counts differ: {:,} against {:,}'.format(len(legacy_wkbs), len(new_wkbs)))
+
+    for field, values in legacy_columns.items():
+        if values.tolist() != new_columns[field].tolist():
+            raise Exception('Field {} differs'.format(field))
+
+    max_diff = 0.0
+    for legacy_wkb, new_wkb in zip(legacy_wkbs, new_wkbs):
+        legacy_pts = np.array(ogr.CreateGeometryFromWkb(bytes(legacy_wkb)).GetPoints())
+        new_pts = np.array(ogr.CreateGeometryFromWkb(bytes(new_wkb)).GetPoints())
+        if legacy_pts.shape != new_pts.shape:
+            raise Exception('Geometries have different numbers of vertices')
+        max_diff = max(max_diff, float(np.abs(legacy_pts - new_pts).max()))
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reaches', help='Number of reaches', type=int, default=200000)
+    parser.add_argument('--interval', help='Segmentation interval (m)', type=float, default=300.0)
+    parser.add_argument('--minimum', help='Minimum segment length (m)', type=float, default=150.0)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        gpkg = os.path.join(temp_dir, 'network.gpkg')
+        synthetic_network(gpkg, args.reaches)
+        flowlines = os.path.join(gpkg, 'flowlines')
+
+        start = time.perf_counter()
+        legacy_segment_network(flowlines, os.path.join(gpkg, 'legacy'), args.interval, args.minimum, 'HUC')
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        segment_network(flowlines, os.path.join(gpkg, 'segmented'), args.interval, args.minimum, 'HUC', create_layer=True)
+        new_time = time.perf_counter() - start
+
+        max_diff = compare(os.path.join(gpkg, 'legacy'), os.path.join(gpkg, 'segmented'))
+        print('{:,} reaches: previous {:.1f}s, new {:.1f}s, speedup {:.1f}x. Same features and attributes, largest vertex difference {:.2e}'.format(
+            args.reaches, legacy_time, new_time, legacy_time / new_time, max_diff))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+""" Benchmark the tiled Voronoi construction
+
+    Samples both banks of a set of synthetic meandering streams spread across
+    a square and builds the NARVoronoi regions with one scipy Voronoi call and
+    with TiledVoronoi, which builds the diagram one tile (plus a halo) at a
+    time in a process pool and stitches the trusted cells back together.
+    Each build runs in its own process so that the peak memory (maximum
+    resident set size) of each one can be reported. The cells of every point
+    and the region neighbours are compared.
+
+    Usage: python benchmark_tiled_voronoi.py [--points 2000000] [--tile-size 3000] [--workers 4]
+"""
+import time
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from rscommons import Logger
+from rscommons.thiessen.vor import NARVoronoi
+
+STREAM_SPACING = 400.0
+CHANNEL_WIDTH = 16.0
+
+
+def bank_points(count: int) -> np.ndarray:
+    """Points along both banks of parallel meandering streams spread over a square with about 10m between points"""
+
+    rng = np.random.default_rng(6)
+    side = np.sqrt(count) * 10.0
+    streams = max(int(side / STREAM_SPACING), 1)
+    per_bank = count // (2 * streams)
+    banks = []
+    for stream in range(streams):
+        x = np.sort(rng.uniform(0, side, per_bank))
+        centre = stream * STREAM_SPACING + 100.0 * np.sin(x / 300.0 + stream)
+        for offset in [CHANNEL_WIDTH / 2, -CHANNEL_WIDTH / 2]:
+            banks.append(np.column_stack([x, centre + offset + rng.normal(0, 1.0, per_bank)]))
+    return np.vstack(banks) + [500000.0, 4000000.0]
+
+
+def build(args: tuple) -> tuple:
+    """Build the diagram in this process and return the cells, neighbours, time and peak memory"""
+
+    count, tile_size, workers = args
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    points = bank_points(count)
+    start = time.perf_counter()
+    vor = NARVoronoi(points, tile_size=tile_size, workers=workers)
+    vor.calculate_neighbours()
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    worker_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    # Every point's cell as its vertex coordinates sorted and its neighbours as point indexes
+    region_point = np.full(len(vor.regions), -1, dtype=np.int64)
+    region_point[vor.point_region] = np.arange(len(points))
+    unbounded = np.zeros(len(points), dtype=bool)
+    cells = []
+    neighbours = []
+    for pt_idx, region_id in enumerate(vor.point_region.tolist()):
+        region = vor.regions[region_id]
+        unbounded[pt_idx] = -1 in region
+        cells.append(vor.vertices[sorted(idx for idx in region if idx >= 0)].reshape(-1, 2))
+        adjacent = vor.region_neighbour.indices[vor.region_neighbour.indptr[region_id]:vor.region_neighbour.indptr[region_id + 1]]
+        neighbours.append(np.sort(region_point[adjacent]))
+    cells = [cell[np.lexsort((cell[:, 1], cell[:, 0]))] for cell in cells]
+
+    return len(points), elapsed, peak, worker_peak, unbounded, [len(cell) for cell in cells], np.concatenate(cells), [len(adj) for adj in neighbours], np.concatenate(neighbours)
+
+
+def compare(whole: tuple, tiled: tuple) -> tuple:
+    """Count the points whose cells or neighbours differ and the largest vertex difference of the others"""
+
+    cell_ends = [np.cumsum(result[5]) for result in (whole, tiled)]
+    neighbour_ends = [np.cumsum(result[7]) for result in (whole, tiled)]
+    different = 0
+    max_diff = 0.0
+    for pt_idx in range(whole[0]):
+        cells = [result[6][ends[pt_idx] - result[5][pt_idx]:ends[pt_idx]] for result, ends in zip((whole, tiled), cell_ends)]
+        adjacent = [result[8][ends[pt_idx] - result[7][pt_idx]:ends[pt_idx]] for result, ends in zip((whole, tiled), neighbour_ends)]
+        if whole[4][pt_idx] != tiled[4][pt_idx] or cells[0].shape != cells[1].shape or not np.array_equal(adjacent[0], adjacent[1]):
+            different += 1
+        elif len(cells[0]) > 0:
+            max_diff = max(max_diff, float(np.abs(cells[0] - cells[1]).max()))
+    return different, max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', help='Number of Voronoi points', type=int, default=2000000)
+    parser.add_argument('--tile-size', help='Tile size (m)', type=float, default=3000.0)
+    parser.add_argument('--workers', help='Number of worker processes for the tiles', type=int, default=4)
+    args = parser.parse_args()
+
+    # A fresh process for each build so one does not inherit the memory of the other
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        whole = executor.submit(build, (args.points, None, 1)).result()
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        tiled = executor.submit(build, (args.points, args.tile_size, args.workers)).result()
+
+    different, max_diff = compare(whole, tiled)
+    print('{:,} points. One Voronoi: {:.1f}s, peak {:,.0f} MB'.format(whole[0], whole[1], whole[2] / 1024))
+    print('Tiles of {:,.0f}m with {} workers: {:.1f}s, peak {:,.0f} MB (largest worker {:,.0f} MB)'.format(
+        args.tile_size, args.workers, tiled[1], tiled[2] / 1024, tiled[3] / 1024))
+    print('{:,} points with a different cell or neighbours. Largest vertex difference for the rest {:.2e}m'.format(different, max_diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+""" Benchmark the Voronoi region adjacency
+
+    Samples the two banks of a synthetic meandering channel and builds the
+    NARVoronoi regions. For the smaller sizes the previous
+    calculate_neighbours(), which compares the vertex lists of every pair of
+    regions, is timed and its neighbours compared with the CSR adjacency built
+    from the ridge points. The ridge point adjacency and collectCenterLines()
+    are then timed on every size, up to millions of points.
+
+    Usage: python benchmark_voronoi.py [--points 2000 10000 100000 1000000 2000000] [--previous-max 2000]
+"""
+import time
+import argparse
+import numpy as np
+from shapely.geometry import Point, box
+from rscommons import Logger
+from rscommons.thiessen.vor import NARVoronoi
+from rscommons.thiessen.shapes import RiverPoint
+
+CHANNEL_WIDTH = 30.0
+
+
+def bank_points(count: int) -> list:
+    """Points along the left (side 1) and right (side -1) banks of a meandering channel"""
+
+    rng = np.random.default_rng(4)
+    x = np.sort(rng.uniform(0, count * 2.0, count // 2))
+    centre = 200.0 * np.sin(x / 500.0)
+    points = []
+    for offset, side in [(CHANNEL_WIDTH / 2, 1), (-CHANNEL_WIDTH / 2, -1)]:
+        y = centre + offset + rng.normal(0, 1.0, len(x))
+        points.extend(RiverPoint(Point(px, py), side=side) for px, py in zip(x, y))
+    return points
+
+
+def previous_neighbours(regions: list) -> list:
+    """calculate_neighbours() comparing the vertices of every pair of regions"""
+
+    region_neighbour = []
+    for idx, reg in enumerate(regions):
+        adj = []
+        for idy, reg2 in enumerate(regions):
+            if idx != idy and len(set(reg) - (set(reg) - set(reg2))) >= 2:
+                adj.append(idy)
+        region_neighbour.append(adj)
+    return region_neighbour
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', help='Numbers of Voronoi points', type=int, nargs='+', default=[2000, 10000, 100000, 1000000, 2000000])
+    parser.add_argument('--previous-max', help='Largest number of points to run the previous pairwise adjacency on', type=int, default=2000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    for count in args.points:
+        points = bank_points(count)
+        start = time.perf_counter()
+        vor = NARVoronoi(points)
+        voronoi_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vor.calculate_neighbours()
+        adjacency_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        centerline = vor.collectCenterLines(box(-1, -300, count * 2.0 + 1, 300))
+        centerline_time = time.perf_counter() - start
+
+        line = '{:,} points: Voronoi {:.2f}s, ridge adjacency {:.2f}s, centerline {:.2f}s ({} of {:,.0f}m)'.format(
+            len(points), voronoi_time, adjacency_time, centerline_time, centerline.geom_type, centerline.length)
+
+        if count <= args.previous_max:
+            start = time.perf_counter()
+            previous = previous_neighbours(vor.regions)
+            previous_time = time.perf_counter() - start
+
+            adjacency = vor.region_neighbour
+            different = [idx for idx, adj in enumerate(previous) if adj != adjacency.indices[adjacency.indptr[idx]:adjacency.indptr[idx + 1]].tolist()]
+            line += ', pairwise adjacency {:.2f}s ({:,} regions with different neighbours)'.format(previous_time, len(different))
+
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
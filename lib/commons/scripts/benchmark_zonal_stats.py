@@ -0,0 +1,83 @@
+""" Benchmark the single pass zonal statistics engine against per-polygon masking
+
+    Builds a synthetic float raster and a set of overlapping reach buffers
+    then times rscommons.zonal_stats.zonal_statistics() and the original
+    rasterio.mask loop (raster_buffer_stats.masked_buffer_stats()).
+
+    Usage: python benchmark_zonal_stats.py [--polygons 10000] [--size 8000]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import LineString
+from rscommons import Logger
+from rscommons.zonal_stats import zonal_statistics
+from rscommons.raster_buffer_stats import masked_buffer_stats
+from rscommons.util import safe_remove_dir
+
+
+def synthetic_raster(path: str, size: int, cell_size: float):
+    """Square float32 raster written in tiled blocks"""
+
+    rng = np.random.default_rng(1)
+    with rasterio.open(path, 'w', driver='GTiff', width=size, height=size, count=1, dtype='float32', tiled=True,
+                       blockxsize=256, blockysize=256, crs='EPSG:26912', transform=from_origin(0, size * cell_size, cell_size, cell_size), nodata=-9999) as dst:
+        for _ij, window in dst.block_windows(1):
+            dst.write(rng.uniform(0, 3000, (window.height, window.width)).astype(np.float32), 1, window=window)
+
+
+def synthetic_buffers(count: int, extent: float, buffer_dist: float) -> dict:
+    """Buffers of short random walk reaches. Consecutive reaches share end points so buffers overlap"""
+
+    rng = np.random.default_rng(2)
+    polygons = {}
+    x_coord, y_coord = rng.uniform(0, extent, 2)
+    for reach_id in range(count):
+        if reach_id % 50 == 0:
+            x_coord, y_coord = rng.uniform(0, extent, 2)
+        new_x = np.clip(x_coord + rng.normal(0, 150), 0, extent)
+        new_y = np.clip(y_coord + rng.normal(0, 150), 0, extent)
+        polygons[reach_id] = LineString([(x_coord, y_coord), (new_x, new_y)]).buffer(buffer_dist)
+        x_coord, y_coord = new_x, new_y
+    return polygons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polygons', help='Number of buffer polygons', type=int, default=10000)
+    parser.add_argument('--size', help='Raster width and height in cells', type=int, default=8000)
+    parser.add_argument('--buffer', help='Buffer distance in metres', type=float, default=100)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    cell_size = 10.0
+    temp_dir = mkdtemp()
+    try:
+        raster = os.path.join(temp_dir, 'values.tif')
+        synthetic_raster(raster, args.size, cell_size)
+        polygons = synthetic_buffers(args.polygons, args.size * cell_size, args.buffer)
+
+        start = time.perf_counter()
+        expected = masked_buffer_stats(polygons, raster)
+        masked_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = zonal_statistics(polygons, raster)
+        zonal_time = time.perf_counter() - start
+
+        max_diff = max(abs(actual[key]['Mean'] - expected[key]['Mean']) for key in expected if expected[key]['Mean'] is not None)
+        print('{:,} polygons on a {:,} x {:,} raster'.format(args.polygons, args.size, args.size))
+        print('rasterio.mask loop: {:.2f}s, zonal_statistics: {:.2f}s, speedup {:.1f}x, max mean difference {:.2e}'.format(
+            masked_time, zonal_time, masked_time / zonal_time, max_diff))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
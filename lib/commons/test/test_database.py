@@ -0,0 +1,78 @@
+""" Testing for the pooled database connections
+
+"""
+import os
+import unittest
+from tempfile import mkdtemp
+from rscommons.database import SQLiteCon, get_connection, close_connections, transaction, batch_write, write_db_attributes
+from rscommons.util import safe_remove_dir
+
+
+class DatabaseTest(unittest.TestCase):
+    """Connection pool, transactions and batched writes
+    """
+
+    def setUp(self):
+        super(DatabaseTest, self).setUp()
+        self.temp_dir = mkdtemp()
+        self.database = os.path.join(self.temp_dir, 'test.sqlite')
+        conn = get_connection(self.database)
+        conn.execute('CREATE TABLE ReachAttributes (ReachID INTEGER PRIMARY KEY NOT NULL, iGeo_Len REAL CHECK (iGeo_Len > 0), iHyd_QLow REAL)')
+        conn.commit()
+
+    def tearDown(self):
+        close_connections()
+        safe_remove_dir(self.temp_dir)
+
+    def test_pool(self):
+        conn = get_connection(self.database)
+        self.assertIs(get_connection(self.database), conn)
+        # NORMAL
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()[0], 1)
+
+        # A replaced file gets a new connection
+        close_connections(self.database)
+        os.remove(self.database)
+        replaced = get_connection(self.database)
+        self.assertEqual(replaced.execute("SELECT count(*) FROM sqlite_master WHERE name = 'ReachAttributes'").fetchone()[0], 0)
+
+    def test_batch_write(self):
+        rows = [[reach_id, float(reach_id)] for reach_id in range(25)]
+        errs = batch_write(self.database, 'INSERT INTO ReachAttributes (ReachID, iGeo_Len) VALUES (?, ?)', rows, batch_size=10)
+        # ReachID 0 breaks the length constraint
+        self.assertEqual(errs, 1)
+        self.assertFalse(get_connection(self.database).in_transaction)
+        self.assertEqual(get_connection(self.database).execute('SELECT count(*) FROM ReachAttributes').fetchone()[0], 24)
+
+        write_db_attributes(self.database, {reach_id: {'iHyd_QLow': reach_id * 2.0} for reach_id in range(1, 11)}, ['iHyd_QLow'], summarize=False)
+        with SQLiteCon(self.database) as database:
+            database.curs.execute('SELECT count(iHyd_QLow) AS Total, max(iHyd_QLow) AS Maximum FROM ReachAttributes')
+            self.assertEqual(database.curs.fetchone(), {'Total': 10, 'Maximum': 20.0})
+
+        # Without nulling first only the reaches that are given change
+        write_db_attributes(self.database, {1: {'iHyd_QLow': 100.0}, 2: {}}, ['iHyd_QLow'], set_null_first=False, summarize=False)
+        values = dict(get_connection(self.database).execute('SELECT ReachID, iHyd_QLow FROM ReachAttributes WHERE ReachID <= 4').fetchall())
+        self.assertEqual(values, {1: 100.0, 2: None, 3: 6.0, 4: 8.0})
+
+    def test_transactions(self):
+        conn = get_connection(self.database)
+        with self.assertRaises(ValueError):
+            with transaction(conn):
+                conn.execute('INSERT INTO ReachAttributes (ReachID, iGeo_Len) VALUES (1, 1.0)')
+                raise ValueError('rolled back')
+        self.assertEqual(conn.execute('SELECT count(*) FROM ReachAttributes').fetchone()[0], 0)
+
+        # Uncommitted changes are discarded when the outermost SQLiteCon exits
+        with SQLiteCon(self.database) as outer:
+            outer.curs.execute('INSERT INTO ReachAttributes (ReachID, iGeo_Len) VALUES (1, 1.0)')
+            with SQLiteCon(self.database) as inner:
+                with transaction(inner.conn):
+                    inner.curs.execute('INSERT INTO ReachAttributes (ReachID, iGeo_Len) VALUES (2, 1.0)')
+            self.assertTrue(outer.conn.in_transaction)
+        self.assertEqual(conn.execute('SELECT count(*) FROM ReachAttributes').fetchone()[0], 0)
+        self.assertIsNone(conn.row_factory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+""" Testing for the tree reduction union
+
+"""
+import unittest
+import numpy as np
+from shapely.ops import unary_union
+from shapely.geometry import Point, LineString
+from rscommons.geometry_union import tree_union, spatial_order
+
+
+class GeometryUnionTest(unittest.TestCase):
+    """Compare the tree reduction with a single unary_union
+    """
+
+    def setUp(self):
+        super(GeometryUnionTest, self).setUp()
+        rng = np.random.default_rng(9)
+        self.polygons = [Point(x, y).buffer(r, 8) for (x, y), r in zip(rng.uniform(0, 1000, (1500, 2)), rng.uniform(5, 40, 1500))]
+        starts = rng.uniform(0, 1000, (200, 2))
+        self.lines = [LineString([start, start + rng.normal(0, 30, 2), start + rng.normal(0, 60, 2)]) for start in starts]
+
+    def test_spatial_order(self):
+        order = spatial_order(self.polygons + [None])
+        self.assertEqual(sorted(order.tolist()), list(range(len(self.polygons) + 1)))
+        self.assertEqual(order[-1], len(self.polygons))
+
+    def test_polygons(self):
+        expected = unary_union(self.polygons)
+        for workers, group_size in [(1, 64), (2, 100), (1, 5000)]:
+            actual = tree_union(self.polygons, workers, group_size)
+            self.assertAlmostEqual(actual.area, expected.area, places=6)
+            self.assertAlmostEqual(actual.symmetric_difference(expected).area, 0.0, places=6)
+
+    def test_lines(self):
+        expected = unary_union(self.lines)
+        actual = tree_union(self.lines, group_size=16)
+        self.assertAlmostEqual(actual.length, expected.length, places=6)
+        self.assertAlmostEqual(actual.symmetric_difference(expected).length, 0.0, places=6)
+
+    def test_empty(self):
+        self.assertIsNone(tree_union([]))
+        self.assertTrue(tree_union([self.polygons[0]]).equals(self.polygons[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
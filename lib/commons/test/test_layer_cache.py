@@ -0,0 +1,82 @@
+""" Testing for the process layer cache
+
+"""
+import os
+import time
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+from shapely.geometry import Point
+from rscommons.layer_cache import LayerCache, LayerColumns, dataset_stamp
+from rscommons.util import safe_remove_dir
+
+
+def _layer(count: int, offset: int = 0) -> LayerColumns:
+    geoms = [Point(i, i).buffer(1) for i in range(count)]
+    columns = {'ReachID': [offset + i for i in range(count)], 'Name': ['reach {}'.format(i) for i in range(count)]}
+    return LayerColumns(list(range(count)), geoms, columns, {'ReachID': np.int64}, geom_bytes=1000 * count)
+
+
+class LayerCacheTest(unittest.TestCase):
+    """LRU byte budget and invalidation of the cached layers
+    """
+
+    def test_columns(self):
+        layer = _layer(5, offset=100)
+        self.assertEqual(len(layer), 5)
+        self.assertEqual(layer.columns['ReachID'].dtype, np.int64)
+        self.assertEqual(layer.columns['Name'].dtype, object)
+        self.assertEqual(sorted(layer.geometry_dict('ReachID')), list(range(100, 105)))
+
+        with_nulls = LayerColumns([1, 2], [None, Point(0, 0)], {'Value': [None, 2.5]}, {'Value': np.float64})
+        self.assertEqual(with_nulls.columns['Value'].dtype, object)
+        self.assertEqual(list(with_nulls.geometry_dict()), [2])
+
+    def test_lru_budget(self):
+        size = _layer(10).nbytes
+        cache = LayerCache(budget=int(size * 2.5))
+        for name in ['a', 'b']:
+            cache.put((name,), (1,), _layer(10))
+        self.assertIsNotNone(cache.get(('a',), (1,)))
+
+        # 'b' is now the least recently used and makes room for 'c'
+        cache.put(('c',), (1,), _layer(10))
+        self.assertIsNone(cache.get(('b',), (1,)))
+        self.assertIsNotNone(cache.get(('a',), (1,)))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * size)
+
+        # Layers larger than the budget are never stored
+        cache.put(('big',), (1,), _layer(40))
+        self.assertIsNone(cache.get(('big',), (1,)))
+        self.assertEqual(cache.nbytes, 2 * size)
+
+    def test_invalidation(self):
+        cache = LayerCache()
+        cache.put(('a',), (1,), _layer(3))
+        self.assertIsNone(cache.get(('a',), (2,)))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_dataset_stamp(self):
+        temp_dir = mkdtemp()
+        try:
+            shp = os.path.join(temp_dir, 'layer.shp')
+            dbf = os.path.join(temp_dir, 'layer.dbf')
+            for path in [shp, dbf]:
+                with open(path, 'w') as file:
+                    file.write('data')
+            before = dataset_stamp(shp)
+            self.assertEqual(len(before), 2)
+
+            # Only the attribute table changes
+            time.sleep(0.01)
+            with open(dbf, 'a') as file:
+                file.write('more')
+            self.assertNotEqual(dataset_stamp(shp), before)
+        finally:
+            safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
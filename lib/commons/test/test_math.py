@@ -2,7 +2,8 @@
 
 """
 import unittest
-from rscommons.math import safe_eval, EquationError
+import numpy as np
+from rscommons.math import safe_eval, compile_equation, EquationError
 
 
 class MathTest(unittest.TestCase):
@@ -37,3 +38,60 @@ class MathTest(unittest.TestCase):
         with self.assertRaises(EquationError) as ctx:
             safe_eval("0.177 * (a ** 0.397) * (p ** 0.453)", {"a": 1})
         self.assertTrue("Equation produced non-numeric result" in ctx.exception.args[0])
+
+    def test_compiled_equation(self):
+        """[summary]
+        """
+        equation = compile_equation("0.177 * (a ** 0.397) * (p ** 0.453)")
+        self.assertEqual(equation.variables, ['a', 'p'])
+        self.assertIs(compile_equation("0.177 * (a ** 0.397) * (p ** 0.453)"), equation)
+
+        areas = np.array([1.0, 12.5, 830.2])
+        results = equation.evaluate({'a': areas, 'p': 45.2})
+        for area, result in zip(areas, results):
+            self.assertAlmostEqual(result, safe_eval("0.177 * (a ** 0.397) * (p ** 0.453)", {"a": area, "p": 45.2}), 12)
+
+        self.assertEqual(compile_equation("2 * sqrt(x) - -1").evaluate({'x': [4.0, 9.0]}).tolist(), [5.0, 7.0])
+        self.assertEqual(compile_equation("1 + 1").evaluate({}, count=3).tolist(), [2.0, 2.0, 2.0])
+
+        # Anything outside the whitelist is rejected before evaluation
+        for bad in ["__import__('os')", "a.real", "a[0]", "open('file')", "lambda: 1", "'text'", "exp"]:
+            with self.assertRaises(EquationError):
+                compile_equation(bad)
+
+        with self.assertRaises(EquationError) as ctx:
+            compile_equation("1+((1 /0")
+        self.assertTrue("Error parsing equation" in ctx.exception.args[0])
+
+        with self.assertRaises(EquationError) as ctx:
+            equation.evaluate({'a': areas})
+        self.assertTrue("missing values for p" in ctx.exception.args[0])
+
+        with self.assertRaises(EquationError) as ctx:
+            compile_equation("1 / a").evaluate({'a': [1.0, 0.0]})
+        self.assertTrue("infinite or non-numeric result for 1 of 2" in ctx.exception.args[0])
+
+    def test_compiled_sympy_names(self):
+        """The SymPy constants and functions that safe_eval() equations use give the same results
+        """
+        values = np.array([0.3, 1.0, 12.5, 83.2])
+        for eval_fn in ["pi*a", "E**a", "ln(a)", "Max(a,1)", "Min(a, 2, b)", "log(a,10)", "log(a)", "Abs(1 - a)", "2*pi*sqrt(a) + E"]:
+            results = compile_equation(eval_fn).evaluate({'a': values, 'b': 5.0})
+            for value, result in zip(values, results):
+                self.assertTrue(np.isclose(result, safe_eval(eval_fn, {'a': value, 'b': 5.0}), rtol=1e-12, atol=0), eval_fn)
+
+        # A parameter named like a constant replaces it
+        equation = compile_equation("E * 2")
+        self.assertEqual(equation.variables, [])
+        self.assertEqual(equation.evaluate({'E': 3.0}).tolist(), 6.0)
+        self.assertAlmostEqual(float(equation.evaluate({})), safe_eval("E * 2"), 12)
+
+        # The argument counts are checked
+        for bad in ["log(a, 10, 2)", "ln(a, 2)", "Max()", "sqrt()"]:
+            with self.assertRaises(EquationError):
+                compile_equation(bad)
+
+        # The rest of SymPy is not supported
+        for unsupported in ["sin(a)", "floor(a)"]:
+            with self.assertRaises(EquationError):
+                compile_equation(unsupported)
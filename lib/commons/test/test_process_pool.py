@@ -0,0 +1,32 @@
+""" Testing for the ordered process pool
+
+"""
+import unittest
+from rscommons.process_pool import ordered_map
+
+_offset = {}
+
+
+def _init(offset):
+    _offset['value'] = offset
+
+
+def _add(value):
+    return value + _offset['value']
+
+
+class ProcessPoolTest(unittest.TestCase):
+    """Every task comes back once and in order whatever the number of workers
+    """
+
+    def test_ordered_map(self):
+        for workers in [1, 2, 3]:
+            results = list(ordered_map(_add, iter(range(25)), workers, initializer=_init, initargs=(100,)))
+            self.assertEqual(results, list(range(100, 125)))
+
+    def test_empty(self):
+        self.assertEqual(list(ordered_map(_add, [], 2, initializer=_init, initargs=(1,))), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
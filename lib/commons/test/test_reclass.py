@@ -0,0 +1,75 @@
+""" Testing for the lookup table reclassification
+
+"""
+import os
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rscommons.reclass import ReclassTable, reclass_raster
+from rscommons.util import safe_remove_dir
+
+
+class ReclassTest(unittest.TestCase):
+    """Compare lookup table reclassification with np.vectorize(dict.get)
+    """
+
+    def setUp(self):
+        super(ReclassTest, self).setUp()
+        self.outdir = mkdtemp()
+        rng = np.random.default_rng(8)
+        self.codes = [11, 12, 31, 7050, 7051, 7292, 9016, 9327]
+        self.mapping = {code: int(rng.integers(0, 5)) for code in self.codes}
+        self.data = rng.choice(self.codes + [-9999, 13], (120, 90)).astype(np.int16)
+
+    def tearDown(self):
+        super(ReclassTest, self).tearDown()
+        safe_remove_dir(self.outdir)
+
+    def test_dense_and_sparse(self):
+        expected = np.vectorize(lambda code: self.mapping.get(code, -1))(self.data)
+        for dense_limit in [1 << 20, 10]:
+            table = ReclassTable(self.mapping, default=-1, dense_limit=dense_limit)
+            np.testing.assert_array_equal(table(self.data), expected)
+            np.testing.assert_array_equal(table.missing(self.data), [-9999, 13])
+
+    def test_float_values(self):
+        mapping = {11: 0.66, 12: 0.33, 31: 1.0}
+        table = ReclassTable(mapping)
+        self.assertEqual(table.dtype, np.float64)
+        np.testing.assert_array_equal(table(np.array([11, 12, 31, 7050])), [0.66, 0.33, 1.0, 0.0])
+
+    def test_empty_table(self):
+        table = ReclassTable({}, default=3)
+        np.testing.assert_array_equal(table(self.data), np.full(self.data.shape, 3))
+        self.assertEqual(len(table.missing(self.data)), len(np.unique(self.data)))
+
+    def test_reclass_raster(self):
+        raster = os.path.join(self.outdir, 'codes.tif')
+        with rasterio.open(raster, 'w', driver='GTiff', width=90, height=120, count=1, dtype='int16', tiled=True, blockxsize=32, blockysize=32,
+                           crs='EPSG:26912', transform=from_origin(500000, 4000000, 30, 30), nodata=-9999) as dst:
+            dst.write(self.data, 1)
+
+        suitability = os.path.join(self.outdir, 'suitability.tif')
+        doubled = os.path.join(self.outdir, 'doubled.tif')
+        missing = reclass_raster(raster, [
+            (suitability, ReclassTable(self.mapping, default=-1, dtype=np.int16), -9999),
+            (doubled, ReclassTable({code: 2 * code for code in self.codes + [-9999]}, dtype=np.int32), None)
+        ], compress='deflate')
+
+        np.testing.assert_array_equal(missing[suitability], [13])
+        np.testing.assert_array_equal(missing[doubled], [13])
+
+        with rasterio.open(suitability) as src:
+            self.assertEqual(src.nodata, -9999)
+            expected = np.vectorize(lambda code: -9999 if code == -9999 else self.mapping.get(code, -1))(self.data)
+            np.testing.assert_array_equal(src.read(1), expected)
+
+        with rasterio.open(doubled) as src:
+            self.assertIsNone(src.nodata)
+            np.testing.assert_array_equal(src.read(1), np.where(self.data == 13, 0, 2 * self.data.astype(np.int32)))
+
+
+if __name__ == '__main__':
+    unittest.main()
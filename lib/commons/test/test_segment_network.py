@@ -0,0 +1,52 @@
+""" Testing for the network segmentation
+
+"""
+import unittest
+import numpy as np
+from shapely.geometry import LineString
+from rscommons.segment_network import segment_line, cut, line_lengths
+
+
+def _cut_repeatedly(coords, interval, minimum):
+    """Parts from calling cut() on the remaining line until it is too short"""
+    parts = []
+    remaining = LineString(coords)
+    while remaining and remaining.length >= (interval + minimum):
+        part, remaining = cut(remaining, interval)
+        parts.append(np.asarray(part.coords))
+    return parts + [np.asarray(remaining.coords)]
+
+
+class SegmentNetworkTest(unittest.TestCase):
+    """Segmenting lines with cumulative lengths and the end point node index
+    """
+
+    def test_segment_line(self):
+        rng = np.random.default_rng(2)
+        for test in range(200):
+            dims = 2 if test % 2 == 0 else 3
+            coords = np.cumsum(rng.normal(0, rng.uniform(1, 200), (int(rng.integers(2, 60)), dims)), axis=0) + 500000.0
+            if test % 5 == 0:
+                # Whole coordinates put cuts exactly on vertices and make some lines touch themselves
+                coords = np.round(coords)
+            interval, minimum = float(rng.choice([37.0, 100.0, 300.0])), float(rng.choice([10.0, 50.0, 150.0]))
+
+            self.assertEqual(line_lengths(coords)[-1], LineString(coords).length)
+            if line_lengths(coords)[-1] < interval + minimum:
+                continue
+
+            expected = _cut_repeatedly(coords, interval, minimum)
+            parts = segment_line(coords, interval, minimum)
+            self.assertEqual(len(parts), len(expected))
+            for part, expected_part in zip(parts, expected):
+                self.assertTrue(np.array_equal(part, expected_part))
+
+        # Rings keep the special handling in cut()
+        ring = np.array([[0.0, 0.0], [1000.0, 0.0], [1000.0, 1000.0], [0.0, 1000.0], [0.0, 0.0]])
+        parts = segment_line(ring, 300.0, 100.0)
+        self.assertEqual(len(parts), len(_cut_repeatedly(ring, 300.0, 100.0)))
+        self.assertEqual(parts[0].tolist(), [[0.0, 0.0], [300.0, 0.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
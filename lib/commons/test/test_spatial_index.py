@@ -0,0 +1,50 @@
+""" Testing for the spatial index helpers
+
+"""
+import unittest
+import numpy as np
+from shapely.geometry import Polygon, box
+from rscommons.spatial_index import GeometryIndex, connected_components
+
+
+def brute_force_components(geoms) -> list:
+    """Components by repeatedly growing groups until nothing changes"""
+
+    labels = list(range(len(geoms)))
+    changed = True
+    while changed:
+        changed = False
+        for idx, geom in enumerate(geoms):
+            for other, other_geom in enumerate(geoms):
+                if labels[other] != labels[idx] and not geom.is_empty and geom.intersects(other_geom):
+                    low = min(labels[idx], labels[other])
+                    labels = [low if label in (labels[idx], labels[other]) else label for label in labels]
+                    changed = True
+    return labels
+
+
+class SpatialIndexTest(unittest.TestCase):
+    """Compare the indexed queries and components with brute force answers
+    """
+
+    def test_intersecting(self):
+        rng = np.random.default_rng(3)
+        geoms = [box(x, y, x + 5, y + 5) for x, y in rng.uniform(0, 100, (200, 2))]
+        index = GeometryIndex(geoms)
+        query = box(20, 20, 40, 35)
+        self.assertEqual(index.intersecting(query), [idx for idx, geom in enumerate(geoms) if geom.intersects(query)])
+
+    def test_connected_components(self):
+        rng = np.random.default_rng(4)
+        geoms = [box(x, y, x + 4, y + 4) for x, y in rng.uniform(0, 100, (300, 2))]
+        # Shapes that only share an edge or a corner are connected
+        geoms += [box(200, 0, 210, 10), box(210, 0, 220, 10), box(220, 10, 230, 20), Polygon()]
+        self.assertEqual(connected_components(geoms), brute_force_components(geoms))
+
+        labels = connected_components(geoms)
+        self.assertEqual(labels[-4], labels[-2])
+        self.assertEqual(labels[-1], len(geoms) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
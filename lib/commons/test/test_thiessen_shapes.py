@@ -0,0 +1,76 @@
+""" Testing for the Thiessen centerline points and densification
+
+"""
+import unittest
+import numpy as np
+from shapely.geometry import LineString, Polygon
+from rscommons.thiessen.shapes import centerline_distances, interpolate_lines, line_length, densifyShape
+from rscommons.thiessen.vor import NARVoronoi
+
+
+def _random_lines(rng, count):
+    return [np.cumsum(rng.normal(0, rng.uniform(1, 100), (int(rng.integers(2, 40)), 2)), axis=0) + [400000.0, 5000000.0] for _i in range(count)]
+
+
+class ThiessenShapesTest(unittest.TestCase):
+    """Bulk interpolation along lines compared with Shapely
+    """
+
+    def test_interpolate_lines(self):
+        rng = np.random.default_rng(3)
+        lines = _random_lines(rng, 50)
+        line_ids = rng.integers(0, len(lines), 2000)
+        lengths = np.array([line_length(coords) for coords in lines])
+        distances = rng.uniform(-1.2, 1.2, len(line_ids)) * lengths[line_ids]
+        # Distances right on the vertices and the ends
+        distances[:50] = 0.0
+        distances[50:100] = lengths[line_ids[50:100]]
+
+        points = interpolate_lines(lines, line_ids, distances)
+        for point, line_id, dist in zip(points, line_ids, distances):
+            self.assertEqual(tuple(point), LineString(lines[line_id]).interpolate(dist).coords[0])
+
+        self.assertEqual(interpolate_lines(lines, np.array([], dtype=np.int64), np.array([])).shape, (0, 2))
+
+    def test_centerline_distances(self):
+        rng = np.random.default_rng(4)
+        lines = _random_lines(rng, 20)
+        distance = 25.0
+        line_ids, distances = centerline_distances([line_length(coords) for coords in lines], distance)
+        points = interpolate_lines(lines, line_ids, distances)
+
+        for line_id, coords in enumerate(lines):
+            line = LineString(coords)
+            self.assertEqual(line_length(coords), line.length)
+
+            # Points the way they were generated one at a time
+            expected = [line.interpolate(distance), line.interpolate(0.5, True), line.interpolate(-distance)]
+            interval = distance / line.length
+            current = interval
+            while current < 1.0:
+                expected.append(line.interpolate(current, True))
+                current = current + interval
+            if line.project(line.interpolate(0.25, True)) > distance:
+                expected.append(line.interpolate(0.25, True))
+                expected.append(line.interpolate(-0.25, True))
+
+            self.assertEqual([tuple(pt) for pt in points[line_ids == line_id]], [pt.coords[0] for pt in expected])
+
+    def test_densify_and_voronoi(self):
+        shape = Polygon([(0, 0), (100, 0), (100, 35), (0, 40)], [[(20, 10), (30, 10), (30, 20), (20, 20)]])
+        dense = densifyShape(shape, 3.0)
+        self.assertAlmostEqual(dense.area, shape.area, 6)
+        exterior = np.asarray(dense.exterior.coords)
+        self.assertLessEqual(np.max(np.hypot(*np.diff(exterior, axis=0).T)), 3.0 + 1e-9)
+
+        coords = np.asarray(dense.exterior.coords)[:-1]
+        vor = NARVoronoi(coords)
+        self.assertEqual(len(vor.point_region), len(coords))
+        self.assertAlmostEqual(vor.centroid[0], coords[:, 0].mean(), 9)
+
+        dissolved = vor.dissolve_by_ids(np.arange(len(coords)) % 3)
+        self.assertEqual(sorted(dissolved.keys()), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
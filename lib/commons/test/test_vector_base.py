@@ -3,7 +3,11 @@
 """
 import unittest
 import os
-from shapely.geometry import LineString
+from tempfile import mkdtemp
+from unittest.mock import patch
+from osgeo import ogr
+from shapely import wkb as shapely_wkb
+from shapely.geometry import LineString, Point, box
 from rscommons import Logger, initGDALOGRErrors, GeopackageLayer, ShapefileLayer
 from rscommons.classes.vector_base import VectorBase, VectorBaseException
 from rscommons.util import safe_remove_dir
@@ -99,3 +103,122 @@ class VectorBaseTest(unittest.TestCase):
 
         self.assertTrue(ogr_obj.Length() > 0)
         self.assertEqual(ogr_obj.Length(), linestring.length)
+
+
+# Geometry, Name, Count and Value of the features in the columns test layer
+COLUMN_FEATURES = [
+    (Point(0, 0), 'first', 1, 0.5),
+    (Point(1, 1), None, 2, None),
+    (Point(2, 2), 'third', None, 2.5),
+    (Point(10, 10), 'fourth', 4, 4.5),
+]
+
+
+class VectorColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        super(VectorColumnsTest, self).setUp()
+        self.outdir = mkdtemp()
+        self.layer_path = os.path.join(self.outdir, 'columns.gpkg', 'points')
+
+        with GeopackageLayer(self.layer_path, write=True) as lyr:
+            lyr.create_layer(ogr.wkbPoint, epsg=4326, fields={'Name': ogr.OFTString, 'Count': ogr.OFTInteger, 'Value': ogr.OFTReal})
+            lyr.write_columns([geom.wkb for geom, *_ in COLUMN_FEATURES], {
+                'Name': [name for _geom, name, _count, _value in COLUMN_FEATURES],
+                'Count': [count for _geom, _name, count, _value in COLUMN_FEATURES],
+                'Value': [value for _geom, _name, _count, value in COLUMN_FEATURES],
+                'Missing': [0] * len(COLUMN_FEATURES)
+            })
+
+    def tearDown(self):
+        super(VectorColumnsTest, self).tearDown()
+        safe_remove_dir(self.outdir)
+
+    def read_columns(self, arrow: bool, **kwargs):
+        """Read the test layer through GDAL's Arrow stream or force the feature by feature fallback"""
+
+        with GeopackageLayer(self.layer_path) as lyr:
+            if not arrow:
+                with patch.object(VectorBase, 'ARROW_FIELD_TYPES', []):
+                    return lyr.read_columns(**kwargs)
+
+            if not hasattr(lyr.ogr_layer, 'GetArrowStreamAsNumPy') or not lyr.ogr_layer.TestCapability(ogr.OLCFastGetArrowStream):
+                self.skipTest('GDAL has no Arrow stream for this layer')
+            return lyr.read_columns(**kwargs)
+
+    def test_round_trip(self):
+        for arrow in [True, False]:
+            with self.subTest(arrow=arrow):
+                fids, wkbs, columns = self.read_columns(arrow)
+                self.assertEqual(len(fids), len(COLUMN_FEATURES))
+                self.assertEqual(sorted(columns), ['Count', 'Name', 'Value'])
+                for idx, (geom, name, count, value) in enumerate(COLUMN_FEATURES):
+                    self.assertTrue(shapely_wkb.loads(bytes(wkbs[idx])).equals(geom))
+                    self.assertEqual(columns['Name'][idx], name)
+                    self.assertEqual(columns['Count'][idx], count)
+                    self.assertEqual(columns['Value'][idx], value)
+
+                _fids, _wkbs, columns = self.read_columns(arrow, fields=['Value'])
+                self.assertEqual(list(columns), ['Value'])
+
+    def test_nulls(self):
+        for arrow in [True, False]:
+            with self.subTest(arrow=arrow):
+                _fids, _wkbs, columns = self.read_columns(arrow)
+                # Columns with nulls come back as object arrays with None for the nulls
+                self.assertEqual(columns['Count'].dtype, object)
+                self.assertEqual(columns['Value'].dtype, object)
+                self.assertIsNone(columns['Name'][1])
+                self.assertIsNone(columns['Value'][1])
+                self.assertIsNone(columns['Count'][2])
+
+                # Without nulls the numeric columns are typed
+                _fids, _wkbs, columns = self.read_columns(arrow, attribute_filter='Count IS NOT NULL AND Value IS NOT NULL')
+                self.assertEqual(columns['Count'].dtype.kind, 'i')
+                self.assertEqual(columns['Value'].dtype.kind, 'f')
+                self.assertEqual(columns['Count'].tolist(), [1, 4])
+                self.assertEqual(columns['Value'].tolist(), [0.5, 4.5])
+
+    def test_filters(self):
+        for arrow in [True, False]:
+            with self.subTest(arrow=arrow):
+                _fids, _wkbs, columns = self.read_columns(arrow, attribute_filter='Count >= 2')
+                self.assertEqual(columns['Name'].tolist(), [None, 'fourth'])
+
+                _fids, wkbs, columns = self.read_columns(arrow, clip_rect=[-1, -1, 3, 3])
+                self.assertEqual(len(wkbs), 3)
+                self.assertEqual(columns['Name'].tolist(), ['first', None, 'third'])
+
+                _fids, wkbs, columns = self.read_columns(arrow, clip_shape=box(5, 5, 15, 15))
+                self.assertEqual(columns['Name'].tolist(), ['fourth'])
+                self.assertTrue(shapely_wkb.loads(bytes(wkbs[0])).equals(Point(10, 10)))
+
+                # The filters are cleared afterwards
+                fids, _wkbs, _columns = self.read_columns(arrow)
+                self.assertEqual(len(fids), len(COLUMN_FEATURES))
+
+        with GeopackageLayer(self.layer_path) as lyr:
+            self.assertRaises(VectorBaseException, lambda: lyr.read_columns(fields=['Nope']))
+            self.assertRaises(VectorBaseException, lambda: lyr.read_columns(clip_shape=box(0, 0, 1, 1), clip_rect=[0, 0, 1, 1]))
+
+    def test_fid_update(self):
+        fids, _wkbs, _columns = self.read_columns(False)
+
+        with GeopackageLayer(self.layer_path, write=True) as lyr:
+            # Passing None for the geometries keeps those of the updated features
+            count = lyr.write_columns(None, {'Value': [10.0, None], 'Count': [None, 40]}, fids=[fids[0], fids[3]])
+            self.assertEqual(count, 2)
+            self.assertRaises(VectorBaseException, lambda: lyr.write_columns(None, {'Value': [1.0]}, fids=[fids[0], fids[1]]))
+            self.assertRaises(VectorBaseException, lambda: lyr.write_columns(None, {'Value': [1.0]}, fids=[max(fids) + 100]))
+            # New features need geometries
+            self.assertRaises(VectorBaseException, lambda: lyr.write_columns(None, {'Value': [1.0]}))
+
+        for arrow in [True, False]:
+            with self.subTest(arrow=arrow):
+                new_fids, wkbs, columns = self.read_columns(arrow)
+                self.assertEqual(new_fids.tolist(), fids.tolist())
+                self.assertEqual(columns['Value'].tolist(), [10.0, None, 2.5, None])
+                self.assertEqual(columns['Count'].tolist(), [None, 2, None, 40])
+                self.assertEqual(columns['Name'].tolist(), ['first', None, 'third', 'fourth'])
+                for idx, (geom, *_) in enumerate(COLUMN_FEATURES):
+                    self.assertTrue(shapely_wkb.loads(bytes(wkbs[idx])).equals(geom))
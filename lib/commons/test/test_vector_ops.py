@@ -5,6 +5,8 @@ import unittest
 import os
 from tempfile import mkdtemp
 from osgeo import ogr
+from shapely.geometry import MultiPolygon, Polygon, box
+from shapely.ops import unary_union
 from rscommons import vector_ops
 from rscommons import Logger, ShapefileLayer, GeopackageLayer, initGDALOGRErrors
 from rscommons.util import safe_remove_dir
@@ -16,6 +18,36 @@ log.setup(verbose=True)
 
 datadir = os.path.join(os.path.dirname(__file__), 'data')
 
+# Overlapping, disjoint and multipart polygons for the overlay operators
+OVERLAY_GEOMS = [
+    box(0, 0, 10, 10),
+    box(8, 0, 20, 10),
+    MultiPolygon([box(30, 0, 32, 10), box(34, 0, 36, 10)]),
+]
+TARGET_GEOMS = {
+    'overlap': box(5, 5, 15, 15),
+    'disjoint': box(50, 50, 60, 60),
+    'multipart': MultiPolygon([box(-5, 2, 2, 4), box(28, 2, 40, 4)]),
+    'split': box(29, 5, 37, 6),
+}
+
+
+def legacy_intersection(overlay_geoms, target_geoms):
+    """Every target intersected with the union of the whole overlay layer"""
+    union = unary_union(overlay_geoms)
+    return [(name, geom.intersection(union)) for name, geom in target_geoms.items()]
+
+
+def legacy_difference(remove_geoms, target_geoms):
+    """Every target with the overlapping features removed one at a time, split into polygons"""
+    results = []
+    for name, geom in target_geoms.items():
+        for geom_diff in remove_geoms:
+            if geom_diff.intersects(geom):
+                geom = geom.difference(geom_diff)
+        results.extend((name, part) for part in (geom.geoms if isinstance(geom, MultiPolygon) else [geom]))
+    return results
+
 
 class VectorOpsTest(unittest.TestCase):
     """[summary]
@@ -226,3 +258,63 @@ class VectorOpsTest(unittest.TestCase):
         self.assertEqual(len(values.keys()), 2)
         for shp_obj in values.values():
             self.assertGreater(shp_obj.area, 0)
+
+    def write_overlay_layers(self):
+        """Geopackage with the overlay polygons and the named target polygons"""
+        gpkg = os.path.join(self.outdir, 'overlay.gpkg')
+        with GeopackageLayer(os.path.join(gpkg, 'overlay'), write=True) as lyr:
+            lyr.create_layer(ogr.wkbMultiPolygon, epsg=26912)
+            for geom in OVERLAY_GEOMS:
+                lyr.create_feature(geom)
+        with GeopackageLayer(os.path.join(gpkg, 'targets'), write=True) as lyr:
+            lyr.create_layer(ogr.wkbMultiPolygon, epsg=26912, fields={'Name': ogr.OFTString})
+            for name, geom in TARGET_GEOMS.items():
+                lyr.create_feature(geom, {'Name': name})
+        return gpkg
+
+    def assert_overlay_output(self, out_path, expected):
+        """The output features match the expected (Name, geometry) pairs in any order"""
+        with GeopackageLayer(out_path) as lyr:
+            results = []
+            for feat, _counter, _progbar in lyr.iterate_features():
+                # Empty intersections may come back without a geometry
+                geom = feat.GetGeometryRef()
+                results.append((feat.GetField('Name'), GeopackageLayer.ogr2shapely(geom) if geom is not None else Polygon()))
+
+        def sort_key(item):
+            return (item[0],) + (tuple(item[1].bounds) if not item[1].is_empty else ())
+
+        results = sorted(results, key=sort_key)
+        expected = sorted(expected, key=sort_key)
+        self.assertEqual([name for name, _geom in results], [name for name, _geom in expected])
+        for (name, geom), (_name, expected_geom) in zip(results, expected):
+            self.assertAlmostEqual(geom.area, expected_geom.area, 6, msg=name)
+            self.assertAlmostEqual(geom.symmetric_difference(expected_geom).area, 0, 6, msg=name)
+
+    def test_intersection(self):
+        """[summary]
+        """
+        gpkg = self.write_overlay_layers()
+        out_path = os.path.join(gpkg, 'intersection')
+        vector_ops.intersection(os.path.join(gpkg, 'overlay'), os.path.join(gpkg, 'targets'), out_path, 26912)
+
+        expected = legacy_intersection(OVERLAY_GEOMS, TARGET_GEOMS)
+        self.assertAlmostEqual(dict(expected)['overlap'].area, 50)
+        self.assertTrue(dict(expected)['disjoint'].is_empty)
+        self.assert_overlay_output(out_path, expected)
+
+    def test_difference(self):
+        """[summary]
+        """
+        gpkg = self.write_overlay_layers()
+        out_path = os.path.join(gpkg, 'difference')
+        vector_ops.difference(os.path.join(gpkg, 'overlay'), os.path.join(gpkg, 'targets'), out_path)
+
+        expected = legacy_difference(OVERLAY_GEOMS, TARGET_GEOMS)
+        self.assertEqual(sorted(name for name, _geom in expected), ['disjoint', 'multipart', 'multipart', 'multipart', 'multipart', 'overlap', 'split', 'split', 'split'])
+        self.assert_overlay_output(out_path, expected)
+
+        # Targets covered by the remove layer are skipped rather than written empty
+        vector_ops.difference(os.path.join(gpkg, 'overlay'), os.path.join(gpkg, 'overlay'), os.path.join(gpkg, 'covered'))
+        with GeopackageLayer(os.path.join(gpkg, 'covered')) as lyr:
+            self.assertEqual(lyr.ogr_layer.GetFeatureCount(), 0)
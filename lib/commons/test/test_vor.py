@@ -0,0 +1,65 @@
+""" Testing for the Voronoi regions
+
+"""
+import unittest
+import numpy as np
+from shapely.geometry import Point, box
+from rscommons.thiessen.vor import NARVoronoi
+from rscommons.thiessen.shapes import RiverPoint
+
+
+class VoronoiTest(unittest.TestCase):
+    """Region adjacency from the ridge points and the centerline between the banks
+    """
+
+    def test_neighbours(self):
+        rng = np.random.default_rng(1)
+        vor = NARVoronoi([RiverPoint(Point(pt)) for pt in rng.uniform(0, 100, (300, 2))])
+        vor.calculate_neighbours()
+
+        # Regions that share a wall share two vertices
+        for idx, reg in enumerate(vor.regions):
+            expected = [idy for idy, reg2 in enumerate(vor.regions) if idx != idy and len(set(reg) & set(reg2)) >= 2]
+            adjacency = vor.region_neighbour
+            self.assertEqual(adjacency.indices[adjacency.indptr[idx]:adjacency.indptr[idx + 1]].tolist(), expected)
+
+    def test_centerline(self):
+        rng = np.random.default_rng(2)
+        x = np.linspace(0, 1000, 200)
+        points = [RiverPoint(Point(px, 15.0 + rng.normal(0, 1)), side=1) for px in x] + [RiverPoint(Point(px, -15.0 + rng.normal(0, 1)), side=-1) for px in x]
+        vor = NARVoronoi(points)
+        vor.calculate_neighbours()
+
+        centerline = vor.collectCenterLines(box(-10, -20, 1010, 20))
+        self.assertEqual(centerline.geom_type, 'LineString')
+        self.assertTrue(all(abs(y) < 5 for _x, y in centerline.coords))
+        self.assertGreater(centerline.length, 1000)
+
+    def test_tiled(self):
+        rng = np.random.default_rng(3)
+        points = rng.uniform(0, 1000, (3000, 2)) + [400000.0, 5000000.0]
+        whole = NARVoronoi(points)
+        whole.calculate_neighbours()
+
+        for workers in [1, 2]:
+            tiled = NARVoronoi(points, tile_size=150.0, workers=workers)
+            tiled.calculate_neighbours()
+            self.assertEqual(len(tiled.vertices), len(whole.vertices))
+
+            for pt_idx in range(len(points)):
+                region = whole.regions[whole.point_region[pt_idx]]
+                tiled_region = tiled.regions[tiled.point_region[pt_idx]]
+                self.assertEqual(-1 in region, -1 in tiled_region)
+                verts = np.array(sorted(whole.vertices[idx].tolist() for idx in region if idx >= 0))
+                tiled_verts = np.array(sorted(tiled.vertices[idx].tolist() for idx in tiled_region if idx >= 0))
+                self.assertEqual(verts.shape, tiled_verts.shape)
+                self.assertTrue(np.allclose(verts, tiled_verts, rtol=0, atol=1e-6))
+
+                # The same neighbouring points
+                neighbours = whole.region_neighbour.indices[whole.region_neighbour.indptr[whole.point_region[pt_idx]]:whole.region_neighbour.indptr[whole.point_region[pt_idx] + 1]]
+                tiled_neighbours = tiled.region_neighbour.indices[tiled.region_neighbour.indptr[pt_idx]:tiled.region_neighbour.indptr[pt_idx + 1]]
+                self.assertEqual(sorted(np.flatnonzero(np.isin(whole.point_region, neighbours)).tolist()), tiled_neighbours.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
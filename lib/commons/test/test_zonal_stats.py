@@ -0,0 +1,177 @@
+""" Testing for the single pass zonal statistics
+
+"""
+import os
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio import features
+from rasterio.mask import mask
+from rasterio.transform import from_origin
+from shapely.geometry import Point, LineString, box
+from rscommons.zonal_stats import zonal_statistics, zonal_tally, zonal_cross_tally, non_overlapping_batches
+from rscommons.raster_buffer_stats import masked_buffer_stats
+from rscommons.database import batch_insert
+from rscommons.util import safe_remove_dir
+
+
+def write_test_raster(path: str, width: int = 200, height: int = 150, nodata: float = -9999.0):
+    """Random float raster with a band of NoData cells"""
+
+    rng = np.random.default_rng(12)
+    data = rng.uniform(0, 1000, (height, width)).astype(np.float32)
+    data[40:45, :] = nodata
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1, dtype='float32',
+                       crs='EPSG:26912', transform=from_origin(500000, 4000000, 10, 10), nodata=nodata) as dst:
+        dst.write(data, 1)
+
+
+def write_class_raster(path: str, width: int = 200, height: int = 150, nodata: int = -9999, seed: int = 5, nodata_rows: slice = slice(40, 45)):
+    """Random vegetation type raster with a band of NoData cells"""
+
+    rng = np.random.default_rng(seed)
+    data = rng.choice([11, 12, 3001, 7045, 9016], (height, width)).astype(np.int16)
+    data[nodata_rows, :] = nodata
+    with rasterio.open(path, 'w', driver='GTiff', width=width, height=height, count=1, dtype='int16',
+                       crs='EPSG:26912', transform=from_origin(500000, 4000000, 10, 10), nodata=nodata) as dst:
+        dst.write(data, 1)
+
+
+def masked_tally(polygons: dict, raster: str, all_touched: bool) -> dict:
+    """Reference tally using one mask and np.unique() per polygon"""
+
+    results = {}
+    with rasterio.open(raster) as src:
+        data = src.read(1, masked=True)
+        for poly_id, polygon in polygons.items():
+            if all_touched:
+                inside = features.rasterize([(polygon, 1)], out_shape=src.shape, transform=src.transform, all_touched=True, fill=0) > 0
+                values = data[inside].compressed()
+            else:
+                try:
+                    raw, _transform = mask(src, [polygon], crop=True)
+                except ValueError:
+                    results[poly_id] = {}
+                    continue
+                values = np.ma.masked_values(raw, src.nodata).compressed()
+            results[poly_id] = {int(val): int(count) for val, count in zip(*np.unique(values, return_counts=True))}
+    return results
+
+
+class ZonalStatsTest(unittest.TestCase):
+    """Compare the zonal statistics engine with per-polygon masking
+    """
+
+    def setUp(self):
+        super(ZonalStatsTest, self).setUp()
+        self.outdir = mkdtemp()
+        self.raster = os.path.join(self.outdir, 'values.tif')
+        write_test_raster(self.raster)
+        self.class_raster = os.path.join(self.outdir, 'classes.tif')
+        write_class_raster(self.class_raster)
+        self.class_raster2 = os.path.join(self.outdir, 'classes2.tif')
+        write_class_raster(self.class_raster2, seed=6, nodata_rows=slice(43, 50))
+
+        rng = np.random.default_rng(3)
+        self.polygons = {}
+        for poly_id in range(60):
+            x_coord = rng.uniform(500000, 502000)
+            y_coord = rng.uniform(3998500, 4000000)
+            self.polygons[poly_id] = Point(x_coord, y_coord).buffer(rng.uniform(15, 200))
+
+        # Overlapping buffers along a line, one straddling the raster edge and one spanning the NoData band
+        self.polygons[100] = LineString([(500100, 3999900), (501500, 3999200)]).buffer(60)
+        self.polygons[101] = LineString([(500100, 3999900), (501500, 3999300)]).buffer(30)
+        self.polygons[102] = Point(500000, 3999000).buffer(100)
+        self.polygons[103] = box(500500, 3999520, 500700, 3999620)
+
+    def tearDown(self):
+        super(ZonalStatsTest, self).tearDown()
+        safe_remove_dir(self.outdir)
+
+    def test_matches_masked_stats(self):
+        expected = masked_buffer_stats(self.polygons, self.raster)
+
+        for window_size in [1024, 37]:
+            actual = zonal_statistics(self.polygons, self.raster, window_size)
+            self.assertEqual(set(actual.keys()), set(expected.keys()))
+
+            for poly_id, stats in expected.items():
+                self.assertEqual(actual[poly_id]['Count'], stats['Count'])
+                for stat in ['Mean', 'Maximum', 'Minimum', 'Sum']:
+                    if stats[stat] is None:
+                        self.assertIsNone(actual[poly_id][stat])
+                    else:
+                        self.assertAlmostEqual(actual[poly_id][stat], stats[stat], delta=abs(stats[stat]) * 1e-5)
+
+    def test_tally_matches_masked_unique(self):
+        for all_touched in [False, True]:
+            expected = masked_tally(self.polygons, self.class_raster, all_touched)
+            for window_size in [1024, 37]:
+                actual = zonal_tally(self.polygons, self.class_raster, window_size, all_touched)
+                self.assertEqual(actual, expected)
+
+    def test_cross_tally(self):
+        expected = {}
+        with rasterio.open(self.class_raster) as src1, rasterio.open(self.class_raster2) as src2:
+            data1 = src1.read(1, masked=True)
+            data2 = src2.read(1, masked=True)
+            for poly_id, polygon in self.polygons.items():
+                inside = features.rasterize([(polygon, 1)], out_shape=src1.shape, transform=src1.transform, all_touched=True, fill=0) > 0
+                pairs = zip(data1[inside].tolist(fill_value=None), data2[inside].tolist(fill_value=None))
+                expected[poly_id] = {}
+                for pair in pairs:
+                    if pair != (None, None):
+                        expected[poly_id][pair] = expected[poly_id].get(pair, 0) + 1
+
+        actual = zonal_cross_tally(self.polygons, [self.class_raster, self.class_raster2], 37, all_touched=True)
+        self.assertEqual(actual, expected)
+
+    def test_outside_raster(self):
+        actual = zonal_statistics({1: Point(0, 0).buffer(10)}, self.raster)
+        self.assertIsNone(actual[1]['Mean'])
+        self.assertIsNone(actual[1]['Count'])
+        self.assertEqual(zonal_tally({1: Point(0, 0).buffer(10)}, self.class_raster), {1: {}})
+
+    def test_non_overlapping_batches(self):
+        geoms = list(self.polygons.values())
+        batches = non_overlapping_batches(geoms)
+
+        for i, geom1 in enumerate(geoms):
+            for j, geom2 in enumerate(geoms):
+                if i < j and batches[i] == batches[j]:
+                    self.assertFalse(geom1.envelope.intersects(geom2.envelope))
+
+
+class BatchInsertTest(unittest.TestCase):
+
+    def setUp(self):
+        super(BatchInsertTest, self).setUp()
+        self.outdir = mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.outdir, 'batch.sqlite'))
+        self.conn.execute('CREATE TABLE ReachAttributes (ReachID INTEGER PRIMARY KEY NOT NULL, iGeo_Len REAL CHECK (iGeo_Len > 0), iHyd_QLow REAL)')
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        safe_remove_dir(self.outdir)
+
+    def test_batch_insert(self):
+        sql = 'INSERT INTO ReachAttributes (ReachID, iGeo_Len) VALUES (?, ?)'
+
+        # Nothing is committed until the caller commits, whether or not the batch had to be retried row by row
+        for rows, expected_errs in [([[1, 1.0], [3, 3.0]], 0), ([[1, 1.0], [2, 0.0], [3, 3.0]], 1)]:
+            self.assertEqual(batch_insert(self.conn, sql, rows), expected_errs)
+            self.assertTrue(self.conn.in_transaction)
+            self.conn.rollback()
+            self.assertEqual(self.conn.execute('SELECT count(*) FROM ReachAttributes').fetchone()[0], 0)
+
+        self.assertEqual(batch_insert(self.conn, sql, [[1, 1.0], [3, 3.0]]), 0)
+        self.conn.commit()
+        self.assertEqual(self.conn.execute('SELECT count(*) FROM ReachAttributes').fetchone()[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,7 @@ CREATE TABLE ReachAttributes (ReachID INTEGER PRIMARY KEY NOT NULL, WatershedID
 CREATE TABLE HydroParams (ParamID INTEGER PRIMARY KEY NOT NULL, Name TEXT UNIQUE NOT NULL, Description TEXT NOT NULL, Aliases TEXT, DataUnits TEXT NOT NULL, EquationUnits TEXT, Conversion REAL NOT NULL DEFAULT (1), Definition TEXT);
 CREATE INDEX FK_ReachVegetation_ReachID ON ReachVegetation (ReachID);
 CREATE INDEX FK_ReachVegetation_VegetationID ON ReachVegetation (VegetationID);
+CREATE INDEX IX_ReachVegetation_Buffer ON ReachVegetation (Buffer, ReachID, VegetationID, CellCount);
 CREATE INDEX FK_VegetationOverrides_EcoregionID ON VegetationOverrides (EcoregionID);
 CREATE INDEX FK_VegetationOverrides_VegetationID ON VegetationOverrides (VegetationID);
 CREATE INDEX IX_Watersheds_EcoregionID ON Watersheds (EcoregionID);
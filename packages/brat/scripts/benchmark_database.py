@@ -0,0 +1,181 @@
+""" Benchmark the database writes of a BRAT run
+
+    Builds two copies of a synthetic BRAT database (the ReachAttributes and
+    lookup tables of the BRAT schema with a number of reaches) and replays the
+    sequence of database helper calls that brat_run makes: nulling the output
+    fields, writing each set of calculated fields with its summary, the
+    departure update and the run metadata.
+
+    One copy is written with the previous helpers, which open a new connection
+    for every call and null each field with its own UPDATE, and the other with
+    rscommons.database, which uses pooled connections with performance pragmas
+    and explicit transactions. The final ReachAttributes tables are compared.
+
+    Usage: python benchmark_database.py [--reaches 100000]
+"""
+import os
+import time
+import argparse
+import sqlite3
+from tempfile import mkdtemp
+import numpy as np
+from rscommons import Logger
+from rscommons.database import load_lookup_data, write_db_attributes, set_reach_fields_null, execute_query, store_metadata, close_connections
+from rscommons.util import safe_remove_dir
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', 'database', 'brat_schema.sql')
+CSV_DIR = os.path.join(os.path.dirname(__file__), '..', 'database', 'data')
+
+REAL_FIELDS = ['iVeg100EX', 'iVeg_30EX', 'iVeg100HPE', 'iVeg_30HPE', 'iPC_LU', 'iPC_VLowLU', 'iPC_LowLU', 'iPC_ModLU', 'iPC_HighLU', 'iHyd_QLow',
+               'iHyd_Q2', 'iHyd_SPLow', 'iHyd_SP2', 'oVC_HPE', 'oVC_EX', 'oCC_HPE', 'mCC_HPE_CT', 'oCC_EX', 'mCC_EX_CT', 'mCC_HisDep']
+INTEGER_FIELDS = ['RiskID', 'LimitationID', 'OpportunityID']
+
+# The groups of fields written together by each brat_run step, with the range of their values
+WRITES = [
+    (['iHyd_QLow'], 0, 100), (['iHyd_SPLow'], 0, 1000), (['iHyd_Q2'], 0, 500), (['iHyd_SP2'], 0, 5000),
+    (['iVeg100EX'], 0, 4), (['iVeg_30EX'], 0, 4), (['oVC_EX'], 0, 40), (['oCC_EX', 'mCC_EX_CT'], 0, 40),
+    (['iVeg100HPE'], 0, 4), (['iVeg_30HPE'], 0, 4), (['oVC_HPE'], 0, 40), (['oCC_HPE', 'mCC_HPE_CT'], 0, 40),
+    (['iPC_LU', 'iPC_VLowLU', 'iPC_LowLU', 'iPC_ModLU', 'iPC_HighLU'], 0, 100)
+]
+
+
+def synthetic_database(path: str, reaches: int):
+    """BRAT tables (without the GeoPackage ones) and lookup data with reaches in one watershed"""
+
+    conn = sqlite3.connect(path)
+    for statement in open(SCHEMA).read().split(';\n'):
+        if 'gpkg_' not in statement and statement.strip().startswith('CREATE TABLE'):
+            conn.execute(statement)
+    conn.commit()
+
+    load_lookup_data(path, CSV_DIR)
+    close_connections(path)
+
+    conn.execute('PRAGMA foreign_keys = ON')
+    huc = conn.execute('SELECT WatershedID FROM Watersheds LIMIT 1').fetchone()[0]
+    conn.executemany('INSERT INTO ReachAttributes (ReachID, WatershedID, iGeo_Len, iGeo_DA, iGeo_Slope) VALUES (?, ?, ?, ?, ?)',
+                     [(reach_id, huc, 100.0 + reach_id % 900, float(reach_id % 5000), 0.01) for reach_id in range(1, reaches + 1)])
+    conn.commit()
+    conn.close()
+
+
+def synthetic_values(conn_path: str, reaches: int) -> list:
+    """Values for every write in the replayed run, including the dam risk, limitation and opportunity IDs"""
+
+    rng = np.random.default_rng(11)
+    conn = sqlite3.connect(conn_path)
+    writes = []
+    for fields, low, high in WRITES:
+        writes.append((fields, {reach_id: {field: float(value) for field, value in zip(fields, rng.uniform(low, high, len(fields)))} for reach_id in range(1, reaches + 1)}))
+
+    ids = {field: [row[0] for row in conn.execute('SELECT {0} FROM {1}'.format(field, table))]
+           for field, table in [('RiskID', 'DamRisks'), ('LimitationID', 'DamLimitations'), ('OpportunityID', 'DamOpportunities')]}
+    writes.append((INTEGER_FIELDS, {reach_id: {field: int(rng.choice(ids[field])) for field in INTEGER_FIELDS} for reach_id in range(1, reaches + 1)}))
+    conn.close()
+    return writes
+
+
+def replay(path: str, writes: list, write_attributes, set_null, execute, metadata):
+    """The database calls of brat_run in order"""
+
+    metadata(path, 'BRAT_Run_DateTime', '2020-01-01T00:00:00')
+    set_null(path, REAL_FIELDS)
+    set_null(path, INTEGER_FIELDS)
+    for fields, values in writes[:-2]:
+        write_attributes(path, values, fields)
+    execute(path, 'UPDATE ReachAttributes SET mCC_HisDep = mCC_HPE_CT - mCC_EX_CT WHERE (mCC_EX_CT IS NOT NULL) AND (mCC_HPE_CT IS NOT NULL)')
+    for fields, values in writes[-2:]:
+        write_attributes(path, values, fields)
+
+
+def legacy_write_db_attributes(database, reaches, fields, set_null_first=True, summarize=True):
+    """write_db_attributes() before the connection pool"""
+
+    conn = sqlite3.connect(database)
+    conn.execute('pragma foreign_keys=ON')
+    curs = conn.cursor()
+    if set_null_first is True:
+        for field in fields:
+            curs.execute('UPDATE ReachAttributes SET {} = NULL'.format(field))
+
+    results = []
+    for reachid, values in reaches.items():
+        results.append([values[field] if field in values else None for field in fields])
+        results[-1].append(reachid)
+
+    sql = 'UPDATE ReachAttributes SET {} WHERE ReachID = ?'.format(','.join(['{}=?'.format(field) for field in fields]))
+    curs.executemany(sql, results)
+    conn.commit()
+
+    if summarize is True:
+        for field in fields:
+            legacy_summarize_reaches(database, field)
+
+
+def legacy_summarize_reaches(database, field):
+    conn = sqlite3.connect(database)
+    curs = conn.cursor()
+    curs.execute('SELECT Max({0}), Min({0}), Avg({0}), Count({0}) FROM ReachAttributes WHERE ({0} IS NOT NULL)'.format(field))
+    curs.fetchone()
+    curs.execute('SELECT Count(*) FROM ReachAttributes WHERE {0} IS NULL'.format(field))
+    curs.fetchone()
+
+
+def legacy_set_reach_fields_null(database, fields):
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('UPDATE ReachAttributes SET {}'.format(','.join(['{} = NULL'.format(field) for field in fields])))
+    conn.commit()
+    conn.close()
+
+
+def legacy_execute_query(database, sql):
+    conn = sqlite3.connect(database)
+    conn.execute('pragma foreign_keys=ON')
+    conn.execute(sql)
+    conn.commit()
+
+
+def legacy_store_metadata(database, key, value):
+    conn = sqlite3.connect(database)
+    conn.execute('INSERT OR REPLACE INTO MetaData (KeyInfo, ValueInfo) VALUES (?, ?)', [key, value])
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reaches', help='Number of reaches', type=int, default=100000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        legacy_db, pooled_db = os.path.join(temp_dir, 'legacy.gpkg'), os.path.join(temp_dir, 'pooled.gpkg')
+        for path in [legacy_db, pooled_db]:
+            synthetic_database(path, args.reaches)
+        writes = synthetic_values(legacy_db, args.reaches)
+        print('{:,} reaches, {} attribute writes'.format(args.reaches, len(writes)))
+
+        start = time.perf_counter()
+        replay(legacy_db, writes, legacy_write_db_attributes, legacy_set_reach_fields_null, legacy_execute_query, legacy_store_metadata)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        replay(pooled_db, writes, write_db_attributes, set_reach_fields_null, execute_query, store_metadata)
+        pooled_time = time.perf_counter() - start
+        close_connections()
+
+        print('database time: previous {:.2f}s, pooled {:.2f}s, speedup {:.1f}x'.format(legacy_time, pooled_time, legacy_time / pooled_time))
+
+        tables = [sqlite3.connect(path).execute('SELECT * FROM ReachAttributes ORDER BY ReachID').fetchall() for path in [legacy_db, pooled_db]]
+        if tables[0] != tables[1]:
+            raise Exception('The ReachAttributes tables are different')
+        print('ReachAttributes tables are identical')
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+""" Benchmark the land use intensity calculation
+
+    Fills the ReachVegetation table of a synthetic BRAT database with random
+    cell counts of existing and historic vegetation types for two buffers and
+    compares the previous calculate_land_use(), which joins ReachVegetation to
+    the vegetation, land use and epoch tables once for the mean intensity and
+    again for every land use intensity class, with the single scan version in
+    sqlbrat.utils.land_use. The results are compared.
+
+    Usage: python -m scripts.benchmark_land_use [--reaches 100000]
+"""
+import os
+import time
+import argparse
+import sqlite3
+from tempfile import mkdtemp
+import numpy as np
+from rscommons import Logger
+from rscommons.database import close_connections
+from rscommons.util import safe_remove_dir
+from sqlbrat.utils.land_use import calculate_land_use
+from scripts.benchmark_database import synthetic_database
+from tests.test_land_use import legacy_calculate_land_use
+
+BUFFERS = [30.0, 100.0]
+
+
+def synthetic_vegetation(path: str, reaches: int, types_per_reach: int = 12):
+    """Cell counts for a random sample of the vegetation types for every reach and buffer"""
+
+    rng = np.random.default_rng(5)
+    conn = sqlite3.connect(path)
+    veg_ids = np.array([row[0] for row in conn.execute('SELECT VegetationID FROM VegetationTypes')])
+    rows = []
+    for reach_id in range(1, reaches + 1):
+        for veg_id in rng.choice(veg_ids, types_per_reach, replace=False):
+            for buffer in BUFFERS:
+                cells = float(rng.integers(1, 200))
+                rows.append((reach_id, int(veg_id), buffer, cells * 900.0, cells))
+    conn.executemany('INSERT INTO ReachVegetation (ReachID, VegetationID, Buffer, Area, CellCount) VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def compare(legacy: dict, single: dict):
+    """Raise if the reaches or any of their values differ"""
+
+    if legacy.keys() != single.keys():
+        raise Exception('Different reaches: {:,} against {:,}'.format(len(legacy), len(single)))
+
+    for reach_id, values in legacy.items():
+        if values.keys() != single[reach_id].keys():
+            raise Exception('Different fields for reach {}'.format(reach_id))
+        for field, value in values.items():
+            if not np.isclose(value, single[reach_id][field], rtol=1e-9, atol=1e-9):
+                raise Exception('Reach {} {} is {} instead of {}'.format(reach_id, field, single[reach_id][field], value))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reaches', help='Number of reaches', type=int, default=100000)
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        database = os.path.join(temp_dir, 'land_use.gpkg')
+        synthetic_database(database, args.reaches)
+        synthetic_vegetation(database, args.reaches)
+
+        for buffer in BUFFERS:
+            start = time.perf_counter()
+            legacy = legacy_calculate_land_use(database, buffer)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            single = calculate_land_use(database, buffer)
+            single_time = time.perf_counter() - start
+            close_connections()
+
+            compare(legacy, single)
+            print('{:,} reaches, {}m buffer: previous {:.2f}s, single scan {:.2f}s, speedup {:.1f}x (identical results)'.format(
+                args.reaches, buffer, legacy_time, single_time, legacy_time / single_time))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
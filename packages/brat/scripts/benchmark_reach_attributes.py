@@ -0,0 +1,71 @@
+""" Benchmark the bulk ReachAttributes writer
+
+    Writes all the BRAT run output fields for every reach of a synthetic BRAT
+    database in one call, first with the previous write_db_attributes()
+    (one UPDATE per field to null it, one UPDATE per reach and two summary
+    scans per field) and then with rscommons.database.write_db_attributes()
+    (one temporary table, one joined UPDATE and one aggregate summary query).
+    The final ReachAttributes tables are compared.
+
+    Usage: python -m scripts.benchmark_reach_attributes [--reaches 10000 100000]
+"""
+import os
+import time
+import argparse
+import sqlite3
+from tempfile import mkdtemp
+import numpy as np
+from rscommons import Logger
+from rscommons.database import write_db_attributes, close_connections
+from rscommons.util import safe_remove_dir
+from scripts.benchmark_database import synthetic_database, legacy_write_db_attributes, REAL_FIELDS
+
+
+def synthetic_values(reaches: int, fields: list) -> dict:
+    """Values between 0 and 4 (valid for every output field) for 90% of the reaches and some nulls"""
+
+    rng = np.random.default_rng(3)
+    values = rng.uniform(0, 4, (reaches, len(fields)))
+    nulls = rng.random((reaches, len(fields))) < 0.05
+    return {reach_id: {field: (None if nulls[row, col] else float(values[row, col])) for col, field in enumerate(fields)}
+            for row, reach_id in enumerate(range(1, reaches + 1)) if row % 10 != 0}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reaches', help='Numbers of reaches', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    fields = REAL_FIELDS
+    temp_dir = mkdtemp()
+    try:
+        for reaches in args.reaches:
+            legacy_db, bulk_db = os.path.join(temp_dir, 'legacy_{}.gpkg'.format(reaches)), os.path.join(temp_dir, 'bulk_{}.gpkg'.format(reaches))
+            for path in [legacy_db, bulk_db]:
+                synthetic_database(path, reaches)
+            values = synthetic_values(reaches, fields)
+
+            start = time.perf_counter()
+            legacy_write_db_attributes(legacy_db, values, fields)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            write_db_attributes(bulk_db, values, fields)
+            bulk_time = time.perf_counter() - start
+            close_connections()
+
+            tables = [sqlite3.connect(path).execute('SELECT * FROM ReachAttributes ORDER BY ReachID').fetchall() for path in [legacy_db, bulk_db]]
+            if tables[0] != tables[1]:
+                raise Exception('The ReachAttributes tables are different for {:,} reaches'.format(reaches))
+
+            print('{:,} reaches, {} fields: previous {:.2f}s, bulk {:.2f}s, speedup {:.1f}x (identical tables)'.format(
+                reaches, len(fields), legacy_time, bulk_time, legacy_time / bulk_time))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
 import argparse
 from operator import le
-import sqlite3
 import os
 # from turtle import pen
 from xml.etree import ElementTree as ET
 
 from rscommons import Logger, dotenv, ModelConfig, RSReport, RSProject
 from rscommons.util import safe_makedirs
+from rscommons.database import get_connection
 from rscommons.plotting import xyscatter, box_plot, pie, horizontal_bar
 from sympy import sec
 
@@ -191,9 +191,8 @@ class BratReport(RSReport):
         pEl2.text = 'The following table contains the total beaver dam capacity for the watershed based on existing and historic vegetation. The vegetation only entries are capacitites based on only the vegetation fuzzy inference system; the others are based on the combined fuzzy inferences system that acocunts for hydrology and slope.'
         section.append(pEl2)
 
-        conn = sqlite3.connect(self.database)
-        conn.row_factory = _dict_factory
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = _dict_factory
         fields = [
             ('Existing capacity (vegetation only)', 'Sum((iGeo_Len / 1000) * oVC_EX)'),
             ('Historic capacity (vegetation only)', 'Sum((iGeo_Len / 1000) * oVC_HPE)'),
@@ -329,8 +328,8 @@ class BratReport(RSReport):
         pEl.text = 'Below are the equations used to estimate baseflow and peak flow (~two-year recurrence interval), as well as the values used for the parameters in those equations.'
         section.append(pEl)
 
-        conn = sqlite3.connect(self.database)
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = None
 
         curs.execute('SELECT MaxDrainage, QLow, Q2 FROM Watersheds')
         row = curs.fetchone()
@@ -500,9 +499,8 @@ class BratReport(RSReport):
         section.append(pEl)
 
         # This project has a db so we'll need a connection
-        conn = sqlite3.connect(self.database)
-        conn.row_factory = _dict_factory
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = _dict_factory
 
         row = curs.execute('SELECT Sum(iGeo_Len) AS TotalLength, Count(ReachID) AS TotalReaches FROM vwReaches').fetchone()
         values = {
@@ -552,9 +550,8 @@ class BratReport(RSReport):
     def vegetation(self, parent_sec):
         self.log.info('Recording vegetation information')
         section = self.section('Vegetation', 'Vegetation', parent_sec, level=2)
-        conn = sqlite3.connect(self.database)
-        # conn.row_factory = _dict_factory
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = None
 
         for epochid, veg_type in [(2, 'Historic Vegetation'), (1, 'Existing Vegetation')]:
 
@@ -614,9 +611,8 @@ class BratReport(RSReport):
         # Use a class here because it repeats
         # section = self.section(None, attribute, parent_el, level=2)
         RSReport.header(3, attribute, parent_el)
-        conn = sqlite3.connect(self.database)
-        conn.row_factory = _dict_factory
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = _dict_factory
 
         # Summary statistics (min, max etc) for the current attribute
         curs.execute('SELECT Count({0}) "Values", Max({0}) Maximum, Min({0}) Minimum, Avg({0}) Average FROM vwReaches WHERE {0} IS NOT NULL'.format(attribute))
@@ -649,9 +645,8 @@ class BratReport(RSReport):
 
         RSReport.header(3, '{} Summary'.format(self.f_names[attribute_field]), elParent)
 
-        conn = sqlite3.connect(self.database)
-        conn.row_factory = _dict_factory
-        curs = conn.cursor()
+        curs = get_connection(self.database).cursor()
+        curs.row_factory = _dict_factory
 
         data = []
         for abin in bins:
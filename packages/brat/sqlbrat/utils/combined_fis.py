@@ -15,6 +15,7 @@ import skfuzzy as fuzz
 from skfuzzy import control as ctrl
 from rscommons.database import load_attributes, write_db_attributes
 from rscommons import ProgressBar, Logger, dotenv
+from sqlbrat.utils.fis_engine import BatchFIS
 
 
 def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: float):
@@ -43,54 +44,12 @@ def combined_fis(database: str, label: str, veg_type: str, max_drainage_area: fl
     log.info('Process completed successfully.')
 
 
-def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_field: str, dam_count_field: str, max_drainage_area: float):
-    """
-    Calculate dam capacity and density using combined FIS
-    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
-    :param veg_fis_field: Attribute containing the output of the vegetation FIS
-    :param com_capacity_field: Attribute used to store the capacity result in feature_values
-    :param com_density_field: Attribute used to store the capacity results in feature_values
-    :param max_drainage_area: Reaches with drainage area greater than this threshold will have zero capacity
-    :return: Insert the dam capacity and density values to the feature_values dictionary
-    """
-
-    log = Logger('Combined FIS')
-    log.info('Initializing Combined FIS')
-
-    if not max_drainage_area:
-        log.warning('Missing max drainage area. Calculating combined FIS without max drainage threshold.')
-
-    # get arrays for fields of interest
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    reachcode_array = np.zeros(feature_count, np.int64)
-    veg_array = np.zeros(feature_count, np.float64)
-    hydq2_array = np.zeros(feature_count, np.float64)
-    hydlow_array = np.zeros(feature_count, np.float64)
-    slope_array = np.zeros(feature_count, np.float64)
-    drain_array = np.zeros(feature_count, np.float64)
-
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        reachcode_array[counter] = values['ReachCode']
-        veg_array[counter] = values[veg_fis_field]
-        hydlow_array[counter] = values['iHyd_SPLow']
-        hydq2_array[counter] = values['iHyd_SP2']
-        slope_array[counter] = values['iGeo_Slope']
-        drain_array[counter] = values['iGeo_DA']
-        counter += 1
+def combined_fis_system():
+    """Build the scikit-fuzzy control system for the combined FIS
 
-    # Adjust inputs to be within FIS membership range
-    veg_array[veg_array < 0] = 0
-    veg_array[veg_array > 45] = 45
-
-    hydq2_array[hydq2_array < 0] = 0.0001
-    hydq2_array[hydq2_array > 10000] = 10000
-
-    hydlow_array[hydlow_array < 0] = 0.0001
-    hydlow_array[hydlow_array > 10000] = 10000
-    slope_array[slope_array > 1] = 1
+    Returns:
+        ctrl.ControlSystem -- combined FIS with 'input1' (ovc), 'input2' (sp2), 'input3' (splow), 'input4' (slope) and 'result' (density)
+    """
 
     # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
     ovc = ctrl.Antecedent(np.arange(0, 45, 0.01), 'input1')
@@ -127,8 +86,7 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
     density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
 
     # build fis rule table
-    log.info('Building FIS rule table')
-    comb_ctrl = ctrl.ControlSystem([
+    return ctrl.ControlSystem([
         ctrl.Rule(ovc['none'], density['none']),
         ctrl.Rule(splow['cannot'], density['none']),
         ctrl.Rule(slope['cannot'], density['none']),
@@ -198,7 +156,59 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
         ctrl.Rule(ovc['pervasive'] & sp2['blowout'] & splow['probably'] & slope['probably'], density['rare'])
     ])
 
-    comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
+
+def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_field: str, dam_count_field: str, max_drainage_area: float, reference: bool = False):
+    """
+    Calculate dam capacity and density using combined FIS
+    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
+    :param veg_fis_field: Attribute containing the output of the vegetation FIS
+    :param com_capacity_field: Attribute used to store the capacity result in feature_values
+    :param com_density_field: Attribute used to store the capacity results in feature_values
+    :param max_drainage_area: Reaches with drainage area greater than this threshold will have zero capacity
+    :param reference: Evaluate each reach with scikit-fuzzy instead of the vectorized BatchFIS engine
+    :return: Insert the dam capacity and density values to the feature_values dictionary
+    """
+
+    log = Logger('Combined FIS')
+    log.info('Initializing Combined FIS')
+
+    if not max_drainage_area:
+        log.warning('Missing max drainage area. Calculating combined FIS without max drainage threshold.')
+
+    # get arrays for fields of interest
+    feature_count = len(feature_values)
+    reachid_array = np.zeros(feature_count, np.int64)
+    reachcode_array = np.zeros(feature_count, np.int64)
+    veg_array = np.zeros(feature_count, np.float64)
+    hydq2_array = np.zeros(feature_count, np.float64)
+    hydlow_array = np.zeros(feature_count, np.float64)
+    slope_array = np.zeros(feature_count, np.float64)
+    drain_array = np.zeros(feature_count, np.float64)
+
+    counter = 0
+    for reach_id, values in feature_values.items():
+        reachid_array[counter] = reach_id
+        reachcode_array[counter] = values['ReachCode']
+        veg_array[counter] = values[veg_fis_field]
+        hydlow_array[counter] = values['iHyd_SPLow']
+        hydq2_array[counter] = values['iHyd_SP2']
+        slope_array[counter] = values['iGeo_Slope']
+        drain_array[counter] = values['iGeo_DA']
+        counter += 1
+
+    # Adjust inputs to be within FIS membership range
+    veg_array[veg_array < 0] = 0
+    veg_array[veg_array > 45] = 45
+
+    hydq2_array[hydq2_array < 0] = 0.0001
+    hydq2_array[hydq2_array > 10000] = 10000
+
+    hydlow_array[hydlow_array < 0] = 0.0001
+    hydlow_array[hydlow_array > 10000] = 10000
+    slope_array[slope_array > 1] = 1
+
+    log.info('Building FIS rule table')
+    comb_ctrl = combined_fis_system()
 
     # calculate defuzzified centroid value for density 'none' MF group
     # this will be used to re-classify output values that fall in this group
@@ -208,38 +218,42 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
     mfx = fuzz.trimf(x_vals, [0, 0, 0.1])
     defuzz_centroid = round(fuzz.defuzz(x_vals, mfx, 'centroid'), 6)
 
-    progbar = ProgressBar(len(reachid_array), 50, "Combined FIS")
-    counter = 0
-
-    for i, reach_id in enumerate(reachid_array):
-
-        capacity = 0.0
-        # Only compute FIS if the reach has less than user-defined max drainage area.
-        # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
-        if not max_drainage_area or drain_array[i] < max_drainage_area:
-
+    # Only compute FIS if the reach has less than user-defined max drainage area.
+    # this enforces a stream size threshold above which beaver dams won't persist and/or won't be built
+    # (reaches with the 33600 reach code are computed regardless of drainage area)
+    if max_drainage_area:
+        compute_mask = (drain_array < max_drainage_area) | (reachcode_array == 33600)
+    else:
+        compute_mask = np.ones(feature_count, dtype=bool)
+    compute_idx = np.flatnonzero(compute_mask)
+
+    results = np.zeros(feature_count, np.float64)
+    if reference:
+        comb_fis = ctrl.ControlSystemSimulation(comb_ctrl)
+        progbar = ProgressBar(len(compute_idx), 50, "Combined FIS")
+        for counter, i in enumerate(compute_idx):
             comb_fis.input['input1'] = veg_array[i]
             comb_fis.input['input2'] = hydq2_array[i]
             comb_fis.input['input3'] = hydlow_array[i]
             comb_fis.input['input4'] = slope_array[i]
             comb_fis.compute()
-            capacity = comb_fis.output['result']
-
-            # Combined FIS result cannot be higher than limiting vegetation FIS result
-            if capacity > veg_array[i]:
-                capacity = veg_array[i]
-
-            if round(capacity, 6) == defuzz_centroid:
-                capacity = 0.0
+            results[i] = comb_fis.output['result']
+            progbar.update(counter + 1)
+        progbar.finish()
+    elif len(compute_idx) > 0:
+        log.info('Running combined FIS on {:,} reaches'.format(len(compute_idx)))
+        results[compute_idx] = BatchFIS(comb_ctrl).compute({
+            'input1': veg_array[compute_idx],
+            'input2': hydq2_array[compute_idx],
+            'input3': hydlow_array[compute_idx],
+            'input4': slope_array[compute_idx]
+        })
 
-        elif drain_array[i] >= max_drainage_area and reachcode_array[i] == 33600:
+    for i, reach_id in enumerate(reachid_array):
 
-            comb_fis.input['input1'] = veg_array[i]
-            comb_fis.input['input2'] = hydq2_array[i]
-            comb_fis.input['input3'] = hydlow_array[i]
-            comb_fis.input['input4'] = slope_array[i]
-            comb_fis.compute()
-            capacity = comb_fis.output['result']
+        capacity = 0.0
+        if compute_mask[i]:
+            capacity = float(results[i])
 
             # Combined FIS result cannot be higher than limiting vegetation FIS result
             if capacity > veg_array[i]:
@@ -254,10 +268,6 @@ def calculate_combined_fis(feature_values: dict, veg_fis_field: str, capacity_fi
         feature_values[reach_id][capacity_field] = round(capacity, 2)
         feature_values[reach_id][dam_count_field] = round(count, 2)
 
-        counter += 1
-        progbar.update(counter)
-
-    progbar.finish()
     log.info('Done')
 
 
@@ -0,0 +1,246 @@
+""" Vectorized evaluation of scikit-fuzzy control systems.
+
+    The BRAT FIS models are defined with scikit-fuzzy but running them through
+    ControlSystemSimulation.compute() one reach at a time is slow on large
+    networks. BatchFIS compiles the rules of an existing ctrl.ControlSystem into
+    NumPy min/max operations and defuzzifies all reaches at once, reproducing
+    the scikit-fuzzy Mamdani inference (including the upsampling of the output
+    universe at the activation cut points) so that results match the
+    per-reach path.
+"""
+import numpy as np
+from skfuzzy.control.term import Term, TermAggregate
+
+
+class BatchFIS():
+    """Mamdani inference over arrays of inputs using the membership
+    functions and rules of a scikit-fuzzy control system.
+    """
+
+    def __init__(self, control_system, chunk_size: int = 1000):
+        """
+        Arguments:
+            control_system {ctrl.ControlSystem} -- scikit-fuzzy control system with a single consequent
+            chunk_size {int} -- Number of inputs defuzzified together. Controls peak memory.
+        """
+
+        consequents = list(control_system.consequents)
+        if len(consequents) != 1:
+            raise Exception('BatchFIS only supports control systems with a single consequent. Found {}.'.format(len(consequents)))
+
+        if consequents[0].defuzzify_method != 'centroid':
+            raise Exception('BatchFIS only supports centroid defuzzification. Found {}.'.format(consequents[0].defuzzify_method))
+
+        self.chunk_size = chunk_size
+        self.antecedents = {ant.label: ant for ant in control_system.antecedents}
+        self.consequent = consequents[0]
+
+        # Consequent terms in a fixed order. Activation cuts are stored as columns in this order
+        self.out_terms = list(self.consequent.terms.values())
+        self.out_universe = np.asarray(self.consequent.universe, dtype=np.float64)
+        self.out_mfs = [np.asarray(term.mf, dtype=np.float64) for term in self.out_terms]
+        self.out_peaks = [_unimodal_peak(mf, term.label) for mf, term in zip(self.out_mfs, self.out_terms)]
+        self.out_supports = [_support(mf) for mf in self.out_mfs]
+
+        # The trapezoidal area and first moment over the universe are linear in the membership
+        # values so they reduce to a dot product with these per-point weights
+        width = np.diff(self.out_universe)
+        self.area_weights = np.zeros_like(self.out_universe)
+        self.area_weights[:-1] += 0.5 * width
+        self.area_weights[1:] += 0.5 * width
+        self.moment_weights = np.zeros_like(self.out_universe)
+        self.moment_weights[:-1] += width / 6.0 * (2.0 * self.out_universe[:-1] + self.out_universe[1:])
+        self.moment_weights[1:] += width / 6.0 * (self.out_universe[:-1] + 2.0 * self.out_universe[1:])
+
+        # Each rule becomes its antecedent tree plus the list of (consequent term index, weight)
+        term_index = {id(term): idx for idx, term in enumerate(self.out_terms)}
+        self.rules = []
+        for rule in control_system.rules:
+            outputs = [(term_index[id(weighted.term)], weighted.weight) for weighted in rule.consequent]
+            self.rules.append((rule.antecedent, rule.and_func, rule.or_func, outputs))
+
+    def compute(self, inputs: dict) -> np.ndarray:
+        """Run the FIS for every element of the input arrays
+
+        Arguments:
+            inputs {dict} -- 1D arrays of input values keyed by antecedent label. All arrays must be the same length.
+
+        Returns:
+            np.ndarray -- defuzzified consequent value for each input element
+        """
+
+        missing = [label for label in self.antecedents if label not in inputs]
+        if len(missing) > 0:
+            raise Exception('Missing FIS inputs: {}'.format(', '.join(missing)))
+
+        values = {}
+        for label, ant in self.antecedents.items():
+            # scikit-fuzzy clips inputs to the bounds of the universe
+            universe = np.asarray(ant.universe, dtype=np.float64)
+            values[label] = np.clip(np.asarray(inputs[label], dtype=np.float64), universe.min(), universe.max())
+
+        count = len(next(iter(values.values())))
+        result = np.zeros(count, dtype=np.float64)
+
+        for start in range(0, count, self.chunk_size):
+            chunk = {label: arr[start:start + self.chunk_size] for label, arr in values.items()}
+            cuts = self._activation_cuts(chunk)
+            result[start:start + self.chunk_size] = self._defuzz_centroid(cuts)
+
+        return result
+
+    def _activation_cuts(self, chunk: dict) -> np.ndarray:
+        """Evaluate the rule base and return the accumulated activation
+        of each consequent term as an (inputs, terms) array"""
+
+        memberships = {}
+        count = len(next(iter(chunk.values())))
+        cuts = np.zeros((count, len(self.out_terms)), dtype=np.float64)
+
+        for antecedent, and_func, or_func, outputs in self.rules:
+            firing = self._firing_strength(antecedent, chunk, memberships, and_func, or_func)
+            for idx, weight in outputs:
+                # Accumulation is the consequent's accumulation method (maximum by default)
+                cuts[:, idx] = self.consequent.accumulation_method(cuts[:, idx], firing * weight)
+
+        return cuts
+
+    def _firing_strength(self, node, chunk, memberships, and_func, or_func) -> np.ndarray:
+        """Recursively evaluate a rule antecedent tree over the input arrays"""
+
+        if isinstance(node, Term):
+            key = id(node)
+            if key not in memberships:
+                ant = node.parent
+                memberships[key] = np.interp(chunk[ant.label], np.asarray(ant.universe, dtype=np.float64), np.asarray(node.mf, dtype=np.float64))
+            return memberships[key]
+
+        if isinstance(node, TermAggregate):
+            term1 = self._firing_strength(node.term1, chunk, memberships, and_func, or_func)
+            if node.kind == 'not':
+                return 1.0 - term1
+
+            term2 = self._firing_strength(node.term2, chunk, memberships, and_func, or_func)
+            return and_func(term1, term2) if node.kind == 'and' else or_func(term1, term2)
+
+        raise Exception('Unsupported FIS rule antecedent {}'.format(node))
+
+    def _defuzz_centroid(self, cuts: np.ndarray) -> np.ndarray:
+        """Centroid defuzzification of the clipped consequent membership functions.
+
+        scikit-fuzzy inserts the points where each term crosses its activation cut
+        into the output universe before integrating the piecewise linear output
+        membership function. Here the integral is taken over the regular universe
+        for every input at once and then corrected in just those universe cells
+        that contain one of the inserted points.
+        """
+
+        count = cuts.shape[0]
+        universe = self.out_universe
+        last_cell = len(universe) - 2
+
+        # Output membership function at the universe points. Each term only affects its own support
+        grid_mf = np.zeros((count, len(universe)), dtype=np.float64)
+        for idx, (mf, support) in enumerate(zip(self.out_mfs, self.out_supports)):
+            np.maximum(grid_mf[:, support], np.minimum(cuts[:, idx, None], mf[support]), out=grid_mf[:, support])
+
+        area = grid_mf @ self.area_weights
+        moment = grid_mf @ self.moment_weights
+
+        # Inserted points, sorted within each input, and the output membership function at them
+        extra = np.full((count, 2 * len(self.out_terms)), universe[0], dtype=np.float64)
+        for idx, (mf, peak) in enumerate(zip(self.out_mfs, self.out_peaks)):
+            extra[:, 2 * idx], extra[:, 2 * idx + 1] = _cut_crossings(universe, mf, peak, cuts[:, idx])
+        extra.sort(axis=1)
+
+        extra_mf = np.zeros_like(extra)
+        for idx, mf in enumerate(self.out_mfs):
+            np.maximum(extra_mf, np.minimum(cuts[:, idx, None], np.interp(extra, universe, mf)), out=extra_mf)
+
+        rows = np.arange(count)[:, None]
+        cell = np.clip(np.searchsorted(universe, extra, side='right') - 1, 0, last_cell)
+        first_in_cell = np.ones(extra.shape, dtype=bool)
+        first_in_cell[:, 1:] = cell[:, 1:] != cell[:, :-1]
+        last_in_cell = np.ones(extra.shape, dtype=bool)
+        last_in_cell[:, :-1] = cell[:, :-1] != cell[:, 1:]
+
+        cell_x1 = universe[cell]
+        cell_y1 = grid_mf[rows, cell]
+        cell_x2 = universe[cell + 1]
+        cell_y2 = grid_mf[rows, cell + 1]
+
+        # Segment ending at each inserted point starts at the previous inserted point in the same cell or the cell start
+        prev_x = np.where(first_in_cell, cell_x1, np.roll(extra, 1, axis=1))
+        prev_y = np.where(first_in_cell, cell_y1, np.roll(extra_mf, 1, axis=1))
+        sub_area, sub_moment = _segment_integrals(prev_x, prev_y, extra, extra_mf)
+
+        # The last inserted point in a cell also closes the segment to the cell end
+        end_area, end_moment = _segment_integrals(extra, extra_mf, cell_x2, cell_y2)
+        sub_area += np.where(last_in_cell, end_area, 0.0)
+        sub_moment += np.where(last_in_cell, end_moment, 0.0)
+
+        # Remove the original (unsplit) cell once
+        cell_area, cell_moment = _segment_integrals(cell_x1, cell_y1, cell_x2, cell_y2)
+        sub_area -= np.where(first_in_cell, cell_area, 0.0)
+        sub_moment -= np.where(first_in_cell, cell_moment, 0.0)
+
+        area += np.sum(sub_area, axis=1)
+        moment += np.sum(sub_moment, axis=1)
+
+        return moment / np.fmax(area, np.finfo(float).eps)
+
+
+def _segment_integrals(x1, y1, x2, y2):
+    """Area and first moment under the straight line segments (x1, y1) to (x2, y2)"""
+
+    width = x2 - x1
+    area = 0.5 * width * (y1 + y2)
+    moment = width / 6.0 * (x1 * (2.0 * y1 + y2) + x2 * (y1 + 2.0 * y2))
+    return area, moment
+
+
+def _unimodal_peak(mf: np.ndarray, label: str) -> int:
+    """Index of the maximum of a membership function that rises then falls"""
+
+    peak = int(np.argmax(mf))
+    if np.any(np.diff(mf[:peak + 1]) < 0) or np.any(np.diff(mf[peak:]) > 0):
+        raise Exception('BatchFIS requires unimodal consequent membership functions. Term {} is not.'.format(label))
+    return peak
+
+
+def _support(mf: np.ndarray) -> slice:
+    """Slice of the universe over which a membership function is non-zero"""
+
+    nonzero = np.flatnonzero(mf > 0)
+    if len(nonzero) == 0:
+        return slice(0, 0)
+    return slice(int(nonzero[0]), int(nonzero[-1]) + 1)
+
+
+def _cut_crossings(universe: np.ndarray, mf: np.ndarray, peak: int, cuts: np.ndarray):
+    """Universe values where a unimodal membership function crosses each cut level.
+
+    Mirrors skfuzzy's _interp_universe_fast(). Inputs without a crossing (or with a zero
+    cut, which only produces existing universe points) return universe[0], which adds
+    a zero width segment and leaves the centroid unchanged.
+    """
+
+    last = len(universe) - 1
+    valid = (cuts > 0) & (cuts <= mf[peak])
+
+    # First index at or above the cut on the rising limb and last index at or above it on the falling limb
+    first_above = np.searchsorted(mf[:peak + 1], cuts, side='left')
+    last_above = last - np.searchsorted(mf[peak:][::-1], cuts, side='left')
+
+    rising = np.full(cuts.shape, universe[0])
+    falling = np.full(cuts.shape, universe[0])
+
+    has_rise = valid & (first_above > 0)
+    j = first_above[has_rise] - 1
+    rising[has_rise] = universe[j] + (cuts[has_rise] - mf[j]) * (universe[j + 1] - universe[j]) / (mf[j + 1] - mf[j])
+
+    has_fall = valid & (last_above < last)
+    j = last_above[has_fall]
+    falling[has_fall] = universe[j] + (cuts[has_fall] - mf[j]) * (universe[j + 1] - universe[j]) / (mf[j + 1] - mf[j])
+
+    return rising, falling
@@ -7,7 +7,9 @@ import argparse
 import os
 import sys
 import traceback
+import numpy as np
 from rscommons import Logger, dotenv
+from rscommons.math import compile_equation
 from rscommons.database import write_db_attributes, SQLiteCon, load_attributes
 
 
@@ -94,27 +96,23 @@ def calculate_hydrology(reaches: dict, equation: str, params: dict, drainage_con
         [type]: [description]
     """
 
-    results = {}
-
     log = Logger('Hydrology')
 
-    try:
-        # Loop over each reach
-        for reachid, values in reaches.items():
-
-            # Use the drainage area for the current reach and convert to the units used in the equation
-            params[DRNAREA_PARAM] = values['iGeo_DA'] * drainage_conversion_factor
+    # Convert the drainage area of every reach to the units used in the equation
+    reach_ids = list(reaches.keys())
+    fn_params = dict(params)
+    fn_params[DRNAREA_PARAM] = np.array([values['iGeo_DA'] for values in reaches.values()], dtype=np.float64) * drainage_conversion_factor
 
-            # Execute the equation but restrict the use of all built-in functions
-            eval_result = eval(equation, {'__builtins__': None}, params)
-            results[reachid] = {field: eval_result}
+    try:
+        # The equation is validated once and then evaluated for all the reaches together
+        discharges = compile_equation(equation).evaluate(fn_params, count=len(reach_ids))
     except Exception as ex:
         [log.warning('{}: {}'.format(param, value)) for param, value in params.items()]
         log.warning('Hydrology formula failed: {}'.format(equation))
-        log.error('Error calculating {} hydrology')
+        log.error('Error calculating {} hydrology'.format(field))
         raise ex
 
-    return results
+    return {reachid: {field: discharge} for reachid, discharge in zip(reach_ids, discharges.tolist())}
 
 
 def main():
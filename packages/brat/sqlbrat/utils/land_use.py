@@ -4,9 +4,9 @@
     17 Oct 2019
 """
 import argparse
-import sqlite3
+import numpy as np
 from rscommons import Logger, dotenv
-from rscommons.database import write_db_attributes
+from rscommons.database import write_db_attributes, get_connection
 
 
 def land_use(database: str, buffer: float):
@@ -24,6 +24,10 @@ def land_use(database: str, buffer: float):
 def calculate_land_use(database: str, buffer: float):
     """ Perform actual land use intensity calculation
 
+    The vegetation cells of every reach are read with one scan of ReachVegetation and
+    the mean intensity and the proportion of each intensity class are calculated by
+    grouping the cells by reach.
+
     Args:
         database (str): [description]
         buffer (float): [description]
@@ -35,52 +39,59 @@ def calculate_land_use(database: str, buffer: float):
     log = Logger('Land Use')
     log.info('Calculating land use using a buffer distance of {:,}m'.format(buffer))
 
-    conn = sqlite3.connect(database)
+    conn = get_connection(database)
+
     curs = conn.cursor()
+    curs.row_factory = None
 
-    # Calculate the average land use intensity and also retrieve the total number of cells for each reach
-    curs.execute('SELECT RV.ReachID, 100.0 * SUM(Intensity * CAST(CellCount AS REAL)) / CAST(TotalCells AS REAL) AS Intensity'
+    # Every vegetation cell count in the buffer with its land use intensity (NULL when the
+    # vegetation type has no land use) and whether it belongs to the existing epoch
+    curs.execute('SELECT RV.ReachID, RV.CellCount, L.Intensity, COALESCE(EP.Metadata = "EX", 0)'
                  ' FROM ReachVegetation RV'
-                 ' INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID'
-                 ' INNER JOIN LandUses L ON VT.LandUseID = L.LandUseID'
-                 ' INNER JOIN Epochs EP ON VT.EpochID = EP.EpochID'
-                 ' INNER JOIN (SELECT ReachID, SUM(CellCount) AS TotalCells FROM ReachVegetation WHERE Buffer = ? GROUP BY ReachID) AS RS ON RV.ReachID = RS.ReachID'
-                 ' WHERE (Buffer = ?) AND (EP.Metadata = "EX")'
-                 ' GROUP BY RV.ReachID', [buffer, buffer])
-
-    results = {row[0]: {'iPC_LU': row[1], 'Cumulative': 0.0} for row in curs.fetchall()}
+                 ' LEFT JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID'
+                 ' LEFT JOIN LandUses L ON VT.LandUseID = L.LandUseID'
+                 ' LEFT JOIN Epochs EP ON VT.EpochID = EP.EpochID'
+                 ' WHERE RV.Buffer = ?', [buffer])
+    rows = curs.fetchall()
+
+    reach_ids, groups = np.unique(np.array([row[0] for row in rows], dtype=np.int64), return_inverse=True)
+    cells = np.array([row[1] for row in rows], dtype=np.float64)
+    intensity = np.array([row[2] if row[2] is not None else np.nan for row in rows], dtype=np.float64)
+    existing = np.array([row[3] for row in rows], dtype=bool)
+    land_use_cells = existing & ~np.isnan(intensity)
+
+    # The mean intensity is relative to the cells of all epochs. The class proportions are
+    # relative to the cells of the existing epoch (including those without a land use)
+    total_cells = np.bincount(groups, weights=cells, minlength=len(reach_ids))
+    existing_cells = np.bincount(groups[existing], weights=cells[existing], minlength=len(reach_ids))
+    weighted_intensity = np.bincount(groups[land_use_cells], weights=intensity[land_use_cells] * cells[land_use_cells], minlength=len(reach_ids))
+
+    # Only reaches with existing vegetation that has a land use get values
+    has_land_use = np.bincount(groups[land_use_cells], minlength=len(reach_ids)) > 0
+    results = {int(reach_ids[idx]): {'iPC_LU': 100.0 * weighted_intensity[idx] / total_cells[idx], 'Cumulative': 0.0} for idx in np.flatnonzero(has_land_use)}
 
     # Get the land use intensity classes in ASCENDING ORDER OF INTENSITY
     curs.execute('SELECT Name, MaxIntensity, TargetCol FROM LandUseIntensities ORDER BY MaxIntensity ASC')
     luclasses = [(row[0], row[1], row[2]) for row in curs.fetchall()]
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportions = land_use_cells * cells / existing_cells[groups]
+
     for name, max_intensity, target_col in luclasses:
         log.info('Processing {} land use intensity class ({}) with max intensity of {}'.format(name, target_col, max_intensity))
 
-        # Ensure all reaches initialized with zero proportion (because following code skips classes without values in DB)
-        for values in results.values():
-            values[target_col] = 0.0
-
-        # Calculate the number
-        curs.execute("""SELECT RV.ReachID, 100.0 * SUM(CAST(CellCount AS REAL) / CAST(TotalCells AS REAL)) AS Proportion
-                      FROM ReachVegetation RV
-                      INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID
-                      INNER JOIN LandUses L ON VT.LandUseID = L.LandUseID
-                      INNER JOIN Epochs EP ON VT.EpochID = EP.EpochID
-                      INNER JOIN (
-                         SELECT ReachID, SUM(CellCount) AS TotalCells
-                         FROM ReachVegetation RV
-                             INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID
-                             INNER JOIN Epochs E ON VT.EpochID = E.EpochID
-                         WHERE (Buffer = ? AND E.Metadata = 'EX') GROUP BY ReachID
-                      ) AS RS ON RV.ReachID = RS.ReachID
-                      WHERE (Buffer = ?) AND (EP.Metadata = 'EX') AND (Intensity <= ?)
-                      GROUP BY RV.ReachID
-                      """, [buffer, buffer, max_intensity])
-
-        for row in curs.fetchall():
-            results[row[0]][target_col] = row[1] - results[row[0]]['Cumulative']
-            results[row[0]]['Cumulative'] = row[1]
+        # Cumulative proportion of the existing cells with an intensity up to the class maximum
+        in_class = land_use_cells & (intensity <= max_intensity)
+        cumulative = 100.0 * np.bincount(groups[in_class], weights=proportions[in_class], minlength=len(reach_ids))
+        reached = np.bincount(groups[in_class], minlength=len(reach_ids)) > 0
+
+        for idx in np.flatnonzero(has_land_use):
+            values = results[int(reach_ids[idx])]
+            if reached[idx]:
+                values[target_col] = float(cumulative[idx]) - values['Cumulative']
+                values['Cumulative'] = float(cumulative[idx])
+            else:
+                values[target_col] = 0.0
 
     log.info('Land use intensity calculation complete.')
     return results
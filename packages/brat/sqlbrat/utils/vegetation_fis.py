@@ -16,6 +16,7 @@ from skfuzzy import control as ctrl
 from rscommons import Logger, ProgressBar, dotenv
 from rscommons.database import load_attributes
 from rscommons.database import write_db_attributes
+from sqlbrat.utils.fis_engine import BatchFIS
 
 
 def vegetation_fis(database: str, label: str, veg_type: str):
@@ -42,34 +43,12 @@ def vegetation_fis(database: str, label: str, veg_type: str):
     log.info('Process completed successfully.')
 
 
-def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, riparian_field: str, out_field: str):
-    """
-    Beaver dam capacity vegetation FIS
-    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
-    :param streamside_field: Name of the feature streamside vegetation attribute
-    :param riparian_field: Name of the riparian vegetation attribute
-    :return: Inserts 'FIS' key into feature dictionaries with the vegetation FIS values
-    """
-
-    log = Logger('Vegetation FIS')
-
-    feature_count = len(feature_values)
-    reachid_array = np.zeros(feature_count, np.int64)
-    riparian_array = np.zeros(feature_count, np.float64)
-    streamside_array = np.zeros(feature_count, np.float64)
+def vegetation_fis_system():
+    """Build the scikit-fuzzy control system for the vegetation FIS
 
-    counter = 0
-    for reach_id, values in feature_values.items():
-        reachid_array[counter] = reach_id
-        riparian_array[counter] = values[riparian_field]
-        streamside_array[counter] = values[streamside_field]
-        counter += 1
-
-    # Ensure vegetation inputs are within the 0-4 range
-    riparian_array[riparian_array < 0] = 0
-    riparian_array[riparian_array > 4] = 4
-    streamside_array[streamside_array < 0] = 0
-    streamside_array[streamside_array > 4] = 4
+    Returns:
+        ctrl.ControlSystem -- 25 rule vegetation FIS with 'input1' (riparian), 'input2' (streamside) and 'result' (density)
+    """
 
     # create antecedent (input) and consequent (output) objects to hold universe variables and membership functions
     riparian = ctrl.Antecedent(np.arange(0, 4, 0.01), 'input1')
@@ -96,7 +75,7 @@ def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, ripar
     density['pervasive'] = fuzz.trapmf(density.universe, [12, 25, 45, 45])
 
     # build fis rule table
-    veg_ctrl = ctrl.ControlSystem([
+    return ctrl.ControlSystem([
         ctrl.Rule(riparian['unsuitable'] & streamside['unsuitable'], density['none']),
         ctrl.Rule(riparian['barely'] & streamside['unsuitable'], density['rare']),
         ctrl.Rule(riparian['moderately'] & streamside['unsuitable'], density['rare']),
@@ -123,7 +102,39 @@ def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, ripar
         ctrl.Rule(riparian['suitable'] & streamside['preferred'], density['pervasive']),
         ctrl.Rule(riparian['preferred'] & streamside['preferred'], density['pervasive'])
     ])
-    veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
+
+
+def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, riparian_field: str, out_field: str, reference: bool = False):
+    """
+    Beaver dam capacity vegetation FIS
+    :param feature_values: Dictionary of features keyed by ReachID and values are dictionaries of attributes
+    :param streamside_field: Name of the feature streamside vegetation attribute
+    :param riparian_field: Name of the riparian vegetation attribute
+    :param reference: Evaluate each reach with scikit-fuzzy instead of the vectorized BatchFIS engine
+    :return: Inserts 'FIS' key into feature dictionaries with the vegetation FIS values
+    """
+
+    log = Logger('Vegetation FIS')
+
+    feature_count = len(feature_values)
+    reachid_array = np.zeros(feature_count, np.int64)
+    riparian_array = np.zeros(feature_count, np.float64)
+    streamside_array = np.zeros(feature_count, np.float64)
+
+    counter = 0
+    for reach_id, values in feature_values.items():
+        reachid_array[counter] = reach_id
+        riparian_array[counter] = values[riparian_field]
+        streamside_array[counter] = values[streamside_field]
+        counter += 1
+
+    # Ensure vegetation inputs are within the 0-4 range
+    riparian_array[riparian_array < 0] = 0
+    riparian_array[riparian_array > 4] = 4
+    streamside_array[streamside_array < 0] = 0
+    streamside_array[streamside_array > 4] = 4
+
+    veg_ctrl = vegetation_fis_system()
 
     # calculate defuzzified centroid value for density 'none' MF group
     # this will be used to re-classify output values that fall in this group
@@ -137,13 +148,23 @@ def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, ripar
     defuzz_pervasive = round(fuzz.defuzz(x_vals, mfx_pervasive, 'centroid'))
 
     # run fuzzy inference system on inputs and defuzzify output
-    progbar = ProgressBar(len(reachid_array), 50, "Vegetation FIS")
-    counter = 0
+    if reference:
+        results = np.zeros(feature_count, np.float64)
+        veg_fis = ctrl.ControlSystemSimulation(veg_ctrl)
+        progbar = ProgressBar(len(reachid_array), 50, "Vegetation FIS")
+        for i in range(feature_count):
+            veg_fis.input['input1'] = riparian_array[i]
+            veg_fis.input['input2'] = streamside_array[i]
+            veg_fis.compute()
+            results[i] = veg_fis.output['result']
+            progbar.update(i + 1)
+        progbar.finish()
+    else:
+        log.info('Running vegetation FIS on {:,} reaches'.format(feature_count))
+        results = BatchFIS(veg_ctrl).compute({'input1': riparian_array, 'input2': streamside_array})
+
     for i, reach_id in enumerate(reachid_array):
-        veg_fis.input['input1'] = riparian_array[i]
-        veg_fis.input['input2'] = streamside_array[i]
-        veg_fis.compute()
-        result = veg_fis.output['result']
+        result = float(results[i])
 
         # set ovc_* to 0 if output falls fully in 'none' category and to 40 if falls fully in 'pervasive' category
         if round(result, 6) == defuzz_centroid:
@@ -154,10 +175,6 @@ def calculate_vegegtation_fis(feature_values: dict, streamside_field: str, ripar
 
         feature_values[reach_id][out_field] = round(result, 2)
 
-        counter += 1
-        progbar.update(counter)
-
-    progbar.finish()
     log.info('Done')
 
 
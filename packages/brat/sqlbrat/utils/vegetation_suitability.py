@@ -11,10 +11,10 @@ import argparse
 import os
 import sys
 import traceback
-import rasterio
 import numpy as np
-from rscommons import Logger, ProgressBar, dotenv
+from rscommons import Logger, dotenv
 from rscommons.database import write_db_attributes, SQLiteCon
+from rscommons.reclass import ReclassTable, reclass_raster
 
 
 def vegetation_suitability(gpkg_path: str, buffer: float, prefix: str, ecoregion: str):
@@ -115,36 +115,11 @@ def output_vegetation_raster(gpkg_path, raster_path, output_path, epoch, prefix,
                               'WHERE EpochID = ? AND EcoregionID = ?', [epochid, ecoregion])
         results = {row['VegetationID']: row['EffectiveSuitability'] for row in database.curs.fetchall()}
 
-    def translate_suit(in_val, in_nodata, out_nodata):
-        if in_val == in_nodata:
-            return out_nodata
-        elif in_val in results:
-            return results[in_val]
-        log.warning('Could not find {} VegetationID={}'.format(prefix, in_val))
-        return -1
-
-    vector = np.vectorize(translate_suit)
-
-    with rasterio.open(raster_path) as source_ds:
-        out_meta = source_ds.meta
-        out_meta['dtype'] = 'int16'
-        out_meta['nodata'] = -9999
-        out_meta['compress'] = 'deflate'
-
-        with rasterio.open(output_path, "w", **out_meta) as dest_ds:
-            progbar = ProgressBar(len(list(source_ds.block_windows(1))), 50, "Writing Vegetation Raster: {}".format(epoch))
-            counter = 0
-            for ji, window in dest_ds.block_windows(1):
-                progbar.update(counter)
-                counter += 1
-                in_data = source_ds.read(1, window=window, masked=True)
-
-                # Fill the masked values with the appropriate nodata vals
-                # Unthresholded in the base band (mostly for debugging)
-                out_data = vector(in_data, source_ds.meta['nodata'], out_meta['nodata'])
-                dest_ds.write(np.int16(out_data), window=window, indexes=1)
-
-            progbar.finish()
+    # VegetationIDs missing from the database get a suitability of -1
+    table = ReclassTable(results, default=-1, dtype=np.int16)
+    missing = reclass_raster(raster_path, [(output_path, table, -9999)], "Writing Vegetation Raster: {}".format(epoch), compress='deflate')
+    for vegetation_id in missing[output_path]:
+        log.warning('Could not find {} VegetationID={}'.format(prefix, vegetation_id))
 
 
 def main():
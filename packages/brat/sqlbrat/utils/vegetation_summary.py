@@ -5,15 +5,11 @@
    28 Aug 2019
 """
 import os
-import numpy as np
 from osgeo import gdal, ogr
-import rasterio
-import sqlite3
-from rasterio.mask import mask
 from rscommons import GeopackageLayer, Logger
-from rscommons.database import SQLiteCon
+from rscommons.database import SQLiteCon, batch_insert
 from rscommons.classes.vector_base import VectorBase
-from shapely.geometry.base import GEOMETRY_TYPES
+from rscommons.zonal_stats import zonal_tally
 
 
 def vegetation_summary(outputs_gpkg_path: str, label: str, veg_raster: str, buffer: float, save_polygons_path: str):
@@ -40,10 +36,9 @@ def vegetation_summary(outputs_gpkg_path: str, label: str, veg_raster: str, buff
     conversion_factor = VectorBase.rough_convert_metres_to_raster_units(veg_raster, 1.0)
     cell_area = abs(geo_transform[1] * geo_transform[5]) / conversion_factor**2
 
-    # Open the raster and then loop over all polyline features
-    veg_counts = []
+    # Buffer all the reaches and then tally the vegetation under them in a single pass over the raster
     polygons = {}
-    with rasterio.open(veg_raster) as src, GeopackageLayer(os.path.join(outputs_gpkg_path, 'ReachGeometry')) as lyr:
+    with GeopackageLayer(os.path.join(outputs_gpkg_path, 'ReachGeometry')) as lyr:
         _srs, transform = VectorBase.get_transform_from_raster(lyr.spatial_ref, veg_raster)
         spatial_ref = lyr.spatial_ref
 
@@ -53,46 +48,24 @@ def vegetation_summary(outputs_gpkg_path: str, label: str, veg_raster: str, buff
             if transform:
                 geom.Transform(transform)
 
-            polygon = VectorBase.ogr2shapely(geom).buffer(raster_buffer)
-            polygons[reach_id] = polygon
-
-            try:
-                # retrieve an array for the cells under the polygon
-                raw_raster = mask(src, [polygon], crop=True)[0]
-                mask_raster = np.ma.masked_values(raw_raster, src.nodata)
-                # print(mask_raster)
-
-                # Reclass the raster to dam suitability. Loop over present values for performance
-                for oldvalue in np.unique(mask_raster):
-                    if oldvalue is not np.ma.masked:
-                        cell_count = np.count_nonzero(mask_raster == oldvalue)
-                        veg_counts.append([reach_id, int(oldvalue), buffer, cell_count * cell_area, cell_count])
-            except Exception as ex:
-                log.warning('Error obtaining vegetation raster values for ReachID {}'.format(reach_id))
-                log.warning(ex)
-
-    # Write the reach vegetation values to the database
-    # Because sqlite3 doesn't give us any feedback we do this in batches so that we can figure out what values
-    # Are causing constraint errors
+            polygons[reach_id] = VectorBase.ogr2shapely(geom).buffer(raster_buffer)
+
+    tallies = zonal_tally(polygons, veg_raster)
+
+    veg_counts = []
+    for reach_id, tally in tallies.items():
+        veg_counts.extend([reach_id, int(value), buffer, cell_count * cell_area, cell_count] for value, cell_count in tally.items() if int(value) != -9999)
+
+    missing = sum(1 for tally in tallies.values() if len(tally) == 0)
+    if missing > 0:
+        log.warning('{:,} reaches have no vegetation raster values within the {}m buffer'.format(missing, int(buffer)))
+
+    # Write the reach vegetation values to the database in one transaction
     with SQLiteCon(outputs_gpkg_path) as database:
-        errs = 0
-        batch_count = 0
-        for veg_record in veg_counts:
-            batch_count += 1
-            if int(veg_record[1]) != -9999:
-                try:
-                    database.conn.execute('INSERT INTO ReachVegetation (ReachID, VegetationID, Buffer, Area, CellCount) VALUES (?, ?, ?, ?, ?)', veg_record)
-                # Sqlite can't report on SQL errors so we have to print good log messages to help intuit what the problem is
-                except sqlite3.IntegrityError as err:
-                    # THis is likely a constraint error.
-                    errstr = "Integrity Error when inserting records: ReachID: {} VegetationID: {}".format(veg_record[0], veg_record[1])
-                    log.error(errstr)
-                    errs += 1
-                except sqlite3.Error as err:
-                    # This is any other kind of error
-                    errstr = "SQL Error when inserting records: ReachID: {} VegetationID: {} ERROR: {}".format(veg_record[0], veg_record[1], str(err))
-                    log.error(errstr)
-                    errs += 1
+        errs = batch_insert(database.conn,
+                            'INSERT INTO ReachVegetation (ReachID, VegetationID, Buffer, Area, CellCount) VALUES (?, ?, ?, ?, ?)',
+                            veg_counts,
+                            lambda veg_record: 'ReachID: {} VegetationID: {}'.format(veg_record[0], veg_record[1]))
         if errs > 0:
             raise Exception('Errors were found inserting records into the database. Cannot continue.')
         database.conn.commit()
@@ -0,0 +1,99 @@
+""" Parity tests between the vectorized BatchFIS engine
+    and the per-reach scikit-fuzzy evaluation
+"""
+import unittest
+import numpy as np
+from skfuzzy import control as ctrl
+from sqlbrat.utils.fis_engine import BatchFIS
+from sqlbrat.utils.vegetation_fis import vegetation_fis_system, calculate_vegegtation_fis
+from sqlbrat.utils.combined_fis import combined_fis_system, calculate_combined_fis
+
+
+def skfuzzy_compute(control_system, inputs: dict) -> np.ndarray:
+    """Reference evaluation of a control system one element at a time"""
+
+    sim = ctrl.ControlSystemSimulation(control_system)
+    count = len(next(iter(inputs.values())))
+    results = np.zeros(count)
+    for i in range(count):
+        for label, values in inputs.items():
+            sim.input[label] = values[i]
+        sim.compute()
+        results[i] = sim.output['result']
+    return results
+
+
+class VegetationFISTest(unittest.TestCase):
+
+    def setUp(self):
+        super(VegetationFISTest, self).setUp()
+        rng = np.random.default_rng(42)
+        # Random values plus the membership function break points and the universe limits
+        breaks = np.array([0, 0.1, 1, 2, 3, 3.99, 4])
+        self.riparian = np.concatenate([rng.uniform(0, 4, 300), np.repeat(breaks, len(breaks))])
+        self.streamside = np.concatenate([rng.uniform(0, 4, 300), np.tile(breaks, len(breaks))])
+
+    def test_batch_matches_skfuzzy(self):
+        veg_ctrl = vegetation_fis_system()
+        inputs = {'input1': self.riparian, 'input2': self.streamside}
+
+        expected = skfuzzy_compute(veg_ctrl, inputs)
+        actual = BatchFIS(veg_ctrl, chunk_size=64).compute(inputs)
+
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-6)
+
+    def test_calculate_reference_mode(self):
+        batch = {reach: {'iVeg_30EX': s, 'iVeg100EX': r} for reach, (r, s) in enumerate(zip(self.riparian, self.streamside))}
+        reference = {reach: dict(values) for reach, values in batch.items()}
+
+        calculate_vegegtation_fis(batch, 'iVeg_30EX', 'iVeg100EX', 'oVC_EX')
+        calculate_vegegtation_fis(reference, 'iVeg_30EX', 'iVeg100EX', 'oVC_EX', reference=True)
+
+        for reach, values in reference.items():
+            self.assertAlmostEqual(batch[reach]['oVC_EX'], values['oVC_EX'], delta=0.01)
+
+
+class CombinedFISTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CombinedFISTest, self).setUp()
+        rng = np.random.default_rng(7)
+        count = 200
+        self.ovc = np.concatenate([rng.uniform(0, 45, count), [0, 0.1, 1.5, 8, 25, 45]])
+        self.sp2 = np.concatenate([rng.uniform(0, 3000, count), [0.0001, 1000, 1200, 1600, 2400, 10000]])
+        self.splow = np.concatenate([rng.uniform(0, 250, count), [0.0001, 150, 175, 180, 190, 10000]])
+        self.slope = np.concatenate([rng.uniform(0, 0.3, count), [0, 0.0002, 0.005, 0.15, 0.23, 1]])
+
+    def test_batch_matches_skfuzzy(self):
+        comb_ctrl = combined_fis_system()
+        inputs = {'input1': self.ovc, 'input2': self.sp2, 'input3': self.splow, 'input4': self.slope}
+
+        expected = skfuzzy_compute(comb_ctrl, inputs)
+        actual = BatchFIS(comb_ctrl, chunk_size=50).compute(inputs)
+
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-6)
+
+    def test_calculate_reference_mode(self):
+        batch = {}
+        for reach, values in enumerate(zip(self.ovc, self.sp2, self.splow, self.slope)):
+            batch[reach] = {
+                'oVC_EX': values[0],
+                'iHyd_SP2': values[1],
+                'iHyd_SPLow': values[2],
+                'iGeo_Slope': values[3],
+                'iGeo_DA': float(reach % 50),
+                'iGeo_Len': 500.0,
+                'ReachCode': 33600 if reach % 7 == 0 else 46006
+            }
+        reference = {reach: dict(values) for reach, values in batch.items()}
+
+        calculate_combined_fis(batch, 'oVC_EX', 'oCC_EX', 'mCC_EX_CT', 30)
+        calculate_combined_fis(reference, 'oVC_EX', 'oCC_EX', 'mCC_EX_CT', 30, reference=True)
+
+        for reach, values in reference.items():
+            self.assertAlmostEqual(batch[reach]['oCC_EX'], values['oCC_EX'], delta=0.01)
+            self.assertAlmostEqual(batch[reach]['mCC_EX_CT'], values['mCC_EX_CT'], delta=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
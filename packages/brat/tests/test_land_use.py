@@ -0,0 +1,157 @@
+""" Parity tests between the single scan land use intensity calculation
+    and the previous per reach and per intensity class queries
+"""
+import os
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+from rscommons.database import close_connections
+from rscommons.util import safe_remove_dir
+from sqlbrat.utils.land_use import calculate_land_use
+
+SCHEMA = [
+    'CREATE TABLE Epochs (EpochID INTEGER PRIMARY KEY NOT NULL, Name TEXT NOT NULL UNIQUE, Metadata TEXT, Notes TEXT)',
+    'CREATE TABLE LandUses (LandUseID INTEGER PRIMARY KEY NOT NULL, Name TEXT UNIQUE NOT NULL, Intensity REAL NOT NULL DEFAULT (0))',
+    'CREATE TABLE LandUseIntensities (IntensityID INTEGER PRIMARY KEY NOT NULL, Name TEXT UNIQUE NOT NULL, MaxIntensity REAL NOT NULL UNIQUE, TargetCol TEXT UNIQUE NOT NULL)',
+    'CREATE TABLE VegetationTypes (VegetationID INTEGER PRIMARY KEY NOT NULL, EpochID INTEGER REFERENCES Epochs (EpochID) NOT NULL, Name TEXT NOT NULL, LandUseID INTEGER REFERENCES LandUses (LandUseID))',
+    'CREATE TABLE ReachVegetation (ReachID INTEGER NOT NULL, VegetationID INTEGER REFERENCES VegetationTypes (VegetationID) NOT NULL, Buffer REAL NOT NULL, Area REAL NOT NULL, CellCount REAL NOT NULL, PRIMARY KEY (ReachID, VegetationID, Buffer))',
+    'CREATE INDEX IX_ReachVegetation_Buffer ON ReachVegetation (Buffer, ReachID, VegetationID, CellCount)'
+]
+
+# VegetationID, EpochID and LandUseID (None for vegetation without a land use)
+VEGETATION_TYPES = [
+    (1, 1, 1), (2, 1, 2), (3, 1, 3), (4, 1, 4), (5, 1, None),
+    (6, 2, 1), (7, 2, 3), (8, 2, None)
+]
+
+
+def legacy_calculate_land_use(database: str, buffer: float) -> dict:
+    """The previous calculate_land_use() with one query per land use intensity class"""
+
+    conn = sqlite3.connect(database)
+    curs = conn.cursor()
+    curs.execute('SELECT RV.ReachID, 100.0 * SUM(Intensity * CAST(CellCount AS REAL)) / CAST(TotalCells AS REAL) AS Intensity'
+                 ' FROM ReachVegetation RV'
+                 ' INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID'
+                 ' INNER JOIN LandUses L ON VT.LandUseID = L.LandUseID'
+                 ' INNER JOIN Epochs EP ON VT.EpochID = EP.EpochID'
+                 ' INNER JOIN (SELECT ReachID, SUM(CellCount) AS TotalCells FROM ReachVegetation WHERE Buffer = ? GROUP BY ReachID) AS RS ON RV.ReachID = RS.ReachID'
+                 ' WHERE (Buffer = ?) AND (EP.Metadata = "EX")'
+                 ' GROUP BY RV.ReachID', [buffer, buffer])
+    results = {row[0]: {'iPC_LU': row[1], 'Cumulative': 0.0} for row in curs.fetchall()}
+
+    curs.execute('SELECT Name, MaxIntensity, TargetCol FROM LandUseIntensities ORDER BY MaxIntensity ASC')
+    for _name, max_intensity, target_col in curs.fetchall():
+        for values in results.values():
+            values[target_col] = 0.0
+
+        curs.execute("""SELECT RV.ReachID, 100.0 * SUM(CAST(CellCount AS REAL) / CAST(TotalCells AS REAL)) AS Proportion
+                      FROM ReachVegetation RV
+                      INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID
+                      INNER JOIN LandUses L ON VT.LandUseID = L.LandUseID
+                      INNER JOIN Epochs EP ON VT.EpochID = EP.EpochID
+                      INNER JOIN (
+                         SELECT ReachID, SUM(CellCount) AS TotalCells
+                         FROM ReachVegetation RV
+                             INNER JOIN VegetationTypes VT ON RV.VegetationID = VT.VegetationID
+                             INNER JOIN Epochs E ON VT.EpochID = E.EpochID
+                         WHERE (Buffer = ? AND E.Metadata = 'EX') GROUP BY ReachID
+                      ) AS RS ON RV.ReachID = RS.ReachID
+                      WHERE (Buffer = ?) AND (EP.Metadata = 'EX') AND (Intensity <= ?)
+                      GROUP BY RV.ReachID
+                      """, [buffer, buffer, max_intensity])
+
+        for row in curs.fetchall():
+            results[row[0]][target_col] = row[1] - results[row[0]]['Cumulative']
+            results[row[0]]['Cumulative'] = row[1]
+
+    conn.close()
+    return results
+
+
+class LandUseTest(unittest.TestCase):
+
+    def setUp(self):
+        super(LandUseTest, self).setUp()
+        self.temp_dir = mkdtemp()
+        self.database = os.path.join(self.temp_dir, 'brat.gpkg')
+
+        conn = sqlite3.connect(self.database)
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.executemany('INSERT INTO Epochs (EpochID, Name, Metadata) VALUES (?, ?, ?)', [(1, 'Existing', 'EX'), (2, 'Historic', 'HPE')])
+        conn.executemany('INSERT INTO LandUses (LandUseID, Name, Intensity) VALUES (?, ?, ?)', [(1, 'Natural', 0.0), (2, 'Agricultural', 0.33), (3, 'Developed', 0.66), (4, 'Urban', 1.0)])
+        conn.executemany('INSERT INTO LandUseIntensities (IntensityID, Name, MaxIntensity, TargetCol) VALUES (?, ?, ?, ?)', [
+            (1, 'Very Low', 0, 'iPC_VLowLU'), (2, 'Low', 0.33, 'iPC_LowLU'), (3, 'Moderate', 0.66, 'iPC_ModLU'), (4, 'High', 1, 'iPC_HighLU')])
+        conn.executemany('INSERT INTO VegetationTypes (VegetationID, EpochID, Name, LandUseID) VALUES (?, ?, ?, ?)', [
+            (veg_id, epoch_id, 'Vegetation {}'.format(veg_id), land_use_id) for veg_id, epoch_id, land_use_id in VEGETATION_TYPES])
+
+        rows = [
+            # Existing vegetation of every intensity in both buffers
+            (1, 1, 100.0, 10), (1, 2, 100.0, 20), (1, 3, 100.0, 30), (1, 4, 100.0, 40), (1, 2, 30.0, 5),
+            # Only historic vegetation
+            (2, 6, 100.0, 50), (2, 7, 100.0, 25),
+            # Only existing vegetation without a land use
+            (3, 5, 100.0, 12),
+            # Existing vegetation with and without a land use and historic vegetation
+            (4, 3, 100.0, 15), (4, 5, 100.0, 5), (4, 7, 100.0, 30), (4, 8, 100.0, 10),
+            # Only in the 30m buffer
+            (5, 4, 30.0, 8), (5, 1, 30.0, 2)
+        ]
+
+        # Random samples of the vegetation types for more reaches. Reach 6 has no vegetation rows at all
+        rng = np.random.default_rng(3)
+        for reach_id in range(7, 60):
+            for veg_id in rng.choice([veg_id for veg_id, _epoch_id, _land_use_id in VEGETATION_TYPES], int(rng.integers(1, 6)), replace=False):
+                for buffer in [30.0, 100.0]:
+                    rows.append((reach_id, int(veg_id), buffer, int(rng.integers(1, 200))))
+
+        conn.executemany('INSERT INTO ReachVegetation (ReachID, VegetationID, Buffer, Area, CellCount) VALUES (?, ?, ?, ?, ?)',
+                         [(reach_id, veg_id, buffer, cells * 900.0, cells) for reach_id, veg_id, buffer, cells in rows])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        close_connections()
+        safe_remove_dir(self.temp_dir)
+
+    def assert_matches_legacy(self, buffer: float) -> dict:
+        legacy = legacy_calculate_land_use(self.database, buffer)
+        results = calculate_land_use(self.database, buffer)
+
+        self.assertEqual(sorted(results.keys()), sorted(legacy.keys()))
+        for reach_id, values in legacy.items():
+            self.assertEqual(sorted(results[reach_id].keys()), sorted(values.keys()))
+            for field, value in values.items():
+                self.assertTrue(np.isclose(results[reach_id][field], value, rtol=1e-12, atol=1e-12),
+                                'Reach {} {} is {} instead of {}'.format(reach_id, field, results[reach_id][field], value))
+        return results
+
+    def test_buffer_100(self):
+        results = self.assert_matches_legacy(100.0)
+
+        # Reaches without existing vegetation that has a land use get no values
+        for reach_id in [2, 3, 5, 6]:
+            self.assertNotIn(reach_id, results)
+
+        self.assertAlmostEqual(results[1]['iPC_LU'], 100.0 * (20 * 0.33 + 30 * 0.66 + 40 * 1.0) / 100)
+        self.assertAlmostEqual(results[1]['iPC_VLowLU'], 10.0)
+        self.assertAlmostEqual(results[1]['iPC_HighLU'], 40.0)
+
+        # The mean intensity is relative to all the cells and the classes to the existing cells
+        self.assertAlmostEqual(results[4]['iPC_LU'], 100.0 * 15 * 0.66 / 60)
+        self.assertAlmostEqual(results[4]['iPC_ModLU'], 75.0)
+        self.assertAlmostEqual(results[4]['iPC_VLowLU'], 0.0)
+
+    def test_buffer_30(self):
+        results = self.assert_matches_legacy(30.0)
+        self.assertIn(5, results)
+        self.assertNotIn(6, results)
+
+    def test_no_vegetation(self):
+        self.assertEqual(self.assert_matches_legacy(50.0), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,13 +13,14 @@ import traceback
 import time
 from typing import List, Dict
 
+import numpy as np
 from osgeo import ogr
 from rscommons.classes.rs_project import RSMeta, RSMetaTypes
 
 from rscommons.util import safe_makedirs, parse_metadata, pretty_duration
 from rscommons import RSProject, RSLayer, ModelConfig, Logger, dotenv, initGDALOGRErrors
 from rscommons import GeopackageLayer
-from rscommons.math import safe_eval
+from rscommons.math import compile_equation
 from rscommons.raster_buffer_stats import raster_buffer_stats2
 from rscommons.vector_ops import get_geometry_unary_union, buffer_by_field, copy_feature_class, merge_feature_classes, remove_holes_feature_class, difference
 from rscommons.vbet_network import vbet_network
@@ -250,26 +251,20 @@ def calculate_bankfull(network_layer: Path, out_field: str, eval_fn: str, functi
         eval_fn (str): equation to use in eval function
         function_params (dict): parameters to use in eval function
     """
+    equation = compile_equation(eval_fn)
+    fields = sorted(set(value for value in function_params.values() if isinstance(value, str)))
+
     with GeopackageLayer(network_layer, write=True) as layer:
 
         layer.create_field(out_field, ogr.OFTReal)
 
-        layer.ogr_layer.StartTransaction()
-        for feat, *_ in layer.iterate_features("Calculating bankfull"):
-
-            fn_params = {}
-            for param, value in function_params.items():
-                if isinstance(value, str):
-                    field_value = feat.GetField(value)
-                    fn_params[param] = field_value if field_value is not None else 0
-                else:
-                    fn_params[param] = value
-            # eval seems to mutate the fn_params object so we pass in a copy so that we can report on the errors if needed
-            result = safe_eval(eval_fn, fn_params)
-            feat.SetField(out_field, result)
-            layer.ogr_layer.SetFeature(feat)
-
-        layer.ogr_layer.CommitTransaction()
+        # Null field values are treated as zero
+        fids, _wkbs, columns = layer.read_columns(fields)
+        field_values = {field: np.array([value if value is not None else 0 for value in values], dtype=np.float64) for field, values in columns.items()}
+        fn_params = {param: field_values[value] if isinstance(value, str) else value for param, value in function_params.items()}
+
+        results = equation.evaluate(fn_params, count=len(fids))
+        layer.write_columns(None, {out_field: results}, fids=fids, name="Calculating bankfull")
 
 
 def create_project(huc: int, output_dir: Path, meta: List[RSMeta], meta_dict: Dict[str, str]):
@@ -1,21 +1,27 @@
 import os
 import xml.etree.ElementTree as ET
-import sqlite3
 import rasterio
 import numpy as np
+from rasterio.windows import Window
+from rscommons import Logger, ProgressBar
 from rscommons.util import safe_makedirs
+from rscommons.reclass import ReclassTable
+from rscommons.database import get_connection
 
+# Reclassed products of each vegetation raster. LUI is only for existing vegetation
+VEGETATION_PRODUCTS = ['RAW', 'RIPARIAN', 'NATIVE_RIPARIAN', 'VEGETATED', 'CONVERSION', 'LUI']
 
-def load_vegetation_raster(rasterpath: str, gpkg: str, existing=False, output_folder=None):
-    """[summary]
+
+def load_reclass_values(gpkg: str, existing=False):
+    """Load the reclass values for each vegetation type from the database
 
     Args:
-        rasterpath ([type]): [description]
-        existing (bool, optional): [description]. Defaults to False.
-        output_folder ([type], optional): [description]. Defaults to None.
+        gpkg (str): path to the RVD geopackage containing the VegetationTypes table
+        existing (bool, optional): True for existing vegetation, False for historic. Defaults to False.
 
     Returns:
-        [type]: [description]
+        tuple: list of valid VegetationIDs and a dictionary of {VegetationID: value} lookups keyed
+            by RIPARIAN, NATIVE_RIPARIAN, VEGETATED, CONVERSION and LUI (None for historic vegetation)
     """
 
     conversion_lookup = {
@@ -111,58 +117,89 @@ def load_vegetation_raster(rasterpath: str, gpkg: str, existing=False, output_fo
     # lui_values = {int(n[ifield_value].text): lui_lookup.setdefault(n[ifield_group_name].text, 0) for n in root.findall(".//Row")} if existing is True else {}
 
     # Load reclass values
-    with sqlite3.connect(gpkg) as conn:
-        c = conn.cursor()
-        valid_values = [v[0] for v in c.execute("SELECT VegetationID FROM VegetationTypes").fetchall()]
-        conversion_values = {row[0]: conversion_lookup.setdefault(row[1], 0) for row in c.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
-        riparian_values = {row[0]: 1 if row[1] == "Riparian" else 0 for row in c.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
-        native_riparian_values = {row[0]: 1 if row[1] == "Riparian" and not("Introduced" in row[2]) else 0 for row in c.execute('SELECT VegetationID, Physiognomy, LandUseGroup FROM VegetationTypes').fetchall()}
-        vegetation_values = {row[0]: 1 if row[1] in vegetated_classes else 0 for row in c.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
-        lui_values = {row[0]: lui_lookup.setdefault(row[1], 0) for row in c.execute('SELECT VegetationID, LandUseGroup FROM VegetationTypes').fetchall()} if existing else {}
-
-    # Read array
-    with rasterio.open(rasterpath) as raster:
-        no_data = int(raster.nodatavals[0])
-        conversion_values[no_data] = 0
-        riparian_values[no_data] = 0
-        native_riparian_values[no_data] = 0
-        vegetation_values[no_data] = 0
-        if existing:
-            lui_values[no_data] = 0.0
-
-        valid_values.append(no_data)
-        raw_array = raster.read(1, masked=True)
-        for value in np.unique(raw_array):
-            if not isinstance(value, type(np.ma.masked)) and value not in valid_values:
-                raise Exception(f"Vegetation raster value {value} not found in current data dictionary")
-
-        # Reclass array https://stackoverflow.com/questions/16992713/translate-every-element-in-numpy-array-according-to-key
-        riparian_array = np.vectorize(riparian_values.get)(raw_array)
-        native_riparian_array = np.vectorize(native_riparian_values.get)(raw_array)
-        vegetated_array = np.vectorize(vegetation_values.get)(raw_array)
-        conversion_array = np.vectorize(conversion_values.get)(raw_array)
-        lui_array = np.vectorize(lui_values.get)(raw_array) if existing else None
-
-        output = {"RAW": raw_array,
-                  "RIPARIAN": riparian_array,
-                  "NATIVE_RIPARIAN": native_riparian_array,
-                  "VEGETATED": vegetated_array,
-                  "CONVERSION": conversion_array,
-                  "LUI": lui_array}
-
-        if output_folder:
-            for raster_name, raster_array in output.items():
-                if raster_array is not None:
-                    safe_makedirs(output_folder)
-                    with rasterio.open(os.path.join(output_folder, f"{'EXISTING' if existing else 'HISTORIC'}_{raster_name}.tif"),
-                                       'w',
-                                       driver='GTiff',
-                                       height=raster.height,
-                                       width=raster.width,
-                                       count=1,
-                                       dtype=np.int16,
-                                       crs=raster.crs,
-                                       transform=raster.transform) as dataset:
-                        dataset.write(raster_array.astype(np.int16), 1)
-
-    return output
+    curs = get_connection(gpkg).cursor()
+    curs.row_factory = None
+    valid_values = [v[0] for v in curs.execute("SELECT VegetationID FROM VegetationTypes").fetchall()]
+    conversion_values = {row[0]: conversion_lookup.setdefault(row[1], 0) for row in curs.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
+    riparian_values = {row[0]: 1 if row[1] == "Riparian" else 0 for row in curs.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
+    native_riparian_values = {row[0]: 1 if row[1] == "Riparian" and not("Introduced" in row[2]) else 0 for row in curs.execute('SELECT VegetationID, Physiognomy, LandUseGroup FROM VegetationTypes').fetchall()}
+    vegetation_values = {row[0]: 1 if row[1] in vegetated_classes else 0 for row in curs.execute('SELECT VegetationID, Physiognomy FROM VegetationTypes').fetchall()}
+    lui_values = {row[0]: lui_lookup.setdefault(row[1], 0) for row in curs.execute('SELECT VegetationID, LandUseGroup FROM VegetationTypes').fetchall()} if existing else None
+
+    return valid_values, {"RIPARIAN": riparian_values,
+                          "NATIVE_RIPARIAN": native_riparian_values,
+                          "VEGETATED": vegetation_values,
+                          "CONVERSION": conversion_values,
+                          "LUI": lui_values}
+
+
+def write_vegetation_rasters(existing_path: str, historic_path: str, gpkg: str, output_folder: str, window_size: int = 1024):
+    """Reclass the existing and historic vegetation rasters and write the intermediate rasters one window at a time
+
+    Writes {EPOCH}_{PRODUCT}.tif for each epoch and product in VEGETATION_PRODUCTS (no LUI for historic vegetation),
+    the RIPARIAN_ZONES, NATIVE_RIPARIAN_ZONES and VEGETATION_ZONES rasters where either epoch has the class and
+    Conversion_Raster.tif, the historic minus the existing conversion value. Only one window of each raster is in
+    memory at a time.
+
+    Args:
+        existing_path (str): existing vegetation raster
+        historic_path (str): historic vegetation raster with the same shape
+        gpkg (str): path to the RVD geopackage containing the VegetationTypes table
+        output_folder (str): folder for the intermediate rasters
+        window_size (int, optional): width and height of the windows read at a time. Defaults to 1024.
+    """
+
+    log = Logger('Vegetation Rasters')
+    safe_makedirs(output_folder)
+
+    with rasterio.open(existing_path) as existing, rasterio.open(historic_path) as historic:
+        sources = {'EXISTING': existing, 'HISTORIC': historic}
+        if existing.shape != historic.shape:
+            raise Exception('Vegetation raster shapes are not equal Existing={} Historic={}. Cannot continue'.format(existing.shape, historic.shape))
+
+        # Reclass lookups with the NoData value of each raster reclassed to 0
+        lookups = {}
+        for epoch, raster in sources.items():
+            valid_values, reclass_values = load_reclass_values(gpkg, epoch == 'EXISTING')
+            no_data = int(raster.nodatavals[0])
+            for name, values in reclass_values.items():
+                if values is not None:
+                    values[no_data] = 0.0 if name == 'LUI' else 0
+            valid_values.append(no_data)
+            lookups[epoch] = (ReclassTable({value: 0 for value in valid_values}), {name: ReclassTable(values) for name, values in reclass_values.items() if values is not None})
+
+        profile = {'driver': 'GTiff', 'height': existing.height, 'width': existing.width, 'count': 1, 'dtype': np.int16, 'crs': existing.crs, 'transform': existing.transform}
+        names = ['{}_{}'.format(epoch, product) for epoch in sources for product in VEGETATION_PRODUCTS if not (epoch == 'HISTORIC' and product == 'LUI')]
+        names += ['RIPARIAN_ZONES', 'NATIVE_RIPARIAN_ZONES', 'VEGETATION_ZONES', 'Conversion_Raster']
+        outputs = {name: rasterio.open(os.path.join(output_folder, '{}.tif'.format(name)), 'w', **profile) for name in names}
+        try:
+            windows = [Window(col_off, row_off, min(window_size, existing.width - col_off), min(window_size, existing.height - row_off))
+                       for row_off in range(0, existing.height, window_size) for col_off in range(0, existing.width, window_size)]
+            progbar = ProgressBar(len(windows), 50, 'Reclassing vegetation')
+            for counter, window in enumerate(windows, start=1):
+                progbar.update(counter)
+                vegetation = {}
+                for epoch, raster in sources.items():
+                    raw_array = raster.read(1, window=window, masked=True)
+                    valid_table, tables = lookups[epoch]
+                    unknown_values = valid_table.missing(raw_array.compressed())
+                    if len(unknown_values) > 0:
+                        raise Exception(f"Vegetation raster value {unknown_values[0]} not found in current data dictionary")
+
+                    # NoData cells are reclassed too but stay masked
+                    mask = np.ma.getmaskarray(raw_array)
+                    vegetation[epoch] = {'RAW': raw_array, **{name: np.ma.masked_array(table(raw_array.data), mask=mask) for name, table in tables.items()}}
+                    for name, array in vegetation[epoch].items():
+                        outputs['{}_{}'.format(epoch, name)].write(array.astype(np.int16), 1, window=window)
+
+                # Vegetation zone calculations and conversions
+                outputs['RIPARIAN_ZONES'].write((((vegetation['EXISTING']['RIPARIAN'] + vegetation['HISTORIC']['RIPARIAN']) > 0) * 1).astype(np.int16), 1, window=window)
+                outputs['NATIVE_RIPARIAN_ZONES'].write((((vegetation['EXISTING']['NATIVE_RIPARIAN'] + vegetation['HISTORIC']['NATIVE_RIPARIAN']) > 0) * 1).astype(np.int16), 1, window=window)
+                outputs['VEGETATION_ZONES'].write((((vegetation['EXISTING']['VEGETATED'] + vegetation['HISTORIC']['VEGETATED']) > 0) * 1).astype(np.int16), 1, window=window)
+                outputs['Conversion_Raster'].write((vegetation['HISTORIC']['CONVERSION'] - vegetation['EXISTING']['CONVERSION']).astype(np.int16), 1, window=window)
+            progbar.finish()
+        finally:
+            for output in outputs.values():
+                output.close()
+
+    log.info('Vegetation rasters written to {}'.format(output_folder))
@@ -0,0 +1,63 @@
+from typing import Dict, List
+from rscommons.zonal_stats import zonal_cross_tally
+
+
+def extract_reach_vegetation(polygons: dict, existing_raster: str, historic_raster: str, reclass_values: Dict[str, dict], conversion_classifications: List[dict], window_size: int = 1024):
+    """Vegetation cell counts, mean riparian coverage and mean vegetation conversion for each reach
+
+    The existing and historic vegetation rasters are cross tabulated under every
+    reach polygon in a single windowed pass. Everything RVD needs per reach follows
+    from the number of cells of each (existing, historic) vegetation type pair, so
+    memory depends on the window size and not on the size of the watershed.
+
+    Args:
+        polygons (dict): reach polygons keyed by ReachID, in raster coordinates
+        existing_raster (str): path to the existing vegetation raster
+        historic_raster (str): path to the historic vegetation raster. Must be aligned with the existing raster
+        reclass_values (Dict[str, dict]): reclass lookups from load_reclass_values() keyed by EXISTING and HISTORIC
+        conversion_classifications (List[dict]): rows of the ConversionTypes table
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 1024.
+
+    Returns:
+        tuple: vegetation cell counts {epoch: {reachid: {vegetationid: count}}}, riparian means
+            {reachid: {field: mean}} and conversion means {reachid: {field: mean}}
+    """
+
+    reach_tallies = zonal_cross_tally(polygons, [existing_raster, historic_raster], window_size, all_touched=True)
+
+    epochs = ["EXISTING", "HISTORIC"]
+    unique_vegetation_counts = {epoch: {} for epoch in epochs}
+    reach_average_riparian = {}
+    reach_average_change = {}
+
+    for reachid, tally in reach_tallies.items():
+        riparian_values_mean = {}
+        for position, epoch in enumerate(epochs):
+            # Cells that are NoData in this epoch do not count towards its totals
+            counts = {}
+            for classes, count in tally.items():
+                if classes[position] is not None:
+                    counts[classes[position]] = counts.get(classes[position], 0) + count
+            unique_vegetation_counts[epoch][reachid] = counts
+
+            total = sum(counts.values())
+            for name, field in [("RIPARIAN", "Riparian"), ("NATIVE_RIPARIAN", "NativeRiparian")]:
+                lookup = reclass_values[epoch][name]
+                covered = sum(count * lookup.get(vegetationid, 0) for vegetationid, count in counts.items())
+                riparian_values_mean[f"{epoch.capitalize()}{field}Mean"] = covered / total if total > 0 else 0.0
+
+        # Conversions are the change in conversion value between historic and existing
+        # for cells that have vegetation in both epochs
+        existing_lookup = reclass_values["EXISTING"]["CONVERSION"]
+        historic_lookup = reclass_values["HISTORIC"]["CONVERSION"]
+        changes = {}
+        for (existing, historic), count in tally.items():
+            if existing is not None and historic is not None:
+                change = historic_lookup.get(historic, 0) - existing_lookup.get(existing, 0)
+                changes[change] = changes.get(change, 0) + count
+
+        total = sum(changes.values())
+        reach_average_change[reachid] = {c['FieldName']: changes.get(int(c["TypeValue"]), 0) / total if total > 0 else 0.0 for c in conversion_classifications}
+        reach_average_riparian[reachid] = riparian_values_mean
+
+    return unique_vegetation_counts, reach_average_riparian, reach_average_change
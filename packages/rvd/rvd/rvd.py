@@ -14,25 +14,26 @@ import os
 import traceback
 import datetime
 import time
-import sqlite3
 from typing import List, Dict
 import rasterio
 from rasterio import features
 from osgeo import ogr, gdal, osr
 import numpy as np
+from shapely.geometry import Point
 from rscommons.classes.rs_project import RSMeta, RSMetaTypes
 
 from rscommons.util import safe_makedirs, parse_metadata, pretty_duration
 from rscommons import Logger, RSProject, RSLayer, ModelConfig, dotenv, initGDALOGRErrors, ProgressBar
 from rscommons import GeopackageLayer, VectorBase
 from rscommons.build_network import build_network
-from rscommons.database import create_database, write_db_attributes, dict_factory, SQLiteCon
+from rscommons.database import create_database, write_db_attributes, dict_factory, SQLiteCon, batch_insert, get_connection
 from rscommons.vector_ops import get_geometry_unary_union, copy_feature_class
 from rscommons.thiessen.vor import NARVoronoi
-from rscommons.thiessen.shapes import centerline_points, clip_polygons
+from rscommons.thiessen.shapes import centerline_point_arrays, clip_polygons
 
 from rvd.rvd_report import RVDReport
-from rvd.lib.load_vegetation import load_vegetation_raster
+from rvd.lib.load_vegetation import write_vegetation_rasters, load_reclass_values, VEGETATION_PRODUCTS
+from rvd.lib.reach_vegetation import extract_reach_vegetation
 from rvd.lib.classify_conversions import classify_conversions
 from rvd.__version__ import __version__
 
@@ -233,19 +234,18 @@ def rvd(huc: int, flowlines_orig: Path, existing_veg_orig: Path, historic_veg_or
     log.info("Calculating Voronoi Polygons...")
 
     # Add all the points (including islands) to the list
-    flowline_thiessen_points_groups = centerline_points(cleaned_path, distance_buffer, transform_shp_to_raster)
-    flowline_thiessen_points = [pt for group in flowline_thiessen_points_groups.values() for pt in group]
-    simple_save([pt.point for pt in flowline_thiessen_points], ogr.wkbPoint, raster_srs, "Thiessen_Points", intermediates_gpkg_path)
+    thiessen_coords, thiessen_fids, _properties = centerline_point_arrays(cleaned_path, distance_buffer, transform_shp_to_raster)
+    simple_save([Point(x, y) for x, y in thiessen_coords.tolist()], ogr.wkbPoint, raster_srs, "Thiessen_Points", intermediates_gpkg_path)
 
     # Exterior is the shell and there is only ever 1
-    myVorL = NARVoronoi(flowline_thiessen_points)
+    myVorL = NARVoronoi(thiessen_coords)
 
     # Generate Thiessen Polys
     myVorL.createshapes()
 
     # Dissolve by flowlines
     log.info("Dissolving Thiessen Polygons")
-    dissolved_polys = myVorL.dissolve_by_property('fid')
+    dissolved_polys = myVorL.dissolve_by_ids(thiessen_fids)
 
     # Clip Thiessen Polys
     log.info("Clipping Thiessen Polygons to Valley Bottom")
@@ -262,133 +262,44 @@ def rvd(huc: int, flowlines_orig: Path, existing_veg_orig: Path, historic_veg_or
     # dissolved_polys2 = dissolve_by_points(flowline_thiessen_points_groups, myVorL.polys)
     # simple_save(dissolved_polys2.values(), ogr.wkbPolygon, out_srs, "ThiessenPolygonsDissolved_OLD", intermediates_gpkg_path)
 
-    # Load Vegetation Rasters
+    # Reclass the Existing and Historic Vegetation Rasters into the intermediate rasters one window at a time
     log.info(f"Loading Existing and Historic Vegetation Rasters")
-    vegetation = {}
-    vegetation["EXISTING"] = load_vegetation_raster(prj_existing_path, outputs_gpkg_path, True, output_folder=os.path.join(output_folder, 'Intermediates'))
-    vegetation["HISTORIC"] = load_vegetation_raster(prj_historic_path, outputs_gpkg_path, False, output_folder=os.path.join(output_folder, 'Intermediates'))
+    write_vegetation_rasters(prj_existing_path, prj_historic_path, outputs_gpkg_path, os.path.join(output_folder, 'Intermediates'))
 
-    for epoch in vegetation.keys():
-        for name in vegetation[epoch].keys():
+    for epoch in ["EXISTING", "HISTORIC"]:
+        for name in VEGETATION_PRODUCTS:
             if not f"{epoch}_{name}" == "HISTORIC_LUI":
                 project.add_project_raster(proj_nodes['Intermediates'], LayerTypes[f"{epoch}_{name}"])
 
-    if vegetation["EXISTING"]["RAW"].shape != vegetation["HISTORIC"]["RAW"].shape:
-        raise Exception('Vegetation raster shapes are not equal Existing={} Historic={}. Cannot continue'.format(vegetation["EXISTING"]["RAW"].shape, vegetation["HISTORIC"]["RAW"].shape))
-
-    # Vegetation zone calculations
-    riparian_zone_arrays = {}
-    riparian_zone_arrays["RIPARIAN_ZONES"] = ((vegetation["EXISTING"]["RIPARIAN"] + vegetation["HISTORIC"]["RIPARIAN"]) > 0) * 1
-    riparian_zone_arrays["NATIVE_RIPARIAN_ZONES"] = ((vegetation["EXISTING"]["NATIVE_RIPARIAN"] + vegetation["HISTORIC"]["NATIVE_RIPARIAN"]) > 0) * 1
-    riparian_zone_arrays["VEGETATION_ZONES"] = ((vegetation["EXISTING"]["VEGETATED"] + vegetation["HISTORIC"]["VEGETATED"]) > 0) * 1
-
-    # Save Intermediate Rasters
-    for name, raster in riparian_zone_arrays.items():
-        save_intarr_to_geotiff(raster, os.path.join(output_folder, "Intermediates", f"{name}.tif"), prj_existing_path)
+    for name in ["RIPARIAN_ZONES", "NATIVE_RIPARIAN_ZONES", "VEGETATION_ZONES"]:
         project.add_project_raster(proj_nodes['Intermediates'], LayerTypes[name])
-
-    # Calculate Riparian Departure per Reach
-    riparian_arrays = {f"{epoch.capitalize()}{(name.capitalize()).replace('Native_riparian', 'NativeRiparian')}Mean": array for epoch, arrays in vegetation.items() for name, array in arrays.items() if name in ["RIPARIAN", "NATIVE_RIPARIAN"]}
-
-    # Vegetation Cell Counts
-    raw_arrays = {f"{epoch}": array for epoch, arrays in vegetation.items() for name, array in arrays.items() if name == "RAW"}
-
-    # Generate Vegetation Conversions
-    vegetation_change = (vegetation["HISTORIC"]["CONVERSION"] - vegetation["EXISTING"]["CONVERSION"])
-    save_intarr_to_geotiff(vegetation_change, os.path.join(output_folder, "Intermediates", "Conversion_Raster.tif"), prj_existing_path)
     project.add_project_raster(proj_nodes['Intermediates'], LayerTypes['VEGETATION_CONVERSION'])
 
     # load conversion types dictionary from database
-    conn = sqlite3.connect(outputs_gpkg_path)
-    conn.row_factory = dict_factory
-    curs = conn.cursor()
+    curs = get_connection(outputs_gpkg_path).cursor()
+    curs.row_factory = dict_factory
     curs.execute('SELECT * FROM ConversionTypes')
     conversion_classifications = curs.fetchall()
     curs.execute('SELECT * FROM vwConversions')
     conversion_ids = curs.fetchall()
 
-    # Split vegetation change classes into binary arrays
-    vegetation_change_arrays = {
-        c['FieldName']: (vegetation_change == int(c["TypeValue"])) * 1 if int(c["TypeValue"]) in np.unique(vegetation_change) else None
-        for c in conversion_classifications
-    }
-
-    # Calcuate average and unique cell counts  per reach
-    progbar = ProgressBar(len(clipped_thiessen.keys()), 50, "Extracting array values by reach...")
-    counter = 0
-    discarded = 0
-    with rasterio.open(prj_existing_path) as dataset:
-        unique_vegetation_counts = {}
-        reach_average_riparian = {}
-        reach_average_change = {}
-        for reachid, poly in clipped_thiessen.items():
-            counter += 1
-            progbar.update(counter)
-            # we can discount a lot of shapes here.
-            if not poly.is_valid or poly.is_empty or poly.area == 0 or poly.geom_type not in ["Polygon", "MultiPolygon"]:
-                discarded += 1
-                continue
-
-            raw_values_unique = {}
-            change_values_mean = {}
-            riparian_values_mean = {}
-            reach_raster = np.ma.masked_invalid(
-                features.rasterize(
-                    [poly],
-                    out_shape=dataset.shape,
-                    transform=dataset.transform,
-                    all_touched=True,
-                    fill=np.nan))
-            for raster_name, raster in raw_arrays.items():
-                if raster is not None:
-                    current_raster = np.ma.masked_array(raster, mask=reach_raster.mask)
-                    raw_values_unique[raster_name] = np.unique(np.ma.filled(current_raster, fill_value=0), return_counts=True)
-                else:
-                    raw_values_unique[raster_name] = []
-            for raster_name, raster in riparian_arrays.items():
-                if raster is not None:
-                    current_raster = np.ma.masked_array(raster, mask=reach_raster.mask)
-                    riparian_values_mean[raster_name] = np.ma.mean(current_raster)
-                else:
-                    riparian_values_mean[raster_name] = 0.0
-            for raster_name, raster in vegetation_change_arrays.items():
-                if raster is not None:
-                    current_raster = np.ma.masked_array(raster, mask=reach_raster.mask)
-                    change_values_mean[raster_name] = np.ma.mean(current_raster)
-                else:
-                    change_values_mean[raster_name] = 0.0
-            unique_vegetation_counts[reachid] = raw_values_unique
-            reach_average_riparian[reachid] = riparian_values_mean
-            reach_average_change[reachid] = change_values_mean
-
-    progbar.finish()
+    # Vegetation cell counts, riparian means and conversion means per reach from windowed reads of the vegetation rasters
+    log.info('Extracting vegetation values by reach')
+    valid_polygons = {}
+    for reachid, poly in clipped_thiessen.items():
+        # we can discount a lot of shapes here.
+        if poly.is_valid and not poly.is_empty and poly.area > 0 and poly.geom_type in ["Polygon", "MultiPolygon"]:
+            valid_polygons[reachid] = poly
+    reclass_values = {"EXISTING": load_reclass_values(outputs_gpkg_path, True)[1], "HISTORIC": load_reclass_values(outputs_gpkg_path, False)[1]}
+    epoch_tallies, reach_average_riparian, reach_average_change = extract_reach_vegetation(valid_polygons, prj_existing_path, prj_historic_path, reclass_values, conversion_classifications)
 
     with SQLiteCon(outputs_gpkg_path) as gpkg:
         # Ensure all reaches are present in the ReachAttributes table before storing RVD output values
         gpkg.curs.execute('INSERT INTO ReachAttributes (ReachID) SELECT ReachID FROM ReachGeometry;')
 
-        errs = 0
-        for reachid, epochs in unique_vegetation_counts.items():
-            for epoch in epochs.values():
-                insert_values = [[reachid, int(vegetationid), float(count * cell_area), int(count)] for vegetationid, count in zip(epoch[0], epoch[1]) if vegetationid != 0]
-                try:
-                    gpkg.curs.executemany('''INSERT INTO ReachVegetation (
-                        ReachID,
-                        VegetationID,
-                        Area,
-                        CellCount)
-                        VALUES (?,?,?,?)''', insert_values)
-                # Sqlite can't report on SQL errors so we have to print good log messages to help intuit what the problem is
-                except sqlite3.IntegrityError as err:
-                    # THis is likely a constraint error.
-                    errstr = "Integrity Error when inserting records: ReachID: {} VegetationIDs: {}".format(reachid, str(list(epoch[0])))
-                    log.error(errstr)
-                    errs += 1
-                except sqlite3.Error as err:
-                    # This is any other kind of error
-                    errstr = "SQL Error when inserting records: ReachID: {} VegetationIDs: {} ERROR: {}".format(reachid, str(list(epoch[0])), str(err))
-                    log.error(errstr)
-                    errs += 1
+        insert_values = [[reachid, int(vegetationid), float(count * cell_area), int(count)] for tallies in epoch_tallies.values() for reachid, tally in tallies.items() for vegetationid, count in tally.items() if vegetationid != 0]
+        errs = batch_insert(gpkg.conn, 'INSERT INTO ReachVegetation (ReachID, VegetationID, Area, CellCount) VALUES (?,?,?,?)', insert_values,
+                            lambda values: 'ReachID: {} VegetationID: {}'.format(values[0], values[1]))
         if errs > 0:
             raise Exception('Errors were found inserting records into the database. Cannot continue.')
         gpkg.conn.commit()
@@ -604,20 +515,6 @@ def simple_save(list_geoms, ogr_type, srs, layer_name, gpkg_path):
         lyr.ogr_layer.CommitTransaction()
 
 
-def save_intarr_to_geotiff(array, out_file, reference_raster):
-    with rasterio.open(reference_raster) as reference:
-        with rasterio.open(out_file,
-                           "w",
-                           driver="GTiff",
-                           height=array.shape[0],
-                           width=array.shape[1],
-                           count=1,
-                           dtype=np.int16,
-                           crs=reference.crs,
-                           transform=reference.transform) as new:
-            new.write(array.astype(np.int16), 1)
-
-
 def create_project(huc, output_dir, meta: List[RSMeta], meta_dict: Dict[str, str]):
 
     project_name = 'RVD for HUC {}'.format(huc)
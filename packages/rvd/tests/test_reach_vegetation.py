@@ -0,0 +1,176 @@
+""" Parity tests between the windowed RVD vegetation rasters and reach extraction
+    and the previous whole raster reclass and per reach masking
+"""
+import os
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio import features
+from rasterio.transform import from_origin
+from shapely.geometry import box
+from rscommons.database import close_connections
+from rscommons.util import safe_remove_dir
+from rvd.lib.load_vegetation import load_reclass_values, write_vegetation_rasters, VEGETATION_PRODUCTS
+from rvd.lib.reach_vegetation import extract_reach_vegetation
+
+# VegetationID, Physiognomy and LandUseGroup
+VEGETATION_TYPES = [
+    (11, 'Open Water', 'Open Water'),
+    (21, 'Riparian', 'Riparian Forest'),
+    (22, 'Riparian', 'Introduced Riparian'),
+    (31, 'Conifer', 'Conifer'),
+    (41, 'Shrubland', 'Shrubland'),
+    (51, 'Agricultural', 'Agricultural-Wheat'),
+    (61, 'Developed', 'Developed-Roads'),
+    (71, 'Grassland', 'Grassland')
+]
+
+CONVERSION_CLASSIFICATIONS = [{'FieldName': 'Conv{}'.format(idx), 'TypeValue': str(value)} for idx, value in enumerate([0, 30, 50, 80, 98, -30, -50, 450, 999])]
+
+ROWS = 48
+COLS = 40
+WINDOW_SIZE = 16
+NO_DATA = {'EXISTING': -9999, 'HISTORIC': 0}
+
+
+def legacy_vegetation(raster_path: str, gpkg: str, existing: bool) -> dict:
+    """The previous load_vegetation_raster(): the whole raster reclassed as masked arrays"""
+
+    _valid_values, reclass_values = load_reclass_values(gpkg, existing)
+    with rasterio.open(raster_path) as raster:
+        no_data = int(raster.nodatavals[0])
+        raw_array = raster.read(1, masked=True)
+
+    output = {'RAW': raw_array}
+    for name, values in reclass_values.items():
+        if values is None:
+            continue
+        values[no_data] = 0.0 if name == 'LUI' else 0
+        output[name] = np.ma.masked_array(np.vectorize(values.get)(raw_array.data), mask=np.ma.getmaskarray(raw_array))
+    return output
+
+
+def legacy_reach_vegetation(polygons: dict, existing_path: str, vegetation: dict) -> tuple:
+    """The previous RVD reach loop: every polygon rasterized over the whole raster to mask the vegetation arrays"""
+
+    riparian_arrays = {f"{epoch.capitalize()}{(name.capitalize()).replace('Native_riparian', 'NativeRiparian')}Mean": array
+                       for epoch, arrays in vegetation.items() for name, array in arrays.items() if name in ['RIPARIAN', 'NATIVE_RIPARIAN']}
+    vegetation_change = vegetation['HISTORIC']['CONVERSION'] - vegetation['EXISTING']['CONVERSION']
+    vegetation_change_arrays = {
+        c['FieldName']: (vegetation_change == int(c['TypeValue'])) * 1 if int(c['TypeValue']) in np.unique(vegetation_change) else None
+        for c in CONVERSION_CLASSIFICATIONS
+    }
+
+    counts = {epoch: {} for epoch in vegetation}
+    reach_average_riparian = {}
+    reach_average_change = {}
+    with rasterio.open(existing_path) as dataset:
+        for reachid, poly in polygons.items():
+            reach_raster = np.ma.masked_invalid(features.rasterize([poly], out_shape=dataset.shape, transform=dataset.transform, all_touched=True, fill=np.nan, dtype=np.float64))
+            reach_average_riparian[reachid] = {name: np.ma.mean(np.ma.masked_array(raster, mask=reach_raster.mask)) for name, raster in riparian_arrays.items()}
+            reach_average_change[reachid] = {name: np.ma.mean(np.ma.masked_array(raster, mask=reach_raster.mask)) if raster is not None else 0.0
+                                             for name, raster in vegetation_change_arrays.items()}
+            for epoch, arrays in vegetation.items():
+                values, value_counts = np.unique(np.ma.masked_array(arrays['RAW'], mask=reach_raster.mask).compressed(), return_counts=True)
+                counts[epoch][reachid] = dict(zip(values.tolist(), value_counts.tolist()))
+
+    return counts, reach_average_riparian, reach_average_change
+
+
+class ReachVegetationTest(unittest.TestCase):
+
+    def setUp(self):
+        super(ReachVegetationTest, self).setUp()
+        self.temp_dir = mkdtemp()
+        self.gpkg = os.path.join(self.temp_dir, 'rvd.gpkg')
+        conn = sqlite3.connect(self.gpkg)
+        conn.execute('CREATE TABLE VegetationTypes (VegetationID INTEGER PRIMARY KEY NOT NULL, Physiognomy TEXT, LandUseGroup TEXT)')
+        conn.executemany('INSERT INTO VegetationTypes (VegetationID, Physiognomy, LandUseGroup) VALUES (?, ?, ?)', VEGETATION_TYPES)
+        conn.commit()
+        conn.close()
+
+        # Random vegetation with NoData patches, one of them NoData in both epochs
+        rng = np.random.default_rng(7)
+        veg_ids = [row[0] for row in VEGETATION_TYPES]
+        self.rasters = {}
+        for epoch, no_data in NO_DATA.items():
+            array = rng.choice(veg_ids, (ROWS, COLS)).astype(np.int16)
+            array[rng.random((ROWS, COLS)) < 0.1] = no_data
+            array[30:38, 4:12] = no_data
+            path = os.path.join(self.temp_dir, '{}.tif'.format(epoch.lower()))
+            with rasterio.open(path, 'w', driver='GTiff', height=ROWS, width=COLS, count=1, dtype=np.int16, nodata=no_data,
+                               crs='EPSG:26912', transform=from_origin(0, ROWS, 1, 1)) as dataset:
+                dataset.write(array, 1)
+            self.rasters[epoch] = path
+
+        # Reaches across the window boundaries, a reach in the NoData patch and one outside the raster
+        self.polygons = {
+            1: box(2, 2, 20.5, 14),
+            2: box(14.2, 10, 35, 40.6),
+            3: box(30, 0, 40, 48),
+            4: box(5, 11, 11, 17),
+            5: box(100, 100, 110, 110)
+        }
+        self.empty_reaches = [4, 5]
+
+    def tearDown(self):
+        close_connections()
+        safe_remove_dir(self.temp_dir)
+
+    def test_vegetation_rasters(self):
+        out_dir = os.path.join(self.temp_dir, 'windowed')
+        write_vegetation_rasters(self.rasters['EXISTING'], self.rasters['HISTORIC'], self.gpkg, out_dir, window_size=WINDOW_SIZE)
+
+        vegetation = {epoch: legacy_vegetation(path, self.gpkg, epoch == 'EXISTING') for epoch, path in self.rasters.items()}
+        expected = {'{}_{}'.format(epoch, name): array for epoch, arrays in vegetation.items() for name, array in arrays.items()}
+        expected['RIPARIAN_ZONES'] = ((vegetation['EXISTING']['RIPARIAN'] + vegetation['HISTORIC']['RIPARIAN']) > 0) * 1
+        expected['NATIVE_RIPARIAN_ZONES'] = ((vegetation['EXISTING']['NATIVE_RIPARIAN'] + vegetation['HISTORIC']['NATIVE_RIPARIAN']) > 0) * 1
+        expected['VEGETATION_ZONES'] = ((vegetation['EXISTING']['VEGETATED'] + vegetation['HISTORIC']['VEGETATED']) > 0) * 1
+        expected['Conversion_Raster'] = vegetation['HISTORIC']['CONVERSION'] - vegetation['EXISTING']['CONVERSION']
+        self.assertEqual(len(expected), 2 * len(VEGETATION_PRODUCTS) - 1 + 4)
+
+        # The previous code wrote each whole array the same way
+        with rasterio.open(self.rasters['EXISTING']) as reference:
+            profile = {'driver': 'GTiff', 'height': ROWS, 'width': COLS, 'count': 1, 'dtype': np.int16, 'crs': reference.crs, 'transform': reference.transform}
+        legacy_dir = os.path.join(self.temp_dir, 'legacy')
+        os.makedirs(legacy_dir)
+        for name, array in expected.items():
+            with rasterio.open(os.path.join(legacy_dir, '{}.tif'.format(name)), 'w', **profile) as dataset:
+                dataset.write(array.astype(np.int16), 1)
+
+        for name in expected:
+            with rasterio.open(os.path.join(legacy_dir, '{}.tif'.format(name))) as legacy, rasterio.open(os.path.join(out_dir, '{}.tif'.format(name))) as windowed:
+                self.assertEqual(windowed.profile, legacy.profile, name)
+                np.testing.assert_array_equal(windowed.read(1), legacy.read(1), name)
+
+    def test_reach_vegetation(self):
+        reclass_values = {'EXISTING': load_reclass_values(self.gpkg, True)[1], 'HISTORIC': load_reclass_values(self.gpkg, False)[1]}
+        counts, riparian, change = extract_reach_vegetation(self.polygons, self.rasters['EXISTING'], self.rasters['HISTORIC'], reclass_values,
+                                                            CONVERSION_CLASSIFICATIONS, window_size=WINDOW_SIZE)
+
+        vegetation = {epoch: legacy_vegetation(path, self.gpkg, epoch == 'EXISTING') for epoch, path in self.rasters.items()}
+        legacy_counts, legacy_riparian, legacy_change = legacy_reach_vegetation(self.polygons, self.rasters['EXISTING'], vegetation)
+
+        self.assertEqual(counts, legacy_counts)
+        for reachid in self.polygons:
+            for new_values, legacy_values in [(riparian[reachid], legacy_riparian[reachid]), (change[reachid], legacy_change[reachid])]:
+                self.assertEqual(sorted(new_values.keys()), sorted(legacy_values.keys()))
+                for field, legacy_value in legacy_values.items():
+                    if reachid in self.empty_reaches and legacy_value is np.ma.masked:
+                        # Reaches without any valid cells used to get a masked mean and now get zero
+                        self.assertEqual(new_values[field], 0.0, '{} {}'.format(reachid, field))
+                    else:
+                        self.assertAlmostEqual(new_values[field], float(legacy_value), 12, '{} {}'.format(reachid, field))
+
+        # Both empty reaches had masked means before
+        for reachid in self.empty_reaches:
+            self.assertTrue(all(value is np.ma.masked for value in legacy_riparian[reachid].values()))
+            self.assertEqual(counts['EXISTING'][reachid], {})
+            self.assertEqual(counts['HISTORIC'][reachid], {})
+        self.assertTrue(any(value > 0 for reachid in [1, 2, 3] for value in change[reachid].values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+""" Benchmark the VBET centerlines
+
+    Builds a synthetic dendritic network (a branching tree of meandering
+    reaches with NHDPlus HydroSeq, UpHydroSeq and DnHydroSeq attributes) and
+    one valley bottom polygon around each reach, then runs the whole of
+    vbet_centerline() against a copy of the previous version, which
+    tracked the walked reaches in a list, unioned the path one reach at a time
+    with OGR, tested every valley bottom polygon against every path before a
+    UnionCascaded and built and trimmed the centerlines of each path in one
+    build_centerline() call on OGR geometries. The output layers are compared
+    feature by feature.
+
+    Usage: python -m scripts.benchmark_centerline [--reaches 2000] [--workers 2,4]
+"""
+import os
+import time
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+from osgeo import ogr
+from shapely.geometry import LineString, Point, Polygon
+from shapely.ops import linemerge, split
+from shapely.wkb import loads as wkbload
+from rscommons import Logger, GeopackageLayer
+from rscommons.util import safe_remove_dir
+from rscommons.thiessen.shapes import RiverPoint, densifyShape, GetBufferedBounds, projToShape, splitClockwise
+from rscommons.thiessen.vor import NARVoronoi
+from vbet.vbet_centerline import vbet_centerline
+
+REACH_LENGTH = 1500.0
+
+
+def synthetic_network(gpkg: str, reaches: int):
+    """Binary tree of reaches flowing into their parents with a valley bottom polygon around each one"""
+
+    rng = np.random.default_rng(5)
+    tops = np.zeros((reaches, 2))
+    headings = np.zeros(reaches)
+    with GeopackageLayer(gpkg, 'flowlines', write=True) as lyr, GeopackageLayer(gpkg, 'vbet', write=True) as lyr_vbet:
+        lyr.create_layer(ogr.wkbLineString, epsg=26912, fields={'HydroSeq': ogr.OFTReal, 'UpHydroSeq': ogr.OFTReal, 'DnHydroSeq': ogr.OFTReal})
+        lyr_vbet.create_layer(ogr.wkbPolygon, epsg=26912)
+        lyr.ogr_layer.StartTransaction()
+        lyr_vbet.ogr_layer.StartTransaction()
+        for reach_id in range(reaches):
+            parent = (reach_id - 1) // 2
+            bottom = tops[parent] if reach_id > 0 else np.array([500000.0, 4000000.0])
+            depth = int(np.log2(reach_id + 1))
+            headings[reach_id] = headings[parent] + (0.6 / depth if reach_id % 2 else -0.6 / depth) if reach_id > 0 else np.pi / 2
+
+            # Meander up the valley from the confluence and store the line flowing down
+            steps = np.linspace(0, REACH_LENGTH, 25)
+            along = np.column_stack([np.cos(headings[reach_id]), np.sin(headings[reach_id])])
+            across = np.column_stack([-along[:, 1], along[:, 0]])
+            coords = bottom + steps[:, None] * along + (40.0 * np.sin(steps / 200.0) + rng.normal(0, 3.0, len(steps)))[:, None] * across
+            coords[0] = bottom
+            tops[reach_id] = coords[-1]
+            line = LineString(coords[::-1])
+
+            children = [child for child in [2 * reach_id + 1, 2 * reach_id + 2] if child < reaches]
+            lyr.create_feature(line, {
+                'HydroSeq': reach_id + 1,
+                'UpHydroSeq': children[0] + 1 if len(children) > 0 else 0,
+                'DnHydroSeq': parent + 1 if reach_id > 0 else 0
+            })
+            lyr_vbet.create_feature(line.buffer(120.0 / (1 + depth * 0.25)))
+        lyr.ogr_layer.CommitTransaction()
+        lyr_vbet.ogr_layer.CommitTransaction()
+
+
+def legacy_vbet_centerline(flowlines: str, vbet_polygons: str, out_layer: str):
+    """The previous vbet_centerline(): a list of walked reaches, a union per reach and a scan of every polygon for every path"""
+
+    log = Logger('vbet_centerline')
+    reaches = {}
+    with GeopackageLayer(flowlines) as lyr, GeopackageLayer(vbet_polygons) as lyr_polygons, GeopackageLayer(out_layer, write=True) as lyr_output:
+        lyr_output.create_layer(ogr.wkbLineString, spatial_ref=lyr.ogr_layer.GetSpatialRef())
+        lyr_output.create_field("HydroSeq", field_type=ogr.OFTReal)
+        lyr_output_defn = lyr_output.ogr_layer.GetLayerDefn()
+        degree_factor = lyr.rough_convert_metres_to_vector_units(1)
+
+        for feat, *_ in lyr.iterate_features():
+            reaches[feat.GetField('HydroSeq')] = {'up': feat.GetField('UpHydroSeq'), 'down': feat.GetField('DnHydroSeq'), 'geom': feat.GetGeometryRef().Clone()}
+
+        headwaters = {k: v for k, v in reaches.items() if v['up'] == 0 or v['up'] not in reaches}
+        processed = []
+        unioned_reaches = {}
+        for HydroSeq in headwaters:
+            unioned_geom = reaches[HydroSeq]['geom']
+            HydroSeq_next = reaches[HydroSeq]['down']
+            while HydroSeq_next != 0 and HydroSeq_next in reaches:
+                unioned_geom = unioned_geom.Union(reaches[HydroSeq_next]['geom'])
+                if HydroSeq_next in processed:
+                    break
+                processed.append(HydroSeq_next)
+                HydroSeq_next = reaches[HydroSeq_next]['down']
+            unioned_reaches[HydroSeq] = unioned_geom
+
+        merged_centerline = None
+        for HydroSeq, line in unioned_reaches.items():
+            polys = ogr.Geometry(ogr.wkbMultiPolygon)
+            for poly_feat, *_ in lyr_polygons.iterate_features():
+                poly = poly_feat.GetGeometryRef()
+                if not poly.IsEmpty() and poly.Intersects(line):
+                    polys.AddGeometry(poly)
+            if not polys.IsValid() or polys.Area() == 0:
+                poly_test = polys.Buffer(0)
+                if not poly_test.IsValid():
+                    log.warning('Invalid geometry')
+                    continue
+                polys = poly_test
+            poly_union = polys.UnionCascaded() if polys.GetGeometryType() == ogr.wkbMultiPolygon else polys
+
+            if poly_union:
+                centerlines, merged_centerline = legacy_build_centerline(line, poly_union, 20, dist_factor=degree_factor, existing_centerlines=merged_centerline, up_reach=reaches[HydroSeq]['geom'])
+                for centerline in centerlines or []:
+                    feat_out = ogr.Feature(lyr_output_defn)
+                    feat_out.SetGeometry(centerline)
+                    feat_out.SetField('HydroSeq', HydroSeq)
+                    lyr_output.ogr_layer.CreateFeature(feat_out)
+
+
+def legacy_build_centerline(thalweg, bounding_polygon, spacing=None, dist_factor=1, existing_centerlines=None, up_reach=None):
+    """The previous build_centerline(): OGR geometries in and out, building and trimming the centerlines in one call"""
+
+    log = Logger('build_centerline')
+    log.info('Building centerline')
+    thalweg.FlattenTo2D()
+    bounding_polygon.FlattenTo2D()
+
+    g_thalweg_load = wkbload(bytes(thalweg.ExportToWkb()))
+    g_thalweg_init = g_thalweg_load if g_thalweg_load.geometryType() == 'LineString' else linemerge(g_thalweg_load)
+    g_polygon = wkbload(bytes(bounding_polygon.ExportToWkb()))
+
+    buffer = (g_polygon.area / g_thalweg_init.length) * 1.5
+    processing_extent = g_thalweg_init.buffer(buffer)
+    rivershape = g_polygon if g_polygon.type == 'Polygon' else max(g_polygon.geoms, key=lambda a: a.area)
+
+    coords = [coord for coord in g_thalweg_init.coords if Point(coord).within(rivershape)]
+    if len(coords) < 2:
+        return None, existing_centerlines
+    g_thalweg = LineString(coords)
+
+    rivershape_smooth = densifyShape(rivershape, spacing * dist_factor) if spacing else rivershape
+
+    thalwegStart = LineString([g_thalweg.coords[1], g_thalweg.coords[0]])
+    thalwegEnd = LineString([g_thalweg.coords[-2], g_thalweg.coords[-1]])
+    rivershape_bounds = GetBufferedBounds(rivershape, 5 * dist_factor)
+    thalwegStartExt = projToShape(thalwegStart, rivershape_bounds)
+    thalwegEndExt = projToShape(thalwegEnd, rivershape_bounds)
+
+    thalweglist = list(g_thalweg.coords)
+    thalweglist.insert(0, thalwegStartExt.coords[1])
+    thalweglist.append(thalwegEndExt.coords[1])
+    bankshapes = splitClockwise(rivershape_bounds, LineString(thalweglist))
+
+    points = []
+    for pt in list(rivershape_smooth.exterior.coords):
+        g_pt = Point(pt)
+        side = 1 if bankshapes[0].contains(g_pt) else -1
+        if processing_extent.contains(g_pt):
+            points.append(RiverPoint(g_pt, interior=False, side=side))
+    for idx, island in enumerate(rivershape_smooth.interiors):
+        for pt in list(island.coords):
+            g_pt = Point(pt)
+            side = 1 if bankshapes[0].contains(g_pt) else -1
+            if processing_extent.contains(g_pt):
+                points.append(RiverPoint(g_pt, interior=True, side=side, island=idx))
+
+    myVorL = NARVoronoi(points)
+    myVorL.calculate_neighbours()
+    centerlines_raw = myVorL.collectCenterLines(Polygon(rivershape.exterior))
+    if centerlines_raw.type == 'GeometryCollection':
+        return None, existing_centerlines
+
+    centerline_segments = split(centerlines_raw, rivershape)
+    centerlines_long = [LineString(segment.coords[1:-1] if len(segment.coords) > 3 else segment.coords)
+                        for segment in centerline_segments.geoms if segment.interpolate(segment.length / 2).within(rivershape)]
+
+    if existing_centerlines:
+        g_existing_centerlines = wkbload(bytes(existing_centerlines.ExportToWkb()))
+        l_existing_centerlines = [g_existing_centerlines] if g_existing_centerlines.type == "LineString" else list(g_existing_centerlines.geoms)
+        up_reach.FlattenTo2D()
+        g_up_reach = wkbload(bytes(up_reach.ExportToWkb()))
+
+        centerlines = []
+        for line in centerlines_long:
+            new_segment = line.difference(g_existing_centerlines)
+            for segment in [new_segment] if new_segment.type == 'LineString' else new_segment.geoms:
+                if segment.intersects(g_up_reach):
+                    centerlines.append(segment)
+        centerlines_merged = linemerge(centerlines + l_existing_centerlines)
+    else:
+        centerlines = centerlines_long
+        centerlines_merged = linemerge(centerlines)
+
+    return [ogr.CreateGeometryFromWkb(centerline.wkb) for centerline in centerlines], ogr.CreateGeometryFromWkb(centerlines_merged.wkb)
+
+
+def compare(legacy_path: str, new_path: str) -> tuple:
+    """Number of features, how many of them are identical and the difference in total length"""
+
+    with GeopackageLayer(legacy_path) as legacy_lyr, GeopackageLayer(new_path) as new_lyr:
+        _fids, legacy_wkbs, legacy_columns = legacy_lyr.read_columns()
+        _fids, new_wkbs, new_columns = new_lyr.read_columns()
+
+    identical = sum(1 for legacy_wkb, new_wkb, legacy_id, new_id in zip(legacy_wkbs, new_wkbs, legacy_columns['HydroSeq'], new_columns['HydroSeq'])
+                    if bytes(legacy_wkb) == bytes(new_wkb) and legacy_id == new_id)
+    lengths = [sum(ogr.CreateGeometryFromWkb(bytes(wkb)).Length() for wkb in wkbs) for wkbs in (legacy_wkbs, new_wkbs)]
+    return len(legacy_wkbs), len(new_wkbs), identical, lengths[1] - lengths[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reaches', help='Number of reaches', type=int, default=2000)
+    parser.add_argument('--workers', help='Comma separated worker counts to compare with the serial run', type=str, default='2,4')
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        gpkg = os.path.join(temp_dir, 'vbet.gpkg')
+        synthetic_network(gpkg, args.reaches)
+        flowlines = os.path.join(gpkg, 'flowlines')
+        vbet_polygons = os.path.join(gpkg, 'vbet')
+
+        start = time.perf_counter()
+        legacy_vbet_centerline(flowlines, vbet_polygons, os.path.join(gpkg, 'legacy'))
+        legacy_time = time.perf_counter() - start
+        print('{:,} reaches, {} CPUs. Previous: {:.1f}s'.format(args.reaches, os.cpu_count(), legacy_time))
+
+        for workers in [1] + [int(val) for val in args.workers.split(',')]:
+            out_layer = os.path.join(gpkg, 'centerlines_{}'.format(workers))
+            start = time.perf_counter()
+            vbet_centerline(flowlines, vbet_polygons, out_layer, workers=workers)
+            new_time = time.perf_counter() - start
+
+            legacy_count, new_count, identical, length_diff = compare(os.path.join(gpkg, 'legacy'), out_layer)
+            print('{} worker{}: {:.1f}s, speedup {:.1f}x. {:,} features against {:,}, {:,} identical, total length difference {:.2f}'.format(
+                workers, 's' if workers > 1 else '', new_time, legacy_time / new_time, new_count, legacy_count, identical, length_diff))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+""" Benchmark the tiled VBET evidence calculation with different numbers of workers
+
+    Builds a synthetic stack of slope, HAND, TWI, channel and transform zone
+    rasters that spans many 256 x 256 tiles, then times:
+
+    1. The original loop that evaluates every zone transform over each block
+       and picks one with np.choose, against the zone-aware np.interp kernels
+       of vbet.vbet_database.compile_transforms().
+    2. vbet.vbet_evidence.calculate_evidence() serially and with a process pool.
+
+    Every output is compared byte for byte with the serial output.
+
+    Usage: python -m scripts.benchmark_evidence [--size 6000] [--workers 2,4,8]
+"""
+import os
+import time
+import filecmp
+import argparse
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from scipy import interpolate
+from rscommons import Logger
+from rscommons.util import safe_remove_dir
+from vbet.vbet_evidence import calculate_evidence
+
+NODATA = -9999
+OUTPUTS = ['VBET_EVIDENCE', 'NORMALIZED_SLOPE', 'NORMALIZED_HAND', 'NORMALIZED_TWI', 'EVIDENCE_CHANNEL', 'EVIDENCE_TOPO']
+
+
+def synthetic_stack(folder: str, size: int) -> dict:
+    """Tiled float32 inputs and int16 transform zone rasters derived from a smooth synthetic DEM"""
+
+    rng = np.random.default_rng(1)
+    profile = {'driver': 'GTiff', 'width': size, 'height': size, 'count': 1, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+               'crs': 'EPSG:26912', 'transform': from_origin(500000, 4000000 + size * 10.0, 10.0, 10.0), 'compress': 'deflate'}
+
+    rasters = {name: os.path.join(folder, '{}.tif'.format(name.lower())) for name in ['Slope', 'HAND', 'TWI', 'Channel', 'TRANSFORM_ZONE_Slope', 'TRANSFORM_ZONE_HAND']}
+    handles = {name: rasterio.open(path, 'w', dtype='int16' if name.startswith('TRANSFORM_ZONE') else 'float32', nodata=NODATA, **profile) for name, path in rasters.items()}
+    try:
+        for _ij, window in handles['Slope'].block_windows(1):
+            rows, cols = np.mgrid[window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width]
+            dem = 1500 + 200 * np.sin(rows / 300.0) * np.cos(cols / 250.0) + rng.normal(0, 2, rows.shape)
+            valley = np.abs(np.sin(cols / 400.0)) * 60
+            nodata = rng.random(rows.shape) < 0.02
+
+            blocks = {
+                'Slope': np.abs(np.gradient(dem)[0]) * 10,
+                'HAND': valley + rng.uniform(0, 5, rows.shape),
+                'TWI': rng.uniform(2, 18, rows.shape),
+                'Channel': (valley < 3).astype(np.float32),
+                'TRANSFORM_ZONE_Slope': (cols * 3 // size),
+                'TRANSFORM_ZONE_HAND': (rows * 3 // size)
+            }
+            for name, block in blocks.items():
+                block = block.astype(handles[name].dtypes[0])
+                if not name.startswith('TRANSFORM_ZONE'):
+                    block[nodata] = NODATA
+                handles[name].write(block, 1, window=window)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    return rasters
+
+
+def synthetic_configuration() -> dict:
+    """VBET configuration like load_configuration() with three zones for slope and HAND"""
+
+    def transform(inflections):
+        return interpolate.interp1d(np.array([v[0] for v in inflections]), np.array([v[1] for v in inflections]), kind='linear', bounds_error=False, fill_value=0.0)
+
+    inflections = {
+        'Slope': [[(0, 1), (slope, 1), (slope * 2, 0)] for slope in [6, 12, 18]],
+        'HAND': [[(0, 1), (hand, 1), (hand * 3, 0)] for hand in [5, 10, 20]],
+        'TWI': [[(0, 0), (8, 0.5), (20, 1)]],
+        'Channel': [[(0, 0), (1, 1)]]
+    }
+
+    return {
+        'Inputs': {name: {} for name in inflections},
+        'Transforms': {name: [transform(values) for values in zones] for name, zones in inflections.items()},
+        'Inflections': {name: [('linear', [v[0] for v in values], [v[1] for v in values]) for values in zones] for name, zones in inflections.items()},
+        'Zones': {'Slope': {0: 100, 1: 1000, 2: None}, 'HAND': {0: 100, 1: 1000, 2: None}}
+    }
+
+
+def choose_evidence(in_rasters: dict, out_rasters: dict, vbet_run: dict):
+    """The original evidence loop that evaluates every zone transform over every block"""
+
+    read_rasters = {name: rasterio.open(raster) for name, raster in in_rasters.items()}
+    out_meta = read_rasters['Slope'].meta
+    out_meta['driver'] = 'GTiff'
+    out_meta['count'] = 1
+    out_meta['compress'] = 'deflate'
+    write_rasters = {name: rasterio.open(raster, 'w', **out_meta) for name, raster in out_rasters.items()}
+
+    for _ji, window in read_rasters['Slope'].block_windows(1):
+        block = {block_name: raster.read(1, window=window, masked=True) for block_name, raster in read_rasters.items()}
+
+        normalized = {}
+        for name in vbet_run['Inputs']:
+            if name in vbet_run['Zones']:
+                transforms = [np.ma.MaskedArray(transform(block[name].data), mask=block[name].mask) for transform in vbet_run['Transforms'][name]]
+                normalized[name] = np.ma.MaskedArray(np.choose(block[f'TRANSFORM_ZONE_{name}'].data, transforms, mode='clip'), mask=block[name].mask)
+            else:
+                normalized[name] = np.ma.MaskedArray(vbet_run['Transforms'][name][0](block[name].data), mask=block[name].mask)
+
+        fvals_topo = np.ma.mean([normalized['Slope'], normalized['HAND'], normalized['TWI']], axis=0)
+        fvals_channel = 0.995 * block['Channel']
+        fvals_evidence = np.maximum(fvals_topo, fvals_channel)
+
+        write_rasters['VBET_EVIDENCE'].write(np.ma.filled(np.float32(fvals_evidence), out_meta['nodata']), window=window, indexes=1)
+        write_rasters['NORMALIZED_SLOPE'].write(normalized['Slope'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
+        write_rasters['NORMALIZED_HAND'].write(normalized['HAND'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
+        write_rasters['NORMALIZED_TWI'].write(normalized['TWI'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
+        write_rasters['EVIDENCE_CHANNEL'].write(np.ma.filled(np.float32(fvals_channel), out_meta['nodata']), window=window, indexes=1)
+        write_rasters['EVIDENCE_TOPO'].write(np.ma.filled(np.float32(fvals_topo), out_meta['nodata']), window=window, indexes=1)
+
+    for raster_obj in list(read_rasters.values()) + list(write_rasters.values()):
+        raster_obj.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', help='Raster width and height in cells', type=int, default=6000)
+    parser.add_argument('--workers', help='Comma separated worker counts to compare with the serial run', type=str, default='2,4,8')
+    args = parser.parse_args()
+
+    log = Logger('Benchmark')
+    log.setup(verbose=False)
+
+    temp_dir = mkdtemp()
+    try:
+        in_rasters = synthetic_stack(temp_dir, args.size)
+        vbet_run = synthetic_configuration()
+        with rasterio.open(in_rasters['Slope']) as src:
+            tiles = len(list(src.block_windows(1)))
+        print('{:,} x {:,} input stack with {:,} tiles, {} CPUs'.format(args.size, args.size, tiles, os.cpu_count()))
+
+        def run(workers):
+            out_rasters = {name: os.path.join(temp_dir, '{}_{}.tif'.format(name.lower(), workers)) for name in OUTPUTS}
+            start = time.perf_counter()
+            calculate_evidence(in_rasters, out_rasters, vbet_run, workers)
+            return out_rasters, time.perf_counter() - start
+
+        choose = {name: os.path.join(temp_dir, '{}_choose.tif'.format(name.lower())) for name in OUTPUTS}
+        start = time.perf_counter()
+        choose_evidence(in_rasters, choose, vbet_run)
+        choose_time = time.perf_counter() - start
+
+        serial, serial_time = run(1)
+        identical = all(filecmp.cmp(choose[name], serial[name], shallow=False) for name in OUTPUTS)
+        print('Serial: np.choose over every zone {:.2f}s, zone-aware kernels {:.2f}s, speedup {:.1f}x, byte-identical {}'.format(
+            choose_time, serial_time, choose_time / serial_time, identical))
+
+        for workers in [int(val) for val in args.workers.split(',')]:
+            parallel, parallel_time = run(workers)
+            identical = all(filecmp.cmp(serial[name], parallel[name], shallow=False) for name in OUTPUTS)
+            print('{} workers: {:.2f}s, speedup {:.1f}x, byte-identical {}'.format(workers, parallel_time, serial_time / parallel_time, identical))
+    finally:
+        safe_remove_dir(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+""" Tests for splitting the valley bottom by the transportation network
+    and sorting the pieces into connected and disconnected floodplain
+"""
+import unittest
+from shapely.geometry import LineString, MultiLineString, Point, Polygon, box
+from shapely.ops import unary_union
+from vbet.floodplain_connectivity import floodplain_areas, _parts, _probe, NODE_TOLERANCE
+
+
+def areas(geoms: list) -> list:
+    return sorted(round(geom.area, 6) for geom in geoms)
+
+
+class FloodplainAreasTest(unittest.TestCase):
+
+    def test_road_split(self):
+        # A road across the valley cuts off the half the flowline does not reach
+        valley = box(0, 0, 10, 10)
+        road = LineString([(5, 0), (5, 10)])
+        connected, disconnected = floodplain_areas([valley], valley, road, [LineString([(1, 1), (2, 2)])])
+        self.assertEqual(areas(connected), [50.0])
+        self.assertEqual(areas(disconnected), [50.0])
+        self.assertTrue(unary_union(connected).contains(Point(2.5, 5)))
+        self.assertTrue(unary_union(disconnected).contains(Point(7.5, 5)))
+
+    def test_no_roads(self):
+        valley = box(0, 0, 10, 10)
+        connected, disconnected = floodplain_areas([valley], valley, LineString(), [LineString([(1, 1), (2, 2)])])
+        self.assertEqual(areas(connected), [100.0])
+        self.assertEqual(disconnected, [])
+
+    def test_empty(self):
+        self.assertEqual(floodplain_areas([], Polygon(), LineString(), []), ([], []))
+
+    def test_shared_catchment_edge(self):
+        # Connectivity carries across the boundary between two catchments but not across a road
+        catchments = [box(0, 0, 10, 10), box(10, 0, 20, 10), box(20, 0, 30, 10)]
+        valley = unary_union(catchments)
+        road = LineString([(20, 0), (20, 10)])
+        connected, disconnected = floodplain_areas(catchments, valley, road, [LineString([(1, 1), (2, 2)])])
+        self.assertEqual(areas(connected), [100.0, 100.0])
+        self.assertEqual(areas(disconnected), [100.0])
+        self.assertTrue(unary_union(disconnected).contains(Point(25, 5)))
+
+    def test_holes_dropped(self):
+        # The road crosses the hole so both of the pieces that fill it are dropped
+        valley = box(0, 0, 10, 10).difference(box(4, 4, 6, 6))
+        road = valley.intersection(LineString([(5, 0), (5, 10)]))
+        connected, disconnected = floodplain_areas([valley], valley, road, [LineString([(1, 1), (2, 2)])])
+        self.assertAlmostEqual(sum(geom.area for geom in connected), 48.0)
+        self.assertAlmostEqual(sum(geom.area for geom in disconnected), 48.0)
+        for geom in connected + disconnected:
+            self.assertFalse(geom.contains(Point(4.5, 5)))
+            self.assertFalse(geom.contains(Point(5.5, 5)))
+
+    def test_flowline_touch(self):
+        valley = box(0, 0, 10, 10)
+        road = LineString([(5, 0), (5, 10)])
+
+        # A flowline that only touches the valley edge still selects the piece it touches
+        connected, disconnected = floodplain_areas([valley], valley, road, [LineString([(7, -5), (7, 0)])])
+        self.assertTrue(unary_union(connected).contains(Point(7.5, 5)))
+        self.assertEqual(areas(disconnected), [50.0])
+
+        # A flowline along the road touches both sides
+        connected, disconnected = floodplain_areas([valley], valley, road, [LineString([(5, 2), (5, 8)])])
+        self.assertEqual(areas(connected), [50.0, 50.0])
+        self.assertEqual(disconnected, [])
+
+        # A flowline outside the valley selects nothing
+        connected, disconnected = floodplain_areas([valley], valley, road, [LineString([(20, 20), (30, 30)])])
+        self.assertEqual(connected, [])
+        self.assertEqual(areas(disconnected), [50.0, 50.0])
+
+
+class HelpersTest(unittest.TestCase):
+
+    def test_parts(self):
+        geom = MultiLineString([[(0, 0), (1, 1)], [(2, 2), (3, 3)]]).union(box(5, 5, 6, 6))
+        self.assertEqual(len(_parts(geom)), 3)
+        self.assertEqual(len(_parts(geom, LineString)), 2)
+        self.assertEqual(len(_parts(geom, Polygon)), 1)
+        self.assertEqual(_parts(None), [])
+        self.assertEqual(_parts(Polygon()), [])
+        self.assertEqual(_parts(box(0, 0, 1, 1).exterior, LineString)[0].geom_type, 'LineString')
+
+    def test_probe(self):
+        probe = _probe(LineString([(0, 0), (4, 0)]))
+        self.assertTrue(probe.contains(Point(2, 0)))
+        self.assertLess(probe.bounds[2] - probe.bounds[0], 3 * NODE_TOLERANCE)
+
+        # Lines with more than two vertices are probed at their second vertex
+        probe = _probe(LineString([(0, 0), (1, 3), (4, 0)]))
+        self.assertTrue(probe.contains(Point(1, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+""" Tests for the VBET centerline paths and merging on a small synthetic network
+
+    The expected values are the results of the previous implementation
+    (list based traversal and per reach OGR unions) on the same network.
+"""
+import unittest
+import numpy as np
+from shapely.geometry import LineString
+from shapely.ops import unary_union
+from vbet.vbet_centerline import stream_paths, build_centerline, merge_centerlines
+
+
+def synthetic_network() -> tuple:
+    """Two headwaters joining a single outlet reach with a valley bottom polygon around all three"""
+
+    x = np.linspace(0, 2000, 81)
+    main = np.column_stack([x, 30 * np.sin(x / 200)])
+    reaches = {
+        1: {'up': 0, 'down': 3, 'geom': LineString(main[:41])},
+        2: {'up': 0, 'down': 3, 'geom': LineString([(1000, 700), (1000, 400), tuple(main[40])])},
+        3: {'up': 1, 'down': 0, 'geom': LineString(main[40:])},
+    }
+    valley = LineString(main).buffer(60).union(reaches[2]['geom'].buffer(40))
+    return reaches, valley
+
+
+class StreamPathsTest(unittest.TestCase):
+
+    def test_paths(self):
+        reaches, _valley = synthetic_network()
+        self.assertEqual(stream_paths(reaches), {1: [1, 3], 2: [2, 3]})
+
+    def test_missing_down_reach(self):
+        reaches, _valley = synthetic_network()
+        del reaches[3]
+        self.assertEqual(stream_paths(reaches), {1: [1], 2: [2]})
+
+    def test_long_trunk(self):
+        # The second path stops at the first reach the first path already walked
+        reaches = {
+            1: {'up': 0, 'down': 3},
+            2: {'up': 0, 'down': 4},
+            3: {'up': 1, 'down': 4},
+            4: {'up': 3, 'down': 5},
+            5: {'up': 4, 'down': 0},
+        }
+        self.assertEqual(stream_paths(reaches), {1: [1, 3, 4, 5], 2: [2, 4]})
+
+
+class CenterlineTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CenterlineTest, self).setUp()
+        self.reaches, self.valley = synthetic_network()
+
+    def path_centerlines(self, path: list) -> list:
+        geoms = [self.reaches[HydroSeq]['geom'] for HydroSeq in path]
+        return build_centerline(geoms[0] if len(geoms) == 1 else unary_union(geoms), self.valley, 20, 1)
+
+    def test_build_centerline(self):
+        centerlines = self.path_centerlines([1, 3])
+        self.assertEqual(len(centerlines), 1)
+        self.assertAlmostEqual(centerlines[0].length, 2011.993034, places=5)
+
+        # Untrimmed, the tributary's centerline runs on down the shared outlet reach
+        centerlines = self.path_centerlines([2, 3])
+        self.assertEqual(len(centerlines), 1)
+        self.assertGreater(centerlines[0].length, 721.97066 + 900)
+
+    def test_merge_centerlines(self):
+        merged = None
+        lengths = {}
+        for HydroSeq, path in stream_paths(self.reaches).items():
+            centerlines, merged = merge_centerlines(self.path_centerlines(path), merged, self.reaches[HydroSeq]['geom'])
+            lengths[HydroSeq] = [centerline.length for centerline in centerlines]
+
+        self.assertEqual(len(lengths[1]), 1)
+        self.assertEqual(len(lengths[2]), 1)
+        self.assertAlmostEqual(lengths[1][0], 2011.993034, places=5)
+        self.assertAlmostEqual(lengths[2][0], 721.97066, places=4)
+        self.assertAlmostEqual(merged.length, 2733.963694, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
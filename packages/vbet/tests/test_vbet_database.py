@@ -0,0 +1,145 @@
+""" Tests for the compiled VBET transforms against the interp1d transforms
+    loaded from the VBET database and picked per cell with np.choose
+"""
+import os
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+from scipy import interpolate
+from rscommons.util import safe_remove_dir
+from vbet.vbet_database import load_configuration, compile_transforms, LinearKernel, ZoneTransforms
+from vbet.vbet_evidence import evidence_block
+
+database_folder = os.path.join(os.path.dirname(__file__), '..', 'database')
+
+# Transform type and inflection points of each zone of each input. TWI repeats an inflection point
+INPUT_ZONES = {
+    'Slope': [('linear', [(0, 1), (6, 1), (12, 0)]), ('linear', [(0, 1), (12, 1), (24, 0)]), ('linear', [(0, 1), (18, 1), (36, 0)])],
+    'HAND': [('linear', [(0, 1), (5, 1), (15, 0)]), ('nearest', [(0, 1), (10, 0.5), (30, 0)])],
+    'TWI': [('linear', [(0, 0), (8, 0.5), (8, 0.6), (20, 1)])],
+    'Channel': [('linear', [(0, 0), (1, 1)])]
+}
+
+
+def legacy_normalize(vbet_run: dict, name: str, values: np.ndarray, zones: np.ndarray) -> np.ndarray:
+    """The previous evidence loop: every transform over every cell, then one picked per cell by zone"""
+
+    if name in vbet_run['Zones']:
+        return np.choose(zones, [transform(values) for transform in vbet_run['Transforms'][name]], mode='clip')
+    return vbet_run['Transforms'][name][0](values)
+
+
+class CompiledTransformsTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CompiledTransformsTest, self).setUp()
+        self.temp_dir = mkdtemp()
+        self.database = os.path.join(self.temp_dir, 'vbet.gpkg')
+
+        conn = sqlite3.connect(self.database)
+        conn.execute('CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL)')
+        with open(os.path.join(database_folder, 'vbet_schema.sql')) as sqlfile:
+            conn.executescript(sqlfile.read())
+        with open(os.path.join(database_folder, 'data', 'transform_types.csv')) as csvfile:
+            type_ids = {}
+            for line in csvfile.readlines()[1:]:
+                type_id, type_name = line.split(',')[:2]
+                type_ids[type_name] = int(type_id)
+                conn.execute('INSERT INTO transform_types (type_id, name) VALUES (?, ?)', [int(type_id), type_name])
+
+        conn.execute("INSERT INTO scenarios (scenario_id, scenario_name, machine_code) VALUES (1, 'Test', 'TEST')")
+        transform_id = 0
+        for input_id, (name, zones) in enumerate(INPUT_ZONES.items(), start=1):
+            conn.execute('INSERT INTO inputs (input_id, name) VALUES (?, ?)', [input_id, name])
+            conn.execute('INSERT INTO scenario_inputs (scenario_input_id, scenario_id, input_id) VALUES (?, 1, ?)', [input_id, input_id])
+            for zone, (kind, inflections) in enumerate(zones):
+                transform_id += 1
+                conn.execute('INSERT INTO transforms (transform_id, type_id, input_id, name) VALUES (?, ?, ?, ?)', [transform_id, type_ids[kind], input_id, '{} {}'.format(name, zone)])
+                conn.execute('INSERT INTO input_zones (scenario_input_id, transform_id, min_value, max_value) VALUES (?, ?, ?, ?)', [input_id, transform_id, zone * 100, (zone + 1) * 100])
+                conn.executemany('INSERT INTO inflections (transform_id, input_value, output_value) VALUES (?, ?, ?)', [(transform_id, x, y) for x, y in inflections])
+        conn.commit()
+        conn.close()
+
+        self.vbet_run = load_configuration('TEST', self.database)
+
+    def tearDown(self):
+        safe_remove_dir(self.temp_dir)
+
+    def test_linear_kernel(self):
+        x_vals = np.array([0.0, 6.0, 12.0])
+        y_vals = np.array([1.0, 1.0, 0.0])
+        kernel = LinearKernel(x_vals, y_vals)
+        reference = interpolate.interp1d(x_vals, y_vals, kind='linear', bounds_error=False, fill_value=0.0)
+
+        values = np.concatenate([np.linspace(-5, 20, 1001), x_vals, [np.nan]])
+        np.testing.assert_array_equal(kernel(values), reference(values))
+        self.assertEqual(kernel(np.array([-0.1]))[0], 0.0)
+        self.assertEqual(kernel(np.array([12.1]))[0], 0.0)
+
+    def test_compile_transforms(self):
+        transforms = compile_transforms(self.vbet_run)
+        self.assertEqual(sorted(transforms), sorted(INPUT_ZONES))
+
+        # Only inputs with more than one zone in the configuration are zoned
+        self.assertEqual(sorted(self.vbet_run['Zones']), ['HAND', 'Slope'])
+        self.assertEqual({name: transform.zoned for name, transform in transforms.items()}, {'Slope': True, 'HAND': True, 'TWI': False, 'Channel': False})
+
+        # Linear transforms with distinct inflection points become LinearKernels. Everything else keeps its interp1d
+        self.assertTrue(all(isinstance(kernel, LinearKernel) for kernel in transforms['Slope'].kernels))
+        self.assertIsInstance(transforms['HAND'].kernels[0], LinearKernel)
+        self.assertIs(transforms['HAND'].kernels[1], self.vbet_run['Transforms']['HAND'][1])
+        self.assertIs(transforms['TWI'].kernels[0], self.vbet_run['Transforms']['TWI'][0])
+
+    def test_matches_choose(self):
+        transforms = compile_transforms(self.vbet_run)
+        rng = np.random.default_rng(11)
+        values = rng.uniform(-5, 45, (64, 48))
+        # Zones outside the range of transforms are clipped like np.choose(mode='clip')
+        zones = rng.integers(-1, 5, (64, 48)).astype(np.int16)
+
+        for name, transform in transforms.items():
+            expected = legacy_normalize(self.vbet_run, name, values, zones)
+            np.testing.assert_array_equal(transform(values, zones if transform.zoned else None), expected, name)
+
+        # The buffer is reused by the next call with the same shape
+        first = transforms['Slope'](values, zones)
+        self.assertIs(transforms['Slope'](values[::-1], zones), first)
+
+    def test_zoned_flag(self):
+        values = np.linspace(-5, 40, 50)
+        zones = np.repeat([0, 1], 25)
+        transforms = self.vbet_run['Transforms']['Slope']
+
+        # A zoned input with a single transform still uses it for every zone
+        single = ZoneTransforms(transforms[:1], zoned=True)
+        np.testing.assert_array_equal(single(values, zones), transforms[0](values))
+        self.assertRaises(Exception, lambda: single(values))
+
+        # An input that is not zoned uses its first transform whatever the number of transforms
+        unzoned = ZoneTransforms(transforms)
+        self.assertFalse(unzoned.zoned)
+        np.testing.assert_array_equal(unzoned(values), transforms[0](values))
+
+    def test_evidence_block(self):
+        transforms = compile_transforms(self.vbet_run)
+        rng = np.random.default_rng(5)
+        shape = (32, 32)
+        block = {name: np.ma.masked_array(rng.uniform(0, 40, shape), mask=rng.random(shape) < 0.1) for name in ['Slope', 'HAND', 'TWI']}
+        block['Channel'] = np.ma.masked_array((rng.random(shape) < 0.2).astype(np.float32))
+        block['TRANSFORM_ZONE_Slope'] = np.ma.masked_array(rng.integers(0, 3, shape).astype(np.int16))
+        block['TRANSFORM_ZONE_HAND'] = np.ma.masked_array(rng.integers(0, 2, shape).astype(np.int16))
+
+        # TWI is not zoned so its block has no zone raster even when it has several transforms
+        transforms['TWI'] = ZoneTransforms(self.vbet_run['Transforms']['Slope'])
+        outputs = evidence_block(block, transforms, -9999)
+
+        for name, output in [('Slope', 'NORMALIZED_SLOPE'), ('HAND', 'NORMALIZED_HAND')]:
+            expected = legacy_normalize(self.vbet_run, name, block[name].data, block['TRANSFORM_ZONE_{}'.format(name)].data)
+            expected = np.ma.masked_array(expected, mask=block[name].mask).astype('float32').filled(-9999)
+            np.testing.assert_array_equal(outputs[output], expected, name)
+        np.testing.assert_array_equal(outputs['NORMALIZED_TWI'], np.ma.masked_array(self.vbet_run['Transforms']['Slope'][0](block['TWI'].data), mask=block['TWI'].mask).astype('float32').filled(-9999))
+
+
+if __name__ == '__main__':
+    unittest.main()
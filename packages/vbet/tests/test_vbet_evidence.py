@@ -0,0 +1,102 @@
+""" Tests for the block by block VBET evidence calculation with and without worker processes
+"""
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from scipy import interpolate
+from rscommons.util import safe_remove_dir
+from vbet import vbet_evidence
+from vbet.vbet_evidence import calculate_evidence
+
+NODATA = -9999
+ROWS = 88
+COLS = 72
+BLOCK_SIZE = 16
+OUTPUTS = ['VBET_EVIDENCE', 'NORMALIZED_SLOPE', 'NORMALIZED_HAND', 'NORMALIZED_TWI', 'EVIDENCE_CHANNEL', 'EVIDENCE_TOPO']
+
+# Inflection points of each zone of each input
+INFLECTIONS = {
+    'Slope': [[(0, 1), (slope, 1), (slope * 2, 0)] for slope in [6, 12, 18]],
+    'HAND': [[(0, 1), (hand, 1), (hand * 3, 0)] for hand in [5, 10]],
+    'TWI': [[(0, 0), (8, 0.5), (20, 1)]],
+    'Channel': [[(0, 0), (1, 1)]]
+}
+
+
+class CalculateEvidenceTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CalculateEvidenceTest, self).setUp()
+        self.temp_dir = mkdtemp()
+
+        # Tiled rasters whose last row and column of blocks are partial
+        profile = {'driver': 'GTiff', 'width': COLS, 'height': ROWS, 'count': 1, 'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE,
+                   'crs': 'EPSG:26912', 'transform': from_origin(500000, 4000000, 10, 10), 'nodata': NODATA}
+        rng = np.random.default_rng(17)
+        nodata = rng.random((ROWS, COLS)) < 0.05
+        arrays = {
+            'Slope': rng.uniform(0, 40, (ROWS, COLS)),
+            'HAND': rng.uniform(0, 35, (ROWS, COLS)),
+            'TWI': rng.uniform(2, 18, (ROWS, COLS)),
+            'Channel': (rng.random((ROWS, COLS)) < 0.1),
+            'TRANSFORM_ZONE_Slope': rng.integers(0, 3, (ROWS, COLS)),
+            'TRANSFORM_ZONE_HAND': rng.integers(0, 2, (ROWS, COLS))
+        }
+
+        self.in_rasters = {}
+        for name, array in arrays.items():
+            path = os.path.join(self.temp_dir, '{}.tif'.format(name.lower()))
+            dtype = 'int16' if name.startswith('TRANSFORM_ZONE') else 'float32'
+            array = array.astype(dtype)
+            if dtype == 'float32':
+                array[nodata] = NODATA
+            with rasterio.open(path, 'w', dtype=dtype, **profile) as dataset:
+                dataset.write(array, 1)
+            self.in_rasters[name] = path
+
+        self.vbet_run = {
+            'Inputs': {name: {} for name in INFLECTIONS},
+            'Transforms': {name: [interpolate.interp1d(np.array([v[0] for v in values]), np.array([v[1] for v in values]), kind='linear', bounds_error=False, fill_value=0.0)
+                                  for values in zones] for name, zones in INFLECTIONS.items()},
+            'Inflections': {name: [('linear', [v[0] for v in values], [v[1] for v in values]) for values in zones] for name, zones in INFLECTIONS.items()},
+            'Zones': {'Slope': {0: 100, 1: 1000, 2: None}, 'HAND': {0: 100, 1: None}}
+        }
+
+    def tearDown(self):
+        safe_remove_dir(self.temp_dir)
+
+    def evidence(self, workers: int) -> dict:
+        out_rasters = {name: os.path.join(self.temp_dir, '{}_{}.tif'.format(name.lower(), workers)) for name in OUTPUTS}
+        calculate_evidence(self.in_rasters, out_rasters, self.vbet_run, workers)
+
+        arrays = {}
+        for name, path in out_rasters.items():
+            with rasterio.open(path) as dataset:
+                self.assertEqual((dataset.height, dataset.width), (ROWS, COLS))
+                arrays[name] = dataset.read(1)
+        return arrays
+
+    def test_workers(self):
+        serial = self.evidence(1)
+
+        # Three blocks per task so that the blocks are spread over several tasks and both workers
+        with mock.patch.object(vbet_evidence, 'TASK_CELLS', 3 * BLOCK_SIZE * BLOCK_SIZE):
+            parallel = self.evidence(2)
+
+        for name in OUTPUTS:
+            np.testing.assert_array_equal(parallel[name], serial[name], name)
+
+        # Every block was written and the input NoData carries through
+        with rasterio.open(self.in_rasters['Slope']) as dataset:
+            nodata = dataset.read(1) == NODATA
+        self.assertTrue(np.all(serial['NORMALIZED_SLOPE'][nodata] == NODATA))
+        self.assertTrue(np.all((serial['NORMALIZED_SLOPE'][~nodata] >= 0) & (serial['NORMALIZED_SLOPE'][~nodata] <= 1)))
+        self.assertTrue(np.all(serial['VBET_EVIDENCE'][~nodata] != NODATA))
+
+
+if __name__ == '__main__':
+    unittest.main()
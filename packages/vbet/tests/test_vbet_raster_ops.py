@@ -0,0 +1,166 @@
+""" Tests for the windowed VBET raster operations against the
+    whole raster and per zone versions they replace
+"""
+import os
+import unittest
+from tempfile import mkdtemp
+import numpy as np
+import rasterio
+from rasterio.mask import mask
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+from shapely.geometry import box, mapping, shape
+from shapely.ops import unary_union
+from rscommons.util import safe_remove_dir
+from vbet.vbet_raster_ops import raster_clean, polygonize_zones
+
+NODATA = -9999
+TRANSFORM = from_origin(1000, 2000, 10, 10)
+
+
+def write_raster(path: str, array: np.ndarray, nodata):
+    with rasterio.open(path, 'w', driver='GTiff', height=array.shape[0], width=array.shape[1], count=1, dtype=array.dtype,
+                       nodata=nodata, crs='EPSG:26912', transform=TRANSFORM) as dataset:
+        dataset.write(array, 1)
+
+
+def proximity(targets: np.ndarray) -> np.ndarray:
+    """Distance in pixels from every cell to the nearest target cell, like gdal.ComputeProximity. Infinite without targets"""
+
+    rows, cols = np.nonzero(targets)
+    if len(rows) == 0:
+        return np.full(targets.shape, np.inf)
+    grid_rows, grid_cols = np.indices(targets.shape)
+    distances = np.sqrt((grid_rows[..., None] - rows) ** 2 + (grid_cols[..., None] - cols) ** 2)
+    return distances.min(axis=2)
+
+
+def legacy_clean(valid: np.ndarray, buffer_pixels: int) -> np.ndarray:
+    """The original raster_clean: grow to the cells within buffer_pixels of a valid cell, then
+    keep the grown cells that are more than buffer_pixels from any cell that was not grown"""
+
+    grown = np.logical_or(valid, proximity(valid) <= buffer_pixels)
+    return proximity(np.logical_not(grown)) > buffer_pixels
+
+
+def legacy_polygonize(raster_path: str, zones: dict) -> dict:
+    """The original per zone loop: crop the raster to each zone and polygonize the cells equal to 1"""
+
+    zone_polygons = {}
+    with rasterio.open(raster_path) as raster:
+        for zone_id, zone in zones.items():
+            data, mask_transform = mask(raster, [mapping(zone)], crop=True)
+            zone_polygons[zone_id] = [shape(geom) for geom, val in shapes(data, transform=mask_transform) if val == 1]
+    return zone_polygons
+
+
+class RasterCleanTest(unittest.TestCase):
+
+    def setUp(self):
+        super(RasterCleanTest, self).setUp()
+        self.temp_dir = mkdtemp()
+
+        # Blobs, specks and gaps of valid cells, some of them on the raster edges
+        rng = np.random.default_rng(21)
+        self.evidence = rng.random((37, 29)).astype(np.float32)
+        self.evidence[10:20, 5:15] = 0.9
+        self.evidence[12:14, 8:10] = 0.1
+        self.evidence[:, 0] = 0.95
+        self.evidence[rng.random(self.evidence.shape) < 0.05] = NODATA
+
+    def tearDown(self):
+        safe_remove_dir(self.temp_dir)
+
+    def clean(self, in_path: str, name: str, **kwargs) -> np.ndarray:
+        out_path = os.path.join(self.temp_dir, '{}.tif'.format(name))
+        raster_clean(in_path, out_path, **kwargs)
+        with rasterio.open(out_path) as dataset:
+            return dataset.read(1)
+
+    def test_clean(self):
+        # A thresholded raster where only the valid cells have data
+        thresholded = np.where(self.evidence >= 0.68, np.float32(1), np.float32(NODATA))
+        in_path = os.path.join(self.temp_dir, 'thresholded.tif')
+        write_raster(in_path, thresholded, NODATA)
+
+        for buffer_pixels in [1, 2, 3]:
+            expected = np.where(legacy_clean(thresholded != NODATA, buffer_pixels), 1, NODATA)
+            single = self.clean(in_path, 'single_{}'.format(buffer_pixels), buffer_pixels=buffer_pixels)
+            tiled = self.clean(in_path, 'tiled_{}'.format(buffer_pixels), buffer_pixels=buffer_pixels, tile_size=8, workers=2)
+            np.testing.assert_array_equal(single, expected, 'single tile, {} pixels'.format(buffer_pixels))
+            np.testing.assert_array_equal(tiled, expected, 'tiled, {} pixels'.format(buffer_pixels))
+
+    def test_clean_threshold(self):
+        # The evidence raster thresholded in the same pass
+        in_path = os.path.join(self.temp_dir, 'evidence.tif')
+        write_raster(in_path, self.evidence, NODATA)
+        valid = np.logical_and(self.evidence != NODATA, self.evidence >= 0.68)
+
+        for buffer_pixels in [1, 2]:
+            expected = legacy_clean(valid, buffer_pixels).astype(np.uint8)
+            single = self.clean(in_path, 'single_{}'.format(buffer_pixels), buffer_pixels=buffer_pixels, thr_val=0.68)
+            tiled = self.clean(in_path, 'tiled_{}'.format(buffer_pixels), buffer_pixels=buffer_pixels, thr_val=0.68, tile_size=5, workers=2)
+            np.testing.assert_array_equal(single, expected, 'single tile, {} pixels'.format(buffer_pixels))
+            np.testing.assert_array_equal(tiled, expected, 'tiled, {} pixels'.format(buffer_pixels))
+
+    def test_nothing_valid(self):
+        in_path = os.path.join(self.temp_dir, 'empty.tif')
+        write_raster(in_path, np.full((12, 12), NODATA, dtype=np.float32), NODATA)
+        np.testing.assert_array_equal(self.clean(in_path, 'empty_clean', tile_size=5, workers=2), np.full((12, 12), NODATA))
+
+
+class PolygonizeZonesTest(unittest.TestCase):
+
+    def setUp(self):
+        super(PolygonizeZonesTest, self).setUp()
+        self.temp_dir = mkdtemp()
+
+        cells = np.zeros((40, 40), dtype=np.uint8)
+        # A polygon with a hole across the window seams at row and column 16 and across the zone boundary at column 20
+        cells[10:26, 8:30] = 1
+        cells[14:18, 12:15] = 0
+        # Cells that only touch at a corner across a window seam
+        cells[30, 15] = 1
+        cells[31, 16] = 1
+        # A polygon on the far edge of the raster and a single cell
+        cells[33:40, 25:40] = 1
+        cells[2, 2] = 1
+        self.raster_path = os.path.join(self.temp_dir, 'threshold.tif')
+        write_raster(self.raster_path, cells, 0)
+
+        # Zone boundaries on the cell edges so that the cell centres inside a zone are the cells it cuts
+        self.zones = {
+            1: box(1000, 1600, 1200, 2000),
+            2: box(1200, 1600, 1400, 2000)
+        }
+
+    def tearDown(self):
+        safe_remove_dir(self.temp_dir)
+
+    def test_polygonize_zones(self):
+        expected = legacy_polygonize(self.raster_path, self.zones)
+        self.assertEqual([len(expected[zone_id]) for zone_id in self.zones], [4, 2])
+
+        for window_size in [16, 7, 2048]:
+            results = polygonize_zones(self.raster_path, self.zones, window_size=window_size)
+            self.assertEqual(sorted(results), sorted(self.zones))
+            for zone_id in self.zones:
+                message = 'zone {}, {} cell windows'.format(zone_id, window_size)
+                self.assertEqual(len(results[zone_id]), len(expected[zone_id]), message)
+                self.assertEqual(sorted(round(poly.area, 6) for poly in results[zone_id]), sorted(round(poly.area, 6) for poly in expected[zone_id]), message)
+                self.assertAlmostEqual(unary_union(results[zone_id]).symmetric_difference(unary_union(expected[zone_id])).area, 0, 6, message)
+                self.assertTrue(all(poly.is_valid for poly in results[zone_id]), message)
+
+        # The seams dissolve: the holed polygon is one polygon with its hole in the first zone
+        results = polygonize_zones(self.raster_path, self.zones, window_size=16)
+        holed = [poly for poly in results[1] if len(poly.interiors) > 0]
+        self.assertEqual(len(holed), 1)
+        self.assertAlmostEqual(holed[0].area, (16 * 12 - 12) * 100)
+
+    def test_empty_zone(self):
+        results = polygonize_zones(self.raster_path, {**self.zones, 3: box(5000, 5000, 5100, 5100)}, window_size=16)
+        self.assertEqual(results[3], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
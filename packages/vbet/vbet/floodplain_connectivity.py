@@ -9,20 +9,29 @@
 # -------------------------------------------------------------------------------
 import os
 import sys
-from typing import List
+from typing import List, Tuple
 import argparse
 import traceback
+import numpy as np
 from osgeo import ogr
-from shapely.geometry import MultiPolygon, MultiLineString, LineString, Point, MultiPoint, Polygon
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from shapely.geometry import LineString, Point, Polygon
+from shapely.geometry.base import BaseGeometry
 from shapely.ops import polygonize, unary_union
+from shapely.prepared import prep
 
 from rscommons import ProgressBar, Logger, dotenv, initGDALOGRErrors, GeopackageLayer
+from rscommons.spatial_index import GeometryIndex
 from rscommons.util import safe_makedirs
 from rscommons.vector_ops import get_geometry_unary_union, load_geometries
 
 
 Path = str
 
+# Distance (in layer units) within which a point is taken to be on a noded line
+NODE_TOLERANCE = 1e-9
+
 initGDALOGRErrors()
 
 
@@ -45,15 +54,7 @@ def floodplain_connectivity(vbet_network: Path, vbet_polygon: Path, roads: Path,
 
     # Prepare vbet and catchments
     geom_vbet = get_geometry_unary_union(vbet_polygon)
-    geoms_raw_vbet = list(load_geometries(vbet_polygon, None).values())
-    listgeoms = []
-    for geom in geoms_raw_vbet:
-        if geom.geom_type == "MultiPolygon":
-            for g in geom:
-                listgeoms.append(g)
-        else:
-            listgeoms.append(geom)
-    geoms_vbet = MultiPolygon(listgeoms)
+    geoms_vbet = [part for geom in load_geometries(vbet_polygon, None).values() for part in _parts(geom)]
 
     # Clip Transportation Network by VBET
     log.info("Merging Transportation Networks")
@@ -64,151 +65,143 @@ def floodplain_connectivity(vbet_network: Path, vbet_polygon: Path, roads: Path,
     log.info("Clipping Transportation Network by VBET")
     geom_transportation_clipped = geom_vbet.intersection(geom_transportation)
     if debug_gpkg:
-        quicksave(debug_gpkg, "Clipped_Transportation", geom_transportation_clipped, ogr.wkbLineString)
+        quicksave(debug_gpkg, "Clipped_Transportation", _parts(geom_transportation_clipped, LineString), ogr.wkbLineString)
 
-    # Split Valley Edges at transportation intersections
-    log.info("Splitting Valley Edges at transportation network intersections")
-    geom_vbet_edges = MultiLineString([geom.exterior for geom in geoms_vbet] + [g for geom in geoms_vbet for g in geom.interiors])
-    geom_vbet_interior_pts = MultiPoint([Polygon(g).representative_point() for geom in geom_vbet for g in geom.interiors])
+    network_lines = list(load_geometries(vbet_network, None).values())
+    geoms_connected, geoms_disconnected = floodplain_areas(geoms_vbet, geom_vbet, geom_transportation_clipped, network_lines, debug_gpkg)
 
-    if debug_gpkg:
-        quicksave(debug_gpkg, "Valley_Edges_Raw", geom_vbet_edges, ogr.wkbLineString)
-
-    vbet_splitpoints = []
-    vbet_splitlines = []
-    counter = 0
-    for geom_edge in geom_vbet_edges:
-        counter += 1
-        log.info('Splitting edge features {}/{}'.format(counter, len(geom_vbet_edges)))
-        if geom_edge.is_valid:
-            if not geom_edge.intersects(geom_transportation):
-                vbet_splitlines = vbet_splitlines + [geom_edge]
-                continue
-            pts = geom_transportation.intersection(geom_edge)
-            if pts.is_empty:
-                vbet_splitlines = vbet_splitlines + [geom_edge]
-                continue
-            if isinstance(pts, Point):
-                pts = [pts]
-            geom_boundaries = [geom_edge]
-
-            progbar = ProgressBar(len(geom_boundaries), 50, "Processing")
-            counter = 0
-            for pt in pts:
-                # TODO: I tried to break this out but I'm not sure
-                new_boundaries = []
-                for line in geom_boundaries:
-                    if line is not None:
-                        split_line = line_splitter(line, pt)
-                        progbar.total += len(split_line)
-                        for new_line in split_line:
-                            counter += 1
-                            progbar.update(counter)
-                            if new_line is not None:
-                                new_boundaries.append(new_line)
-                geom_boundaries = new_boundaries
-                # TODO: Not sure this is having the intended effect
-                # geom_boundaries = [new_line for line in geom_boundaries if line is not None for new_line in line_splitter(line, pt) if new_line is not None]
-            progbar.finish()
-            vbet_splitlines = vbet_splitlines + geom_boundaries
-            vbet_splitpoints = vbet_splitpoints + [pt for pt in pts]
+    log.info("Union connected floodplains")
+    geoms_connected_output = _parts(unary_union(geoms_connected))
+    geoms_disconnected_output = _parts(unary_union(geoms_disconnected))
+
+    # Save Outputs
+    log.info("Save Floodplain Output")
+    with GeopackageLayer(out_polygon, write=True) as out_lyr:
+        out_lyr.create_layer(ogr.wkbPolygon, epsg=4326)
+        out_lyr.create_field("Connected", ogr.OFTInteger)
+        progbar = ProgressBar(len(geoms_connected_output) + len(geoms_disconnected_output), 50, f"saving {out_lyr.ogr_layer_name} features")
+        counter = 0
+        out_lyr.ogr_layer.StartTransaction()
+        for connected, shapes in [(1, geoms_connected_output), (0, geoms_disconnected_output)]:
+            for shape in shapes:
+                counter += 1
+                progbar.update(counter)
+                out_lyr.create_feature(shape, attributes={"Connected": connected})
+        out_lyr.ogr_layer.CommitTransaction()
+        progbar.finish()
+
+
+def floodplain_areas(geoms_vbet: List[Polygon], geom_vbet: BaseGeometry, geom_transportation: BaseGeometry, network_lines: List[BaseGeometry], debug_gpkg: Path = None) -> Tuple[List[Polygon], List[Polygon]]:
+    """Split the valley bottoms by the transportation network and sort the pieces into connected and disconnected floodplain
+
+    The valley edges and the transportation lines are noded together in one union and polygonized once. Pieces
+    that share an edge that is not part of the transportation network (e.g. the boundary between two catchments)
+    are adjacent and every piece of a group of adjacent pieces is connected when any of them touches the network.
+
+    Args:
+        geoms_vbet (List[Polygon]): valley bottom polygons
+        geom_vbet (BaseGeometry): union of the valley bottom polygons
+        geom_transportation (BaseGeometry): transportation lines clipped to the valley bottom
+        network_lines (List[BaseGeometry]): flowlines used to generate VBET
+        debug_gpkg (Path, optional): geopackage for saving the noded edges and split points. Defaults to None.
+
+    Returns:
+        Tuple[List[Polygon], List[Polygon]]: connected and disconnected floodplain pieces
+    """
+
+    log = Logger('Floodplain Connectivity')
+
+    # Node the valley edges and the transportation lines in a single pass
+    log.info("Noding valley edges with the transportation network")
+    vbet_edges = [LineString(ring.coords) for geom in geoms_vbet for ring in [geom.exterior] + list(geom.interiors)]
+    vbet_edges = [edge for edge in vbet_edges if edge.is_valid]
+    transportation_lines = _parts(geom_transportation, LineString)
+    noded_lines = _parts(unary_union(vbet_edges + transportation_lines), LineString)
+
+    # Each noded line is a piece of a transportation line (a barrier) or of a valley edge
+    transportation_index = GeometryIndex(transportation_lines)
+    probes = [_probe(line) for line in noded_lines]
+    barriers = [len(transportation_index.intersecting(probe)) > 0 for probe in probes]
 
     if debug_gpkg:
-        quicksave(debug_gpkg, "Split_Points", vbet_splitpoints, ogr.wkbPoint)
-        quicksave(debug_gpkg, "Valley_Edges_Split", vbet_splitlines, ogr.wkbLineString)
+        edge_index = GeometryIndex(vbet_edges)
+        split_points = _parts(unary_union(transportation_lines).intersection(unary_union(vbet_edges)), Point)
+        quicksave(debug_gpkg, "Split_Points", split_points, ogr.wkbPoint)
+        quicksave(debug_gpkg, "Valley_Edges_Split", [line for line, probe in zip(noded_lines, probes) if len(edge_index.intersecting(probe)) > 0], ogr.wkbLineString)
 
-    # Generate Polygons from lines
+    # Generate Polygons from lines. Those that fill the holes in the valley bottom are dropped
     log.info("Generating Floodplain Polygons")
-    geom_lines = unary_union(vbet_splitlines + [geom_tc for geom_tc in geom_transportation_clipped])
-    geoms_areas = [geom for geom in polygonize(geom_lines) if not any(geom.contains(pt) for pt in geom_vbet_interior_pts)]
+    areas = list(polygonize(noded_lines))
+    area_index = GeometryIndex(areas)
+    in_holes = set()
+    for ring in [ring for geom in _parts(geom_vbet) for ring in geom.interiors]:
+        pt = Polygon(ring).representative_point()
+        in_holes.update(idx for idx in area_index.query(pt) if areas[idx].contains(pt))
+    geoms_areas = [area for idx, area in enumerate(areas) if idx not in in_holes]
 
     if debug_gpkg:
         quicksave(debug_gpkg, "Split_Polygons", geoms_areas, ogr.wkbPolygon)
 
+    # Areas on either side of a valley edge that is not a barrier are adjacent
+    log.info("Labelling adjacent floodplain areas")
+    area_index = GeometryIndex(geoms_areas)
+    pairs = []
+    for probe, barrier in zip(probes, barriers):
+        if barrier:
+            continue
+        sides = area_index.intersecting(probe)
+        pairs.extend((sides[0], side) for side in sides[1:])
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(len(geoms_areas), len(geoms_areas)))
+    _count, labels = connected_components(adjacency, directed=False)
+
     # Select Polygons by flowline intersection
     log.info("Selecting connected floodplains")
-    geom_vbet_network = get_geometry_unary_union(vbet_network)
-    geoms_connected = []
-    geoms_disconnected = []
-    progbar = ProgressBar(len(geoms_areas), 50, f"Running polygon selection")
-    counter = 0
-    for geom in geoms_areas:
+    network_index = GeometryIndex(network_lines)
+    touches_network = np.zeros(len(geoms_areas), dtype=bool)
+    progbar = ProgressBar(len(geoms_areas), 50, "Running polygon selection")
+    for counter, geom in enumerate(geoms_areas, start=1):
         progbar.update(counter)
-        counter += 1
-        if geom_vbet_network.intersects(geom):
-            geoms_connected.append(geom)
-        else:
-            geoms_disconnected.append(geom)
+        prepared = prep(geom)
+        touches_network[counter - 1] = any(prepared.intersects(network_lines[idx]) for idx in network_index.query(geom))
+    progbar.finish()
 
-    log.info("Union connected floodplains")
-    geoms_connected_output = [geom for geom in list(unary_union(geoms_connected))]
-    geoms_disconnected_output = [geom for geom in list(unary_union(geoms_disconnected))]
+    connected_labels = np.zeros(len(labels), dtype=bool)
+    connected_labels[labels[touches_network]] = True
+    connected = connected_labels[labels]
 
-    # Save Outputs
-    log.info("Save Floodplain Output")
-    with GeopackageLayer(out_polygon, write=True) as out_lyr:
-        out_lyr.create_layer(ogr.wkbPolygon, epsg=4326)
-        out_lyr.create_field("Connected", ogr.OFTInteger)
-        progbar = ProgressBar(len(geoms_connected_output) + len(geoms_disconnected_output), 50, f"saving {out_lyr.ogr_layer_name} features")
-        counter = 0
-        for shape in geoms_connected_output:
-            progbar.update(counter)
-            counter += 1
-            out_lyr.create_feature(shape, attributes={"Connected": 1})
-        for shape in geoms_disconnected_output:
-            progbar.update(counter)
-            counter += 1
-            out_lyr.create_feature(shape, attributes={"Connected": 0})
+    return [geom for geom, keep in zip(geoms_areas, connected) if keep], [geom for geom, keep in zip(geoms_areas, connected) if not keep]
 
 
-def line_splitter(line: LineString, pt: Point) -> List[LineString]:
-    """Split a shapley line at a point. Return list of LineStrings split at point
+def _probe(line: LineString) -> Polygon:
+    """A small disc around a point inside a noded line that only touches the polygons on either side of it"""
 
-    Args:
-        line (LineString): Line to split
-        pt ([Point]): Point to split line
+    point = Point(line.coords[1]) if len(line.coords) > 2 else line.interpolate(0.5, normalized=True)
+    return point.buffer(NODE_TOLERANCE)
 
-    Returns:
-        List(LineString): List of linestrings
-    """
-    # TODO: pt. inside line bounding box might be quicker.
-    # line.envelope.contains(pt)
-    if pt.buffer(0.000001).intersects(line):
-        distance = line.project(pt)
-        coords = list(line.coords)
-        if distance == 0.0 or distance == line.length:
-            return [line]
-        for i, p in enumerate(coords):
-            lim = len(coords) - 1
-            pd = line.project(Point(p))
-            if pd == distance:
-                if i == lim:
-                    return [line]
-                else:
-                    lines = [
-                        LineString(coords[:i + 1]),
-                        LineString(coords[i:])]
-                return lines
-            if pd > distance:
-                cp = line.interpolate(distance)
-                lines = [
-                    LineString(coords[:i] + [(cp.x, cp.y)]),
-                    LineString([(cp.x, cp.y)] + coords[i:])]
-                return lines
-        return [line]
-    else:
-        return [line]
+
+def _parts(geom: BaseGeometry, geom_type: type = None) -> List[BaseGeometry]:
+    """Single part geometries of a (possibly multi part or collection) geometry, optionally of one type"""
+
+    if geom is None or geom.is_empty:
+        return []
+    if hasattr(geom, 'geoms'):
+        return [part for sub_geom in geom.geoms for part in _parts(sub_geom, geom_type)]
+    if geom_type is LineString and geom.geom_type == 'LinearRing':
+        return [LineString(geom.coords)]
+    return [geom] if geom_type is None or geom.geom_type == geom_type.__name__ else []
 
 
 def quicksave(gpkg, name, geoms, geom_type):
     with GeopackageLayer(gpkg, name, write=True) as out_lyr:
         out_lyr.create_layer(geom_type, epsg=4326)
         progbar = ProgressBar(len(geoms), 50, f"saving {out_lyr.ogr_layer_name} features")
-        counter = 0
-        for shape in geoms:
+        out_lyr.ogr_layer.StartTransaction()
+        for counter, shape in enumerate(geoms, start=1):
             progbar.update(counter)
-            counter += 1
             out_lyr.create_feature(shape)
+        out_lyr.ogr_layer.CommitTransaction()
+        progbar.finish()
 
 
 def main():
@@ -22,7 +22,6 @@ from osgeo import gdal, ogr
 import rasterio
 from rasterio.features import shapes
 import rasterio.mask
-import numpy as np
 from shapely.geometry import MultiPolygon
 from rscommons.classes.rs_project import RSMeta, RSMetaTypes
 
@@ -34,12 +33,14 @@ from rscommons.thiessen.vor import NARVoronoi
 from rscommons.thiessen.shapes import centerline_points
 from rscommons.vbet_network import vbet_network, create_stream_size_zones, copy_vaa_attributes, join_attributes
 from rscommons.classes.raster import get_data_polygon
+from rscommons.spatial_index import GeometryIndex, connected_components
 
 from vbet.vbet_database import load_configuration, build_vbet_database
 from vbet.vbet_metrics import build_vbet_metric_tables
 from vbet.vbet_report import VBETReport
-from vbet.vbet_raster_ops import rasterize, raster_clean, rasterize_attribute
-from vbet.vbet_outputs import threshold, sanitize
+from vbet.vbet_raster_ops import rasterize, raster_clean, rasterize_attribute, polygonize_zones
+from vbet.vbet_evidence import calculate_evidence
+from vbet.vbet_outputs import sanitize
 from vbet.vbet_centerline import vbet_centerline
 from vbet.__version__ import __version__
 
@@ -113,7 +114,7 @@ flowline_fieldmap = {
     }}
 
 
-def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path, project_folder: Path, reach_codes: List[str], meta: Dict[str, str], flowline_type: str = 'NHD', epsg=cfg.OUTPUT_EPSG, thresh_vals={'VBET_IA': 0.90, 'VBET_FULL': 0.68}):
+def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path, project_folder: Path, reach_codes: List[str], meta: Dict[str, str], flowline_type: str = 'NHD', epsg=cfg.OUTPUT_EPSG, thresh_vals={'VBET_IA': 0.90, 'VBET_FULL': 0.68}, workers: int = 1, polygonize_once: bool = False):
     """generate vbet evidence raster and threshold polygons for a watershed
 
     Args:
@@ -124,6 +125,9 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
         project_folder (Path): path for project results
         reach_codes (List[int]): NHD reach codes for features to include in outputs
         meta (Dict[str,str]): dictionary of riverscapes metadata key: value pairs
+        workers (int, optional): number of processes used to calculate the evidence and cleaned threshold rasters. Defaults to 1.
+        polygonize_once (bool, optional): polygonize each threshold raster in one pass and split the polygons among the catchments
+            instead of masking and polygonizing the raster under each catchment. Defaults to False.
     """
 
     vbet_timer = time.time()
@@ -232,55 +236,13 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
         out_rasters[raster_name] = os.path.join(project_folder, LayerTypes[raster_name].rel_path)
     evidence_raster = os.path.join(project_folder, LayerTypes['VBET_EVIDENCE'].rel_path)
 
-    # Open evidence rasters concurrently. We're looping over windows so this shouldn't affect
-    # memory consumption too much
-    read_rasters = {name: rasterio.open(raster) for name, raster in in_rasters.items()}
-    out_meta = read_rasters['Slope'].meta
-    out_meta['driver'] = 'GTiff'
-    out_meta['count'] = 1
-    out_meta['compress'] = 'deflate'
-
     # We use this to buffer the output
-    cell_size = abs(read_rasters['Slope'].get_transform()[1])
-
-    write_rasters = {name: rasterio.open(raster, 'w', **out_meta) for name, raster in out_rasters.items()}
-    write_rasters['VBET_EVIDENCE'] = rasterio.open(evidence_raster, 'w', **out_meta)
-
-    progbar = ProgressBar(len(list(read_rasters['Slope'].block_windows(1))), 50, "Calculating evidence layer")
-    counter = 0
-    # Again, these rasters should be orthogonal so their windows should also line up
-    for _ji, window in read_rasters['Slope'].block_windows(1):
-        progbar.update(counter)
-        counter += 1
-        block = {block_name: raster.read(1, window=window, masked=True) for block_name, raster in read_rasters.items()}
-
-        normalized = {}
-        for name in vbet_run['Inputs']:
-            if name in vbet_run['Zones']:
-                transforms = [np.ma.MaskedArray(transform(block[name].data), mask=block[name].mask) for transform in vbet_run['Transforms'][name]]
-                normalized[name] = np.ma.MaskedArray(np.choose(block[f'TRANSFORM_ZONE_{name}'].data, transforms, mode='clip'), mask=block[name].mask)
-            else:
-                normalized[name] = np.ma.MaskedArray(vbet_run['Transforms'][name][0](block[name].data), mask=block[name].mask)
-
-        fvals_topo = np.ma.mean([normalized['Slope'], normalized['HAND'], normalized['TWI']], axis=0)
-        fvals_channel = 0.995 * block['Channel']
-        fvals_evidence = np.maximum(fvals_topo, fvals_channel)
-
-        # Fill the masked values with the appropriate nodata vals
-        # Unthresholded in the base band (mostly for debugging)
-        write_rasters['VBET_EVIDENCE'].write(np.ma.filled(np.float32(fvals_evidence), out_meta['nodata']), window=window, indexes=1)
+    with rasterio.open(in_rasters['Slope']) as slope_raster:
+        cell_size = abs(slope_raster.get_transform()[1])
 
-        write_rasters['NORMALIZED_SLOPE'].write(normalized['Slope'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
-        write_rasters['NORMALIZED_HAND'].write(normalized['HAND'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
-        write_rasters['NORMALIZED_TWI'].write(normalized['TWI'].astype('float32').filled(out_meta['nodata']), window=window, indexes=1)
-
-        write_rasters['EVIDENCE_CHANNEL'].write(np.ma.filled(np.float32(fvals_channel), out_meta['nodata']), window=window, indexes=1)
-        write_rasters['EVIDENCE_TOPO'].write(np.ma.filled(np.float32(fvals_topo), out_meta['nodata']), window=window, indexes=1)
-    progbar.finish()
-
-    # Close all rasters here
-    for raster_obj in list(read_rasters.values()) + list(write_rasters.values()):
-        raster_obj.close()
+    # These rasters should be orthogonal so their windows line up. Blocks are computed by
+    # a pool of worker processes and written in order by this one
+    calculate_evidence(in_rasters, {**out_rasters, 'VBET_EVIDENCE': evidence_raster}, vbet_run, workers)
 
     # The remaining rasters get added to the project
     for raster_name in out_rasters:
@@ -328,16 +290,19 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
     catchments_dissolved_path = os.path.join(intermediates_gpkg_path, "catchments_dissolved")
     dissolve_feature_class(catchments_vaa_path, catchments_dissolved_path, epsg, vbet_summary_field)
 
+    # The channel area polygons are the same for every threshold so they are indexed once
+    with GeopackageLayer(project_inputs['CHANNEL_AREA_POLYGONS']) as lyr_channel_area_polygons:
+        channel_area_index = GeometryIndex([VectorBase.ogr2shapely(feat) for feat, *_ in lyr_channel_area_polygons.iterate_features('Indexing channel areas') if feat.GetGeometryRef() is not None])
+
     vbet_threshold = {}
     for str_val, thr_val in thresh_vals.items():
 
         plgnize_id = f'THRESH_{int(thr_val * 100)}'
-        with TempRaster(f'vbet_raw_thresh_{int(thr_val * 100)}') as tmp_raw_thresh, \
-                TempRaster(f'vbet_cleaned_thresh_{int(thr_val * 100)}') as tmp_cleaned_thresh:
+        with TempRaster(f'vbet_cleaned_thresh_{int(thr_val * 100)}') as tmp_cleaned_thresh:
 
-            log.debug('Temporary threshold raster: {}'.format(tmp_raw_thresh.filepath))
-            threshold(evidence_raster, thr_val, tmp_raw_thresh.filepath)
-            raster_clean(tmp_raw_thresh.filepath, tmp_cleaned_thresh.filepath, buffer_pixels=1)
+            log.debug('Temporary cleaned threshold raster: {}'.format(tmp_cleaned_thresh.filepath))
+            # Threshold the evidence and clean the result in a single pass
+            raster_clean(evidence_raster, tmp_cleaned_thresh.filepath, buffer_pixels=1, thr_val=thr_val, workers=workers)
 
             # Threshold and VBET output layers
             plgnize_lyr = RSLayer(f'Raw Threshold at {int(thr_val * 100)}%', plgnize_id, 'Vector', plgnize_id.lower())
@@ -346,7 +311,6 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
 
             with rasterio.open(tmp_cleaned_thresh.filepath, 'r') as raster:
                 with GeopackageLayer(catchments_dissolved_path, write=True) as lyr_reaches, \
-                        GeopackageLayer(project_inputs['CHANNEL_AREA_POLYGONS']) as lyr_channel_area_polygons, \
                         GeopackageLayer(os.path.join(intermediates_gpkg_path, plgnize_lyr.rel_path), write=True) as lyr_output:
 
                     lyr_output.create_layer_from_ref(lyr_reaches)
@@ -354,10 +318,14 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
                     out_layer_defn = lyr_output.ogr_layer.GetLayerDefn()
                     field_count = out_layer_defn.GetFieldCount()
 
-                    rejected_geoms = []
-
-                    lyr_output.ogr_layer.StartTransaction()
+                    if polygonize_once is True:
+                        # Polygonize the whole threshold raster once and split the polygons among the buffered catchments
+                        reach_polygons = {reach_feat.GetFID(): VectorBase.ogr2shapely(reach_feat.GetGeometryRef().Buffer(cell_size))
+                                          for reach_feat, *_ in lyr_reaches.iterate_features("Loading Reaches")}
+                        reach_shapes = polygonize_zones(tmp_cleaned_thresh.filepath, reach_polygons)
 
+                    out_feats = []
+                    out_geoms = []
                     for reach_feat, *_ in lyr_reaches.iterate_features("Processing Reaches"):
                         reach_attributes = {}
                         for n in range(field_count):
@@ -365,56 +333,40 @@ def vbet(huc: int, scenario_code: str, inputs: Dict[str, str], vaa_table: Path,
                             value = reach_feat.GetField(field.name)
                             reach_attributes[field.name] = value
 
-                        geom = reach_feat.GetGeometryRef()
-                        buff = geom.Buffer(cell_size)
-                        geom_json = buff.ExportToJson()
-                        poly = json.loads(geom_json)
-                        data, mask_transform = rasterio.mask.mask(raster, [poly], crop=True)
-
-                        if all(x > 0 for x in data.shape):
-                            out_shapes = list(g for g, v in shapes(data, transform=mask_transform) if v == 1)
-                            for out_shape in out_shapes:
-                                shape_intersected = False
-                                out_geom = ogr.CreateGeometryFromJson(json.dumps(out_shape))
-                                if not out_geom.IsValid():
-                                    out_geom = geom_validity_fix(out_geom)
-                                out_feat = ogr.Feature(out_layer_defn)
-                                out_feat.SetGeometry(out_geom)
-                                for field, value in reach_attributes.items():
-                                    out_feat.SetField(field, value)
-                                for test_feat, *_ in lyr_channel_area_polygons.iterate_features(clip_shape=out_geom):
-                                    test_geom = test_feat.GetGeometryRef()
-                                    if test_geom.Intersects(out_geom):
-                                        shape_intersected = True
-                                        lyr_output.ogr_layer.CreateFeature(out_feat)
-                                        break
-                                if shape_intersected is False:
-                                    rejected_geoms.append(out_feat)
-                    lyr_output.ogr_layer.CommitTransaction()
-
-                    save_feats = []
-                    iterate = True
-                    while iterate is True:
-                        log.info(f"Checking {len(rejected_geoms)} features for inclusion by adjacency")
-                        iterate = False
-                        rejected_geoms2 = []
-                        for out_feat in rejected_geoms:
-                            shape_intersected = False
-                            out_geom = out_feat.GetGeometryRef()
-                            for test_feat, *_ in lyr_output.iterate_features(clip_shape=out_geom):
-                                test_geom = test_feat.GetGeometryRef()
-                                if test_geom.Intersects(out_geom):  # .Buffer(0.0001)
-                                    save_feats.append(out_feat)
-                                    iterate = True
-                                    shape_intersected = True
-                                    break
-                            if shape_intersected is False:
-                                rejected_geoms2.append(out_feat)
-                        rejected_geoms = rejected_geoms2
+                        if polygonize_once is True:
+                            out_shapes = [VectorBase.shapely2ogr(reach_shape) for reach_shape in reach_shapes[reach_feat.GetFID()]]
+                        else:
+                            geom = reach_feat.GetGeometryRef()
+                            buff = geom.Buffer(cell_size)
+                            geom_json = buff.ExportToJson()
+                            poly = json.loads(geom_json)
+                            data, mask_transform = rasterio.mask.mask(raster, [poly], crop=True)
+
+                            out_shapes = []
+                            if all(x > 0 for x in data.shape):
+                                out_shapes = list(ogr.CreateGeometryFromJson(json.dumps(g)) for g, v in shapes(data, transform=mask_transform) if v == 1)
+
+                        for out_geom in out_shapes:
+                            if not out_geom.IsValid():
+                                out_geom = geom_validity_fix(out_geom)
+                            out_feat = ogr.Feature(out_layer_defn)
+                            out_feat.SetGeometry(out_geom)
+                            for field, value in reach_attributes.items():
+                                out_feat.SetField(field, value)
+                            out_feats.append(out_feat)
+                            out_geoms.append(VectorBase.ogr2shapely(out_geom))
+
+                    # Shapes that intersect a channel area are kept along with every shape connected
+                    # to one of them, directly or through a chain of adjacent shapes
+                    intersected = [len(channel_area_index.intersecting(out_geom)) > 0 for out_geom in out_geoms]
+                    components = connected_components(out_geoms)
+                    kept_components = set(component for component, keep in zip(components, intersected) if keep)
+                    adjacent = [idx for idx, component in enumerate(components) if component in kept_components and not intersected[idx]]
+                    log.info(f"Keeping {len(adjacent)} of {len(out_feats) - sum(intersected)} features for inclusion by adjacency")
 
                     lyr_output.ogr_layer.StartTransaction()
-                    for feat in save_feats:
-                        lyr_output.ogr_layer.CreateFeature(feat)
+                    for out_feat in [out_feat for out_feat, keep in zip(out_feats, intersected) if keep] + [out_feats[idx] for idx in adjacent]:
+                        lyr_output.ogr_layer.CreateFeature(out_feat)
                     lyr_output.ogr_layer.CommitTransaction()
 
         # Now the final sanitization
@@ -619,6 +571,8 @@ def main():
     parser.add_argument('--reach_codes', help='Comma delimited reach codes (FCode) to retain when filtering features. Omitting this option retains all features.', type=str)
     parser.add_argument('--flowline_type', type=str, default='NHD')
     parser.add_argument('--meta', help='riverscapes project metadata as comma separated key=value pairs', type=str)
+    parser.add_argument('--workers', help='(optional) number of processes used to calculate the evidence and cleaned threshold rasters', type=int, default=1)
+    parser.add_argument('--polygonize_once', help='(optional) polygonize each threshold raster once instead of once per catchment', action='store_true', default=False)
     parser.add_argument('--verbose', help='(optional) a little extra logging ', action='store_true', default=False)
     parser.add_argument('--debug', help='Add debug tools for tracing things like memory usage at a performance cost.', action='store_true', default=False)
 
@@ -645,7 +599,7 @@ def main():
             log.debug('Return code: {}, [Max process usage] {}'.format(retcode, max_obj))
 
         else:
-            vbet(args.huc, args.scenario_code, inputs, args.vaa_table, args.output_dir, reach_codes, meta, flowline_type=args.flowline_type)
+            vbet(args.huc, args.scenario_code, inputs, args.vaa_table, args.output_dir, reach_codes, meta, flowline_type=args.flowline_type, workers=args.workers, polygonize_once=args.polygonize_once)
 
     except Exception as e:
         log.error(e)
@@ -8,25 +8,31 @@
 #
 # -------------------------------------------------------------------------------
 
+from typing import Dict, List
 from osgeo import ogr
 from shapely.geometry import LineString, Polygon, Point
-from shapely.ops import linemerge, split
-from shapely.wkb import loads as wkbload
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import linemerge, split, unary_union
+from shapely.prepared import prep
 
-from rscommons import GeopackageLayer, Logger
+from rscommons import GeopackageLayer, Logger, ProgressBar, VectorBase
+from rscommons.process_pool import ordered_map
+from rscommons.spatial_index import GeometryIndex
 from rscommons.thiessen.shapes import RiverPoint, densifyShape, GetBufferedBounds, projToShape, splitClockwise
 from rscommons.thiessen.vor import NARVoronoi
 
 # from vbet.vbet_network import join_attributes
 
 
-def vbet_centerline(flowlines, vbet_polygons, out_layer):
-    """[summary]
+def vbet_centerline(flowlines, vbet_polygons, out_layer, workers: int = 1):
+    """Build the valley bottom centerline of every stream path from a headwater down
+    to the first reach that an earlier path already covered
 
     Args:
-        flowlines ([type]): [description]
-        vbet_polygons ([type]): [description]
-        out_layer ([type]): [description]
+        flowlines ([type]): flowlines with HydroSeq, UpHydroSeq and DnHydroSeq fields
+        vbet_polygons ([type]): valley bottom polygons
+        out_layer ([type]): output centerline layer
+        workers (int, optional): number of processes building the path centerlines. Defaults to 1.
     """
     log = Logger('vbet_centerline')
     # fields = ['HydroSeq', 'DnHydroSeq', 'UpHydroSeq']
@@ -36,7 +42,7 @@ def vbet_centerline(flowlines, vbet_polygons, out_layer):
     reaches = {}
 
     with GeopackageLayer(flowlines) as lyr,\
-            GeopackageLayer(vbet_polygons, write=True) as lyr_polygons,\
+            GeopackageLayer(vbet_polygons) as lyr_polygons,\
             GeopackageLayer(out_layer, write=True) as lyr_output:
 
         srs = lyr.ogr_layer.GetSpatialRef()
@@ -46,132 +52,136 @@ def vbet_centerline(flowlines, vbet_polygons, out_layer):
 
         degree_factor = lyr.rough_convert_metres_to_vector_units(1)
 
-        for feat, *_ in lyr.iterate_features():
+        for feat, *_ in lyr.iterate_features('Loading flowlines'):
             reach = {}
             reach['up'] = feat.GetField('UpHydroSeq')
             reach['down'] = feat.GetField('DnHydroSeq')
-            geom = feat.GetGeometryRef()
-            reach['geom'] = geom.Clone()
+            reach['geom'] = VectorBase.ogr2shapely(feat)
             reaches[feat.GetField('HydroSeq')] = reach
 
-        headwaters = {k: v for k, v in reaches.items() if v['up'] == 0 or v['up'] not in reaches}
-        processed = []
-        unioned_reaches = {}
+        paths = stream_paths(reaches)
 
-        for HydroSeq in headwaters:
-            unioned_geom = reaches[HydroSeq]['geom']
-            HydroSeq_next = reaches[HydroSeq]['down']
+        # Every reach is tested against the polygons once, however many paths it is part of
+        polygons = [VectorBase.ogr2shapely(poly_feat) for poly_feat, *_ in lyr_polygons.iterate_features('Loading valley bottoms') if poly_feat.GetGeometryRef() is not None]
+        polygon_index = GeometryIndex(polygons)
+        reach_polygons = {HydroSeq: polygon_index.intersecting(reaches[HydroSeq]['geom']) for HydroSeq in set(HydroSeq for path in paths.values() for HydroSeq in path)}
+        log.info('Building centerlines for {:,} stream paths with {} worker process{}'.format(len(paths), workers, 'es' if workers > 1 else ''))
 
-            lines = ogr.Geometry(ogr.wkbMultiLineString)
+        tasks = ((HydroSeq, [reaches[reach]['geom'] for reach in path], [polygons[idx] for idx in sorted(set(idx for reach in path for idx in reach_polygons[reach]))], degree_factor)
+                 for HydroSeq, path in paths.items())
 
-            while HydroSeq_next != 0 and HydroSeq_next in reaches:
-                union = unioned_geom.Union(reaches[HydroSeq_next]['geom'])
-                unioned_geom = union
-                lines.AddGeometry(reaches[HydroSeq_next]['geom'])
-                if HydroSeq_next in processed:
-                    break
-                processed.append(HydroSeq_next)
-                HydroSeq_next = reaches[HydroSeq_next]['down']
+        # The paths are built independently. Each one is then trimmed against the centerlines of the paths before it in order
+        merged_centerline = None
+        progbar = ProgressBar(len(paths), 50, 'Centerlines')
+        lyr_output.ogr_layer.StartTransaction()
+        for counter, (HydroSeq, centerlines_long) in enumerate(ordered_map(_path_centerlines, tasks, workers), start=1):
+            progbar.update(counter)
+            if centerlines_long is None:
+                continue
+
+            centerlines, merged_centerline = merge_centerlines(centerlines_long, merged_centerline, reaches[HydroSeq]['geom'])
+            for centerline in centerlines:
+                feat_out = ogr.Feature(lyr_output_defn)
+                feat_out.SetGeometry(ogr.CreateGeometryFromWkb(centerline.wkb))
+                feat_out.SetField('HydroSeq', HydroSeq)
+                lyr_output.ogr_layer.CreateFeature(feat_out)
+                feat_out = None
+        lyr_output.ogr_layer.CommitTransaction()
+        progbar.finish()
 
-            unioned_reaches[HydroSeq] = unioned_geom
+    return
 
-        counter = 0
 
-        merged_centerline = None
+def stream_paths(reaches: Dict[int, dict]) -> Dict[int, List[int]]:
+    """Walk down from every headwater until the outlet or the first reach that an earlier path already walked
 
-        for HydroSeq, line in unioned_reaches.items():
+    Args:
+        reaches (Dict[int, dict]): reaches by HydroSeq with the 'up' and 'down' HydroSeq of each
 
-            counter += 1
-            log.info('Processing reach: ({}/{})'.format(counter, len(unioned_reaches)))
+    Returns:
+        Dict[int, List[int]]: HydroSeq of the reaches along each path, keyed by the HydroSeq of its headwater
+    """
 
-            polys = ogr.Geometry(ogr.wkbMultiPolygon)
+    headwaters = [HydroSeq for HydroSeq, reach in reaches.items() if reach['up'] == 0 or reach['up'] not in reaches]
+    processed = set()
+    paths = {}
 
-            for poly_feat, *_ in lyr_polygons.iterate_features():
-                poly = poly_feat.GetGeometryRef()
+    for HydroSeq in headwaters:
+        path = [HydroSeq]
+        HydroSeq_next = reaches[HydroSeq]['down']
 
-                if poly.IsEmpty():
-                    continue
+        while HydroSeq_next != 0 and HydroSeq_next in reaches:
+            path.append(HydroSeq_next)
+            if HydroSeq_next in processed:
+                break
+            processed.add(HydroSeq_next)
+            HydroSeq_next = reaches[HydroSeq_next]['down']
 
-                if poly.Intersects(line):
-                    polys.AddGeometry(poly)
+        paths[HydroSeq] = path
 
-            log.debug('Unioning...')
-            if not polys.IsValid() or polys.Area() == 0:
-                poly_test = polys.Buffer(0)
-                if poly_test.IsValid():
-                    polys = poly_test
-                else:
-                    log.warning('Invalid geometry')
-                    continue
+    return paths
 
-            # with open(os.path.join(os.path.dirname(os.path.dirname(out_layer)), 'layer_{}.json'.format(counter)), 'w') as fs:
-            #     fs.write(polys.ExportToJson())
-            if polys.GetGeometryType() == ogr.wkbMultiPolygon:
-                poly_union = polys.UnionCascaded()
-            else:
-                poly_union = polys
-            log.debug('Unioning complete')
 
-            if poly_union:
-                centerlines, merged_centerline = build_centerline(line, poly_union, 20, dist_factor=degree_factor, existing_centerlines=merged_centerline, up_reach=reaches[HydroSeq]['geom'])
+def _path_centerlines(task: tuple) -> tuple:
+    """Union the reaches and the valley bottom polygons of one stream path and build its centerlines"""
 
-                if centerlines:
-                    for centerline in centerlines:
-                        feat_out = ogr.Feature(lyr_output_defn)
-                        feat_out.SetGeometry(centerline)
-                        feat_out.SetField('HydroSeq', HydroSeq)
-                        lyr_output.ogr_layer.CreateFeature(feat_out)
-                        feat_out = None
+    HydroSeq, path_reaches, path_polygons, dist_factor = task
+    log = Logger('vbet_centerline')
 
-    return
+    polys = [poly if poly.is_valid else poly.buffer(0) for poly in path_polygons if not poly.is_empty]
+    if len(polys) == 0:
+        return HydroSeq, None
 
+    log.debug('Unioning...')
+    poly_union = unary_union(polys)
+    if not poly_union.is_valid or poly_union.area == 0:
+        log.warning('Invalid geometry')
+        return HydroSeq, None
+    log.debug('Unioning complete')
 
-def build_centerline(thalweg, bounding_polygon, spacing=None, dist_factor=1, existing_centerlines=None, up_reach=None):
-    """[summary]
+    return HydroSeq, build_centerline(path_reaches[0] if len(path_reaches) == 1 else unary_union(path_reaches), poly_union, 20, dist_factor=dist_factor)
+
+
+def build_centerline(thalweg: BaseGeometry, bounding_polygon: BaseGeometry, spacing=None, dist_factor=1) -> List[LineString]:
+    """Centerlines of the valley bottom around a thalweg from the Voronoi regions of its banks
 
     Args:
-        thalweg ([type]): [description]
-        bounding_polygon ([type]): [description]
-        spacing ([type], optional): [description]. Defaults to None.
-        dist_factor (int, optional): [description]. Defaults to 1.
-        existing_centerlines ([type], optional): [description]. Defaults to None.
-        up_reach ([type], optional): [description]. Defaults to None.
+        thalweg (BaseGeometry): stream line (or unioned lines) through the valley bottom
+        bounding_polygon (BaseGeometry): valley bottom polygon
+        spacing ([type], optional): distance between the bank points in metres. Defaults to None.
+        dist_factor (int, optional): vector units per metre. Defaults to 1.
 
     Returns:
-        [type]: [description]
+        List[LineString]: centerline segments inside the valley bottom. None if there are none
     """
 
     log = Logger('build_centerline')
     log.info('Building centerline')
-    # Remove Z values
-    thalweg.FlattenTo2D()
-    bounding_polygon.FlattenTo2D()
-
-    # load the geoms
-    g_thalweg_load = wkbload(bytes(thalweg.ExportToWkb()))
-    if g_thalweg_load.geometryType() == 'LineString':
-        g_thalweg_init = g_thalweg_load
+
+    if thalweg.geometryType() == 'LineString':
+        g_thalweg_init = thalweg
     else:
-        g_thalweg_init = linemerge(g_thalweg_load)
-    g_polygon = wkbload(bytes(bounding_polygon.ExportToWkb()))
+        g_thalweg_init = linemerge(thalweg)
+    g_polygon = bounding_polygon
 
     buffer = (g_polygon.area / g_thalweg_init.length) * 1.5
 
-    processing_extent = g_thalweg_init.buffer(buffer)
+    processing_extent = prep(g_thalweg_init.buffer(buffer))
 
     # islands?
     if g_polygon.type == 'Polygon':
         rivershape = g_polygon
     else:
-        rivershape = max(g_polygon, key=lambda a: a.area)
+        rivershape = max(g_polygon.geoms, key=lambda a: a.area)
+    prepared_rivershape = prep(rivershape)
 
     # make sure all thalweg coords are within river polygon
     coords = []
     for coord in g_thalweg_init.coords:
-        if Point(coord).within(rivershape):
+        if prepared_rivershape.contains(Point(coord)):
             coords.append(coord)
     if len(coords) < 2:
-        return None, existing_centerlines
+        return None
     g_thalweg = LineString(coords)
 
     # Prepare geoms
@@ -195,20 +205,21 @@ def build_centerline(thalweg, bounding_polygon, spacing=None, dist_factor=1, exi
     newThalweg = LineString(thalweglist)
 
     bankshapes = splitClockwise(rivershape_bounds, newThalweg)
+    left_bank = prep(bankshapes[0])
 
     points = []
 
     # Exterior is the shell and there is only ever 1
     for pt in list(rivershape_smooth.exterior.coords):
         g_pt = Point(pt)
-        side = 1 if bankshapes[0].contains(g_pt) else -1
+        side = 1 if left_bank.contains(g_pt) else -1
         if processing_extent.contains(g_pt):
             points.append(RiverPoint(g_pt, interior=False, side=side))
 
     for idx, island in enumerate(rivershape_smooth.interiors):
         for pt in list(island.coords):
             g_pt = Point(pt)
-            side = 1 if bankshapes[0].contains(g_pt) else -1
+            side = 1 if left_bank.contains(g_pt) else -1
             if processing_extent.contains(g_pt):
                 points.append(RiverPoint(g_pt, interior=True, side=side, island=idx))
 
@@ -219,36 +230,35 @@ def build_centerline(thalweg, bounding_polygon, spacing=None, dist_factor=1, exi
     centerlines_raw = myVorL.collectCenterLines(Polygon(rivershape.exterior))
 
     if centerlines_raw.type == 'GeometryCollection':
-        return None, existing_centerlines
+        return None
 
     centerline_segments = split(centerlines_raw, rivershape)
-    centerlines_long = [LineString(segment.coords[1:-1] if len(segment.coords) > 3 else segment.coords) for segment in centerline_segments if segment.interpolate(segment.length / 2).within(rivershape)]
+    return [LineString(segment.coords[1:-1] if len(segment.coords) > 3 else segment.coords) for segment in centerline_segments.geoms if prepared_rivershape.contains(segment.interpolate(segment.length / 2))]
+
 
-    if existing_centerlines:
-        g_existing_centerlines = wkbload(bytes(existing_centerlines.ExportToWkb()))
-        l_existing_centerlines = [g_existing_centerlines] if g_existing_centerlines.type == "LineString" else [g for g in g_existing_centerlines]
+def merge_centerlines(centerlines_long: List[LineString], existing_centerlines: BaseGeometry = None, up_reach: BaseGeometry = None) -> tuple:
+    """Trim new centerlines against the ones already built and merge them in
 
-        up_reach.FlattenTo2D()
-        g_up_reach = wkbload(bytes(up_reach.ExportToWkb()))
+    Args:
+        centerlines_long (List[LineString]): centerlines from build_centerline()
+        existing_centerlines (BaseGeometry, optional): merged centerlines of the paths built so far. Defaults to None.
+        up_reach (BaseGeometry, optional): headwater reach of the new path. Defaults to None.
 
-        centerlines = []
+    Returns:
+        tuple: the new centerline segments and the merged centerlines including them
+    """
 
-        for line in centerlines_long:
-            new_segment = line.difference(g_existing_centerlines)
-            if new_segment.type == 'LineString':
-                if new_segment.intersects(g_up_reach):
-                    centerlines.append(new_segment)
-            else:
-                for s in new_segment:
-                    if s.intersects(g_up_reach):
-                        centerlines.append(s)
+    if existing_centerlines is None:
+        return centerlines_long, linemerge(centerlines_long)
 
-        centerlines_merged = linemerge(centerlines + l_existing_centerlines)
-    else:
-        centerlines = centerlines_long
-        centerlines_merged = linemerge(centerlines)
+    l_existing_centerlines = [existing_centerlines] if existing_centerlines.type == "LineString" else list(existing_centerlines.geoms)
+    prepared_up_reach = prep(up_reach)
 
-    geom_centerlines = [ogr.CreateGeometryFromWkb(centerline.to_wkb()) for centerline in centerlines]
-    geom_merged_centerlines = ogr.CreateGeometryFromWkb(centerlines_merged.to_wkb())
+    centerlines = []
+    for line in centerlines_long:
+        new_segment = line.difference(existing_centerlines)
+        for segment in [new_segment] if new_segment.type == 'LineString' else new_segment.geoms:
+            if prepared_up_reach.intersects(segment):
+                centerlines.append(segment)
 
-    return geom_centerlines, geom_merged_centerlines
+    return centerlines, linemerge(centerlines + l_existing_centerlines)
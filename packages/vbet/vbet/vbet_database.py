@@ -48,8 +48,10 @@ def load_configuration(machine_code, database):
     configuration['Inputs'] = inputs_dict
 
     transforms_dict = {}
+    inflections_dict = {}
     for input_name, val in configuration['Inputs'].items():
         input_transforms = []
+        input_inflections = []
         for i, transform_id in enumerate(val['transform_zones']):
             transform_type = curs.execute("""SELECT transform_types.name from transforms INNER JOIN transform_types ON transform_types.type_id = transforms.type_id where transforms.transform_id = ?""", [transform_id]).fetchone()[0]
             values = curs.execute("""SELECT input_value, output_value FROM inflections WHERE transform_id = ? ORDER BY input_value """, [transform_id]).fetchall()
@@ -59,9 +61,12 @@ def load_configuration(machine_code, database):
                 transforms_dict[transform_id] = None
 
             input_transforms.append(interpolate.interp1d(np.array([v[0] for v in values]), np.array([v[1] for v in values]), kind=transform_type, bounds_error=False, fill_value=0.0))
+            input_inflections.append((transform_type, [v[0] for v in values], [v[1] for v in values]))
         transforms_dict[input_name] = input_transforms
+        inflections_dict[input_name] = input_inflections
 
     configuration['Transforms'] = transforms_dict
+    configuration['Inflections'] = inflections_dict
 
     zones_dict = {}
     for input_name, input_zones in configuration["Inputs"].items():
@@ -75,3 +80,97 @@ def load_configuration(machine_code, database):
     configuration['Zones'] = zones_dict
 
     return configuration
+
+
+class LinearKernel():
+    """Piecewise linear transform that is 0.0 outside the inflection points
+
+    interp1d evaluates linear transforms with np.interp as well so the results are identical.
+    """
+
+    def __init__(self, x_vals: np.ndarray, y_vals: np.ndarray):
+        self.x_vals = x_vals
+        self.y_vals = y_vals
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        return np.interp(values, self.x_vals, self.y_vals, left=0.0, right=0.0)
+
+
+class ZoneTransforms():
+    """Normalize the values of one VBET input with the transform of each cell's zone
+
+    Piecewise linear transforms become np.interp kernels and every other kind keeps its
+    interp1d. Each kernel only runs on the cells of its own zone and the output buffer
+    is reused for every block of the same shape. Inputs that are not zoned use the first
+    transform for every cell.
+    """
+
+    def __init__(self, transforms: list, inflections: list = None, zoned: bool = False):
+        """
+        Args:
+            transforms (list): interp1d transform of each zone from load_configuration()
+            inflections (list, optional): (kind, inputs, outputs) of each zone from load_configuration(). Defaults to None.
+            zoned (bool, optional): the input has a transform zone raster (it is in the configuration's Zones). Defaults to False.
+        """
+
+        inflections = inflections if inflections is not None else [None] * len(transforms)
+        self.kernels = [self._compile(transform, inflection) for transform, inflection in zip(transforms, inflections)]
+        self.zoned = zoned
+        self._buffer = None
+
+    @staticmethod
+    def _compile(transform, inflection):
+        """LinearKernel for linear transforms with sorted, distinct inflection points"""
+
+        if inflection is None or inflection[0] != 'linear':
+            return transform
+
+        x_vals = np.array(inflection[1], dtype=np.float64)
+        if len(x_vals) < 2 or np.any(np.diff(x_vals) <= 0):
+            return transform
+
+        return LinearKernel(x_vals, np.array(inflection[2], dtype=np.float64))
+
+    def __call__(self, values: np.ndarray, zones: np.ndarray = None) -> np.ndarray:
+        """Normalized values
+
+        Args:
+            values (np.ndarray): input values
+            zones (np.ndarray, optional): zone of each cell. Required for zoned inputs and ignored otherwise.
+                Zones outside the range of transforms use the first or last transform. Defaults to None.
+
+        Returns:
+            np.ndarray: float64 normalized values. The array is reused by the next call with the same shape
+        """
+
+        if self._buffer is None or self._buffer.shape != values.shape:
+            self._buffer = np.empty(values.shape, dtype=np.float64)
+
+        if not self.zoned:
+            self._buffer[...] = self.kernels[0](values)
+            return self._buffer
+
+        if zones is None:
+            raise Exception('The zone of each cell is required for a zoned transform')
+
+        zones = np.clip(zones, 0, len(self.kernels) - 1)
+        for zone, kernel in enumerate(self.kernels):
+            cells = zones == zone
+            if cells.any():
+                self._buffer[cells] = kernel(values[cells])
+        return self._buffer
+
+
+def compile_transforms(configuration: dict) -> dict:
+    """ZoneTransforms for every input of a VBET configuration
+
+    Args:
+        configuration (dict): VBET configuration from load_configuration()
+
+    Returns:
+        dict: ZoneTransforms keyed by input name. Inputs in the configuration's Zones are zoned
+    """
+
+    inflections = configuration.get('Inflections', {})
+    zones = configuration.get('Zones', {})
+    return {name: ZoneTransforms(transforms, inflections.get(name), name in zones) for name, transforms in configuration['Transforms'].items()}
@@ -0,0 +1,143 @@
+# Name:     VBET Evidence
+#
+# Purpose:  Calculate the normalized, topographic, channel and combined VBET
+#           evidence rasters block by block.
+#
+#           The block windows of the slope raster are split into tasks that a
+#           pool of worker processes compute in parallel. Each worker opens its
+#           own rasterio handles to the input rasters. The calling process is
+#           the only writer and it writes the blocks in the same order as the
+#           serial loop so the outputs are byte-identical regardless of the
+#           number of workers.
+#
+#           Each input is normalized with ZoneTransforms so the transform of a
+#           zone only runs on the cells of that zone.
+#
+# Date:     18 Oct 2026
+# -------------------------------------------------------------------------------
+from typing import Dict, List
+import rasterio
+from rasterio.windows import Window
+import numpy as np
+from rscommons import ProgressBar, Logger
+from rscommons.process_pool import ordered_map
+from vbet.vbet_database import ZoneTransforms, compile_transforms
+
+# Aim for roughly this many cells in each task sent to a worker
+TASK_CELLS = 1 << 20
+
+# Input handles and configuration for each worker process
+_worker_state = {}
+
+
+def evidence_block(block: Dict[str, np.ma.MaskedArray], transforms: Dict[str, ZoneTransforms], nodata) -> Dict[str, np.ndarray]:
+    """Evidence values for one block of the input rasters
+
+    Args:
+        block (Dict[str, np.ma.MaskedArray]): masked input arrays keyed by input name
+        transforms (Dict[str, ZoneTransforms]): transforms of each input from compile_transforms()
+        nodata: output NoData value
+
+    Returns:
+        Dict[str, np.ndarray]: float32 output arrays keyed by output raster name
+    """
+
+    normalized = {}
+    for name, transform in transforms.items():
+        # Zoned inputs pick the transform of each cell from the zone raster
+        zones = block[f'TRANSFORM_ZONE_{name}'].data if transform.zoned else None
+        normalized[name] = np.ma.MaskedArray(transform(block[name].data, zones), mask=block[name].mask)
+
+    fvals_topo = np.ma.mean([normalized['Slope'], normalized['HAND'], normalized['TWI']], axis=0)
+    fvals_channel = 0.995 * block['Channel']
+    fvals_evidence = np.maximum(fvals_topo, fvals_channel)
+
+    # Fill the masked values with the appropriate nodata vals
+    return {
+        # Unthresholded in the base band (mostly for debugging)
+        'VBET_EVIDENCE': np.ma.filled(np.float32(fvals_evidence), nodata),
+        'NORMALIZED_SLOPE': normalized['Slope'].astype('float32').filled(nodata),
+        'NORMALIZED_HAND': normalized['HAND'].astype('float32').filled(nodata),
+        'NORMALIZED_TWI': normalized['TWI'].astype('float32').filled(nodata),
+        'EVIDENCE_CHANNEL': np.ma.filled(np.float32(fvals_channel), nodata),
+        'EVIDENCE_TOPO': np.ma.filled(np.float32(fvals_topo), nodata)
+    }
+
+
+def calculate_evidence(in_rasters: Dict[str, str], out_rasters: Dict[str, str], vbet_run: dict, workers: int = 1):
+    """Write the VBET evidence rasters
+
+    Args:
+        in_rasters (Dict[str, str]): input raster paths keyed by input name. All must share the grid of 'Slope'
+        out_rasters (Dict[str, str]): output raster paths keyed by output name (e.g. VBET_EVIDENCE, NORMALIZED_SLOPE)
+        vbet_run (dict): VBET configuration from load_configuration(). The transforms are compiled with compile_transforms()
+        workers (int, optional): number of worker processes. 1 computes every block in this process. Defaults to 1.
+    """
+
+    log = Logger('VBET Evidence')
+
+    with rasterio.open(in_rasters['Slope']) as template:
+        out_meta = template.meta
+        windows = [window for _ji, window in template.block_windows(1)]
+    out_meta['driver'] = 'GTiff'
+    out_meta['count'] = 1
+    out_meta['compress'] = 'deflate'
+
+    transforms = compile_transforms(vbet_run)
+
+    log.info('Calculating evidence for {:,} blocks with {} worker process{}'.format(len(windows), workers, 'es' if workers > 1 else ''))
+
+    write_rasters = {name: rasterio.open(raster, 'w', **out_meta) for name, raster in out_rasters.items()}
+    try:
+        progbar = ProgressBar(len(windows), 50, "Calculating evidence layer")
+        for counter, (window, outputs) in enumerate(_evidence_blocks(in_rasters, transforms, out_meta['nodata'], windows, workers)):
+            progbar.update(counter + 1)
+            for name, raster in write_rasters.items():
+                raster.write(outputs[name], window=window, indexes=1)
+        progbar.finish()
+    finally:
+        for raster in write_rasters.values():
+            raster.close()
+
+
+def _evidence_blocks(in_rasters: Dict[str, str], transforms: Dict[str, ZoneTransforms], nodata, windows: List[Window], workers: int):
+    """Generate (window, outputs) for every window in order"""
+
+    if workers <= 1:
+        read_rasters = {name: rasterio.open(raster) for name, raster in in_rasters.items()}
+        try:
+            for window in windows:
+                yield window, evidence_block(_read_block(read_rasters, window), transforms, nodata)
+        finally:
+            for raster in read_rasters.values():
+                raster.close()
+        return
+
+    # Group consecutive windows so that each task is big enough to be worth sending to a worker
+    cells = max(int(windows[0].width * windows[0].height), 1) if len(windows) > 0 else 1
+    per_task = max(TASK_CELLS // cells, 1)
+    tasks = [windows[start:start + per_task] for start in range(0, len(windows), per_task)]
+
+    for results in ordered_map(_worker_evidence, tasks, workers, initializer=_init_worker, initargs=(in_rasters, transforms, nodata)):
+        for window, outputs in results:
+            yield window, outputs
+
+
+def _read_block(read_rasters: dict, window: Window) -> Dict[str, np.ma.MaskedArray]:
+    """Masked arrays of every input raster for one window"""
+
+    return {block_name: raster.read(1, window=window, masked=True) for block_name, raster in read_rasters.items()}
+
+
+def _init_worker(in_rasters: Dict[str, str], transforms: Dict[str, ZoneTransforms], nodata):
+    """Open this worker's own handles to the input rasters"""
+
+    _worker_state['rasters'] = {name: rasterio.open(raster) for name, raster in in_rasters.items()}
+    _worker_state['transforms'] = transforms
+    _worker_state['nodata'] = nodata
+
+
+def _worker_evidence(windows: List[Window]):
+    """Evidence outputs for a list of windows, computed in a worker process"""
+
+    return [(window, evidence_block(_read_block(_worker_state['rasters'], window), _worker_state['transforms'], _worker_state['nodata'])) for window in windows]
@@ -1,9 +1,20 @@
 import os
-import shutil
-from osgeo import ogr, gdal, gdal_array
+from typing import Dict, List
+from osgeo import ogr, gdal
 import rasterio
+from rasterio.features import shapes
+from rasterio.windows import Window
+from affine import Affine
 import numpy as np
+from scipy import ndimage
+from shapely.geometry import shape, Polygon
+from shapely.geometry.base import BaseGeometry
+from shapely.affinity import affine_transform
+from shapely.ops import unary_union
+from shapely.prepared import prep
 from rscommons import ProgressBar, Logger, VectorBase, Timer, TempRaster
+from rscommons.spatial_index import GeometryIndex
+from rscommons.process_pool import ordered_map
 
 
 def rasterize(in_lyr_path, out_raster_path, template_path, all_touched=False):
@@ -84,84 +95,6 @@ def mask_rasters_nodata(in_raster_path, nodata_raster_path, out_raster_path):
             log.info('Complete')
 
 
-# Compute Proximity for channel rasters
-def proximity_raster(src_raster_path: str, out_raster_path: str, dist_units="PIXEL", preserve_nodata=True, dist_factor=None):
-    """Create a proximity raster
-
-    Args:
-        src_raster_path ([type]): [description]
-        out_raster_path ([type]): [description]
-        dist_units (str, optional): set to "GEO" for distance in length . Defaults to "PIXEL".
-    """
-    log = Logger('proximity_raster')
-    tmr = Timer()
-    src_ds = gdal.Open(src_raster_path)
-    srcband = src_ds.GetRasterBand(1)
-
-    drv = gdal.GetDriverByName('GTiff')
-    with TempRaster('vbet_proximity_raster') as tempfile:  # , \
-        # TempRaster('vbet_proximity_raster_distance') as tempfile_dist:
-
-        temp_path = tempfile.filepath
-        dst_ds = drv.Create(temp_path,
-                            src_ds.RasterXSize, src_ds.RasterYSize, 1,
-                            gdal.GetDataTypeByName('Float32'))
-
-        dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
-        dst_ds.SetProjection(src_ds.GetProjectionRef())
-
-        dstband = dst_ds.GetRasterBand(1)
-
-        progbar = ProgressBar(100, 50, "ComputeProximity ")
-
-        def poly_progress(progress, _msg, _data):
-            progbar.update(int(progress * 100))
-
-        log.info('Creating proximity raster')
-        progbar.update(0)
-        gdal.ComputeProximity(srcband, dstband, callback=poly_progress, options=["VALUES=1", f"DISTUNITS={dist_units}", "COMPRESS=DEFLATE"])
-        progbar.finish()
-
-        srcband = None
-        dstband = None
-        src_ds = None
-        dst_ds = None
-
-        if dist_factor is not None:
-            dist_file = os.path.join(os.path.dirname(tempfile.filepath), "raster.tif")
-
-            ds = gdal.Open(temp_path)
-            b1 = ds.GetRasterBand(1)
-            arr = b1.ReadAsArray()
-
-            # apply equation
-            data = arr / dist_factor
-
-            # save array, using ds as a prototype
-            gdal_array.SaveArray(data.astype("float32"), dist_file, "GTIFF", ds)
-            ds = None
-
-            # scrips_dir = next(p for p in sys.path if p.endswith('.venv'))
-            # script = os.path.join(scrips_dir, 'Scripts', 'gdal_calc.py')
-            # run_subprocess(os.path.dirname(tempfile.filepath), ['python', script, '-A', temp_path, f'--outfile={dist_file}', f'--calc=A/{dist_factor}', '--co=COMPRESS=LZW'])
-
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-            temp_path = dist_file
-
-        # Preserve the nodata from the source
-        if preserve_nodata:
-            mask_rasters_nodata(temp_path, src_raster_path, out_raster_path)
-        else:
-            shutil.copyfile(temp_path, out_raster_path)
-
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-
-        log.info('completed in {}'.format(tmr.toString()))
-
-
 def translate(vrtpath_in: str, raster_out_path: str, band: int):
     """GDAL translate Operation from VRT 
 
@@ -183,116 +116,91 @@ def translate(vrtpath_in: str, raster_out_path: str, band: int):
     log.info('completed in {}'.format(tmr.toString()))
 
 
-def inverse_mask(nodata_raster_path, out_raster_path):
-    """Apply the nodata values of one raster to another of identical size
-
-    Args:
-        in_raster_path ([type]): [description]
-        nodata_raster_path ([type]): [description]
-        out_raster_path ([type]): [description]
-    """
-    log = Logger('mask_rasters_nodata')
-
-    with rasterio.open(nodata_raster_path) as nd_src:
-        # All 3 rasters should have the same extent and properties. They differ only in dtype
-        out_meta = nd_src.meta
-        if 'nodata' not in out_meta or out_meta['nodata'] is None:
-            out_meta['nodata'] = -9999
-        out_meta['compress'] = 'deflate'
-
-        with rasterio.open(out_raster_path, 'w', **out_meta) as out_src:
-            progbar = ProgressBar(len(list(nd_src.block_windows(1))), 50, "Applying inverse nodata mask")
-            counter = 0
-            # Again, these rasters should be orthogonal so their windows should also line up
-            for ji, window in nd_src.block_windows(1):
-                progbar.update(counter)
-                counter += 1
-                # These rasterizations don't begin life with a mask.
-                mask = nd_src.read(1, window=window, masked=True).mask
-                # Fill everywhere the mask reads true with a nodata value
-                mask_vals = np.full(mask.shape, 1)
-                output = np.ma.masked_array(mask_vals, np.logical_not(mask))
-                out_src.write(output.filled(out_meta['nodata']).astype(out_meta['dtype']), window=window, indexes=1)
-
-            progbar.finish()
-            log.info('Complete')
-
-
-def raster_clean(in_raster_path: str, out_raster_path: str, buffer_pixels=1):
+def raster_clean(in_raster_path: str, out_raster_path: str, buffer_pixels=1, thr_val: float = None, tile_size: int = 2048, workers: int = 1):
     """This method grows and shrinks the raster by n pixels
 
+    The valid cells are dilated and then eroded by a disc of buffer_pixels radius, which
+    is the same as keeping the cells that are more than buffer_pixels from any cell that
+    is more than buffer_pixels from a valid cell. The raster is processed in tiles with a
+    halo of twice buffer_pixels so the result is written once with no intermediate rasters.
+
     Args:
-        in_raster_path (str): [description]
-        out_raster_path (str): [description]
-        buffer_pixels (int, optional): [description]. Defaults to 1.
+        in_raster_path (str): path to the raster to clean. Cells that are not NoData are valid
+        out_raster_path (str): path to the cleaned uint8 raster (1 for valid cells, 0 for NoData)
+        buffer_pixels (int, optional): number of pixels to grow and shrink by. Defaults to 1.
+        thr_val (float, optional): when set the input is an evidence raster and the valid cells are
+            those greater than or equal to this value, which fuses threshold() into this pass. Defaults to None.
+        tile_size (int, optional): width and height of the tiles processed at a time. Defaults to 2048.
+        workers (int, optional): number of processes used to clean the tiles. Defaults to 1.
     """
 
     log = Logger('raster_clean')
 
-    with TempRaster('vbet_clean_prox_out') as tmp_prox_out, \
-            TempRaster('vbet_clean_buff_out') as tmp_buff_out, \
-            TempRaster('vbet_clean_prox_in') as tmp_prox_in, \
-            TempRaster('vbet_clean_mask') as inv_mask:
-
-        # 1. Find the proximity raster
-        proximity_raster(in_raster_path, tmp_prox_out.filepath, preserve_nodata=False)
-
-        # 2. Logical and the prox > 1 with the mask for the input raster
-        with rasterio.open(tmp_prox_out.filepath) as prox_out_src, \
-                rasterio.open(in_raster_path) as in_data_src:
+    with rasterio.open(in_raster_path) as in_data_src:
+        out_meta = in_data_src.meta
+        # Rasterio can't write back to a VRT so rest the driver and number of bands for the output
+        out_meta['driver'] = 'GTiff'
+        out_meta['count'] = 1
+        out_meta['compress'] = 'deflate'
+        if thr_val is not None:
+            out_meta['dtype'] = rasterio.uint8
+            out_meta['nodata'] = 0
+        width, height = in_data_src.width, in_data_src.height
+
+    tiles = [Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+             for row_off in range(0, height, tile_size) for col_off in range(0, width, tile_size)]
+
+    with rasterio.open(out_raster_path, 'w', **out_meta) as out_data:
+        progbar = ProgressBar(len(tiles), 50, "Growing and shrinking the raster by {} pixels".format(buffer_pixels))
+        for counter, (tile, cleaned) in enumerate(ordered_map(_clean_tile, tiles, workers, initializer=_init_clean, initargs=(in_raster_path, buffer_pixels, thr_val))):
+            progbar.update(counter + 1)
+            output = np.ma.masked_array(np.full(cleaned.shape, 1), np.logical_not(cleaned))
+            out_data.write(output.filled(out_meta['nodata']).astype(out_meta['dtype']), window=tile, indexes=1)
+        progbar.finish()
 
-            # All 3 rasters should have the same extent and properties. They differ only in dtype
-            out_meta = in_data_src.meta
-            # Rasterio can't write back to a VRT so rest the driver and number of bands for the output
-            out_meta['driver'] = 'GTiff'
-            out_meta['count'] = 1
-            out_meta['compress'] = 'deflate'
+    log.info('Cleaning finished')
 
-            with rasterio.open(tmp_buff_out.filepath, 'w', **out_meta) as out_data:
-                progbar = ProgressBar(len(list(out_data.block_windows(1))), 50, "Growing the raster by {} pixels".format(buffer_pixels))
-                counter = 0
-                # Again, these rasters should be orthogonal so their windows should also line up
-                for _ji, window in out_data.block_windows(1):
-                    progbar.update(counter)
-                    counter += 1
-                    prox_out_block = prox_out_src.read(1, window=window)
-                    in_data_block = in_data_src.read(1, window=window, masked=True)
 
-                    new_data = np.full(in_data_block.shape, 1)
-                    new_mask = np.logical_and(in_data_block.mask, prox_out_block > buffer_pixels)
+# Open source raster and cleaning options for each raster_clean worker process
+_clean_state = {}
 
-                    output = np.ma.masked_array(new_data, new_mask)
 
-                    out_data.write(output.filled(out_meta['nodata']).astype(out_meta['dtype']), window=window, indexes=1)
+def _init_clean(in_raster_path: str, buffer_pixels: int, thr_val: float):
+    """Open this process's own handle to the raster being cleaned"""
 
-                progbar.finish()
+    if 'src' in _clean_state:
+        _clean_state['src'].close()
+    _clean_state['src'] = rasterio.open(in_raster_path)
+    _clean_state['buffer_pixels'] = buffer_pixels
+    _clean_state['thr_val'] = thr_val
 
-        # 3. Invert the product of (2) and find the inwards proximity
-        inverse_mask(tmp_buff_out.filepath, inv_mask.filepath)
-        proximity_raster(inv_mask.filepath, tmp_prox_in.filepath, preserve_nodata=False)
+    # Cells within buffer_pixels of the centre, like a proximity distance in pixels
+    offsets = np.arange(-buffer_pixels, buffer_pixels + 1)
+    _clean_state['disc'] = offsets[:, None] ** 2 + offsets[None, :] ** 2 <= buffer_pixels ** 2
 
-        # 4. Now do the final logical and to shrink back a pixel
-        with rasterio.open(tmp_prox_in.filepath) as prox_in_src:
-            # Note: we reuse outmeta from before
 
-            with rasterio.open(out_raster_path, 'w', **out_meta) as out_data_src:
-                progbar = ProgressBar(len(list(out_data.block_windows(1))), 50, "Shrinking the raster by {} pixels".format(buffer_pixels))
-                counter = 0
-                # Again, these rasters should be orthogonal so their windows should also line up
-                for _ji, window in out_data.block_windows(1):
-                    progbar.update(counter)
-                    counter += 1
-                    prox_in_block = prox_in_src.read(1, window=window)
+def _clean_tile(tile: Window):
+    """Grow and shrink the valid cells of one tile, reading a halo around it"""
 
-                    new_data = np.full(prox_in_block.shape, 1)
-                    new_mask = np.logical_not(prox_in_block > buffer_pixels)
+    src = _clean_state['src']
+    halo = 2 * _clean_state['buffer_pixels']
+    col_off, row_off = max(tile.col_off - halo, 0), max(tile.row_off - halo, 0)
+    read_window = Window(col_off, row_off,
+                         min(tile.col_off + tile.width + halo, src.width) - col_off,
+                         min(tile.row_off + tile.height + halo, src.height) - row_off)
 
-                    output = np.ma.masked_array(new_data, new_mask)
-                    out_data_src.write(output.filled(out_meta['nodata']).astype(out_meta['dtype']), window=window, indexes=1)
+    data = src.read(1, window=read_window, masked=True)
+    if _clean_state['thr_val'] is not None:
+        valid = np.logical_not(np.ma.mask_or(np.ma.getmaskarray(data), data.data < _clean_state['thr_val']))
+    else:
+        valid = np.logical_not(np.ma.getmaskarray(data))
 
-                progbar.finish()
+    # Nothing outside the raster counts as valid when growing or as invalid when shrinking
+    grown = ndimage.binary_dilation(valid, structure=_clean_state['disc'], border_value=0)
+    cleaned = ndimage.binary_erosion(grown, structure=_clean_state['disc'], border_value=1)
 
-        log.info('Cleaning finished')
+    row_start, col_start = tile.row_off - row_off, tile.col_off - col_off
+    return tile, cleaned[row_start:row_start + tile.height, col_start:col_start + tile.width]
 
 
 def rasterize_attribute(in_lyr_path, out_raster_path, template_path, attribute_field):
@@ -360,3 +268,59 @@ def rasterize_attribute(in_lyr_path, out_raster_path, template_path, attribute_f
 
         # Now mask the output correctly
         mask_rasters_nodata(tempfile.filepath, template_path, out_raster_path)
+
+
+def polygonize_zones(raster_path: str, zones: Dict[int, BaseGeometry], value: int = 1, window_size: int = 2048) -> Dict[int, List[Polygon]]:
+    """Polygonize the cells of a raster that equal a value once and split the polygons among zones
+
+    The raster is read in windows and polygonized in pixel coordinates so that the
+    pieces of a polygon from neighbouring windows share identical edges and union
+    back together exactly.
+
+    Args:
+        raster_path (str): path to the raster (e.g. a cleaned VBET threshold raster)
+        zones (Dict[int, BaseGeometry]): zone polygons keyed by id, in raster coordinates. Zones may overlap
+        value (int, optional): raster value to polygonize. Defaults to 1.
+        window_size (int, optional): width and height of the raster windows read at a time. Defaults to 2048.
+
+    Returns:
+        Dict[int, List[Polygon]]: polygons of each zone keyed by zone id. Zones with no cells get an empty list
+    """
+    log = Logger('polygonize_zones')
+
+    with rasterio.open(raster_path) as src:
+        to_pixels = (~src.transform).to_shapely()
+        zone_ids = list(zones.keys())
+        pixel_zones = [affine_transform(zones[zone_id], to_pixels) for zone_id in zone_ids]
+        zone_index = GeometryIndex(pixel_zones)
+        prepared_zones = [prep(zone) for zone in pixel_zones]
+        pieces = [[] for _zone in zone_ids]
+
+        windows = [Window(col_off, row_off, min(window_size, src.width - col_off), min(window_size, src.height - row_off))
+                   for row_off in range(0, src.height, window_size) for col_off in range(0, src.width, window_size)]
+
+        progbar = ProgressBar(len(windows), 50, "Polygonizing {}".format(os.path.basename(raster_path)))
+        for counter, window in enumerate(windows):
+            progbar.update(counter + 1)
+            cells = src.read(1, window=window) == value
+            if not cells.any():
+                continue
+            for geom, _val in shapes(cells.astype(np.uint8), mask=cells, transform=Affine.translation(window.col_off, window.row_off)):
+                poly = shape(geom)
+                for idx in zone_index.query(poly):
+                    if prepared_zones[idx].contains(poly):
+                        pieces[idx].append(poly)
+                    elif prepared_zones[idx].intersects(poly):
+                        pieces[idx].append(poly.intersection(pixel_zones[idx]))
+        progbar.finish()
+
+        to_world = src.transform.to_shapely()
+
+    zone_polygons = {}
+    for zone_id, zone_pieces in zip(zone_ids, pieces):
+        merged = unary_union(zone_pieces) if len(zone_pieces) > 0 else Polygon()
+        parts = getattr(merged, 'geoms', [merged])
+        zone_polygons[zone_id] = [affine_transform(part, to_world) for part in parts if isinstance(part, Polygon) and part.area > 0]
+
+    log.info('Polygonized {:,} polygons in {:,} zones'.format(sum(len(polys) for polys in zone_polygons.values()), len(zone_polygons)))
+    return zone_polygons